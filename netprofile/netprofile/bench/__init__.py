@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Benchmark helpers
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import time
+
+class BenchResults(list):
+	"""
+	List of benchmark result rows.
+
+	Each row is a tuple of (case name, number of items processed,
+	elapsed wall time in seconds).
+	"""
+	def timed(self, case, items=1):
+		return _BenchTimer(self, case, items)
+
+	def add(self, case, items, elapsed):
+		self.append((case, items, elapsed))
+
+	def format(self):
+		lines = []
+		for case, items, elapsed in self:
+			rate = (items / elapsed) if elapsed else 0
+			lines.append('%-40s %10d %10.3fs %14.0f/s' % (case, items, elapsed, rate))
+		return '\n'.join(lines)
+
+class _BenchTimer(object):
+	def __init__(self, results, case, items):
+		self.results = results
+		self.case = case
+		self.items = items
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		if exc_type is None:
+			self.results.add(self.case, self.items, time.perf_counter() - self.start)
+		return False
+
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Custom database field type benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import random
+import sys
+
+from sqlalchemy.dialects.mysql import pymysql
+
+from netprofile.bench import BenchResults
+from netprofile.common import ipaddr
+from netprofile.db import fields
+
+class _BenchState(fields.DeclEnum):
+	enabled  = ('E', 'Enabled',  10)
+	disabled = ('D', 'Disabled', 20)
+	deleted  = ('X', 'Deleted',  30)
+
+# Result processing as it was done before fast paths were added.
+
+def _old_mac(value):
+	if value is None:
+		return None
+	return ':'.join('%02x' % x for x in bytes(value))
+
+def _old_ipv4(value):
+	if value is None:
+		return None
+	return ipaddr.IPv4Address(value)
+
+def _old_ipv6(value):
+	if value is None:
+		return None
+	return ipaddr.IPv6Address(bytes(value))
+
+def _old_bool(value):
+	if value is None:
+		return None
+	if value == 'Y':
+		return True
+	if value == b'Y':
+		return True
+	return False
+
+def _old_enum(value):
+	if value is None:
+		return None
+	if isinstance(value, (bytes, bytearray)):
+		value = value.decode('ascii')
+	return _BenchState.from_string(value.strip())
+
+def _bench_type(res, label, old, new, values):
+	count = len(values)
+	with res.timed('%s (old)' % label, count):
+		for v in values:
+			old(v)
+	with res.timed('%s (new)' % label, count):
+		for v in values:
+			new(v)
+
+def run(app=None, count=1000000):
+	"""
+	Convert a number of raw MySQL column values with old and new result
+	processors of custom field types.
+	"""
+	res = BenchResults()
+	rnd = random.Random(count)
+	dialect = pymysql.dialect()
+
+	def proc(typ):
+		return typ.result_processor(dialect, None)
+
+	macs = [bytes(bytearray(rnd.getrandbits(8) for j in range(6))) for i in range(count)]
+	_bench_type(res, 'MACAddress', _old_mac, proc(fields.MACAddress()), macs)
+
+	ints = [rnd.getrandbits(32) for i in range(count)]
+	_bench_type(res, 'IPv4Address', _old_ipv4, proc(fields.IPv4Address()), ints)
+
+	packed = [ipaddr.v6_int_to_packed(rnd.getrandbits(128)) for i in range(count)]
+	_bench_type(res, 'IPv6Address', _old_ipv6, proc(fields.IPv6Address()), packed)
+
+	bools = [rnd.choice(('Y', 'N', None)) for i in range(count)]
+	_bench_type(res, 'NPBoolean', _old_bool, proc(fields.NPBoolean()), bools)
+
+	enums = [rnd.choice(('E', 'D', 'X')) for i in range(count)]
+	_bench_type(res, 'DeclEnumType', _old_enum, proc(_BenchState.db_type()), enums)
+
+	return res
+
+if __name__ == '__main__':
+	count = 1000000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+	print(run(count=count).format())
+
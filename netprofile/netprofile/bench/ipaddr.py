@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: IP address handling benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import random
+import sys
+
+from netprofile.bench import BenchResults
+from netprofile.common import ipaddr
+
+def _bench_family(res, label, cls, ints, strs):
+	count = len(ints)
+
+	with res.timed('%s parse' % label, count):
+		addrs = [cls(s) for s in strs]
+	with res.timed('%s from int' % label, count):
+		iaddrs = [cls(i) for i in ints]
+	with res.timed('%s format' % label, count):
+		for a in iaddrs:
+			str(a)
+	with res.timed('%s format (repeat)' % label, count):
+		for a in iaddrs:
+			str(a)
+	with res.timed('%s packed' % label, count):
+		for a in addrs:
+			a.packed
+	with res.timed('%s compare' % label, count):
+		prev = addrs[0]
+		for a in addrs:
+			prev < a
+			prev == a
+			prev = a
+	with res.timed('%s hash' % label, count):
+		set(addrs)
+	with res.timed('%s sort' % label, count):
+		sorted(addrs)
+
+def _bench_trie(res, rnd, count, nets=1000):
+	prefixes = []
+	for i in range(nets):
+		plen = rnd.choice((16, 20, 22, 24, 24, 24, 26, 28))
+		prefixes.append(ipaddr.IPv4Network('%s/%d' % (ipaddr.IPv4Address(rnd.getrandbits(32)), plen)))
+	addrs = [ipaddr.IPv4Address(rnd.getrandbits(32)) for i in range(count)]
+
+	with res.timed('IPv4 trie build (%d prefixes)' % nets, nets):
+		trie = ipaddr.IPPrefixTrie(prefixes)
+	with res.timed('IPv4 trie lookup', count):
+		for a in addrs:
+			trie.get(a)
+	scan = max(1, count // 100)
+	with res.timed('IPv4 linear scan (%d prefixes)' % nets, scan):
+		for a in addrs[:scan]:
+			for net in prefixes:
+				if a in net:
+					break
+
+def run(app=None, count=1000000):
+	"""
+	Parse, format and compare a number of random IPv4 and IPv6 addresses,
+	then look them up in a prefix trie.
+	"""
+	res = BenchResults()
+	rnd = random.Random(count)
+
+	ints = [rnd.getrandbits(32) for i in range(count)]
+	strs = ['%d.%d.%d.%d' % (i >> 24, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff) for i in ints]
+	_bench_family(res, 'IPv4', ipaddr.IPv4Address, ints, strs)
+
+	# Mimic typical allocations: mostly zeroes in the middle of the address.
+	ints = [(0x20010db8 << 96) | (rnd.getrandbits(16) << 64) | rnd.getrandbits(32) for i in range(count)]
+	strs = [str(ipaddr.IPv6Address(i)) for i in ints]
+	_bench_family(res, 'IPv6', ipaddr.IPv6Address, ints, strs)
+
+	_bench_trie(res, rnd, count)
+
+	return res
+
+if __name__ == '__main__':
+	count = 1000000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+	print(run(count=count).format())
+
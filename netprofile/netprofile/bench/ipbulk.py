@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Bulk IP address operations benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import random
+import sys
+
+import numpy as np
+
+from netprofile import ipbulk
+from netprofile.bench import BenchResults
+from netprofile.common import ipaddr
+
+def _free_blocks(first, last, used, cls):
+	# What a pool report has to do without ipbulk.
+	blocks = []
+	cur = first
+	for a in sorted(set(used)):
+		if a > cur:
+			blocks.extend(ipaddr.summarize_address_range(cls(cur), cls(a - 1)))
+		cur = a + 1
+	if cur <= last:
+		blocks.extend(ipaddr.summarize_address_range(cls(cur), cls(last)))
+	return blocks
+
+def _bench_family(res, label, net, used, cls, mod):
+	count = len(used)
+	first = int(net.network)
+	last = int(net.broadcast)
+	addrs = [cls(a) for a in used]
+
+	with res.timed('%s collapse (ipaddr)' % label, count):
+		ipaddr.collapse_address_list(addrs)
+	with res.timed('%s collapse (ipbulk)' % label, count):
+		arr = mod['array'](used)
+		mod['collapse'](arr, mod['plens'](arr))
+	with res.timed('%s free blocks (ipaddr)' % label, count):
+		_free_blocks(first, last, used, cls)
+	with res.timed('%s free blocks (ipbulk)' % label, count):
+		arr = mod['array'](used)
+		mod['summarize'](*mod['free'](first, last, arr))
+	arr = mod['array'](used)
+	with res.timed('%s sort (ipbulk)' % label, count):
+		mod['sort'](arr)
+	with res.timed('%s unique (ipbulk)' % label, count):
+		mod['unique'](arr)
+
+def run(app=None, count=20000):
+	"""
+	Collapse addresses and find free blocks in a partially used pool, both
+	with the list functions in ipaddr and with their ipbulk counterparts.
+	"""
+	res = BenchResults()
+	rnd = random.Random(count)
+
+	v4 = {
+		'array'     : ipbulk.v4_array,
+		'plens'     : lambda arr: np.full(arr.size, 32, dtype=np.uint8),
+		'collapse'  : ipbulk.collapse_v4,
+		'free'      : ipbulk.free_ranges_v4,
+		'summarize' : ipbulk.summarize_ranges_v4,
+		'sort'      : ipbulk.sort_v4,
+		'unique'    : ipbulk.unique_v4
+	}
+	net = ipaddr.IPv4Network('10.0.0.0/%d' % max(8, 32 - (count * 3 // 2).bit_length()))
+	used = rnd.sample(range(int(net.network), int(net.broadcast) + 1), min(count, net.numhosts))
+	_bench_family(res, 'IPv4', net, used, ipaddr.IPv4Address, v4)
+
+	v6 = {
+		'array'     : ipbulk.v6_array,
+		'plens'     : lambda arr: np.full(arr.shape[0], 128, dtype=np.uint8),
+		'collapse'  : ipbulk.collapse_v6,
+		'free'      : ipbulk.free_ranges_v6,
+		'summarize' : ipbulk.summarize_ranges_v6,
+		'sort'      : ipbulk.sort_v6,
+		'unique'    : ipbulk.unique_v6
+	}
+	net = ipaddr.IPv6Network('2001:db8::/%d' % (128 - (count * 3 // 2).bit_length()))
+	used = [int(net.network) + a for a in rnd.sample(range(net.numhosts), min(count, net.numhosts))]
+	_bench_family(res, 'IPv6', net, used, ipaddr.IPv6Address, v6)
+
+	return res
+
+if __name__ == '__main__':
+	count = 20000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+	print(run(count=count).format())
+
@@ -45,6 +45,7 @@ from kombu import (
 from kombu.common import Broadcast
 
 from netprofile import setup_config
+from netprofile.common.hooks import IHookManager
 from netprofile.common.modules import IModuleManager
 from netprofile.common.util import (
 	as_dict,
@@ -349,6 +350,17 @@ def task_cap(cap):
 
 	return _app_cap_wrapper
 
+def task_uid(kwarg='uid'):
+	"""
+	Make RT server pass ID of the requesting user to the task in a
+	keyword argument.
+	"""
+	def _app_uid_wrapper(wrapped):
+		wrapped.__uid_kwarg__ = kwarg
+		return wrapped
+
+	return _app_uid_wrapper
+
 @celeryd_init.connect
 def _setup(conf=None, **kwargs):
 	global app
@@ -376,6 +388,10 @@ def _setup(conf=None, **kwargs):
 	app.settings = settings
 	app.mmgr = mmgr
 
+	# Let modules prepare their state before worker processes are started.
+	hm = cfg.registry.getUtility(IHookManager)
+	hm.run_hook('np.celery.init', app)
+
 def setup_celery(reg):
 	_parse_ini_settings(reg, app)
 
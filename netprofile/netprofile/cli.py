@@ -521,3 +521,271 @@ class Deploy(Command):
 		os.umask(self.old_mask)
 		self.log.info('Created NetProfile deployment: %s', deploy_dir)
 
+class Benchmark(Lister):
+	"""
+	Run a registered performance benchmark.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(Benchmark, self).get_parser(prog_name)
+		parser.add_argument(
+			'-n', '--count',
+			type=int,
+			default=None,
+			help='Number of items to process.'
+		)
+		parser.add_argument(
+			'name',
+			help='Name of the benchmark to run.'
+		)
+		return parser
+
+	def take_action(self, args):
+		loc = self.app.locale
+		eps = list(pkg_resources.iter_entry_points('netprofile.benchmarks', args.name))
+		if len(eps) < 1:
+			raise RuntimeError('Unable to find benchmark \'%s\'.' % (args.name,))
+		bench = eps[0].load()
+
+		kwargs = {}
+		if args.count is not None:
+			kwargs['count'] = args.count
+		res = bench(self.app, **kwargs)
+
+		columns = (
+			loc.translate(_('Case')),
+			loc.translate(_('Items')),
+			loc.translate(_('Seconds')),
+			loc.translate(_('Items/s'))
+		)
+		data = []
+		for case, items, elapsed in res:
+			rate = (items / elapsed) if elapsed else 0
+			data.append((case, items, '%.3f' % elapsed, '%.0f' % rate))
+		return (columns, data)
+
+def _load_modules(app):
+	mm = app.mm
+
+	if len(mm.modules) > 0:
+		mm.rescan()
+	else:
+		mm.scan()
+
+	if not mm.load('core'):
+		raise RuntimeError('Unable to proceed without core module.')
+	if not mm.load_enabled():
+		raise RuntimeError('Unable to load enabled modules.')
+
+def _partitioned_tables(app, names):
+	_load_modules(app)
+
+	from netprofile.db.partitions import partitioned_tables
+
+	tables = partitioned_tables()
+	if names:
+		unknown = set(names).difference(table.name for table in tables)
+		if unknown:
+			raise RuntimeError('Not a partitioned table: %s.' % (', '.join(sorted(unknown)),))
+		tables = [table for table in tables if table.name in names]
+	return tables
+
+class ListPartitions(Lister):
+	"""
+	List partitions of time-partitioned tables.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(ListPartitions, self).get_parser(prog_name)
+		parser.add_argument(
+			'tables',
+			nargs='*',
+			help='Names of tables to show, defaults to all partitioned tables.'
+		)
+		return parser
+
+	def take_action(self, args):
+		loc = self.app.locale
+		sess = self.app.db_session
+
+		from netprofile.db.partitions import get_partitions
+
+		columns = (
+			loc.translate(_('Table')),
+			loc.translate(_('Partition')),
+			loc.translate(_('Month')),
+			loc.translate(_('Rows'))
+		)
+		data = []
+		for table in _partitioned_tables(self.app, args.tables):
+			parts = get_partitions(sess, table)
+			if len(parts) == 0:
+				data.append((table.name, loc.translate(_('- N/A -')), '', ''))
+				continue
+			for name, month, rows in parts:
+				data.append((table.name, name, month.strftime('%Y-%m') if month else '', rows))
+		return (columns, data)
+
+class RotatePartitions(Command):
+	"""
+	Add upcoming monthly partitions and remove expired ones.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(RotatePartitions, self).get_parser(prog_name)
+		parser.add_argument(
+			'-a', '--ahead',
+			type=int,
+			default=None,
+			help='Number of months after the current one to create partitions for.'
+		)
+		parser.add_argument(
+			'-k', '--keep',
+			type=int,
+			default=None,
+			help='Number of months before the current one to keep. Older partitions are removed.'
+		)
+		parser.add_argument(
+			'--archive',
+			action='store_true',
+			help='Move removed partitions into separate tables instead of dropping them.'
+		)
+		parser.add_argument(
+			'--init',
+			action='store_true',
+			help='Partition tables that are not partitioned yet. This rebuilds them and drops their foreign keys, so ON DELETE actions are no longer enforced.'
+		)
+		parser.add_argument(
+			'tables',
+			nargs='*',
+			help='Names of tables to process, defaults to all partitioned tables.'
+		)
+		return parser
+
+	def take_action(self, args):
+		sess = self.app.db_session
+
+		from netprofile.db.partitions import (
+			expire_partitions,
+			get_partitions,
+			partition_table,
+			roll_forward
+		)
+
+		for table in _partitioned_tables(self.app, args.tables):
+			if args.init:
+				if partition_table(sess, table):
+					self.log.info('Partitioned table \'%s\'.', table.name)
+			elif len(get_partitions(sess, table)) == 0:
+				self.log.warning('Table \'%s\' is not partitioned, use --init to convert it.', table.name)
+				continue
+			months = roll_forward(sess, table, ahead=args.ahead)
+			for month in months:
+				self.log.info('Added partition for %s to table \'%s\'.', month.strftime('%Y-%m'), table.name)
+			names = expire_partitions(sess, table, keep=args.keep, archive=args.archive)
+			for name in names:
+				self.log.info('Removed partition \'%s\' of table \'%s\'.', name, table.name)
+
+def _archived_models(app, names):
+	_load_modules(app)
+
+	from netprofile.db.connection import Base
+	from netprofile.ext.data import _table_to_class
+
+	directory = app.app_config.registry.settings.get('netprofile.archive.directory')
+	if not directory:
+		raise RuntimeError('Archive directory is not configured, set netprofile.archive.directory.')
+	models = [
+		_table_to_class(table.name)
+		for table in Base.metadata.sorted_tables
+		if 'cold_archive' in table.info
+	]
+	if names:
+		unknown = set(names).difference(model.__tablename__ for model in models)
+		if unknown:
+			raise RuntimeError('Not an archived table: %s.' % (', '.join(sorted(unknown)),))
+		models = [model for model in models if model.__tablename__ in names]
+	return (directory, models)
+
+class ListArchives(Lister):
+	"""
+	List archived months of history tables.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(ListArchives, self).get_parser(prog_name)
+		parser.add_argument(
+			'tables',
+			nargs='*',
+			help='Names of tables to show, defaults to all archived tables.'
+		)
+		return parser
+
+	def take_action(self, args):
+		loc = self.app.locale
+		directory, models = _archived_models(self.app, args.tables)
+
+		from netprofile.db.archive import get_archive
+
+		columns = (
+			loc.translate(_('Table')),
+			loc.translate(_('Month')),
+			loc.translate(_('File')),
+			loc.translate(_('Rows')),
+			loc.translate(_('First')),
+			loc.translate(_('Last'))
+		)
+		data = []
+		for model in models:
+			for ent in get_archive(model, directory).index:
+				data.append((
+					model.__tablename__,
+					ent['month'].strftime('%Y-%m'),
+					ent['file'],
+					ent['rows'],
+					ent['min'].strftime('%Y-%m-%d %H:%M:%S'),
+					ent['max'].strftime('%Y-%m-%d %H:%M:%S')
+				))
+		return (columns, data)
+
+class ArchiveHistory(Command):
+	"""
+	Move old rows of history tables into archive files.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(ArchiveHistory, self).get_parser(prog_name)
+		parser.add_argument(
+			'-k', '--keep',
+			type=int,
+			default=12,
+			help='Number of months before the current one to keep in the database.'
+		)
+		parser.add_argument(
+			'tables',
+			nargs='*',
+			help='Names of tables to process, defaults to all archived tables.'
+		)
+		return parser
+
+	def take_action(self, args):
+		directory, models = _archived_models(self.app, args.tables)
+		sess = self.app.db_session
+
+		import transaction
+		from netprofile.db.archive import archive_months
+
+		for model in models:
+			done = archive_months(sess, model, directory, keep=args.keep, commit=transaction.commit)
+			for month, rows in done:
+				self.log.info('Archived %d rows of table \'%s\' for %s.', rows, model.__tablename__, month.strftime('%Y-%m'))
@@ -36,6 +36,19 @@ import struct
 IPV4LENGTH = 32
 IPV6LENGTH = 128
 
+_V4_STRUCT = struct.Struct('!I')
+_V6_STRUCT = struct.Struct('!QQ')
+
+try:
+    _int_from_bytes = int.from_bytes
+except AttributeError:
+    def _v6_int_from_packed(packed):
+        hi, lo = _V6_STRUCT.unpack(packed)
+        return (hi << 64) | lo
+else:
+    def _v6_int_from_packed(packed):
+        return _int_from_bytes(packed, 'big')
+
 try:
 	_int_types = (int, long)
 except NameError:
@@ -145,7 +158,7 @@ def v4_int_to_packed(address):
     """
     if address > _BaseV4._ALL_ONES:
         raise ValueError('Address too large for IPv4')
-    return Bytes(struct.pack('!I', address))
+    return Bytes(_V4_STRUCT.pack(address))
 
 
 def v6_int_to_packed(address):
@@ -157,7 +170,7 @@ def v6_int_to_packed(address):
     Returns:
         The binary representation of this address.
     """
-    return Bytes(struct.pack('!QQ', address >> 64, address & (2**64 - 1)))
+    return Bytes(_V6_STRUCT.pack(address >> 64, address & 0xFFFFFFFFFFFFFFFF))
 
 
 def _find_address_range(addresses):
@@ -429,6 +442,8 @@ class _IPAddrBase(object):
 
     """The mother class."""
 
+    __slots__ = ()
+
     def __index__(self):
         return self._ip
 
@@ -456,9 +471,16 @@ class _BaseIP(_IPAddrBase):
     This IP class contains the version independent methods which are
     used by single IP addresses.
 
+    Concrete address classes store the integer value in the _ip slot,
+    and lazily cache their string and packed forms in _str and _packed.
+
     """
 
+    __slots__ = ()
+
     def __eq__(self, other):
+        if self.__class__ is other.__class__:
+            return self._ip == other._ip
         try:
             return (self._ip == other._ip
                     and self._version == other._version)
@@ -484,6 +506,8 @@ class _BaseIP(_IPAddrBase):
         return not lt
 
     def __lt__(self, other):
+        if self.__class__ is other.__class__:
+            return self._ip < other._ip
         if self._version != other._version:
             raise TypeError('%s and %s are not of the same version' % (
                     str(self), str(other)))
@@ -495,6 +519,8 @@ class _BaseIP(_IPAddrBase):
         return False
 
     def __gt__(self, other):
+        if self.__class__ is other.__class__:
+            return self._ip > other._ip
         if self._version != other._version:
             raise TypeError('%s and %s are not of the same version' % (
                     str(self), str(other)))
@@ -521,10 +547,16 @@ class _BaseIP(_IPAddrBase):
         return '%s(%r)' % (self.__class__.__name__, str(self))
 
     def __str__(self):
-        return  '%s' % self._string_from_ip_int(self._ip)
+        ret = self._str
+        if ret is None:
+            ret = self._str = self._string_from_ip_int(self._ip)
+        return ret
 
     def __hash__(self):
-        return hash(hex(int(self._ip)))
+        return hash(self._ip)
+
+    def __reduce__(self):
+        return (self.__class__, (self._ip,))
 
     def _get_address_key(self):
         return (self._version, self)
@@ -543,9 +575,14 @@ class _BaseNet(_IPAddrBase):
 
     """
 
+    __slots__ = ('_cache', '_ip', '_prefixlen', 'ip', 'netmask')
+
     def __init__(self, address):
         self._cache = {}
 
+    def __reduce__(self):
+        return (self.__class__, (self.with_prefixlen,))
+
     def __repr__(self):
         return '%s(%r)' % (self.__class__.__name__, str(self))
 
@@ -553,11 +590,16 @@ class _BaseNet(_IPAddrBase):
         """Generate Iterator over usable hosts in a network.
 
            This is like __iter__ except it doesn't return the network
-           or broadcast addresses.
+           or broadcast addresses. Point-to-point networks (/31 for IPv4,
+           /127 for IPv6) have no such addresses, so both of their
+           addresses are returned.
 
         """
-        cur = int(self.network) + 1
-        bcast = int(self.broadcast) - 1
+        cur = int(self.network)
+        bcast = int(self.broadcast)
+        if self._prefixlen != (self._max_prefixlen - 1):
+            cur += 1
+            bcast -= 1
         while cur <= bcast:
             cur += 1
             yield IPAddress(cur - 1, version=self._version)
@@ -1025,13 +1067,19 @@ class _BaseV4(object):
 
     """
 
+    __slots__ = ()
+
     # Equivalent to 255.255.255.255 or 32 bits of 1's.
     _ALL_ONES = (2**IPV4LENGTH) - 1
     _DECIMAL_DIGITS = frozenset('0123456789')
+    # Canonical octet strings, which also rules out leading zeroes.
+    _OCTETS = dict((str(i), i) for i in range(256))
+
+    _version = 4
+    _max_prefixlen = IPV4LENGTH
 
     def __init__(self, address):
-        self._version = 4
-        self._max_prefixlen = IPV4LENGTH
+        pass
 
     def _explode_shorthand_ip_string(self):
         return str(self)
@@ -1053,13 +1101,11 @@ class _BaseV4(object):
         if len(octets) != 4:
             raise AddressValueError(ip_str)
 
-        packed_ip = 0
-        for oc in octets:
-            try:
-                packed_ip = (packed_ip << 8) | self._parse_octet(oc)
-            except ValueError:
-                raise AddressValueError(ip_str)
-        return packed_ip
+        try:
+            a, b, c, d = [self._OCTETS[oc] for oc in octets]
+        except KeyError:
+            raise AddressValueError(ip_str)
+        return (a << 24) | (b << 16) | (c << 8) | d
 
     def _parse_octet(self, octet_str):
         """Convert a decimal octet into an integer.
@@ -1094,11 +1140,11 @@ class _BaseV4(object):
             The IP address as a string in dotted decimal notation.
 
         """
-        octets = []
-        for _ in range(4):
-            octets.insert(0, str(ip_int & 0xFF))
-            ip_int >>= 8
-        return '.'.join(octets)
+        return '%d.%d.%d.%d' % (
+            (ip_int >> 24) & 0xFF,
+            (ip_int >> 16) & 0xFF,
+            (ip_int >> 8) & 0xFF,
+            ip_int & 0xFF)
 
     @property
     def max_prefixlen(self):
@@ -1183,6 +1229,8 @@ class IPv4Address(_BaseV4, _BaseIP):
 
     """Represent and manipulate single IPv4 Addresses."""
 
+    __slots__ = ('_ip', '_str', '_packed')
+
     def __init__(self, address):
 
         """
@@ -1200,27 +1248,39 @@ class IPv4Address(_BaseV4, _BaseIP):
             AddressValueError: If ipaddr isn't a valid IPv4 address.
 
         """
-        _BaseV4.__init__(self, address)
+        self._str = None
+        self._packed = None
 
         # Efficient constructor from integer.
         if isinstance(address, _int_types):
-            self._ip = address
             if address < 0 or address > self._ALL_ONES:
                 raise AddressValueError(address)
+            self._ip = address
             return
 
         # Constructing from a packed address
         if isinstance(address, Bytes):
             try:
-                self._ip, = struct.unpack('!I', address)
+                self._ip, = _V4_STRUCT.unpack(address)
             except struct.error:
                 raise AddressValueError(address)  # Wrong length.
+            self._packed = address
             return
 
         # Assume input argument to be string or any object representation
         # which converts into a formatted IP string.
         addr_str = str(address)
         self._ip = self._ip_int_from_string(addr_str)
+        # Only canonical strings get past the parser.
+        self._str = addr_str
+
+    @property
+    def packed(self):
+        """The binary representation of this address."""
+        ret = self._packed
+        if ret is None:
+            ret = self._packed = v4_int_to_packed(self._ip)
+        return ret
 
 
 class IPv4Network(_BaseV4, _BaseNet):
@@ -1332,8 +1392,6 @@ class IPv4Network(_BaseV4, _BaseNet):
             if self.ip != self.network:
                 raise ValueError('%s has host bits set' %
                                  self.ip)
-        if self._prefixlen == (self._max_prefixlen - 1):
-            self.iterhosts = self.__iter__
 
     def _is_hostmask(self, ip_str):
         """Test if the IP string is a hostmask (rather than a netmask).
@@ -1398,13 +1456,19 @@ class _BaseV6(object):
 
     """
 
+    __slots__ = ()
+
     _ALL_ONES = (2**IPV6LENGTH) - 1
     _HEXTET_COUNT = 8
     _HEX_DIGITS = frozenset('0123456789ABCDEFabcdef')
+    # Runs of zero hextets to compress, longest first.
+    _ZERO_RUNS = tuple(':' + '0:' * n for n in range(8, 1, -1))
+
+    _version = 6
+    _max_prefixlen = IPV6LENGTH
 
     def __init__(self, address):
-        self._version = 6
-        self._max_prefixlen = IPV6LENGTH
+        pass
 
     def _ip_int_from_string(self, ip_str):
         """Turn an IPv6 ip_str into an integer.
@@ -1471,19 +1535,23 @@ class _BaseV6(object):
             parts_lo = 0
             parts_skipped = 0
 
-        try:
-            # Now, parse the hextets into a 128-bit integer.
-            ip_int = 0
-            for i in range(parts_hi):
-                ip_int <<= 16
-                ip_int |= self._parse_hextet(parts[i])
-            ip_int <<= 16 * parts_skipped
-            for i in range(-parts_lo, 0):
-                ip_int <<= 16
-                ip_int |= self._parse_hextet(parts[i])
-            return ip_int
-        except ValueError:
+        # Now, parse the hextets into a 128-bit integer. This performs the
+        # same checks as _parse_hextet(), but for all hextets at once.
+        hextets = parts[:parts_hi]
+        if parts_lo:
+            hextets.extend(parts[-parts_lo:])
+        for hextet in hextets:
+            if not 0 < len(hextet) <= 4:
+                raise AddressValueError(ip_str)
+        if not self._HEX_DIGITS.issuperset(''.join(hextets)):
             raise AddressValueError(ip_str)
+        ip_int = 0
+        for hextet in hextets[:parts_hi]:
+            ip_int = (ip_int << 16) | int(hextet, 16)
+        ip_int <<= 16 * parts_skipped
+        for hextet in hextets[parts_hi:]:
+            ip_int = (ip_int << 16) | int(hextet, 16)
+        return ip_int
 
     def _parse_hextet(self, hextet_str):
         """Convert an IPv6 hextet string into an integer.
@@ -1574,13 +1642,19 @@ class _BaseV6(object):
         if ip_int > self._ALL_ONES:
             raise ValueError('IPv6 address is too large')
 
-        hex_str = '%032x' % ip_int
-        hextets = []
-        for x in range(0, 32, 4):
-            hextets.append('%x' % int(hex_str[x:x+4], 16))
+        ip_str = ':%x:%x:%x:%x:%x:%x:%x:%x:' % (
+            (ip_int >> 112) & 0xFFFF, (ip_int >> 96) & 0xFFFF,
+            (ip_int >> 80) & 0xFFFF, (ip_int >> 64) & 0xFFFF,
+            (ip_int >> 48) & 0xFFFF, (ip_int >> 32) & 0xFFFF,
+            (ip_int >> 16) & 0xFFFF, ip_int & 0xFFFF)
 
-        hextets = self._compress_hextets(hextets)
-        return ':'.join(hextets)
+        # Same result as _compress_hextets(), but str.find() locates
+        # the first longest run of zeroes without a Python-level loop.
+        for run in self._ZERO_RUNS:
+            idx = ip_str.find(run)
+            if idx >= 0:
+                return '%s::%s' % (ip_str[1:idx], ip_str[idx + len(run):-1])
+        return ip_str[1:-1]
 
     def _explode_shorthand_ip_string(self):
         """Expand a shortened IPv6 address.
@@ -1759,6 +1833,8 @@ class IPv6Address(_BaseV6, _BaseIP):
     """Represent and manipulate single IPv6 Addresses.
     """
 
+    __slots__ = ('_ip', '_str', '_packed')
+
     def __init__(self, address):
         """Instantiate a new IPv6 address object.
 
@@ -1776,22 +1852,22 @@ class IPv6Address(_BaseV6, _BaseIP):
             AddressValueError: If address isn't a valid IPv6 address.
 
         """
-        _BaseV6.__init__(self, address)
+        self._str = None
+        self._packed = None
 
         # Efficient constructor from integer.
         if isinstance(address, _int_types):
-            self._ip = address
             if address < 0 or address > self._ALL_ONES:
                 raise AddressValueError(address)
+            self._ip = address
             return
 
         # Constructing from a packed address
         if isinstance(address, Bytes):
-            try:
-                hi, lo = struct.unpack('!QQ', address)
-            except struct.error:
+            if len(address) != 16:
                 raise AddressValueError(address)  # Wrong length.
-            self._ip = (hi << 64) | lo
+            self._ip = _v6_int_from_packed(address)
+            self._packed = address
             return
 
         # Assume input argument to be string or any object representation
@@ -1802,6 +1878,14 @@ class IPv6Address(_BaseV6, _BaseIP):
 
         self._ip = self._ip_int_from_string(addr_str)
 
+    @property
+    def packed(self):
+        """The binary representation of this address."""
+        ret = self._packed
+        if ret is None:
+            ret = self._packed = v6_int_to_packed(self._ip)
+        return ret
+
 
 class IPv6Network(_BaseV6, _BaseNet):
 
@@ -1885,8 +1969,6 @@ class IPv6Network(_BaseV6, _BaseNet):
             if self.ip != self.network:
                 raise ValueError('%s has host bits set' %
                                  self.ip)
-        if self._prefixlen == (self._max_prefixlen - 1):
-            self.iterhosts = self.__iter__
 
     def _is_valid_netmask(self, prefixlen):
         """Verify that the netmask/prefixlen is valid.
@@ -1908,3 +1990,233 @@ class IPv6Network(_BaseV6, _BaseNet):
     @property
     def with_netmask(self):
         return self.with_prefixlen
+
+
+def v4_from_int(address):
+    """Build an IPv4Address from a trusted integer.
+
+    Unlike IPv4Address(), this skips type dispatch and range checks, so it
+    must only be used on values that are known to be valid, like the ones
+    read from a database column.
+
+    Args:
+        address: An integer in 0..2**32-1.
+
+    Returns:
+        An IPv4Address object.
+
+    """
+    ret = object.__new__(IPv4Address)
+    ret._ip = address
+    ret._str = None
+    ret._packed = None
+    return ret
+
+
+def v6_from_packed(address):
+    """Build an IPv6Address from a trusted packed address.
+
+    Unlike IPv6Address(), this skips type dispatch. The packed form is kept,
+    so converting the address back to bytes costs nothing.
+
+    Args:
+        address: A 16-byte packed address.
+
+    Returns:
+        An IPv6Address object.
+
+    Raises:
+        AddressValueError: If address has wrong length.
+
+    """
+    if type(address) is not Bytes:
+        address = Bytes(address)
+    if len(address) != 16:
+        raise AddressValueError(address)
+    ret = object.__new__(IPv6Address)
+    ret._ip = _v6_int_from_packed(address)
+    ret._str = None
+    ret._packed = address
+    return ret
+
+
+class IPPrefixTrie(object):
+
+    """Longest-prefix-match lookup table for IPv4 and IPv6 networks.
+
+    Prefixes are kept in a multibit trie with 8-bit strides: each level
+    of the trie covers one octet of the address, and prefixes which don't
+    end on an octet boundary are expanded over all the slots they cover.
+    Looking up an address takes at most 4 (IPv4) or 16 (IPv6) steps, no
+    matter how many prefixes are stored.
+
+    Example:
+        trie = IPPrefixTrie()
+        trie.insert(IPv4Network('10.0.0.0/8'), 'a')
+        trie.insert(IPv4Network('10.1.0.0/16'), 'b')
+        trie.get(IPv4Address('10.1.2.3')) -> 'b'
+        trie.get(IPv4Address('10.2.0.1')) -> 'a'
+        trie.get(IPv4Address('11.0.0.1')) -> None
+
+    """
+
+    __slots__ = ('_roots', '_prefixes')
+
+    def __init__(self, networks=None):
+        """Instantiate a new trie.
+
+        Args:
+            networks: An optional iterable of networks (which are stored
+              with a value of True) or (network, value) tuples.
+
+        """
+        self.clear()
+        if networks:
+            for item in networks:
+                if isinstance(item, tuple):
+                    self.insert(*item)
+                else:
+                    self.insert(item)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self.items()),))
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def __iter__(self):
+        for net, value in self._prefixes.values():
+            yield net
+
+    def __contains__(self, address):
+        return self.longest_match(address) is not None
+
+    def items(self):
+        """Iterate over stored (network, value) tuples."""
+        return iter(self._prefixes.values())
+
+    def clear(self):
+        """Remove all prefixes from the trie."""
+        self._roots = {4: [None, {}], 6: [None, {}]}
+        self._prefixes = {}
+
+    def insert(self, network, value=True):
+        """Add a prefix to the trie, replacing any previous value.
+
+        Args:
+            network: An IPv4Network/IPv6Network object, or anything
+              IPNetwork() accepts. Host bits are ignored.
+            value: An object to return on lookups matching this prefix.
+
+        """
+        if not isinstance(network, _BaseNet):
+            network = IPNetwork(network)
+        net_int = int(network.network)
+        plen = network._prefixlen
+        network = IPNetwork(
+            '%s/%d' % (str(network.network), plen),
+            version=network._version)
+        self._prefixes[(network._version, net_int, plen)] = (network, value)
+        self._insert_entry(network._version, network._max_prefixlen,
+                           net_int, (plen, network, value))
+
+    def remove(self, network):
+        """Remove a prefix from the trie.
+
+        This rebuilds the trie from scratch, so it is meant for occasional
+        edits only.
+
+        Args:
+            network: A network previously passed to insert().
+
+        Raises:
+            KeyError: If the prefix is not in the trie.
+
+        """
+        if not isinstance(network, _BaseNet):
+            network = IPNetwork(network)
+        del self._prefixes[(network._version, int(network.network),
+                            network._prefixlen)]
+        prefixes = list(self._prefixes.values())
+        self.clear()
+        for net, value in prefixes:
+            self.insert(net, value)
+
+    def _insert_entry(self, version, bits, net_int, entry):
+        plen = entry[0]
+        depth = (plen - 1) // 8 if plen else 0
+        node = self._roots[version]
+        for level in range(depth):
+            octet = (net_int >> (bits - 8 * (level + 1))) & 0xFF
+            child = node[1].get(octet)
+            if child is None:
+                child = node[1][octet] = [None, {}]
+            node = child
+        first = (net_int >> (bits - 8 * (depth + 1))) & 0xFF
+        entries = node[0]
+        if entries is None:
+            entries = node[0] = [None] * 256
+        for octet in range(first, first + (1 << (8 * (depth + 1) - plen))):
+            cur = entries[octet]
+            # Longer prefixes always win over expanded shorter ones.
+            if cur is None or cur[0] <= plen:
+                entries[octet] = entry
+
+    def longest_match(self, address):
+        """Find the most specific prefix containing an address.
+
+        Args:
+            address: An IPv4Address/IPv6Address object, or anything
+              IPAddress() accepts. Network objects are also accepted, in
+              which case the prefix must contain the entire network.
+
+        Returns:
+            A (network, value) tuple, or None if nothing matches.
+
+        """
+        if isinstance(address, _BaseNet):
+            return self._network_match(address)
+        if not isinstance(address, _BaseIP):
+            address = IPAddress(address)
+        ip_int = address._ip
+        node = self._roots[address._version]
+        shift = address._max_prefixlen - 8
+        best = None
+        while node is not None:
+            octet = (ip_int >> shift) & 0xFF
+            entries = node[0]
+            if entries is not None and entries[octet] is not None:
+                best = entries[octet]
+            node = node[1].get(octet)
+            shift -= 8
+        if best is None:
+            return None
+        return (best[1], best[2])
+
+    def _network_match(self, network):
+        # Slot expansion may hide shorter prefixes behind longer ones,
+        # so walk the prefix table directly.
+        version = network._version
+        net_int = int(network.network)
+        all_ones = network._ALL_ONES
+        for plen in range(network._prefixlen, -1, -1):
+            key = (version, net_int & (all_ones ^ (all_ones >> plen)), plen)
+            if key in self._prefixes:
+                return self._prefixes[key]
+        return None
+
+    def get(self, address, default=None):
+        """Get the value of the most specific prefix containing an address.
+
+        Args:
+            address: Same as for longest_match().
+            default: A value to return if nothing matches.
+
+        Returns:
+            The value stored along with the matching prefix, or default.
+
+        """
+        match = self.longest_match(address)
+        if match is None:
+            return default
+        return match[1]
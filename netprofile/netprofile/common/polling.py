@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Partitioned polling helpers
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'PollMetrics',
+	'pack_shards',
+	'dispatch_shards'
+]
+
+import time
+import uuid
+
+from celery import (
+	chain,
+	group
+)
+
+class PollMetrics(object):
+	"""
+	Per-run metrics of partitioned polling tasks, kept in a Redis hash for
+	each run. A run is split into shards, which report back when done. Lag
+	is the number of seconds an item was processed past its due time.
+	"""
+	def __init__(self, rsess, kind, ttl=86400 * 7):
+		self.rsess = rsess
+		self.prefix = 'poll:%s:' % (kind,)
+		self.ttl = ttl
+
+	def start(self, ts, shards, items=0, max_lag=0, **extra):
+		"""
+		Record start of a new run and return its ID.
+		"""
+		run_id = uuid.uuid4().hex
+		key = self.prefix + run_id
+		now = time.time()
+		data = {
+			'ts'          : ts.strftime('%Y-%m-%d %H:%M:%S'),
+			'started'     : now,
+			'shards'      : shards,
+			'done_shards' : 0,
+			'items'       : items,
+			'processed'   : 0,
+			'errors'      : 0,
+			'max_lag'     : max_lag
+		}
+		data.update(extra)
+		if shards == 0:
+			data['finished'] = now
+			data['duration'] = 0
+		pipe = self.rsess.pipeline()
+		pipe.hmset(key, data)
+		pipe.expire(key, self.ttl)
+		pipe.set(self.prefix + 'last', run_id)
+		pipe.execute()
+		return run_id
+
+	def shard_done(self, run_id, processed, errors, elapsed, max_lag=0):
+		"""
+		Record results of a single shard. Returns True if it was the last
+		shard of the run.
+		"""
+		key = self.prefix + run_id
+		pipe = self.rsess.pipeline()
+		pipe.hincrby(key, 'processed', processed)
+		pipe.hincrby(key, 'errors', errors)
+		pipe.hincrbyfloat(key, 'shard_time', elapsed)
+		pipe.hincrby(key, 'done_shards', 1)
+		pipe.hmget(key, 'max_lag', 'shards', 'started')
+		res = pipe.execute()
+		old_lag, shards, started = res[-1]
+		if max_lag > float(old_lag or 0):
+			# Racy, but lag is only a hint.
+			self.rsess.hset(key, 'max_lag', max_lag)
+		if (shards is not None) and (res[-2] >= int(shards)):
+			now = time.time()
+			self.rsess.hmset(key, {
+				'finished' : now,
+				'duration' : now - float(started)
+			})
+			return True
+		return False
+
+	def status(self, run_id=None):
+		"""
+		Get metrics of a run, or of the last one if run_id is None.
+		"""
+		if run_id is None:
+			run_id = self.rsess.get(self.prefix + 'last')
+			if run_id is None:
+				return None
+			if isinstance(run_id, bytes):
+				run_id = run_id.decode()
+		data = self.rsess.hgetall(self.prefix + run_id)
+		if not data:
+			return None
+		ret = { 'run_id' : run_id }
+		for key, value in data.items():
+			if isinstance(key, bytes):
+				key = key.decode()
+			if isinstance(value, bytes):
+				value = value.decode()
+			ret[key] = value
+		return ret
+
+def pack_shards(groups, shard_size):
+	"""
+	Pack an iterable of item lists into shards of about shard_size items
+	each. Lists are never split, so that all items of a group are handled
+	by the same worker one after another.
+	"""
+	shards = []
+	cur = []
+	for items in groups:
+		if cur and (len(cur) + len(items) > shard_size):
+			shards.append(cur)
+			cur = []
+		cur.extend(items)
+	if cur:
+		shards.append(cur)
+	return shards
+
+def dispatch_shards(sigs, concurrency):
+	"""
+	Run a list of immutable task signatures in at most concurrency chains
+	at once. Returns number of chains started.
+	"""
+	if len(sigs) == 0:
+		return 0
+	lanes = min(concurrency, len(sigs))
+	group(
+		chain(*sigs[lane::lanes])
+		for lane in range(lanes)
+	).apply_async()
+	return lanes
+
@@ -240,6 +240,10 @@ class RTMessageHandler(sockjs.tornado.SockJSConnection):
 						'value' : 'Access denied'
 					}))
 					return
+			uid_kwarg = getattr(task, '__uid_kwarg__', None)
+			if uid_kwarg:
+				# Always set here, so that clients can't act on behalf of others.
+				task_kwargs[uid_kwarg] = self.user.id
 
 			resp = yield tornado.gen.Task(
 				task.apply_async,
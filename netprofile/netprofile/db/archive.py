@@ -0,0 +1,601 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Cold storage for old history rows
+# © Copyright 2013-2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Monthly Parquet files holding history rows that were moved out of the
+database.
+
+This module requires PyArrow, which is not a hard dependency of NetProfile.
+"""
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'ColdArchive',
+	'get_archive',
+	'archive_months'
+]
+
+import datetime as dt
+import functools
+import json
+import logging
+import operator
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from sqlalchemy import (
+	func,
+	text,
+	types
+)
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy.orm.attributes import set_committed_value
+
+from netprofile.db import fields
+from netprofile.db.ddl import (
+	DropPartitions,
+	add_months,
+	month_start,
+	partition_name
+)
+from netprofile.db.partitions import get_partitions
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+BATCH_SIZE = 50000
+TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+_EQ_OPS = ('eq', '=', '==', '===')
+_NE_OPS = ('ne', '!=', '!==')
+_RANGE_OPS = {
+	'gt' : operator.gt,
+	'>'  : operator.gt,
+	'lt' : operator.lt,
+	'<'  : operator.lt,
+	'ge' : operator.ge,
+	'>=' : operator.ge,
+	'le' : operator.le,
+	'<=' : operator.le
+}
+
+def _arrow_type(coltype):
+	if isinstance(coltype, fields.DeclEnumType):
+		return pa.string()
+	if isinstance(coltype, fields.UInt64):
+		return pa.uint64()
+	if isinstance(coltype, (fields.IPv4Address, fields.IPv6Address, fields.MACAddress)):
+		return None
+	if isinstance(coltype, types.TypeDecorator):
+		coltype = coltype.impl
+	if isinstance(coltype, types.Boolean):
+		return pa.bool_()
+	if isinstance(coltype, types.Integer):
+		return pa.int64()
+	if isinstance(coltype, types.Float):
+		return pa.float64()
+	if isinstance(coltype, types.Numeric):
+		if coltype.precision > 38:
+			return pa.decimal256(coltype.precision, coltype.scale)
+		return pa.decimal128(coltype.precision, coltype.scale)
+	if isinstance(coltype, types.DateTime):
+		return pa.timestamp('us')
+	if isinstance(coltype, types.Date):
+		return pa.date32()
+	if isinstance(coltype, types.String):
+		return pa.string()
+	if isinstance(coltype, (types.LargeBinary, types._Binary)):
+		return pa.binary()
+	return None
+
+def _dump_enum(value):
+	if value is None:
+		return None
+	return value.value
+
+def _dump_bool(value):
+	if value is None:
+		return None
+	return bool(value)
+
+def _load_enum(enum):
+	def _load(value):
+		if value is None:
+			return None
+		return enum.from_string(value)
+	return _load
+
+def _parse_ts(value):
+	return dt.datetime.strptime(value, TS_FORMAT)
+
+def _month_bounds(month):
+	nxt = add_months(month, 1)
+	return (
+		dt.datetime(month.year, month.month, 1),
+		dt.datetime(nxt.year, nxt.month, 1)
+	)
+
+class ColdArchive(object):
+	"""
+	Archived rows of a table, stored as one compressed Parquet file per
+	month in a separate directory. An index file keeps row counts and
+	timestamp ranges of all files, so that readers open only those files
+	that overlap with requested time range.
+
+	Table must name its timestamp column in cold_archive table info key.
+	"""
+	def __init__(self, model, directory):
+		self.model = model
+		self.table = model.__table__
+		self.column = self.table.c[self.table.info['cold_archive']]
+		self.key = model.__mapper__.get_property_by_column(self.column).key
+		self.directory = os.path.join(directory, self.table.name)
+		self.lock = threading.Lock()
+		self._index = None
+		self._index_mtime = None
+
+		mapper = model.__mapper__
+		self.columns = []
+		self.fields = {}
+		self.schema = []
+		for col in self.table.columns:
+			atype = _arrow_type(col.type)
+			if atype is None:
+				raise ValueError('Column %s of table %s can\'t be archived.' % (col.name, self.table.name))
+			dump = load = None
+			if isinstance(col.type, fields.DeclEnumType):
+				dump = _dump_enum
+				load = _load_enum(col.type.enum)
+			elif atype == pa.bool_():
+				dump = _dump_bool
+			key = mapper.get_property_by_column(col).key
+			self.columns.append((col, key, dump, load))
+			self.fields[key] = (col, atype, load)
+			self.schema.append(pa.field(col.name, atype))
+		self.schema = pa.schema(self.schema)
+
+	@property
+	def index_path(self):
+		return os.path.join(self.directory, INDEX_FILE)
+
+	@property
+	def index(self):
+		"""
+		List of archived months, as dicts with month, file, rows, min and max
+		keys. Reloaded whenever index file changes.
+		"""
+		try:
+			mtime = os.stat(self.index_path).st_mtime
+		except OSError:
+			return []
+		with self.lock:
+			if mtime != self._index_mtime:
+				with open(self.index_path, 'r') as fd:
+					entries = json.load(fd)
+				for ent in entries:
+					ent['month'] = dt.datetime.strptime(ent['month'], '%Y-%m').date()
+					ent['min'] = _parse_ts(ent['min'])
+					ent['max'] = _parse_ts(ent['max'])
+				self._index = sorted(entries, key=lambda ent: ent['month'])
+				self._index_mtime = mtime
+			return self._index
+
+	def _write_index(self, entries):
+		tmp = self.index_path + '.tmp'
+		with open(tmp, 'w') as fd:
+			json.dump([{
+				'month' : ent['month'].strftime('%Y-%m'),
+				'file'  : ent['file'],
+				'rows'  : ent['rows'],
+				'min'   : ent['min'].strftime(TS_FORMAT),
+				'max'   : ent['max'].strftime(TS_FORMAT)
+			} for ent in entries], fd, indent=1)
+		os.replace(tmp, self.index_path)
+
+	@property
+	def end(self):
+		"""
+		Start of the first month that was not archived, or None if the
+		archive is empty. The archive is authoritative for all rows before
+		this time.
+		"""
+		idx = self.index
+		if len(idx) == 0:
+			return None
+		start, end = _month_bounds(idx[-1]['month'])
+		return end
+
+	def files(self, ts_from=None, ts_to=None):
+		"""
+		List index entries of files that might hold rows with timestamps
+		between ts_from and ts_to, inclusive.
+		"""
+		return [
+			ent for ent in self.index
+			if ((ts_from is None) or (ent['max'] >= ts_from))
+			and ((ts_to is None) or (ent['min'] <= ts_to))
+		]
+
+	def _filter(self, ts_from, ts_to, expr=None):
+		fld = pc.field(self.column.name)
+		if ts_from is not None:
+			expr = (fld >= ts_from) if (expr is None) else (expr & (fld >= ts_from))
+		if ts_to is not None:
+			expr = (fld <= ts_to) if (expr is None) else (expr & (fld <= ts_to))
+		return expr
+
+	def _value(self, key, value):
+		col, atype, load = self.fields[key]
+		if load is not None:
+			return getattr(value, 'value', value)
+		if pa.types.is_boolean(atype) and (value is not None):
+			return bool(value)
+		return value
+
+	def _rows(self, tbl):
+		data = [tbl.column(col.name).to_pylist() for col, key, dump, load in self.columns]
+		for idx in range(tbl.num_rows):
+			row = {}
+			for (col, key, dump, load), values in zip(self.columns, data):
+				value = values[idx]
+				if load is not None:
+					value = load(value)
+				row[key] = value
+			yield row
+
+	def _top(self, tbl, sort, limit):
+		if len(sort) > 0:
+			names = []
+			arrays = []
+			keys = []
+			for idx, (key, desc) in enumerate(sort):
+				col, atype, load = self.fields[key]
+				values = tbl.column(col.name)
+				if load is not None:
+					# Enumerations sort by symbol order, as in ExtModel.
+					syms = list(col.type.enum)
+					values = pc.take(
+						pa.array([sym.order for sym in syms], type=pa.int64()),
+						pc.index_in(values, value_set=pa.array([sym.value for sym in syms], type=pa.string()))
+					)
+				order = 'descending' if desc else 'ascending'
+				# NULLs go first in ascending order, as in MySQL.
+				names.extend(('n%d' % idx, 'v%d' % idx))
+				arrays.extend((pc.is_valid(values), values))
+				keys.extend((('n%d' % idx, order), ('v%d' % idx, order)))
+			idx = pc.sort_indices(pa.table(arrays, names=names), sort_keys=keys)
+			if limit is not None:
+				idx = idx.slice(0, limit)
+			return tbl.take(idx)
+		if limit is not None:
+			return tbl.slice(0, limit)
+		return tbl
+
+	def _count(self, ent, ts_from, ts_to, expr):
+		if (expr is None) and ((ts_from is None) or (ent['min'] >= ts_from)) and ((ts_to is None) or (ent['max'] <= ts_to)):
+			return ent['rows']
+		return pq.read_table(
+			os.path.join(self.directory, ent['file']),
+			columns=[self.column.name],
+			schema=self.schema,
+			filters=self._filter(ts_from, ts_to, expr)
+		).num_rows
+
+	def read(self, ts_from=None, ts_to=None):
+		"""
+		Yield archived rows with timestamps between ts_from and ts_to,
+		inclusive, as dicts keyed by mapped attribute names.
+		"""
+		flt = self._filter(ts_from, ts_to)
+		for ent in self.files(ts_from, ts_to):
+			tbl = pq.read_table(
+				os.path.join(self.directory, ent['file']),
+				schema=self.schema,
+				filters=flt
+			)
+			for row in self._rows(tbl):
+				yield row
+
+	def expression(self, filters=(), sstr=None, search=()):
+		"""
+		Build PyArrow filter expression. Filters is an iterable of tuples of
+		(attribute key, kind, operator, value), where kind is 'range' for
+		numeric and date columns, 'string' for text columns and None for the
+		rest. They are matched the same way ExtModel matches them in SQL.
+		Search string is looked for in attributes listed in search. Returns
+		None if there is nothing to filter by.
+		"""
+		exprs = []
+		for key, kind, op, value in filters:
+			if key not in self.fields:
+				continue
+			col, atype, load = self.fields[key]
+			fld = pc.field(col.name)
+			if isinstance(value, list):
+				if op not in ('in', 'notin'):
+					continue
+				try:
+					values = pa.array([self._value(key, v) for v in value], type=atype)
+				except (pa.ArrowException, TypeError, ValueError):
+					values = None
+				if values is None:
+					if op == 'in':
+						exprs.append(pc.scalar(False))
+					continue
+				cond = fld.isin(values)
+				exprs.append(cond if (op == 'in') else ~cond)
+				continue
+			if op in _EQ_OPS:
+				exprs.append(fld.is_null() if (value is None) else (fld == self._value(key, value)))
+				continue
+			if op in _NE_OPS:
+				exprs.append(fld.is_valid() if (value is None) else ((fld != self._value(key, value)) | fld.is_null()))
+				continue
+			if value is None:
+				continue
+			if kind == 'range':
+				if op in _RANGE_OPS:
+					exprs.append(_RANGE_OPS[op](fld, value))
+				continue
+			if kind == 'string':
+				text = pc.coalesce(fld, pc.scalar(''))
+				if op in ('contains', 'like'):
+					exprs.append(pc.match_substring(text, value, ignore_case=True))
+				elif op in ('ncontains', 'notlike'):
+					exprs.append(~pc.match_substring(text, value, ignore_case=True))
+				elif op == 'startswith':
+					exprs.append(pc.starts_with(text, value, ignore_case=True))
+				elif op == 'nstartswith':
+					exprs.append(~pc.starts_with(text, value, ignore_case=True))
+				elif op == 'endswith':
+					exprs.append(pc.ends_with(text, value, ignore_case=True))
+				elif op == 'nendswith':
+					exprs.append(~pc.ends_with(text, value, ignore_case=True))
+		if sstr:
+			conds = [
+				pc.match_substring(pc.field(self.fields[key][0].name), sstr, ignore_case=True)
+				for key in search
+				if key in self.fields
+			]
+			if len(conds) > 0:
+				exprs.append(functools.reduce(operator.or_, conds))
+		if len(exprs) == 0:
+			return None
+		return functools.reduce(operator.and_, exprs)
+
+	def select(self, ts_from=None, ts_to=None, expr=None, sort=(), limit=None):
+		"""
+		Get archived rows with timestamps between ts_from and ts_to,
+		inclusive, that match filter expression. Sort is a list of tuples
+		of (attribute key, True for descending order). Sorting and limiting
+		are done by PyArrow within each file, so only rows that can make it
+		into the result are converted to Python objects. Returns a tuple of
+		(total number of matching rows, list of at most limit first rows as
+		dicts keyed by mapped attribute names).
+		"""
+		entries = self.files(ts_from, ts_to)
+		# Files hold disjoint months, so when rows are ordered by timestamp
+		# first, files past the limit can only add to the total.
+		ordered = (len(sort) == 0) or (sort[0][0] == self.key)
+		if (len(sort) > 0) and ordered and sort[0][1]:
+			entries = entries[::-1]
+		flt = self._filter(ts_from, ts_to, expr)
+		total = 0
+		have = 0
+		tables = []
+		for ent in entries:
+			if ordered and (limit is not None) and (have >= limit):
+				total += self._count(ent, ts_from, ts_to, expr)
+				continue
+			tbl = pq.read_table(
+				os.path.join(self.directory, ent['file']),
+				schema=self.schema,
+				filters=flt
+			)
+			total += tbl.num_rows
+			tbl = self._top(tbl, sort, limit)
+			have += tbl.num_rows
+			tables.append(tbl)
+		if len(tables) == 0:
+			return (total, [])
+		if len(tables) == 1:
+			tbl = tables[0]
+		else:
+			tbl = self._top(pa.concat_tables(tables), sort, limit)
+		return (total, list(self._rows(tbl)))
+
+	def load(self, sess, rows):
+		"""
+		Make read-only objects out of archived rows. Objects are detached,
+		so they are never flushed, and their many-to-one relationships are
+		loaded beforehand with one query per relationship. Other lazy
+		relationships can't be loaded. If an object with the same identity
+		is present in the session, it is returned instead.
+		"""
+		mapper = self.model.__mapper__
+		objs = []
+		fresh = []
+		for row in rows:
+			obj = mapper.class_manager.new_instance()
+			for key, value in row.items():
+				set_committed_value(obj, key, value)
+			current = sess.identity_map.get(mapper.identity_key_from_instance(obj))
+			if current is not None:
+				objs.append(current)
+				continue
+			make_transient_to_detached(obj)
+			objs.append(obj)
+			fresh.append(obj)
+		if len(fresh) == 0:
+			return objs
+		for rel in mapper.relationships:
+			if (rel.direction is not MANYTOONE) or (rel.secondary is not None) or (len(rel.local_remote_pairs) != 1):
+				continue
+			local, remote = rel.local_remote_pairs[0]
+			lkey = mapper.get_property_by_column(local).key
+			rkey = rel.mapper.get_property_by_column(remote).key
+			ids = set(getattr(obj, lkey) for obj in fresh)
+			ids.discard(None)
+			found = {}
+			if len(ids) > 0:
+				for tgt in sess.query(rel.mapper).filter(remote.in_(ids)):
+					found[getattr(tgt, rkey)] = tgt
+			for obj in fresh:
+				set_committed_value(obj, rel.key, found.get(getattr(obj, lkey)))
+		return objs
+
+	def write_month(self, sess, month):
+		"""
+		Write all rows of a month to a file and add it to the index,
+		replacing previous file for that month if any. Returns number of
+		written rows.
+		"""
+		start, end = _month_bounds(month)
+		fname = '%s-%s.parquet' % (self.table.name, month.strftime('%Y%m'))
+		path = os.path.join(self.directory, fname)
+		tmp = path + '.tmp'
+		os.makedirs(self.directory, exist_ok=True)
+
+		cols = [col for col, key, dump, load in self.columns]
+		q = sess.query(*cols).filter(
+			self.column >= start,
+			self.column < end
+		).order_by(self.column).yield_per(BATCH_SIZE)
+		pos = cols.index(self.column)
+		rows = 0
+		ts_min = ts_max = None
+		batch = []
+
+		def _flush(writer, batch):
+			data = []
+			for idx, (col, key, dump, load) in enumerate(self.columns):
+				values = [row[idx] for row in batch]
+				if dump is not None:
+					values = [dump(v) for v in values]
+				data.append(pa.array(values, type=self.schema.field(idx).type))
+			writer.write_table(pa.Table.from_arrays(data, schema=self.schema))
+
+		with pq.ParquetWriter(tmp, self.schema, compression='zstd') as writer:
+			for row in q:
+				batch.append(row)
+				if len(batch) >= BATCH_SIZE:
+					_flush(writer, batch)
+					batch = []
+				ts = row[pos]
+				if ts_min is None:
+					ts_min = ts
+				ts_max = ts
+				rows += 1
+			if len(batch) > 0:
+				_flush(writer, batch)
+
+		if rows == 0:
+			os.unlink(tmp)
+			return 0
+		os.replace(tmp, path)
+		entries = [ent for ent in self.index if ent['month'] != month]
+		entries.append({
+			'month' : month,
+			'file'  : fname,
+			'rows'  : rows,
+			'min'   : ts_min,
+			'max'   : ts_max
+		})
+		self._write_index(sorted(entries, key=lambda ent: ent['month']))
+		return rows
+
+_archives = {}
+
+def get_archive(model, directory):
+	"""
+	Get archive of a model that is stored in directory.
+	"""
+	key = (model, directory)
+	arch = _archives.get(key)
+	if arch is None:
+		arch = _archives[key] = ColdArchive(model, directory)
+	return arch
+
+def _set_purging(sess, value):
+	# Archived rows are moved, not gone, so triggers that react to deleted
+	# rows skip them when this variable is set.
+	if sess.get_bind().dialect.name == 'mysql':
+		sess.execute(text('SET @archive_purge := %s' % ('1' if value else 'NULL',)))
+
+def archive_months(sess, model, directory, keep=12, now=None, commit=None):
+	"""
+	Move rows of months that ended more than keep months before the current
+	one into archive, oldest first. Rows are removed by dropping monthly
+	partitions where there are some, and by deleting them otherwise, with
+	@archive_purge variable set for delete triggers on MySQL. If commit
+	is given, it is called after each month. Returns a list of
+	(month, number of rows) tuples.
+	"""
+	if keep < 1:
+		raise ValueError('At least one month of data must be kept.')
+	arch = get_archive(model, directory)
+	table = arch.table
+	first = sess.query(func.min(arch.column)).scalar()
+	if first is None:
+		return []
+	if now is None:
+		now = dt.date.today()
+	cutoff = add_months(month_start(now), -keep)
+	parts = set()
+	if getattr(table, 'partitioning', None) is not None:
+		parts = set(name for name, month, rows in get_partitions(sess, table))
+
+	done = []
+	month = month_start(first)
+	while month < cutoff:
+		rows = arch.write_month(sess, month)
+		if rows > 0:
+			name = partition_name(month)
+			if name in parts:
+				sess.execute(DropPartitions(table, (name,)))
+			else:
+				start, end = _month_bounds(month)
+				_set_purging(sess, True)
+				try:
+					sess.query(model).filter(
+						arch.column >= start,
+						arch.column < end
+					).delete(synchronize_session=False)
+				finally:
+					_set_purging(sess, False)
+			logger.info('Archived %d rows of table %s for %s', rows, table.name, month.strftime('%Y-%m'))
+			done.append((month, rows))
+		if commit is not None:
+			commit()
+		month = add_months(month, 1)
+	return done
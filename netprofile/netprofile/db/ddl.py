@@ -27,6 +27,7 @@ from __future__ import (
 	division
 )
 
+import re
 import sys
 import datetime as dt
 
@@ -37,6 +38,7 @@ from sqlalchemy.schema import (
 	SchemaItem,
 	Table
 )
+from sqlalchemy.exc import CompileError
 from sqlalchemy import (
 	event,
 	text
@@ -502,3 +504,205 @@ class View(SchemaItem):
 	def drop(self):
 		return DropView(self.name)
 
+_partition_name_rx = re.compile(r'^p(\d{4})(\d{2})$')
+
+PARTITION_MAXVALUE = 'pmax'
+
+def month_start(date):
+	return dt.date(date.year, date.month, 1)
+
+def add_months(month, count):
+	idx = month.year * 12 + month.month - 1 + count
+	return dt.date(idx // 12, idx % 12 + 1, 1)
+
+def partition_name(month):
+	"""
+	Get name of a monthly partition.
+	"""
+	return 'p%04d%02d' % (month.year, month.month)
+
+def partition_month(name):
+	"""
+	Get month of a monthly partition from its name. Returns None for
+	catch-all and foreign partitions.
+	"""
+	m = _partition_name_rx.match(name)
+	if m is None:
+		return None
+	return dt.date(int(m.group(1)), int(m.group(2)), 1)
+
+class Partitioned(SchemaItem):
+	"""
+	Schema element that marks a table as eligible for monthly range
+	partitioning.
+
+	Tables are always created unpartitioned and keep their foreign keys.
+	PartitionTable converts them on request, adding partitioning column to
+	the primary key and making it NOT NULL. Rows that have it set to NULL
+	must first be filled from columns listed in fill. Since MySQL does not
+	support foreign keys on partitioned tables, ON DELETE actions of those
+	keys stop working after conversion. ORM mappings stay the same. Rows
+	newer than the last monthly partition go to a catch-all partition,
+	which is split by AddPartitions.
+	"""
+	def __init__(self, column, ahead=2, keep=None, fill=()):
+		self.column = column
+		self.ahead = ahead
+		self.keep = keep
+		self.fill = fill
+
+	def _set_parent(self, parent):
+		if isinstance(parent, Table):
+			self.parent = parent
+			parent.partitioning = self
+
+	@property
+	def partition_column(self):
+		return self.parent.c[self.column]
+
+def _partition_spec(part, compiler):
+	col = part.partition_column
+	name = compiler.sql_compiler.preparer.format_column(col)
+	if isinstance(col.type, sqltypes.TIMESTAMP):
+		return 'PARTITION BY RANGE (UNIX_TIMESTAMP(%s))' % (name,)
+	return 'PARTITION BY RANGE COLUMNS(%s)' % (name,)
+
+def _partition_def(part, compiler, month):
+	bound = add_months(month, 1)
+	value = ddl_fmt({ 'compiler' : compiler }, dt.datetime(bound.year, bound.month, 1))
+	if isinstance(part.partition_column.type, sqltypes.TIMESTAMP):
+		value = 'UNIX_TIMESTAMP(%s)' % (value,)
+	return 'PARTITION %s VALUES LESS THAN (%s)' % (
+		compiler.sql_compiler.preparer.quote(partition_name(month)),
+		value
+	)
+
+def _partition_defs(part, compiler, months):
+	defs = [_partition_def(part, compiler, month) for month in months]
+	defs.append('PARTITION %s VALUES LESS THAN (MAXVALUE)' % (
+		compiler.sql_compiler.preparer.quote(PARTITION_MAXVALUE),
+	))
+	return ', '.join(defs)
+
+def _partition_months(part, since=None):
+	cur = month_start(dt.date.today())
+	month = cur if since is None else min(month_start(since), cur)
+	months = []
+	while month <= add_months(cur, part.ahead):
+		months.append(month)
+		month = add_months(month, 1)
+	return months
+
+def _partition_pk(part, compiler):
+	table = part.parent
+	col = part.partition_column
+	cols = list(table.primary_key.columns)
+	if col not in cols:
+		cols.append(col)
+	return 'PRIMARY KEY (%s)' % (', '.join(
+		compiler.sql_compiler.preparer.format_column(c)
+		for c in cols
+	),)
+
+class PartitionTable(DDLElement):
+	"""
+	SQL DDL object that converts existing table to monthly partitions,
+	starting from a month that holds the oldest rows. Foreign keys must be
+	dropped and NULL values of partitioning column filled beforehand.
+	"""
+	def __init__(self, table, since=None):
+		self.table = table
+		self.since = since
+
+@compiles(PartitionTable, 'mysql')
+def visit_partition_table_mysql(element, compiler, **kw):
+	part = element.table.partitioning
+	if part.partition_column.nullable:
+		raise CompileError('Partitioning column %s of table %s must be NOT NULL' % (
+			part.column,
+			element.table.name
+		))
+	return 'ALTER TABLE %s MODIFY %s, DROP PRIMARY KEY, ADD %s %s (%s)' % (
+		compiler.sql_compiler.preparer.format_table(element.table),
+		compiler.get_column_specification(part.partition_column),
+		_partition_pk(part, compiler),
+		_partition_spec(part, compiler),
+		_partition_defs(part, compiler, _partition_months(part, element.since))
+	)
+
+class AddPartitions(DDLElement):
+	"""
+	SQL DDL object that splits monthly partitions off the catch-all one.
+	"""
+	def __init__(self, table, months):
+		self.table = table
+		self.months = months
+
+@compiles(AddPartitions, 'mysql')
+def visit_add_partitions_mysql(element, compiler, **kw):
+	return 'ALTER TABLE %s REORGANIZE PARTITION %s INTO (%s)' % (
+		compiler.sql_compiler.preparer.format_table(element.table),
+		compiler.sql_compiler.preparer.quote(PARTITION_MAXVALUE),
+		_partition_defs(element.table.partitioning, compiler, element.months)
+	)
+
+class DropPartitions(DDLElement):
+	"""
+	SQL DDL object that drops partitions along with their rows.
+	"""
+	def __init__(self, table, names):
+		self.table = table
+		self.names = names
+
+@compiles(DropPartitions, 'mysql')
+def visit_drop_partitions_mysql(element, compiler, **kw):
+	return 'ALTER TABLE %s DROP PARTITION %s' % (
+		compiler.sql_compiler.preparer.format_table(element.table),
+		', '.join(compiler.sql_compiler.preparer.quote(name) for name in element.names)
+	)
+
+class CreatePartitionArchive(DDLElement):
+	"""
+	SQL DDL object that creates an empty unpartitioned copy of a table.
+	"""
+	def __init__(self, table, name):
+		self.table = table
+		self.name = name
+
+@compiles(CreatePartitionArchive, 'mysql')
+def visit_create_partition_archive_mysql(element, compiler, **kw):
+	return 'CREATE TABLE %s LIKE %s' % (
+		compiler.sql_compiler.preparer.quote(element.name),
+		compiler.sql_compiler.preparer.format_table(element.table)
+	)
+
+class RemovePartitioning(DDLElement):
+	"""
+	SQL DDL object that turns a partitioned table into a regular one.
+	"""
+	def __init__(self, name):
+		self.name = name
+
+@compiles(RemovePartitioning, 'mysql')
+def visit_remove_partitioning_mysql(element, compiler, **kw):
+	return 'ALTER TABLE %s REMOVE PARTITIONING' % (
+		compiler.sql_compiler.preparer.quote(element.name),
+	)
+
+class ExchangePartition(DDLElement):
+	"""
+	SQL DDL object that swaps contents of a partition and a regular table.
+	"""
+	def __init__(self, table, partition, name):
+		self.table = table
+		self.partition = partition
+		self.name = name
+
+@compiles(ExchangePartition, 'mysql')
+def visit_exchange_partition_mysql(element, compiler, **kw):
+	return 'ALTER TABLE %s EXCHANGE PARTITION %s WITH TABLE %s' % (
+		compiler.sql_compiler.preparer.format_table(element.table),
+		compiler.sql_compiler.preparer.quote(element.partition),
+		compiler.sql_compiler.preparer.quote(element.name)
+	)
+
@@ -52,7 +52,6 @@ from netprofile.db import processors
 from netprofile.common import ipaddr
 
 import sys
-import binascii
 
 
 if sys.version < '3':
@@ -155,6 +154,11 @@ class IPv4Address(types.TypeDecorator):
 			return None
 		return ipaddr.IPv4Address(value)
 
+	def result_processor(self, dialect, coltype):
+		if _is_mysql(dialect):
+			return processors.int_to_ipv4
+		return types.TypeDecorator.result_processor(self, dialect, coltype)
+
 class IPv6Address(types.TypeDecorator):
 	"""
 	Hybrid IPv6 address.
@@ -182,6 +186,11 @@ class IPv6Address(types.TypeDecorator):
 			return None
 		return ipaddr.IPv6Address(value)
 
+	def result_processor(self, dialect, coltype):
+		if _is_pgsql(dialect):
+			return types.TypeDecorator.result_processor(self, dialect, coltype)
+		return processors.packed_to_ipv6
+
 class IPv6Offset(types.TypeDecorator):
 	"""
 	IPv6 address offset.
@@ -199,6 +208,11 @@ class IPv6Offset(types.TypeDecorator):
 	def python_type(self):
 		return int
 
+	def process_result_value(self, value, dialect):
+		if value is None:
+			return None
+		return int(value)
+
 class Money(types.TypeDecorator):
 	"""
 	Money amount.
@@ -257,14 +271,19 @@ class MACAddress(types.TypeDecorator):
 			return None
 		if _is_pgsql(dialect):
 			return str(value)
-		return binascii.unhexlify(bytes(value.replace(':', ''), 'utf-8'))
+		return processors.mac_to_binary(value)
 
 	def process_result_value(self, value, dialect):
 		if value is None:
 			return None
 		if _is_pgsql(dialect):
 			return value
-		return ':'.join('%02x' % x for x in value)
+		return processors.binary_to_mac(value)
+
+	def result_processor(self, dialect, coltype):
+		if _is_pgsql(dialect):
+			return None
+		return processors.binary_to_mac
 
 
 
@@ -569,9 +588,11 @@ class DeclEnumType(types.SchemaType, types.TypeDecorator):
 			enum.__name__
 		)
 		self.impl = types.Enum(*enum.values(), name=self.name)
+		self._symbols = {}
 
 	def update_impl(self):
 		self.impl = types.Enum(*self.enum.values(), name=self.name)
+		self._symbols = {}
 
 	def load_dialect_impl(self, dialect):
 		if _is_mysql(dialect):
@@ -596,9 +617,17 @@ class DeclEnumType(types.SchemaType, types.TypeDecorator):
 	def process_result_value(self, value, dialect):
 		if value is None:
 			return None
+		try:
+			return self._symbols[value]
+		except (KeyError, TypeError):
+			pass
+		raw = value
 		if isinstance(value, (bytes, bytearray)):
 			value = value.decode('ascii')
-		return self.enum.from_string(value.strip())
+		sym = self.enum.from_string(value.strip())
+		if not isinstance(raw, bytearray):
+			self._symbols[raw] = sym
+		return sym
 
 	def coerce_compared_value(self, op, value):
 		if isinstance(value, str):
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Partitioned table maintenance
+# © Copyright 2013-2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'partitioned_tables',
+	'get_partitions',
+	'partition_table',
+	'roll_forward',
+	'expire_partitions'
+]
+
+import datetime as dt
+import logging
+
+from sqlalchemy import (
+	func,
+	select,
+	text
+)
+from sqlalchemy.schema import DropConstraint
+
+from .connection import Base
+from .ddl import (
+	AddPartitions,
+	CreatePartitionArchive,
+	DropPartitions,
+	ExchangePartition,
+	PartitionTable,
+	RemovePartitioning,
+	add_months,
+	month_start,
+	partition_month
+)
+
+logger = logging.getLogger(__name__)
+
+_PARTITIONS = text(
+	'SELECT `PARTITION_NAME`, `TABLE_ROWS` '
+	'FROM `information_schema`.`PARTITIONS` '
+	'WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = :table AND `PARTITION_NAME` IS NOT NULL '
+	'ORDER BY `PARTITION_ORDINAL_POSITION`'
+)
+
+def partitioned_tables(metadata=None):
+	"""
+	List tables that have Partitioned schema element attached.
+	"""
+	if metadata is None:
+		metadata = Base.metadata
+	return [
+		table
+		for table in metadata.sorted_tables
+		if getattr(table, 'partitioning', None) is not None
+	]
+
+def get_partitions(sess, table):
+	"""
+	List partitions of a table, as tuples of (name, month, estimated number
+	of rows). Month is None for the catch-all partition. Returns an empty
+	list if the table is not partitioned.
+	"""
+	return [
+		(name, partition_month(name), rows)
+		for name, rows in sess.execute(_PARTITIONS, { 'table' : table.name })
+	]
+
+def partition_table(sess, table):
+	"""
+	Convert existing unpartitioned table to monthly partitions. This drops
+	foreign keys and rebuilds the table, so it takes time proportional to
+	its size. NULL values of partitioning column are filled first. Returns
+	False if the table is already partitioned.
+	"""
+	if len(get_partitions(sess, table)) > 0:
+		return False
+	for fk in table.foreign_key_constraints:
+		if fk.name:
+			if fk.ondelete:
+				logger.warning('Dropping foreign key %s of table %s, ON DELETE %s will no longer be enforced', fk.name, table.name, fk.ondelete)
+			sess.execute(DropConstraint(fk))
+	part = table.partitioning
+	col = part.partition_column
+	sess.execute(table.update().where(col.is_(None)).values({
+		col : func.coalesce(*([table.c[name] for name in part.fill] + [func.now()]))
+	}))
+	since = sess.execute(select([func.min(col)])).scalar()
+	sess.execute(PartitionTable(table, since))
+	return True
+
+def roll_forward(sess, table, now=None, ahead=None):
+	"""
+	Make sure there are monthly partitions for ahead months after the
+	current one. Only the catch-all partition is reorganized, which is
+	cheap as long as it stays empty. Returns a list of added months.
+	"""
+	part = table.partitioning
+	if ahead is None:
+		ahead = part.ahead
+	if now is None:
+		now = dt.date.today()
+	have = [month for name, month, rows in get_partitions(sess, table) if month is not None]
+	if len(have) == 0:
+		raise ValueError('Table %s is not partitioned.' % (table.name,))
+	last = add_months(month_start(now), ahead)
+	months = []
+	month = add_months(max(have), 1)
+	while month <= last:
+		months.append(month)
+		month = add_months(month, 1)
+	if len(months) > 0:
+		sess.execute(AddPartitions(table, months))
+	return months
+
+def expire_partitions(sess, table, keep=None, now=None, archive=False):
+	"""
+	Remove monthly partitions older than keep months before the current
+	one. Dropping a partition takes constant time regardless of number of
+	rows in it. If archive is True, partition contents are first swapped
+	into a separate table named after the partition, which is also done in
+	constant time. Returns a list of removed partition names.
+	"""
+	if keep is None:
+		keep = table.partitioning.keep
+	if keep is None:
+		return []
+	if keep < 1:
+		raise ValueError('At least one month of data must be kept.')
+	if now is None:
+		now = dt.date.today()
+	cutoff = add_months(month_start(now), -keep)
+	names = [
+		name
+		for name, month, rows in get_partitions(sess, table)
+		if (month is not None) and (month < cutoff)
+	]
+	if len(names) == 0:
+		return []
+	if archive:
+		for name in names:
+			arch = '%s_%s' % (table.name, name)
+			sess.execute(CreatePartitionArchive(table, arch))
+			sess.execute(RemovePartitioning(arch))
+			sess.execute(ExchangePartition(table, name, arch))
+			logger.info('Archived partition %s of table %s to %s', name, table.name, arch)
+	sess.execute(DropPartitions(table, names))
+	return names
@@ -27,21 +27,66 @@ from __future__ import (
 	division
 )
 
+import binascii
+
+from netprofile.common import ipaddr
+
+_BOOLEAN_ENUM = {
+	None    : None,
+	True    : 'Y',
+	False   : 'N',
+	'FALSE' : 'N'
+}
+
+_ENUM_BOOLEAN = {
+	None : None,
+	'Y'  : True,
+	b'Y' : True,
+	'N'  : False,
+	b'N' : False
+}
+
 def boolean_to_enum(value):
-	if value is None:
-		return None
-	if value == 'FALSE':
-		return 'N'
+	try:
+		return _BOOLEAN_ENUM[value]
+	except (KeyError, TypeError):
+		pass
 	if value:
 		return 'Y'
 	return 'N'
 
 def enum_to_boolean(value):
+	try:
+		return _ENUM_BOOLEAN[value]
+	except (KeyError, TypeError):
+		return False
+
+def mac_to_binary(value):
+	if value is None:
+		return None
+	return binascii.unhexlify(value.replace(':', ''))
+
+try:
+	b''.hex(':')
+except (AttributeError, TypeError):
+	def binary_to_mac(value):
+		if value is None:
+			return None
+		value = binascii.hexlify(value).decode('ascii')
+		return ':'.join(value[i:i + 2] for i in range(0, len(value), 2))
+else:
+	def binary_to_mac(value):
+		if value is None:
+			return None
+		return value.hex(':')
+
+def int_to_ipv4(value):
+	if value is None:
+		return None
+	return ipaddr.v4_from_int(value)
+
+def packed_to_ipv6(value):
 	if value is None:
 		return None
-	if value == 'Y':
-		return True
-	if value == b'Y':
-		return True
-	return False
+	return ipaddr.v6_from_packed(value)
 
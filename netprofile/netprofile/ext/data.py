@@ -30,6 +30,7 @@ from __future__ import (
 import importlib
 import logging
 import decimal
+import functools
 
 import datetime as dt
 from dateutil.tz import tzlocal
@@ -1774,6 +1775,139 @@ class ExtModel(object):
 					continue
 		return query
 
+	def _get_archive(self, request):
+		if 'cold_archive' not in self.model.__table__.info:
+			return None
+		directory = request.registry.settings.get('netprofile.archive.directory')
+		if not directory:
+			return None
+		try:
+			from netprofile.db.archive import get_archive
+		except ImportError:
+			return None
+		try:
+			return get_archive(self.model, directory)
+		except ValueError as e:
+			logger.warning('Not reading archive of %s: %s', self.name, e)
+			return None
+
+	def _parse_filters(self, trans, params, pname):
+		for fltr in params[pname]:
+			fcol = fltr.get('property', None)
+			if fcol not in trans:
+				continue
+			prop = trans[fcol]
+			colcls = self.model.__mapper__.c[prop.key].type.__class__
+			value = fltr.get('value', None)
+			if not isinstance(value, list):
+				value = self.get_column(fcol).parse_param(value)
+			yield (prop.key, colcls, fltr.get('operator', 'eq'), value)
+
+	def _archive_filters(self, filters):
+		for key, colcls, operator, value in filters:
+			kind = None
+			if issubclass(colcls, _DATE_SET) or issubclass(colcls, _INTEGER_SET) or issubclass(colcls, _DECIMAL_SET) or issubclass(colcls, _IPADDR_SET):
+				kind = 'range'
+			elif issubclass(colcls, _STRING_SET):
+				kind = 'string'
+			yield (key, kind, operator, value)
+
+	def _read_archive(self, arch, trans, params):
+		"""
+		Get number of archived rows that match request filters, and those
+		of them that can make it into requested page. Returns None if
+		requested time range doesn't reach into the archive.
+		"""
+		end = arch.end
+		if end is None:
+			return None
+		filters = []
+		for pname in ('__ffilter', '__filter'):
+			if pname in params:
+				filters.extend(self._parse_filters(trans, params, pname))
+		ts_from = ts_to = None
+		for key, colcls, operator, value in filters:
+			if (key != arch.key) or (value is None) or isinstance(value, list):
+				continue
+			if operator in ('eq', '=', '==', '===', 'gt', '>', 'ge', '>='):
+				ts_from = value if (ts_from is None) else max(ts_from, value)
+			if operator in ('eq', '=', '==', '===', 'lt', '<', 'le', '<='):
+				ts_to = value if (ts_to is None) else min(ts_to, value)
+		if (ts_from is None) or (ts_from >= end):
+			return None
+		if '__xfilter' in params:
+			xflist = params['__xfilter']
+			for xf in self.extra_search:
+				if xf.name in xflist:
+					# Extra filters work on queries only.
+					logger.debug('Not reading archive of %s because of extra filter %s', self.name, xf.name)
+					return None
+		search = ()
+		if '__sstr' in params:
+			search = [
+				trans[f].key
+				for f in self.easy_search
+				if issubclass(self.model.__mapper__.c[trans[f].key].type.__class__, _STRING_SET)
+			]
+		expr = arch.expression(self._archive_filters(filters), params.get('__sstr'), search)
+		limit = int(params.get('__limit', 0))
+		if limit > 0:
+			limit += int(params.get('__start', 0))
+		return arch.select(ts_from, ts_to, expr, self._get_sort_specs(trans, params), limit or None)
+
+	def _get_sort_specs(self, trans, params):
+		specs = []
+		slist = params.get('__sort')
+		if isinstance(slist, list):
+			for sdef in slist:
+				if (not isinstance(sdef, dict)) or (len(sdef) != 2):
+					continue
+				if sdef['property'] not in trans:
+					continue
+				specs.append((trans[sdef['property']].key, sdef['direction'] == 'DESC'))
+		return specs
+
+	def _get_sort_key(self, trans, params):
+		specs = self._get_sort_specs(trans, params)
+
+		def _value(obj, key):
+			val = obj[key] if isinstance(obj, dict) else getattr(obj, key)
+			if isinstance(val, EnumSymbol):
+				return val.order
+			return val
+
+		def _cmp(a, b):
+			for key, desc in specs:
+				va = _value(a, key)
+				vb = _value(b, key)
+				if va == vb:
+					continue
+				# NULLs go first in ascending order, as in MySQL.
+				if va is None:
+					ret = -1
+				elif vb is None:
+					ret = 1
+				else:
+					ret = -1 if va < vb else 1
+				return -ret if desc else ret
+			return 0
+
+		return functools.cmp_to_key(_cmp)
+
+	def _merge_archive(self, arch, sess, objs, rows, trans, params):
+		start = int(params.get('__start', 0))
+		limit = int(params.get('__limit', 0))
+		merged = sorted(list(objs) + rows, key=self._get_sort_key(trans, params))
+		if start > 0:
+			merged = merged[start:]
+		if limit > 0:
+			merged = merged[:limit]
+		loaded = iter(arch.load(sess, [obj for obj in merged if isinstance(obj, dict)]))
+		return [
+			next(loaded) if isinstance(obj, dict) else obj
+			for obj in merged
+		]
+
 	def _get_trans(self, cols):
 		trans = {}
 		for cname, col in cols.items():
@@ -1796,8 +1930,16 @@ class ExtModel(object):
 		cols = self.get_read_columns()
 		trans = self._get_trans(cols)
 		sess = DBSession()
+		arch = self._get_archive(request)
+		arch_rows = None
+		if arch is not None:
+			arch_res = self._read_archive(arch, trans, params)
+			if arch_res is not None:
+				arch_tot, arch_rows = arch_res
 		# Cache total?
 		q = sess.query(func.count('*')).select_from(self.model)
+		if arch_rows is not None:
+			q = q.filter(getattr(self.model, arch.key) >= arch.end)
 		if '__ffilter' in params:
 			q = self._apply_filters(q, trans, params, pname='__ffilter')
 		if '__filter' in params:
@@ -1808,6 +1950,9 @@ class ExtModel(object):
 			q = self._apply_sstr(q, trans, params)
 		tot = q.scalar()
 		q = sess.query(self.model)
+		if arch_rows is not None:
+			tot += arch_tot
+			q = q.filter(getattr(self.model, arch.key) >= arch.end)
 		if '__ffilter' in params:
 			q = self._apply_filters(q, trans, params, pname='__ffilter')
 		if '__filter' in params:
@@ -1821,13 +1966,22 @@ class ExtModel(object):
 		helper = getattr(self.model, '__augment_query__', None)
 		if callable(helper):
 			q = helper(sess, q, params, request)
-		q = self._apply_pagination(q, trans, params)
+		if arch_rows is None:
+			q = self._apply_pagination(q, trans, params)
+		else:
+			# Fetch enough live rows to fill the page after merging them with
+			# archived ones.
+			limit = int(params.get('__limit', 0))
+			if limit > 0:
+				q = q.limit(int(params.get('__start', 0)) + limit)
 		helper = getattr(self.model, '__augment_pg_query__', None)
 		if callable(helper):
 			q = helper(sess, q, params, request)
 		helper = getattr(self.model, '__augment_result__', None)
 		if callable(helper):
 			q = helper(sess, q.all(), params, request)
+		if arch_rows is not None:
+			q = self._merge_archive(arch, sess, q, arch_rows, trans, params)
 		if params.get('__empty', False):
 			row = {}
 			for cname, col in cols.items():
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Vectorized bulk IP address operations
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+NumPy-backed counterparts of the list functions in netprofile.common.ipaddr.
+
+IPv4 addresses are handled as uint32 arrays. IPv6 addresses are handled as
+(N, 2) uint64 arrays, with the high and low halves of each address in
+columns 0 and 1. Ranges are passed around as pairs of such arrays holding
+first and last addresses (both inclusive), and networks as pairs of address
+and prefix length arrays.
+
+This module requires NumPy, which is not a hard dependency of NetProfile.
+"""
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import numpy as np
+
+from netprofile.common import ipaddr
+
+__all__ = [
+	'v4_array',
+	'v4_addresses',
+	'v4_networks',
+	'sort_v4',
+	'unique_v4',
+	'runs_v4',
+	'merge_ranges_v4',
+	'summarize_ranges_v4',
+	'collapse_v4',
+	'free_ranges_v4',
+
+	'v6_array',
+	'v6_addresses',
+	'v6_networks',
+	'sort_v6',
+	'unique_v6',
+	'runs_v6',
+	'merge_ranges_v6',
+	'summarize_ranges_v6',
+	'collapse_v6',
+	'free_ranges_v6'
+]
+
+_U64_MASK = 0xffffffffffffffff
+_ONE = np.uint64(1)
+
+def _bitlen(x):
+	"""
+	Bit length of every element of a uint64 array.
+	"""
+	hi = np.frexp((x >> np.uint64(32)).astype(np.float64))[1]
+	lo = np.frexp((x & np.uint64(0xffffffff)).astype(np.float64))[1]
+	return np.where(hi > 0, hi + 32, lo).astype(np.uint64)
+
+def _empty_ranges(dtype, shape=(0,)):
+	return (np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype))
+
+# IPv4
+
+def _v4_int(addr):
+	if isinstance(addr, str):
+		return int(ipaddr.IPv4Address(addr))
+	return int(addr)
+
+def v4_array(addrs):
+	"""
+	Build uint32 array from an iterable of IPv4Address objects, integers
+	or strings.
+	"""
+	if isinstance(addrs, np.ndarray):
+		return addrs.astype(np.uint32)
+	return np.fromiter(map(_v4_int, addrs), dtype=np.uint32)
+
+def v4_addresses(arr):
+	"""
+	Convert uint32 array to a list of IPv4Address objects.
+	"""
+	cls = ipaddr.IPv4Address
+	return [cls(a) for a in arr.tolist()]
+
+def v4_networks(nets, plens):
+	"""
+	Convert arrays of network addresses and prefix lengths to a list of
+	IPv4Network objects.
+	"""
+	cls = ipaddr.IPv4Network
+	return [cls('%s/%d' % (ipaddr.IPv4Address(n), p)) for n, p in zip(nets.tolist(), plens.tolist())]
+
+def sort_v4(arr):
+	return np.sort(arr, kind='stable')
+
+def unique_v4(arr):
+	"""
+	Sorted unique addresses.
+	"""
+	return np.unique(arr)
+
+def runs_v4(arr):
+	"""
+	Split set of addresses into ranges of consecutive addresses.
+	"""
+	arr = np.unique(arr).astype(np.uint64)
+	if arr.size == 0:
+		return _empty_ranges(np.uint32)
+	brk = np.flatnonzero(np.diff(arr) != _ONE)
+	starts = arr[np.concatenate(([0], brk + 1))]
+	ends = arr[np.concatenate((brk, [arr.size - 1]))]
+	return (starts.astype(np.uint32), ends.astype(np.uint32))
+
+def _merge_v4(starts, ends):
+	# Works on uint64 so that end + 1 never overflows.
+	order = np.argsort(starts, kind='stable')
+	starts = starts[order]
+	cmax = np.maximum.accumulate(ends[order])
+	new = np.empty(starts.size, dtype=bool)
+	new[0] = True
+	new[1:] = starts[1:] > cmax[:-1] + _ONE
+	first = np.flatnonzero(new)
+	last = np.concatenate((first[1:] - 1, [starts.size - 1]))
+	return (starts[first], cmax[last])
+
+def merge_ranges_v4(starts, ends):
+	"""
+	Merge overlapping and adjacent ranges. Returns sorted, disjoint and
+	non-adjacent ranges.
+	"""
+	starts = np.asarray(starts, dtype=np.uint64)
+	ends = np.asarray(ends, dtype=np.uint64)
+	if starts.size == 0:
+		return _empty_ranges(np.uint32)
+	starts, ends = _merge_v4(starts, ends)
+	return (starts.astype(np.uint32), ends.astype(np.uint32))
+
+def _summarize_v4(starts, ends):
+	out_nets = []
+	out_hbits = []
+	while starts.size:
+		diff = ends - starts
+		blen = _bitlen(diff)
+		# Largest power of two not exceeding the range size.
+		fit = _bitlen(diff + _ONE) - _ONE
+		# Largest block the start address is aligned to.
+		low = starts & (~starts + _ONE)
+		align = np.where(starts == 0, np.uint64(32), _bitlen(low) - _ONE)
+		hbits = np.minimum(fit, align)
+		out_nets.append(starts)
+		out_hbits.append(hbits)
+		more = hbits < blen
+		starts = starts[more] + (_ONE << hbits[more])
+		ends = ends[more]
+	if not out_nets:
+		return (np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8))
+	nets = np.concatenate(out_nets)
+	plens = np.uint64(32) - np.concatenate(out_hbits)
+	order = np.argsort(nets, kind='stable')
+	return (nets[order].astype(np.uint32), plens[order].astype(np.uint8))
+
+def summarize_ranges_v4(starts, ends):
+	"""
+	Summarize ranges into a minimal list of CIDR blocks, like
+	ipaddr.summarize_address_range() does for a single range. Ranges must
+	not overlap; use merge_ranges_v4() first if they might.
+
+	Returns arrays of network addresses and prefix lengths.
+	"""
+	return _summarize_v4(
+		np.asarray(starts, dtype=np.uint64),
+		np.asarray(ends, dtype=np.uint64)
+	)
+
+def _v4_net_ranges(nets, plens):
+	nets = np.asarray(nets, dtype=np.uint64)
+	hbits = np.uint64(32) - np.asarray(plens, dtype=np.uint64)
+	hmask = (_ONE << hbits) - _ONE
+	starts = nets & ~hmask
+	return (starts, starts | hmask)
+
+def collapse_v4(nets, plens):
+	"""
+	Collapse networks into a minimal list of CIDR blocks, like
+	ipaddr.collapse_address_list() does.
+	"""
+	starts, ends = _v4_net_ranges(nets, plens)
+	if starts.size == 0:
+		return (np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8))
+	return _summarize_v4(*_merge_v4(starts, ends))
+
+def free_ranges_v4(first, last, starts, ends=None):
+	"""
+	Find ranges inside [first, last] that are not covered by any of the
+	used ranges. If ends is None, starts is an array of used addresses.
+	"""
+	first = _v4_int(first)
+	last = _v4_int(last)
+	if ends is None:
+		starts, ends = runs_v4(starts)
+	starts = np.asarray(starts, dtype=np.uint64)
+	ends = np.asarray(ends, dtype=np.uint64)
+	keep = (ends >= first) & (starts <= last)
+	starts = starts[keep]
+	ends = ends[keep]
+	if starts.size == 0:
+		return (np.array([first], dtype=np.uint32), np.array([last], dtype=np.uint32))
+	starts, ends = _merge_v4(starts, ends)
+	fstarts = np.concatenate(([first], ends + _ONE))
+	fends = np.concatenate((starts.astype(np.int64) - 1, [last]))
+	if starts[0] <= first:
+		fstarts = fstarts[1:]
+		fends = fends[1:]
+	if ends[-1] >= last:
+		fstarts = fstarts[:-1]
+		fends = fends[:-1]
+	return (fstarts.astype(np.uint32), fends.astype(np.uint32))
+
+# IPv6
+
+def _v6_split(x):
+	return (x[:, 0], x[:, 1])
+
+def _v6_join(hi, lo):
+	return np.stack((hi, lo), axis=1)
+
+def _v6_gt(ahi, alo, bhi, blo):
+	return (ahi > bhi) | ((ahi == bhi) & (alo > blo))
+
+def _v6_add(hi, lo, bhi, blo):
+	rlo = lo + blo
+	return (hi + bhi + (rlo < lo).astype(np.uint64), rlo)
+
+def _v6_sub(hi, lo, bhi, blo):
+	return (hi - bhi - (lo < blo).astype(np.uint64), lo - blo)
+
+def _v6_inc(hi, lo):
+	rlo = lo + _ONE
+	return (hi + (rlo == 0).astype(np.uint64), rlo)
+
+def _v6_dec(hi, lo):
+	return (hi - (lo == 0).astype(np.uint64), lo - _ONE)
+
+def _v6_order(hi, lo):
+	return np.lexsort((lo, hi))
+
+def _v6_int(addr):
+	if isinstance(addr, str):
+		return int(ipaddr.IPv6Address(addr))
+	return int(addr)
+
+def v6_array(addrs):
+	"""
+	Build (N, 2) uint64 array from an iterable of IPv6Address objects,
+	integers or strings.
+	"""
+	if isinstance(addrs, np.ndarray):
+		return addrs.astype(np.uint64).reshape(-1, 2)
+	ints = [_v6_int(a) for a in addrs]
+	return _v6_join(
+		np.fromiter((i >> 64 for i in ints), dtype=np.uint64, count=len(ints)),
+		np.fromiter((i & _U64_MASK for i in ints), dtype=np.uint64, count=len(ints))
+	)
+
+def v6_addresses(arr):
+	"""
+	Convert (N, 2) uint64 array to a list of IPv6Address objects.
+	"""
+	cls = ipaddr.IPv6Address
+	return [cls((hi << 64) | lo) for hi, lo in arr.tolist()]
+
+def v6_networks(nets, plens):
+	"""
+	Convert arrays of network addresses and prefix lengths to a list of
+	IPv6Network objects.
+	"""
+	cls = ipaddr.IPv6Network
+	return [
+		cls('%s/%d' % (ipaddr.IPv6Address((hi << 64) | lo), p))
+		for (hi, lo), p in zip(nets.tolist(), plens.tolist())
+	]
+
+def sort_v6(arr):
+	hi, lo = _v6_split(arr)
+	return arr[_v6_order(hi, lo)]
+
+def unique_v6(arr):
+	"""
+	Sorted unique addresses.
+	"""
+	arr = sort_v6(arr)
+	if arr.shape[0] < 2:
+		return arr
+	keep = np.empty(arr.shape[0], dtype=bool)
+	keep[0] = True
+	keep[1:] = np.any(arr[1:] != arr[:-1], axis=1)
+	return arr[keep]
+
+def runs_v6(arr):
+	"""
+	Split set of addresses into ranges of consecutive addresses.
+	"""
+	arr = unique_v6(arr)
+	if arr.shape[0] == 0:
+		return _empty_ranges(np.uint64, (0, 2))
+	hi, lo = _v6_split(arr)
+	nhi, nlo = _v6_inc(hi[:-1], lo[:-1])
+	brk = np.flatnonzero((nhi != hi[1:]) | (nlo != lo[1:]))
+	first = np.concatenate(([0], brk + 1))
+	last = np.concatenate((brk, [arr.shape[0] - 1]))
+	return (arr[first], arr[last])
+
+def _merge_v6(shi, slo, ehi, elo):
+	n = shi.size
+	# Replace range ends with their ranks to get a running maximum.
+	eorder = _v6_order(ehi, elo)
+	erank = np.empty(n, dtype=np.intp)
+	erank[eorder] = np.arange(n)
+	sorder = _v6_order(shi, slo)
+	shi = shi[sorder]
+	slo = slo[sorder]
+	cmax = eorder[np.maximum.accumulate(erank[sorder])]
+	chi = ehi[cmax]
+	clo = elo[cmax]
+	# New range begins where start > running end + 1.
+	dhi, dlo = _v6_dec(shi[1:], slo[1:])
+	new = np.empty(n, dtype=bool)
+	new[0] = True
+	new[1:] = _v6_gt(shi[1:], slo[1:], chi[:-1], clo[:-1]) & _v6_gt(dhi, dlo, chi[:-1], clo[:-1])
+	first = np.flatnonzero(new)
+	last = np.concatenate((first[1:] - 1, [n - 1]))
+	return (shi[first], slo[first], chi[last], clo[last])
+
+def merge_ranges_v6(starts, ends):
+	"""
+	Merge overlapping and adjacent ranges. Returns sorted, disjoint and
+	non-adjacent ranges.
+	"""
+	starts = np.asarray(starts, dtype=np.uint64).reshape(-1, 2)
+	ends = np.asarray(ends, dtype=np.uint64).reshape(-1, 2)
+	if starts.shape[0] == 0:
+		return _empty_ranges(np.uint64, (0, 2))
+	shi, slo, ehi, elo = _merge_v6(*(_v6_split(starts) + _v6_split(ends)))
+	return (_v6_join(shi, slo), _v6_join(ehi, elo))
+
+def _v6_tz(hi, lo):
+	lowhi = hi & (~hi + _ONE)
+	lowlo = lo & (~lo + _ONE)
+	return np.where(
+		lo != 0,
+		_bitlen(lowlo) - _ONE,
+		np.where(hi != 0, _bitlen(lowhi) + np.uint64(63), np.uint64(128))
+	)
+
+def _v6_bitlen(hi, lo):
+	return np.where(hi != 0, _bitlen(hi) + np.uint64(64), _bitlen(lo))
+
+def _summarize_v6(shi, slo, ehi, elo):
+	out_hi = []
+	out_lo = []
+	out_hbits = []
+	while shi.size:
+		dhi, dlo = _v6_sub(ehi, elo, shi, slo)
+		blen = _v6_bitlen(dhi, dlo)
+		# Range size (diff + 1) is a power of two iff diff & (diff + 1) == 0;
+		# this also holds for the whole address space, where diff + 1 wraps.
+		nhi, nlo = _v6_inc(dhi, dlo)
+		pow2 = ((dhi & nhi) == 0) & ((dlo & nlo) == 0)
+		fit = blen - (~pow2).astype(np.uint64)
+		hbits = np.minimum(fit, _v6_tz(shi, slo))
+		out_hi.append(shi)
+		out_lo.append(slo)
+		out_hbits.append(hbits)
+		more = hbits < blen
+		shi = shi[more]
+		slo = slo[more]
+		ehi = ehi[more]
+		elo = elo[more]
+		hbits = hbits[more]
+		small = hbits < 64
+		bhi = np.where(small, np.uint64(0), _ONE << ((hbits - np.uint64(64)) % np.uint64(64)))
+		blo = np.where(small, _ONE << (hbits % np.uint64(64)), np.uint64(0))
+		shi, slo = _v6_add(shi, slo, bhi, blo)
+	if not out_hi:
+		return (np.empty((0, 2), dtype=np.uint64), np.empty(0, dtype=np.uint8))
+	hi = np.concatenate(out_hi)
+	lo = np.concatenate(out_lo)
+	plens = np.uint64(128) - np.concatenate(out_hbits)
+	order = _v6_order(hi, lo)
+	return (_v6_join(hi[order], lo[order]), plens[order].astype(np.uint8))
+
+def summarize_ranges_v6(starts, ends):
+	"""
+	Summarize ranges into a minimal list of CIDR blocks, like
+	ipaddr.summarize_address_range() does for a single range. Ranges must
+	not overlap; use merge_ranges_v6() first if they might.
+
+	Returns arrays of network addresses and prefix lengths.
+	"""
+	starts = np.asarray(starts, dtype=np.uint64).reshape(-1, 2)
+	ends = np.asarray(ends, dtype=np.uint64).reshape(-1, 2)
+	return _summarize_v6(*(_v6_split(starts) + _v6_split(ends)))
+
+def _v6_net_ranges(nets, plens):
+	hi, lo = _v6_split(np.asarray(nets, dtype=np.uint64).reshape(-1, 2))
+	hbits = np.uint64(128) - np.asarray(plens, dtype=np.uint64)
+	# Shifts by 64 or more are undefined, so build both halves of the
+	# host mask separately.
+	lomask = np.where(
+		hbits >= 64,
+		np.uint64(_U64_MASK),
+		(_ONE << (hbits % np.uint64(64))) - _ONE
+	)
+	himask = np.where(
+		hbits >= 128,
+		np.uint64(_U64_MASK),
+		np.where(
+			hbits > 64,
+			(_ONE << ((hbits - np.uint64(64)) % np.uint64(64))) - _ONE,
+			np.uint64(0)
+		)
+	)
+	shi = hi & ~himask
+	slo = lo & ~lomask
+	return (shi, slo, shi | himask, slo | lomask)
+
+def collapse_v6(nets, plens):
+	"""
+	Collapse networks into a minimal list of CIDR blocks, like
+	ipaddr.collapse_address_list() does.
+	"""
+	shi, slo, ehi, elo = _v6_net_ranges(nets, plens)
+	if shi.size == 0:
+		return (np.empty((0, 2), dtype=np.uint64), np.empty(0, dtype=np.uint8))
+	return _summarize_v6(*_merge_v6(shi, slo, ehi, elo))
+
+def free_ranges_v6(first, last, starts, ends=None):
+	"""
+	Find ranges inside [first, last] that are not covered by any of the
+	used ranges. If ends is None, starts is an array of used addresses.
+	"""
+	first = _v6_int(first)
+	last = _v6_int(last)
+	fhi = np.uint64(first >> 64)
+	flo = np.uint64(first & _U64_MASK)
+	lhi = np.uint64(last >> 64)
+	llo = np.uint64(last & _U64_MASK)
+	if ends is None:
+		starts, ends = runs_v6(starts)
+	shi, slo = _v6_split(np.asarray(starts, dtype=np.uint64).reshape(-1, 2))
+	ehi, elo = _v6_split(np.asarray(ends, dtype=np.uint64).reshape(-1, 2))
+	keep = ~_v6_gt(fhi, flo, ehi, elo) & ~_v6_gt(shi, slo, lhi, llo)
+	if not keep.any():
+		return (
+			np.array([[fhi, flo]], dtype=np.uint64),
+			np.array([[lhi, llo]], dtype=np.uint64)
+		)
+	shi, slo, ehi, elo = _merge_v6(shi[keep], slo[keep], ehi[keep], elo[keep])
+	# Gap before each used range and after the last one.
+	ahi, alo = _v6_inc(ehi, elo)
+	bhi, blo = _v6_dec(shi, slo)
+	fshi = np.concatenate(([fhi], ahi))
+	fslo = np.concatenate(([flo], alo))
+	fehi = np.concatenate((bhi, [lhi]))
+	felo = np.concatenate((blo, [llo]))
+	lo_cut = 1 if not _v6_gt(shi[0], slo[0], fhi, flo) else 0
+	hi_cut = fshi.size - (1 if not _v6_gt(lhi, llo, ehi[-1], elo[-1]) else 0)
+	return (
+		_v6_join(fshi[lo_cut:hi_cut], fslo[lo_cut:hi_cut]),
+		_v6_join(fehi[lo_cut:hi_cut], felo[lo_cut:hi_cut])
+	)
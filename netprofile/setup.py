@@ -101,7 +101,20 @@ setup(
 			'module enable = netprofile.cli:EnableModule',
 			'module disable = netprofile.cli:DisableModule',
 
-			'deploy = netprofile.cli:Deploy'
+			'deploy = netprofile.cli:Deploy',
+
+			'partition list = netprofile.cli:ListPartitions',
+			'partition rotate = netprofile.cli:RotatePartitions',
+
+			'archive list = netprofile.cli:ListArchives',
+			'archive run = netprofile.cli:ArchiveHistory',
+
+			'bench = netprofile.cli:Benchmark'
+		],
+		'netprofile.benchmarks' : [
+			'dbtypes = netprofile.bench.dbtypes:run',
+			'ipaddr = netprofile.bench.ipaddr:run',
+			'ipbulk = netprofile.bench.ipbulk:run'
 		],
 		'netprofile.export.formats' : [
 			'csv = netprofile.export.csv:CSVExportFormat',
@@ -60,6 +60,7 @@ class Module(ModuleBase):
 		mmgr.cfg.add_route('access.cl.robots', '/robots.txt', vhost='client')
 		mmgr.cfg.add_route('access.cl.favicon', '/favicon.ico', vhost='client')
 		mmgr.cfg.register_block('stashes.cl.block.info', TemplateObject('netprofile_access:templates/client_block_chrate.mak'))
+		mmgr.cfg.register_block('stashes.cl.block.users', TemplateObject('netprofile_access:templates/client_block_forecast.mak'))
 		mmgr.cfg.scan()
 
 	@classmethod
@@ -132,6 +133,11 @@ class Module(ModuleBase):
 		except NoResultFound:
 			pass
 
+	def get_task_imports(self):
+		return (
+			'netprofile_access.tasks',
+		)
+
 	def get_css(self, request):
 		return (
 			'netprofile_access:static/css/main.css',
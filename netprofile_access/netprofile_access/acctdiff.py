@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - Accounting engine differential harness
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'rate_mod',
+	'rate_plan',
+	'snapshot',
+	'dump_state',
+	'load_state',
+	'record_call',
+	'replay',
+	'RecordingIngest'
+]
+
+import datetime
+import decimal
+import json
+
+from netprofile_access.engine import (
+	AccessBlockInfo,
+	AccountState,
+	AcctEngine,
+	RateMod,
+	RatePlan,
+	StashState
+)
+from netprofile_access.ingest import AccountingIngest
+from netprofile_access.models import (
+	AccessBlock,
+	AccessEntity
+)
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_ACCT_COMPARE = ('rate_id', 'next_rate_id', 'ut_ingress', 'ut_egress', 'qpend', 'state')
+
+def _ts(value):
+	if value is None:
+		return None
+	return value.strftime(TS_FORMAT)
+
+def _from_ts(value):
+	if value is None:
+		return None
+	return datetime.datetime.strptime(value, TS_FORMAT)
+
+def _dec(value):
+	if value is None:
+		return None
+	return str(value)
+
+def _from_dec(value):
+	if value is None:
+		return None
+	return decimal.Decimal(value)
+
+def _enum(value):
+	return getattr(value, 'value', value)
+
+def _period(bp):
+	if bp is None:
+		return None
+	return (
+		bp.start_month, bp.start_day_of_month, bp.start_weekday, bp.start_hour, bp.start_minute,
+		bp.end_month, bp.end_day_of_month, bp.end_weekday, bp.end_hour, bp.end_minute
+	)
+
+def rate_mod(rate_id, rmt):
+	"""
+	Build RateMod object from a rate modifier type.
+	"""
+	return RateMod(
+		rate_id,
+		rmt.oq_sum_multiplier_ingress,
+		rmt.oq_sum_multiplier_egress,
+		rmt.oq_sum_multiplier_seconds,
+		rmt.overwrite_ingress_policy,
+		rmt.overwrite_egress_policy,
+		rmt.ingress_policy,
+		rmt.egress_policy,
+		_period(rmt.billing_period)
+	)
+
+def rate_plan(rate):
+	"""
+	Build RatePlan object from a Rate, with its enabled global modifiers.
+	"""
+	mods = sorted(
+		(gm for gm in rate.global_modmap if gm.enabled),
+		key=lambda gm: gm.lookup_order
+	)
+	return RatePlan(
+		rate.id,
+		_enum(rate.type),
+		rate.advanced_features,
+		rate.quota_period_amount,
+		_enum(rate.quota_period_unit),
+		int(rate.quota_ingress_traffic),
+		int(rate.quota_egress_traffic),
+		rate.quota_sum,
+		rate.auxiliary_sum,
+		rate.overquota_sum_ingress,
+		rate.overquota_sum_egress,
+		rate.allow_overquota_ingress,
+		rate.allow_overquota_egress,
+		rate.ingress_policy,
+		rate.egress_policy,
+		tuple(rate_mod(None, gm.type) for gm in mods)
+	)
+
+def snapshot(sess, entity_id):
+	"""
+	Read everything acct_add looks at for an entity. Returns a tuple of
+	(AccountState, StashState, mapping of rate IDs to RatePlan objects, list
+	of AccessBlockInfo objects), or None if there is no such entity.
+	"""
+	ent = sess.query(AccessEntity).get(entity_id)
+	if ent is None:
+		return None
+	mods = sorted(
+		(rm for rm in ent.rate_modifiers if rm.enabled),
+		key=lambda rm: rm.lookup_order
+	)
+	acct = AccountState(
+		ent.id,
+		ent.stash_id,
+		ent.rate_id,
+		next_rate_id=ent.next_rate_id,
+		alias_of_id=ent.alias_of_id,
+		ut_ingress=int(ent.used_traffic_ingress),
+		ut_egress=int(ent.used_traffic_egress),
+		qpend=ent.quota_period_end,
+		state=ent.access_state,
+		bcheck=ent.check_block_state,
+		pcheck=ent.check_paid_services,
+		mods=tuple(rate_mod(rm.rate_id, rm.type) for rm in mods)
+	)
+	stash = None
+	if ent.stash is not None:
+		stash = StashState(ent.stash.id, ent.stash.amount, ent.stash.credit)
+	rates = {}
+	for rate in (ent.rate, ent.next_rate):
+		if rate is not None:
+			rates[rate.id] = rate_plan(rate)
+	blocks = [
+		AccessBlockInfo(ab.id, _enum(ab.state), ab.start, ab.end)
+		for ab in sess.query(AccessBlock).filter(AccessBlock.entity_id == entity_id)
+	]
+	return (acct, stash, rates, blocks)
+
+def _dump_mod(mod):
+	return [
+		mod.rate_id,
+		_dec(mod.oqsum_ingress_mul), _dec(mod.oqsum_egress_mul), _dec(mod.oqsum_sec_mul),
+		mod.ow_ingress, mod.ow_egress,
+		mod.pol_ingress, mod.pol_egress,
+		mod.period
+	]
+
+def _load_mod(data):
+	return RateMod(
+		data[0],
+		_from_dec(data[1]), _from_dec(data[2]), _from_dec(data[3]),
+		data[4], data[5],
+		data[6], data[7],
+		tuple(data[8]) if (data[8] is not None) else None
+	)
+
+def _dump_acct(acct):
+	data = acct.as_dict()
+	data['qpend'] = _ts(acct.qpend)
+	return data
+
+def dump_state(state):
+	"""
+	Convert snapshot() result to a JSON-serializable dict.
+	"""
+	acct, stash, rates, blocks = state
+	data = {
+		'account' : _dump_acct(acct),
+		'stash'   : None,
+		'rates'   : [],
+		'blocks'  : [[ab.id, ab.state, _ts(ab.start), _ts(ab.end)] for ab in blocks]
+	}
+	data['account']['mods'] = [_dump_mod(mod) for mod in acct.mods]
+	if stash is not None:
+		data['stash'] = {
+			'id'     : stash.id,
+			'amount' : _dec(stash.amount),
+			'credit' : _dec(stash.credit)
+		}
+	for rate in rates.values():
+		rdata = rate._asdict()
+		for fld in ('qsum', 'auxsum', 'oqsum_ingress', 'oqsum_egress'):
+			rdata[fld] = _dec(rdata[fld])
+		rdata['mods'] = [_dump_mod(mod) for mod in rate.mods]
+		data['rates'].append(rdata)
+	return data
+
+def load_state(data):
+	"""
+	Convert dump_state() result back to engine objects.
+	"""
+	adata = dict(data['account'])
+	adata['qpend'] = _from_ts(adata['qpend'])
+	adata['mods'] = tuple(_load_mod(mod) for mod in adata.get('mods', ()))
+	acct = AccountState(**adata)
+	stash = None
+	if data['stash'] is not None:
+		stash = StashState(data['stash']['id'], _from_dec(data['stash']['amount']), _from_dec(data['stash']['credit']))
+	rates = {}
+	for rdata in data['rates']:
+		rdata = dict(rdata)
+		for fld in ('qsum', 'auxsum', 'oqsum_ingress', 'oqsum_egress'):
+			rdata[fld] = _from_dec(rdata[fld])
+		rdata['mods'] = tuple(_load_mod(mod) for mod in rdata['mods'])
+		rates[rdata['id']] = RatePlan(**rdata)
+	blocks = [
+		AccessBlockInfo(ab[0], ab[1], _from_ts(ab[2]), _from_ts(ab[3]))
+		for ab in data['blocks']
+	]
+	return (acct, stash, rates, blocks)
+
+def record_call(sess, outfile, call, entity_id, name, tin, teg, ts):
+	"""
+	Run call(sess, entity_id, name, tin, teg, ts), which is expected to
+	invoke acct_add, and append a JSON line with inputs, entity state before
+	and after the call and the returned row to outfile. Returns the row.
+	"""
+	before = snapshot(sess, entity_id)
+	row = call(sess, entity_id, name, tin, teg, ts)
+	sess.expire_all()
+	after = snapshot(sess, entity_id)
+	rec = {
+		'input'  : [entity_id, name, tin, teg, _ts(ts)],
+		'before' : dump_state(before) if (before is not None) else None,
+		'after'  : None,
+		'result' : None
+	}
+	if after is not None:
+		rec['after'] = {
+			'account' : _dump_acct(after[0]),
+			'stash'   : _dec(after[1].amount) if (after[1] is not None) else None
+		}
+	if row is not None:
+		rec['result'] = [_dec(row[0]), row[1], row[2], row[3]]
+	outfile.write(json.dumps(rec, sort_keys=True))
+	outfile.write('\n')
+	return row
+
+def _same(left, right):
+	if isinstance(left, decimal.Decimal) or isinstance(right, decimal.Decimal):
+		if (left is None) or (right is None):
+			return left is right
+		return decimal.Decimal(left) == decimal.Decimal(right)
+	return left == right
+
+def replay(lines, **engine_args):
+	"""
+	Replay recorded acct_add calls against AcctEngine. Takes an iterable of
+	JSON lines written by record_call() and yields a tuple of (line number,
+	list of mismatch descriptions) for every record where the two differ.
+	Extra keyword arguments are passed to AcctEngine.
+	"""
+	for lineno, line in enumerate(lines, 1):
+		line = line.strip()
+		if not line:
+			continue
+		rec = json.loads(line)
+		diffs = []
+		entity_id, name, tin, teg, ts = rec['input']
+		ts = _from_ts(ts)
+		if rec['before'] is None:
+			acct = stash = None
+			rates = {}
+			blocks = ()
+		else:
+			acct, stash, rates, blocks = load_state(rec['before'])
+		out = AcctEngine(rates, **engine_args).add(acct, stash, tin, teg, ts, blocks)
+
+		expected = rec['result']
+		got = out.result
+		if (expected is None) != (got is None):
+			diffs.append('result: expected %r, got %r' % (expected, got))
+		elif expected is not None:
+			if not _same(_from_dec(expected[0]), got[0]):
+				diffs.append('diff: expected %s, got %s' % (expected[0], got[0]))
+			if expected[1] != got[1]:
+				diffs.append('state: expected %s, got %s' % (expected[1], got[1]))
+
+		after = rec['after']
+		if (after is not None) and (acct is not None):
+			for attr in _ACCT_COMPARE:
+				want = after['account'][attr]
+				have = getattr(acct, attr)
+				if attr == 'qpend':
+					have = _ts(have)
+				if not _same(want, have):
+					diffs.append('%s: expected %s, got %s' % (attr, want, have))
+			if (stash is not None) and not _same(_from_dec(after['stash']), stash.amount):
+				diffs.append('stash amount: expected %s, got %s' % (after['stash'], stash.amount))
+		if diffs:
+			yield (lineno, diffs)
+
+class RecordingIngest(AccountingIngest):
+	"""
+	Accounting ingest that records every acct_add call for replay().
+	"""
+	def __init__(self, outfile, **kwargs):
+		super(RecordingIngest, self).__init__(**kwargs)
+		self.outfile = outfile
+
+	def call(self, sess, entity_id, name, ingress, egress, ts):
+		parent = super(RecordingIngest, self).call
+		return record_call(sess, self.outfile, parent, entity_id, name, ingress, egress, ts)
+
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - Benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import decimal
+import json
+import random
+
+from netprofile.bench import BenchResults
+from netprofile_access.acctdiff import (
+	dump_state,
+	load_state
+)
+from netprofile_access.engine import (
+	AccountState,
+	AcctEngine,
+	RateMod,
+	RatePlan,
+	StashState
+)
+
+def _rates():
+	D = decimal.Decimal
+	night = RateMod(None, D('0.5'), D('0.5'), None, False, False, None, None, (None, None, None, 0, None, None, None, None, 7, None))
+	weekend = RateMod(None, None, D('0'), None, True, False, 'weekend', None, (None, None, 6, None, None, None, None, 7, None, None))
+	rates = {}
+	for rid, rtype, unit, mods in (
+		(1, 'prepaid',      'c_month', ()),
+		(2, 'prepaid_cont', 'f_day',   ()),
+		(3, 'postpaid',     'c_month', ()),
+		(4, 'prepaid',      'a_week',  (night, weekend))
+	):
+		rates[rid] = RatePlan(
+			rid, rtype, bool(mods), 1, unit,
+			10 ** 9, 10 ** 9,
+			D('10'), D('1'), D('0.00000001'), D('0.00000002'),
+			True, True, None, None,
+			mods
+		)
+	return rates
+
+def run(app=None, count=100000, accounts=1000):
+	"""
+	Apply a number of interim accounting updates with the Python accounting
+	engine, and measure cost of loading recorded entity state.
+	"""
+	res = BenchResults()
+	rnd = random.Random(count)
+	rates = _rates()
+	start = datetime.datetime(2015, 1, 1)
+	accts = []
+	for i in range(accounts):
+		accts.append((
+			AccountState(i + 1, i + 1, rnd.choice(tuple(rates))),
+			StashState(i + 1, decimal.Decimal(rnd.randint(0, 1000)), decimal.Decimal(50))
+		))
+	updates = [
+		(
+			rnd.randrange(accounts),
+			rnd.randint(0, 10 ** 7),
+			rnd.randint(0, 10 ** 6),
+			start + datetime.timedelta(seconds=i * 60)
+		)
+		for i in range(count)
+	]
+
+	engine = AcctEngine(rates)
+	with res.timed('acct_add (%d accounts)' % accounts, count):
+		for idx, tin, teg, ts in updates:
+			acct, stash = accts[idx]
+			engine.add(acct, stash, tin, teg, ts)
+
+	states = [json.dumps(dump_state((acct, stash, rates, []))) for acct, stash in accts]
+	with res.timed('load recorded state', len(states)):
+		for data in states:
+			load_state(json.loads(data))
+
+	return res
+
+if __name__ == '__main__':
+	print(run().format())
+
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - CLI commands
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import argparse
+import csv
+import datetime
+import logging
+
+from cliff.command import Command
+
+def _parse_ts(value):
+	if value.isdigit():
+		return datetime.datetime.fromtimestamp(int(value))
+	return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+class IngestAccounting(Command):
+	"""
+	Apply a stream of interim accounting updates in batches.
+
+	Each input line holds entity ID, entity name, ingress and egress
+	traffic deltas and a timestamp, separated by commas. Timestamps are
+	either UNIX time or YYYY-MM-DD HH:MM:SS. Per-entity results are written
+	to standard output.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(IngestAccounting, self).get_parser(prog_name)
+		parser.add_argument(
+			'-w', '--window',
+			type=float,
+			default=60,
+			help='Number of seconds to collect updates for an entity before applying them. Updates further apart than this are never summed together.'
+		)
+		parser.add_argument(
+			'-b', '--batch-size',
+			type=int,
+			default=200,
+			help='Number of entities to apply at once.'
+		)
+		parser.add_argument(
+			'-r', '--record',
+			type=argparse.FileType('a'),
+			default=None,
+			help='Record all acct_add calls to a file, for use with acct replay.'
+		)
+		parser.add_argument(
+			'input',
+			type=argparse.FileType('r'),
+			nargs='?',
+			default='-',
+			help='Input file, defaults to standard input.'
+		)
+		return parser
+
+	def take_action(self, args):
+		mm = self.app.mm
+
+		if len(mm.modules) > 0:
+			mm.rescan()
+		else:
+			mm.scan()
+
+		if not mm.load('core'):
+			raise RuntimeError('Unable to proceed without core module.')
+		if not mm.load_enabled():
+			raise RuntimeError('Unable to load enabled modules.')
+
+		from netprofile_access.ingest import AccountingIngest
+
+		if args.record:
+			from netprofile_access.acctdiff import RecordingIngest
+
+			ingest = RecordingIngest(args.record, window=args.window, batch_size=args.batch_size)
+		else:
+			ingest = AccountingIngest(window=args.window, batch_size=args.batch_size)
+		writer = csv.writer(self.app.stdout, lineterminator='\n')
+
+		def _stream():
+			for row in csv.reader(args.input):
+				if len(row) < 5:
+					continue
+				try:
+					yield (int(row[0]), row[1] or None, int(row[2]), int(row[3]), _parse_ts(row[4].strip()))
+				except ValueError:
+					self.log.warning('Skipping malformed accounting line: %r', row)
+
+		entities = deltas = calls = 0
+		for res in ingest.run(self.app.db_session, _stream()):
+			entities += 1
+			deltas += res.deltas
+			calls += res.calls
+			writer.writerow((res.entity_id, res.deltas, res.ingress, res.egress, res.diff, res.state))
+			self.app.stdout.flush()
+		self.log.info('Applied %d updates for %d entities with %d calls.', deltas, entities, calls)
+
+class ReplayAccounting(Command):
+	"""
+	Replay recorded acct_add calls against Python accounting engine.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(ReplayAccounting, self).get_parser(prog_name)
+		parser.add_argument(
+			'--no-compat',
+			action='store_true',
+			help='Do not reproduce repeated application of last rate modifier.'
+		)
+		parser.add_argument(
+			'--all-traffic',
+			action='store_true',
+			help='Replay as if @npa_all_traffic was set.'
+		)
+		parser.add_argument(
+			'input',
+			type=argparse.FileType('r'),
+			help='File recorded with acct ingest --record.'
+		)
+		return parser
+
+	def take_action(self, args):
+		from netprofile_access.acctdiff import replay
+
+		failed = 0
+		for lineno, diffs in replay(
+			args.input,
+			all_traffic=args.all_traffic,
+			mods_compat=not args.no_compat
+		):
+			failed += 1
+			self.app.stdout.write('%d: %s\n' % (lineno, '; '.join(diffs)))
+		if failed:
+			self.log.error('%d recorded calls differ.', failed)
+			return 1
+		self.log.info('All recorded calls match.')
+
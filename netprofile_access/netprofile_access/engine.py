@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - Accounting engine
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'AcctEngineError',
+	'RatePlan',
+	'RateMod',
+	'AccessBlockInfo',
+	'AccountState',
+	'StashState',
+	'AcctOutcome',
+	'AcctEngine',
+
+	'rate_mods_apply'
+]
+
+import collections
+import datetime
+import decimal
+
+from netprofile_rates.quota import qp_new
+
+MONEY_QUANT = decimal.Decimal('0.00000001')
+ZERO = decimal.Decimal('0')
+
+class AcctEngineError(RuntimeError):
+	pass
+
+RatePlan = collections.namedtuple('RatePlan', (
+	'id', 'type', 'abf',
+	'qp_amount', 'qp_unit',
+	'qt_ingress', 'qt_egress',
+	'qsum', 'auxsum',
+	'oqsum_ingress', 'oqsum_egress',
+	'oq_ingress', 'oq_egress',
+	'pol_ingress', 'pol_egress',
+	'mods'
+))
+RatePlan.__doc__ = """
+Snapshot of a rates_def row. Field mods holds enabled global rate
+modifiers as a sequence of RateMod objects, in lookup order.
+"""
+
+RateMod = collections.namedtuple('RateMod', (
+	'rate_id',
+	'oqsum_ingress_mul', 'oqsum_egress_mul', 'oqsum_sec_mul',
+	'ow_ingress', 'ow_egress',
+	'pol_ingress', 'pol_egress',
+	'period'
+))
+RateMod.__doc__ = """
+Snapshot of an enabled rate modifier with its type. Field period is None
+or a 10-tuple of (start month, start day of month, start weekday, start
+hour, start minute, end month, end day of month, end weekday, end hour,
+end minute), as in bperiods_def. Field rate_id is only used for per-user
+modifiers, None there means any rate.
+"""
+
+AccessBlockInfo = collections.namedtuple('AccessBlockInfo', ('id', 'state', 'start', 'end'))
+
+class AccountState(object):
+	"""
+	Mutable snapshot of an entities_access row, with per-user rate
+	modifiers in lookup order.
+	"""
+	__slots__ = (
+		'entity_id', 'stash_id', 'rate_id', 'next_rate_id', 'alias_of_id',
+		'ut_ingress', 'ut_egress', 'qpend', 'state',
+		'bcheck', 'pcheck', 'mods'
+	)
+
+	def __init__(self, entity_id, stash_id, rate_id, next_rate_id=None, alias_of_id=None, ut_ingress=0, ut_egress=0, qpend=None, state=0, bcheck=False, pcheck=False, mods=()):
+		self.entity_id = entity_id
+		self.stash_id = stash_id
+		self.rate_id = rate_id
+		self.next_rate_id = next_rate_id
+		self.alias_of_id = alias_of_id
+		self.ut_ingress = ut_ingress
+		self.ut_egress = ut_egress
+		self.qpend = qpend
+		self.state = state
+		self.bcheck = bcheck
+		self.pcheck = pcheck
+		self.mods = mods
+
+	def as_dict(self):
+		return dict((attr, getattr(self, attr)) for attr in self.__slots__ if attr != 'mods')
+
+class StashState(object):
+	"""
+	Mutable snapshot of a stashes_def row.
+	"""
+	__slots__ = ('id', 'amount', 'credit')
+
+	def __init__(self, id, amount, credit=ZERO):
+		self.id = id
+		self.amount = decimal.Decimal(amount)
+		self.credit = decimal.Decimal(credit)
+
+	def as_dict(self):
+		return { 'id' : self.id, 'amount' : self.amount, 'credit' : self.credit }
+
+class AcctOutcome(object):
+	"""
+	Result of an accounting update. Fields diff, state, policy_in and
+	policy_eg are what acct_add selects, row is False if it selects nothing.
+	Rows that acct_add would insert are collected in stash_io (as tuples of
+	IO type ID, stash ID, entity ID, timestamp, diff) and in stash_ops (as
+	tuples of stash ID, operation type, timestamp, entity ID, diff, ingress,
+	egress). Activated access blocks are listed in blocks.
+	"""
+	__slots__ = (
+		'row', 'diff', 'state', 'policy_in', 'policy_eg',
+		'stash_io', 'stash_ops', 'blocks'
+	)
+
+	def __init__(self, diff=None, state=None, row=True):
+		self.row = row
+		self.diff = diff
+		self.state = state
+		self.policy_in = None
+		self.policy_eg = None
+		self.stash_io = []
+		self.stash_ops = []
+		self.blocks = []
+
+	def __repr__(self):
+		return '<AcctOutcome(diff=%s, state=%s)>' % (self.diff, self.state)
+
+	@property
+	def result(self):
+		if not self.row:
+			return None
+		return (self.diff, self.state, self.policy_in, self.policy_eg)
+
+def _money(value):
+	return value.quantize(MONEY_QUANT, rounding=decimal.ROUND_HALF_UP)
+
+def _in_period(period, ts):
+	if period is None:
+		return True
+	s_month, s_mday, s_wday, s_hour, s_minute, e_month, e_mday, e_wday, e_hour, e_minute = period
+	for start, end, value in (
+		(s_minute, e_minute, ts.minute),
+		(s_hour,   e_hour,   ts.hour),
+		(s_wday,   e_wday,   ts.weekday() + 1),
+		(s_mday,   e_mday,   ts.day),
+		(s_month,  e_month,  ts.month)
+	):
+		if (start is not None) and (end is not None) and (start <= end):
+			if not (start <= value <= end):
+				return False
+	return True
+
+def _concat_ws(left, right):
+	if left is None:
+		return right
+	return left + ' ' + right
+
+def _rate_mod(mod, ts, oqsum_in, oqsum_eg, oqsum_sec, pol_in, pol_eg):
+	if _in_period(mod.period, ts):
+		if mod.oqsum_ingress_mul is not None:
+			oqsum_in = _money(oqsum_in * mod.oqsum_ingress_mul)
+		if mod.oqsum_egress_mul is not None:
+			oqsum_eg = _money(oqsum_eg * mod.oqsum_egress_mul)
+		if mod.oqsum_sec_mul is not None:
+			oqsum_sec = _money(oqsum_sec * mod.oqsum_sec_mul)
+		if mod.pol_ingress is not None:
+			pol_in = mod.pol_ingress if mod.ow_ingress else _concat_ws(pol_in, mod.pol_ingress)
+		if mod.pol_egress is not None:
+			pol_eg = mod.pol_egress if mod.ow_egress else _concat_ws(pol_eg, mod.pol_egress)
+	return (oqsum_in, oqsum_eg, oqsum_sec, pol_in, pol_eg)
+
+def rate_mods_apply(ts, rate_id, global_mods, user_mods, oqsum_in, oqsum_eg, oqsum_sec, pol_in, pol_eg, compat=True):
+	"""
+	Python counterpart of acct_rate_mods. Applies global and then per-user
+	RateMod objects and returns new (oqsum_in, oqsum_eg, oqsum_sec, pol_in,
+	pol_eg).
+
+	The procedure loops over its cursors with REPEAT, so the fetch that hits
+	the end of a cursor leaves the previous row in place and it is applied
+	once more. If the per-user cursor is empty, it is the last global
+	modifier that gets applied again. With compat set this is reproduced,
+	otherwise every modifier is applied once.
+	"""
+	values = (oqsum_in, oqsum_eg, oqsum_sec, pol_in, pol_eg)
+	last = None
+	for mods in (global_mods, user_mods):
+		for mod in mods:
+			if (mod.rate_id is not None) and (mod.rate_id != rate_id):
+				continue
+			values = _rate_mod(mod, ts, *values)
+			last = mod
+		if compat and (last is not None):
+			values = _rate_mod(last, ts, *values)
+	return values
+
+class AcctEngine(object):
+	"""
+	Pure-Python accounting core.
+
+	Implements the same quota period, prepaid, postpaid and over quota rules
+	as acct_add over plain data structures, so that billing math can be
+	tested without a database server and rating can be moved out of it.
+	Rates are looked up in a mapping of rate IDs to RatePlan objects. Set
+	all_traffic to mimic @npa_all_traffic, and see rate_mods_apply() for
+	mods_compat.
+
+	Paid service checks are done by acct_pcheck, which is supplied by paid
+	services code. Pass a callable with the same arguments as pcheck to
+	handle accounts that have them enabled. It is called as pcheck(account,
+	ts, rate_type, isok, stash_id, qpend, amount, credit, payq, payin,
+	payout) and must return a tuple of (isok, amount, credit, payq, payin,
+	payout).
+	"""
+	def __init__(self, rates, pcheck=None, all_traffic=False, mods_compat=True):
+		self.rates = rates
+		self.pcheck = pcheck
+		self.all_traffic = all_traffic
+		self.mods_compat = mods_compat
+
+	def _rate(self, rate_id, acct, ts):
+		rate = self.rates.get(rate_id)
+		if rate is None:
+			return None
+		oqsum_in = decimal.Decimal(rate.oqsum_ingress)
+		oqsum_eg = decimal.Decimal(rate.oqsum_egress)
+		oqsum_sec = ZERO
+		pol_in = rate.pol_ingress
+		pol_eg = rate.pol_egress
+		if rate.abf:
+			oqsum_in, oqsum_eg, oqsum_sec, pol_in, pol_eg = rate_mods_apply(
+				ts, rate_id, rate.mods, acct.mods,
+				oqsum_in, oqsum_eg, oqsum_sec, pol_in, pol_eg,
+				compat=self.mods_compat
+			)
+		return (rate, oqsum_in, oqsum_eg)
+
+	def _pcheck(self, acct, ts, rate_type, isok, stash_id, qpend, amount, credit, payq, payin, payout):
+		if self.pcheck is None:
+			raise AcctEngineError('Paid service checks are enabled for entity %s, but no pcheck handler is set' % (acct.entity_id,))
+		isok, amount, credit, payq, payin, payout = self.pcheck(acct, ts, rate_type, isok, stash_id, qpend, amount, credit, payq, payin, payout)
+		return (isok, amount, credit, payq, payin, payout)
+
+	def add(self, acct, stash, tin, teg, ts, blocks=()):
+		"""
+		Python counterpart of acct_add. Updates acct and stash in place the
+		same way acct_add updates the database, and returns an AcctOutcome
+		object. Argument blocks is a sequence of AccessBlockInfo objects for
+		this entity, activated blocks are reported in the outcome.
+		"""
+		if acct is None:
+			return AcctOutcome(None, 99)
+		if (acct.state == 2) or (acct.alias_of_id is not None):
+			return AcctOutcome(None, 2)
+		ret = self._rate(acct.rate_id, acct, ts)
+		if (ret is None) or (stash is None) or (stash.id != acct.stash_id):
+			return AcctOutcome(None, 99)
+		rate, oqsum_in, oqsum_eg = ret
+		rate_type = getattr(rate.type, 'value', rate.type)
+
+		user_rateid = acct.rate_id
+		user_nextrateid = acct.next_rate_id
+		user_uin = acct.ut_ingress
+		user_ueg = acct.ut_egress
+		user_qpend = acct.qpend
+		user_state = acct.state
+		user_qporig = user_qpend
+		amount = stash_amorig = stash.amount
+		credit = stash.credit
+		isok = True
+		payq = payin = payout = ZERO
+		st_in = 'qin'
+		st_eg = 'qeg'
+
+		if rate_type in ('prepaid', 'prepaid_cont'):
+			if (user_uin + tin) > rate.qt_ingress:
+				if user_uin < rate.qt_ingress:
+					payin = _money((user_uin + tin - rate.qt_ingress) * oqsum_in)
+					st_in = 'min'
+				else:
+					payin = _money(tin * oqsum_in)
+					st_in = 'oqin'
+			if (user_ueg + teg) > rate.qt_egress:
+				if user_ueg < rate.qt_egress:
+					payout = _money((user_ueg + teg - rate.qt_egress) * oqsum_eg)
+					st_eg = 'meg'
+				else:
+					payout = _money(teg * oqsum_eg)
+					st_eg = 'oqeg'
+
+		user_uin += tin
+		user_ueg += teg
+
+		if (user_qpend is None) or (user_qpend < ts):
+			if acct.bcheck:
+				for block in blocks:
+					bstate = getattr(block.state, 'value', block.state)
+					if (bstate in ('planned', 'active')) and (block.start <= ts <= block.end):
+						out = AcctOutcome(row=False)
+						if bstate == 'planned':
+							out.blocks.append((block.id, 'active', user_state))
+						acct.state = 2
+						acct.bcheck = False
+						return out
+			payq = decimal.Decimal(rate.qsum)
+			if (rate_type == 'postpaid') and (user_qpend is not None):
+				if user_uin > rate.qt_ingress:
+					payin = _money((user_uin - rate.qt_ingress) * oqsum_in)
+					st_in = 'min'
+				if user_ueg > rate.qt_egress:
+					payout = _money((user_ueg - rate.qt_egress) * oqsum_eg)
+					st_eg = 'meg'
+				if acct.pcheck:
+					isok, amount, credit, payq, payin, payout = self._pcheck(acct, ts, rate_type, True, acct.stash_id, user_qpend, amount, credit, payq, payin, payout)
+				amount = _money(amount - payq - payin - payout)
+				user_state = 1 if ((amount + credit) < 0) else 0
+			if (user_nextrateid is not None) and (user_nextrateid != user_rateid):
+				user_rateid = user_nextrateid
+				user_nextrateid = None
+				ret = self._rate(user_rateid, acct, ts)
+				if ret is None:
+					return AcctOutcome(None, 99)
+				rate, oqsum_in, oqsum_eg = ret
+				rate_type = getattr(rate.type, 'value', rate.type)
+				payq = decimal.Decimal(rate.qsum)
+			user_qpend = ts + datetime.timedelta(seconds=qp_new(rate.qp_amount, rate.qp_unit, ts))
+			user_uin = 0
+			user_ueg = 0
+			if (rate_type in ('prepaid', 'prepaid_cont')) and acct.pcheck:
+				isok, amount, credit, payq, payin, payout = self._pcheck(acct, ts, rate_type, False, acct.stash_id, user_qpend, amount, credit, payq, payin, payout)
+
+		if (
+			((user_uin > rate.qt_ingress) and (not rate.oq_ingress))
+		or
+			((user_ueg > rate.qt_egress) and (not rate.oq_egress))
+		):
+			acct.ut_ingress = user_uin
+			acct.ut_egress = user_ueg
+			acct.state = 1
+			return AcctOutcome(0, 1)
+
+		stashop_type = '_'.join(('sub', st_in, st_eg))
+
+		if rate_type in ('prepaid', 'prepaid_cont'):
+			if ((amount + credit) < payq) and (payq > 0):
+				user_state = 1
+				user_qpend = None
+				payq = ZERO
+			if acct.pcheck and (not isok):
+				user_state = 1
+				user_qpend = None
+				payq = ZERO
+			if (rate_type == 'prepaid_cont') and (user_state == 1) and (rate.auxsum is not None) and ((amount + credit) < rate.auxsum):
+				user_qpend = user_qporig
+				payq = ZERO
+			else:
+				amount = _money(amount - payq - payin - payout)
+				if (amount + credit) < 0:
+					user_state = 1
+				elif user_qpend is not None:
+					user_state = 0
+
+		acct.rate_id = user_rateid
+		acct.next_rate_id = user_nextrateid
+		acct.ut_ingress = user_uin
+		acct.ut_egress = user_ueg
+		acct.qpend = user_qpend
+		acct.state = user_state
+		stash.amount = amount
+
+		out = AcctOutcome(_money(amount - stash_amorig), user_state)
+		if (amount != stash_amorig) and (payq > 0):
+			out.stash_io.append((2 if (rate_type == 'postpaid') else 1, stash.id, acct.entity_id, ts, -payq))
+		if not self.all_traffic:
+			if oqsum_in == 0:
+				tin = 0
+			if oqsum_eg == 0:
+				teg = 0
+		if (amount != stash_amorig) or (tin > 0) or (teg > 0):
+			out.stash_ops.append((stash.id, stashop_type, ts, acct.entity_id, out.diff, tin, teg))
+		return out
+
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - Batch accounting ingest
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'AcctDelta',
+	'AcctResult',
+	'AccountingIngest',
+
+	'acct_add'
+]
+
+import collections
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from netprofile_access.engine import _in_period
+from netprofile_access.models import AccessEntity
+
+logger = logging.getLogger(__name__)
+
+_ACCT_ADD = text('CALL acct_add(:aeid, :name, :tin, :teg, :ts)')
+
+def acct_add(sess, entity_id, name, ingress, egress, ts):
+	"""
+	Call acct_add procedure and return its result row, if any. When it
+	blocks an entity, the procedure commits and leaves without returning
+	a result set.
+	"""
+	result = sess.execute(_ACCT_ADD, {
+		'aeid' : entity_id,
+		'name' : name,
+		'tin'  : ingress,
+		'teg'  : egress,
+		'ts'   : ts
+	})
+	if not result.returns_rows:
+		return None
+	return result.fetchone()
+
+AcctDelta = collections.namedtuple('AcctDelta', ('entity_id', 'name', 'ingress', 'egress', 'ts'))
+
+class AcctResult(object):
+	"""
+	Outcome of applying all pending deltas of a single access entity.
+	"""
+	__slots__ = (
+		'entity_id', 'deltas', 'calls',
+		'ingress', 'egress', 'diff',
+		'state', 'policy_ingress', 'policy_egress'
+	)
+
+	def __init__(self, entity_id):
+		self.entity_id = entity_id
+		self.deltas = 0
+		self.calls = 0
+		self.ingress = 0
+		self.egress = 0
+		self.diff = None
+		self.state = None
+		self.policy_ingress = None
+		self.policy_egress = None
+
+	def __repr__(self):
+		return '<AcctResult(%s: deltas=%d, calls=%d, diff=%s, state=%s)>' % (
+			self.entity_id,
+			self.deltas,
+			self.calls,
+			self.diff,
+			self.state
+		)
+
+	def add(self, row):
+		diff, state, pol_in, pol_eg = row
+		self.calls += 1
+		if diff is not None:
+			self.diff = diff if (self.diff is None) else (self.diff + diff)
+		self.state = state
+		self.policy_ingress = pol_in
+		self.policy_egress = pol_eg
+
+class AccountingIngest(object):
+	"""
+	Batch ingest of interim accounting updates.
+
+	Traffic deltas are collected per access entity for up to window seconds
+	and then applied with as few acct_add calls as the rating semantics
+	allow. Consecutive deltas are summed and rated at the timestamp of the
+	last of them as long as they are within the current quota period of the
+	entity, no more than window seconds apart from the first one, and fall
+	into the same set of billing periods of enabled rate modifiers. Rate
+	modifiers are picked by the time of the call, so splitting at billing
+	period boundaries keeps each delta at its own multiplier. The first
+	delta past the end of the quota period is applied on its own, so that
+	the period is rolled over exactly as it would be otherwise, and the end
+	of the new period is re-read before going on.
+
+	Entities are always processed in ascending ID order, in batches of
+	batch_size, so concurrent ingest processes take row locks in the same
+	order and do not queue up behind each other.
+	"""
+	def __init__(self, window=60, batch_size=200):
+		self.window = window
+		self.batch_size = batch_size
+		self.pending = {}
+		self.since = {}
+		self.periods = None
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.pending)
+
+	def add(self, entity_id, ingress, egress, ts, name=None):
+		"""
+		Queue traffic delta for an access entity.
+		"""
+		delta = AcctDelta(entity_id, name, ingress, egress, ts)
+		with self.lock:
+			deltas = self.pending.get(entity_id)
+			if deltas is None:
+				self.pending[entity_id] = [delta]
+				self.since[entity_id] = time.monotonic()
+			else:
+				deltas.append(delta)
+
+	def take(self, force=False):
+		"""
+		Remove and return deltas of all entities that are due, sorted by
+		entity ID.
+		"""
+		deadline = time.monotonic() - self.window
+		with self.lock:
+			if force:
+				due = list(self.pending)
+			else:
+				due = [eid for eid, since in self.since.items() if since <= deadline]
+			due.sort()
+			taken = []
+			for eid in due:
+				taken.append((eid, self.pending.pop(eid)))
+				del self.since[eid]
+		return taken
+
+	def call(self, sess, entity_id, name, ingress, egress, ts):
+		return acct_add(sess, entity_id, name, ingress, egress, ts)
+
+	def quota_ends(self, sess, ids):
+		return dict(sess.query(
+			AccessEntity.id,
+			AccessEntity.quota_period_end
+		).filter(AccessEntity.id.in_(ids)))
+
+	def billing_periods(self, sess):
+		"""
+		Get billing periods of all enabled rate modifier types, as tuples
+		accepted by netprofile_access.engine.
+		"""
+		from netprofile_rates.models import (
+			BillingPeriod,
+			RateModifierType
+		)
+		return [(
+			bp.start_month, bp.start_day_of_month, bp.start_weekday, bp.start_hour, bp.start_minute,
+			bp.end_month, bp.end_day_of_month, bp.end_weekday, bp.end_hour, bp.end_minute
+		) for bp in sess.query(BillingPeriod).join(
+			RateModifierType,
+			RateModifierType.billing_period_id == BillingPeriod.id
+		).filter(
+			RateModifierType.enabled == True
+		).distinct()]
+
+	def period_key(self, ts):
+		return tuple(_in_period(period, ts) for period in self.periods)
+
+	def apply(self, sess, entity_id, deltas, qpend):
+		"""
+		Apply deltas of a single entity. Returns AcctResult object.
+		"""
+		res = AcctResult(entity_id)
+		deltas = sorted(deltas, key=lambda d: d.ts)
+		res.deltas = len(deltas)
+		if self.periods is None:
+			self.periods = self.billing_periods(sess)
+		i = 0
+		while i < len(deltas):
+			j = i + 1
+			if (qpend is not None) and (deltas[i].ts <= qpend):
+				first = deltas[i].ts
+				key = self.period_key(first)
+				while (j < len(deltas)) and (deltas[j].ts <= qpend):
+					if (deltas[j].ts - first).total_seconds() > self.window:
+						break
+					if self.period_key(deltas[j].ts) != key:
+						break
+					j += 1
+			chunk = deltas[i:j]
+			tin = sum(d.ingress for d in chunk)
+			teg = sum(d.egress for d in chunk)
+			row = self.call(sess, entity_id, chunk[-1].name, tin, teg, chunk[-1].ts)
+			if row is not None:
+				res.add(row)
+			res.ingress += tin
+			res.egress += teg
+			i = j
+			if (res.state == 2) or (row is None) or (row[1] == 99):
+				# Blocked, alias or unknown entity: the rest would be ignored too.
+				break
+			if (i < len(deltas)) and ((qpend is None) or (chunk[-1].ts > qpend)):
+				qpend = self.quota_ends(sess, (entity_id,)).get(entity_id)
+		return res
+
+	def flush(self, sess, force=False):
+		"""
+		Apply all due deltas. Returns a list of AcctResult objects.
+		"""
+		taken = self.take(force)
+		results = []
+		if taken:
+			self.periods = self.billing_periods(sess)
+		for start in range(0, len(taken), self.batch_size):
+			batch = taken[start:start + self.batch_size]
+			qpends = self.quota_ends(sess, [eid for eid, deltas in batch])
+			for eid, deltas in batch:
+				try:
+					results.append(self.apply(sess, eid, deltas, qpends.get(eid)))
+				except Exception:
+					logger.exception('Unable to apply accounting for entity %s', eid)
+					sess.rollback()
+					res = AcctResult(eid)
+					res.deltas = len(deltas)
+					results.append(res)
+		if taken:
+			logger.debug(
+				'Applied %d deltas for %d entities with %d calls',
+				sum(res.deltas for res in results),
+				len(results),
+				sum(res.calls for res in results)
+			)
+		return results
+
+	def run(self, sess, stream, interval=1):
+		"""
+		Consume an iterable of (entity ID, ingress, egress, timestamp) or
+		(entity ID, name, ingress, egress, timestamp) tuples, flushing due
+		entities at most every interval seconds. Yields AcctResult objects.
+		"""
+		last = time.monotonic()
+		for delta in stream:
+			if len(delta) == 4:
+				self.add(delta[0], delta[1], delta[2], delta[3])
+			else:
+				self.add(delta[0], delta[2], delta[3], delta[4], name=delta[1])
+			now = time.monotonic()
+			if now - last >= interval:
+				last = now
+				for res in self.flush(sess):
+					yield res
+		for res in self.flush(sess, force=True):
+			yield res
+
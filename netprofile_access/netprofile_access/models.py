@@ -181,6 +181,7 @@ class AccessEntity(Entity):
 		Index('entities_access_i_ipaddrid', 'ipaddrid'),
 		Index('entities_access_i_ip6addrid', 'ip6addrid'),
 		Index('entities_access_i_nextrateid', 'nextrateid'),
+		Index('entities_access_i_qpend', 'qpend'),
 		Trigger('before', 'insert', 't_entities_access_bi'),
 		Trigger('before', 'update', 't_entities_access_bu'),
 		Trigger('after', 'update', 't_entities_access_au'),
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - Celery tasks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import logging
+import time
+
+import redis
+import transaction
+
+from sqlalchemy import (
+	func,
+	or_
+)
+
+from netprofile.celery import app
+from netprofile.common.polling import (
+	PollMetrics,
+	dispatch_shards
+)
+from netprofile.common.util import make_config_dict
+from netprofile.db.connection import DBSession
+
+from netprofile_access.ingest import acct_add
+from netprofile_access.models import AccessEntity
+from netprofile_entities.models import Entity
+from netprofile_rates.models import Rate
+
+logger = logging.getLogger(__name__)
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def acct_metrics(settings=None):
+	rconf = make_config_dict(settings or app.settings, 'netprofile.rt.redis.')
+	return PollMetrics(redis.Redis(**rconf), 'acct')
+
+def _poll_config():
+	cfg = make_config_dict(app.settings, 'netprofile.acct.poll.')
+	return (
+		int(cfg.get('shard_size', 1000)),
+		int(cfg.get('concurrency', 4))
+	)
+
+def _due_filter(sess, q, ts):
+	# Same set of entities acct_poll walks, minus those whose quota period
+	# has not ended yet, as acct_add(aeid, nick, 0, 0, ts) has nothing to
+	# do for them. The qpend condition is resolved from entities_access_i_qpend.
+	ea = AccessEntity.__table__
+	return q.filter(
+		or_(ea.c.qpend == None, ea.c.qpend < ts),
+		ea.c.state != 2,
+		ea.c.aliasid == None,
+		ea.c.rateid.in_(sess.query(Rate.id).filter(Rate.polled == True))
+	)
+
+def poll_shards(sess, ts, shard_size):
+	"""
+	Split entities that are due for polling into ranges of entity IDs
+	holding up to shard_size entities each. Returns a list of (first ID,
+	last ID) tuples.
+	"""
+	ea = AccessEntity.__table__
+	q = _due_filter(sess, sess.query(ea.c.entityid), ts).order_by(ea.c.entityid)
+	shards = []
+	first = last = None
+	count = 0
+	for eid, in q.yield_per(10000):
+		if first is None:
+			first = eid
+		last = eid
+		count += 1
+		if count >= shard_size:
+			shards.append((first, last))
+			first = None
+			count = 0
+	if first is not None:
+		shards.append((first, last))
+	return shards
+
+def queue_stats(sess, ts):
+	"""
+	Get number of entities that are due for polling and lag in seconds of
+	the oldest one.
+	"""
+	ea = AccessEntity.__table__
+	count, oldest = _due_filter(
+		sess,
+		sess.query(func.count(ea.c.entityid), func.min(ea.c.qpend)),
+		ts
+	).one()
+	lag = 0
+	if oldest is not None:
+		lag = max(0, (ts - oldest).total_seconds())
+	return (count, lag)
+
+@app.task
+def task_acct_poll(ts=None):
+	"""
+	Partitioned replacement for acct_poll procedure. Meant to be run from
+	Celery beat instead of ev_acct_poll event.
+
+	Entities that are due are split into ID ranges, which are processed by
+	at most netprofile.acct.poll.concurrency workers at a time. Run metrics
+	are stored in Redis and can be read with acct_metrics().status().
+	"""
+	if ts is None:
+		ts = datetime.datetime.now().replace(microsecond=0)
+	elif not isinstance(ts, datetime.datetime):
+		ts = datetime.datetime.strptime(ts, TS_FORMAT)
+	shard_size, concurrency = _poll_config()
+	started = time.time()
+
+	sess = DBSession()
+	shards = poll_shards(sess, ts, shard_size)
+	transaction.commit()
+
+	run_id = acct_metrics().start(ts, len(shards), plan_time=time.time() - started)
+	tsstr = ts.strftime(TS_FORMAT)
+	lanes = dispatch_shards([
+		task_acct_poll_shard.si(run_id, tsstr, first, last)
+		for first, last in shards
+	], concurrency)
+	logger.info('Started acct_poll run %s with %d shards in %d lanes', run_id, len(shards), lanes)
+	return run_id
+
+@app.task
+def task_acct_poll_shard(run_id, ts, first, last):
+	"""
+	Poll entities with IDs from first to last, inclusive.
+	"""
+	ts = datetime.datetime.strptime(ts, TS_FORMAT)
+	started = time.time()
+	ea = AccessEntity.__table__
+	sess = DBSession()
+	q = _due_filter(
+		sess,
+		sess.query(ea.c.entityid, Entity.nick, ea.c.qpend).join(Entity.__table__, Entity.id == ea.c.entityid),
+		ts
+	).filter(
+		ea.c.entityid.between(first, last)
+	).order_by(ea.c.entityid)
+	rows = q.all()
+
+	count = errors = 0
+	max_lag = 0
+	for eid, nick, qpend in rows:
+		try:
+			acct_add(sess, eid, nick, 0, 0, ts)
+		except Exception:
+			logger.exception('acct_add failed for entity %s', eid)
+			sess.rollback()
+			errors += 1
+			continue
+		count += 1
+		if qpend is not None:
+			max_lag = max(max_lag, (datetime.datetime.now() - qpend).total_seconds())
+	transaction.commit()
+
+	if acct_metrics().shard_done(run_id, count, errors, time.time() - started, max_lag):
+		logger.info('Finished acct_poll run %s', run_id)
+	return count
+
@@ -1,4 +1,10 @@
 ## -*- coding: utf-8 -*-
+% if qp_left.get(a.id) is not None:
+			<div class="row">
+				<label for="fld-qpleft-${a.id}" class="col-sm-4">${_('Period Remaining', domain='netprofile_access')}</label>
+				<div id="fld-qpleft-${a.id}" class="col-sm-8">${'%d%%' % int(qp_left[a.id] * 100)}</div>
+			</div>
+% endif
 			<div class="row">
 				<label for="fld-rate-${stash.id}" class="col-sm-4">${_('Current Rate')}</label>
 				<div id="fld-rate-${stash.id}" class="col-sm-8">
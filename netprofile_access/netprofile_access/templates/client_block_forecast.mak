@@ -0,0 +1,10 @@
+## -*- coding: utf-8 -*-
+<%namespace module="netprofile.tpl.filters" import="date_fmt" />\
+% if funds_until.get(stash.id):
+	<li class="list-group-item">
+		<div class="row">
+			<label for="fld-fundsuntil-${stash.id}" class="col-sm-4">${_('Funds Last Until', domain='netprofile_access')}</label>
+			<div id="fld-fundsuntil-${stash.id}" class="col-sm-8">${funds_until[stash.id] | n,date_fmt}</div>
+		</div>
+	</li>
+% endif
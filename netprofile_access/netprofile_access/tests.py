@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Access module - Tests
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime as dt
+import decimal
+import pkg_resources
+import unittest
+
+from pyramid import testing
+
+from netprofile.common import cache
+from netprofile.db.connection import DBSession
+from netprofile_access.engine import (
+	AccessBlockInfo,
+	AccountState,
+	AcctEngine,
+	RateMod,
+	RatePlan,
+	StashState,
+	rate_mods_apply
+)
+
+D = decimal.Decimal
+TS = dt.datetime(2015, 3, 10, 12, 0, 0)
+
+def _plan(**kwargs):
+	values = {
+		'id'            : 1,
+		'type'          : 'prepaid',
+		'abf'           : False,
+		'qp_amount'     : 1,
+		'qp_unit'       : 'a_day',
+		'qt_ingress'    : 1000,
+		'qt_egress'     : 1000,
+		'qsum'          : D('10.00'),
+		'auxsum'        : None,
+		'oqsum_ingress' : D('0.01'),
+		'oqsum_egress'  : D('0.02'),
+		'oq_ingress'    : True,
+		'oq_egress'     : True,
+		'pol_ingress'   : None,
+		'pol_egress'    : None,
+		'mods'          : ()
+	}
+	values.update(kwargs)
+	return RatePlan(**values)
+
+def _mod(mul, rate_id=None, period=None, pol=None):
+	return RateMod(rate_id, mul, None, None, False, False, pol, None, period)
+
+def _load_models(loaded, name):
+	# Relationships refer to models of dependent modules by name, so all
+	# of them need to be imported.
+	if name in loaded:
+		return
+	eps = list(pkg_resources.iter_entry_points('netprofile.modules', name))
+	if len(eps) < 1:
+		raise RuntimeError('Unable to find module \'%s\'.' % (name,))
+	modcls = loaded[name] = eps[0].load()
+	for depmod in modcls.get_deps():
+		_load_models(loaded, depmod)
+	modcls.get_models()
+
+class _Object(object):
+	def __init__(self, **kwargs):
+		self.__dict__.update(kwargs)
+
+class TestClientAccountsHook(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		if cache.cache is None:
+			cache.cache = cache.configure_cache({
+				'netprofile.cache.backend' : 'dogpile.cache.memory'
+			})
+		loaded = {}
+		for moddef in ('core', 'access'):
+			_load_models(loaded, moddef)
+
+	def setUp(self):
+		self.config = testing.setUp()
+
+	def tearDown(self):
+		DBSession.remove()
+		testing.tearDown()
+
+	def test_quota_and_forecast(self):
+		from netprofile_rates.models import (
+			QuotaPeriodUnit,
+			Rate,
+			RateType
+		)
+		from .views import _tpldef_list_accounts
+
+		qpend = dt.datetime.now().replace(microsecond=0) + dt.timedelta(days=10)
+		rate = Rate(
+			type=RateType.prepaid,
+			quota_period_amount=1,
+			quota_period_unit=QuotaPeriodUnit.absolute_month,
+			quota_sum=decimal.Decimal('10.00')
+		)
+		free = Rate(
+			type=RateType.free,
+			quota_period_amount=1,
+			quota_period_unit=QuotaPeriodUnit.absolute_month,
+			quota_sum=decimal.Decimal('0.00')
+		)
+		stash = _Object(id=1, amount=decimal.Decimal('25.00'), credit=0, access_entities=[
+			_Object(id=10, alias_of_id=None, rate=rate, quota_period_end=qpend),
+			_Object(id=11, alias_of_id=None, rate=free, quota_period_end=qpend),
+			_Object(id=12, alias_of_id=10, rate=rate, quota_period_end=qpend),
+			_Object(id=13, alias_of_id=None, rate=rate, quota_period_end=None)
+		])
+		tpldef = { 'stashes' : [stash] }
+		_tpldef_list_accounts(tpldef, testing.DummyRequest())
+
+		self.assertEqual(sorted(tpldef['qp_left']), [10, 11])
+		self.assertEqual(tpldef['qp_left'][10], decimal.Decimal('0.3333'))
+		self.assertEqual(tpldef['qp_left'][11], decimal.Decimal('0.3333'))
+		# Two more 30-day periods are paid for, the third one is not.
+		self.assertEqual(tpldef['funds_until'][1], qpend + dt.timedelta(days=60))
+
+class TestAcctEngine(unittest.TestCase):
+	def _account(self, **kwargs):
+		values = {
+			'entity_id' : 10,
+			'stash_id'  : 1,
+			'rate_id'   : 1,
+			'qpend'     : TS + dt.timedelta(hours=1)
+		}
+		values.update(kwargs)
+		return AccountState(**values)
+
+	def test_quota_rollover(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(ut_ingress=500, qpend=TS - dt.timedelta(seconds=1))
+		stash = StashState(1, '100.00')
+		out = eng.add(acct, stash, 100, 0, TS)
+		self.assertEqual(out.result, (D('-10.00'), 0, None, None))
+		self.assertEqual(stash.amount, D('90.00'))
+		self.assertEqual(acct.qpend, TS + dt.timedelta(days=1))
+		self.assertEqual((acct.ut_ingress, acct.ut_egress), (0, 0))
+		self.assertEqual(out.stash_io, [(1, 1, 10, TS, D('-10.00'))])
+		self.assertEqual(out.stash_ops, [(1, 'sub_qin_qeg', TS, 10, D('-10.00'), 100, 0)])
+
+	def test_next_rate_on_rollover(self):
+		eng = AcctEngine({ 1 : _plan(), 2 : _plan(id=2, qsum=D('3.00'), qp_unit='a_week') })
+		acct = self._account(next_rate_id=2, qpend=TS - dt.timedelta(seconds=1))
+		stash = StashState(1, '100.00')
+		out = eng.add(acct, stash, 0, 0, TS)
+		self.assertEqual(out.diff, D('-3.00'))
+		self.assertEqual((acct.rate_id, acct.next_rate_id), (2, None))
+		self.assertEqual(acct.qpend, TS + dt.timedelta(weeks=1))
+
+	def test_within_quota(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(ut_ingress=100)
+		stash = StashState(1, '100.00')
+		out = eng.add(acct, stash, 200, 50, TS)
+		self.assertEqual(out.result, (D('0.00'), 0, None, None))
+		self.assertEqual((acct.ut_ingress, acct.ut_egress), (300, 50))
+		self.assertEqual(out.stash_io, [])
+		self.assertEqual(out.stash_ops, [(1, 'sub_qin_qeg', TS, 10, D('0.00'), 200, 50)])
+
+	def test_over_quota(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(ut_ingress=900, ut_egress=1000)
+		stash = StashState(1, '100.00')
+		# Only the part above quota is charged.
+		out = eng.add(acct, stash, 300, 50, TS)
+		self.assertEqual(out.diff, D('-3.00'))
+		self.assertEqual(out.stash_ops, [(1, 'sub_min_oqeg', TS, 10, D('-3.00'), 300, 50)])
+		out = eng.add(acct, stash, 100, 0, TS)
+		self.assertEqual(out.diff, D('-1.00'))
+		# Egress is still over quota, even with nothing added.
+		self.assertEqual(out.stash_ops[0][1], 'sub_oqin_oqeg')
+		self.assertEqual(stash.amount, D('96.00'))
+		self.assertEqual(acct.state, 0)
+
+	def test_over_quota_disabled(self):
+		eng = AcctEngine({ 1 : _plan(oq_ingress=False) })
+		acct = self._account(ut_ingress=900)
+		stash = StashState(1, '100.00')
+		out = eng.add(acct, stash, 200, 0, TS)
+		self.assertEqual(out.result, (0, 1, None, None))
+		self.assertEqual((acct.state, acct.ut_ingress), (1, 1100))
+		self.assertEqual(stash.amount, D('100.00'))
+
+	def test_free_traffic_not_logged(self):
+		eng = AcctEngine({ 1 : _plan(oqsum_ingress=D('0'), oqsum_egress=D('0')) })
+		out = eng.add(self._account(), StashState(1, '100.00'), 200, 50, TS)
+		self.assertEqual(out.stash_ops, [])
+		eng = AcctEngine({ 1 : _plan(oqsum_ingress=D('0'), oqsum_egress=D('0')) }, all_traffic=True)
+		out = eng.add(self._account(), StashState(1, '100.00'), 200, 50, TS)
+		self.assertEqual(out.stash_ops, [(1, 'sub_qin_qeg', TS, 10, D('0.00'), 200, 50)])
+
+	def test_block_on_balance(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(qpend=TS - dt.timedelta(seconds=1))
+		stash = StashState(1, '5.00')
+		out = eng.add(acct, stash, 0, 0, TS)
+		self.assertEqual(out.result, (D('0.00'), 1, None, None))
+		self.assertEqual((acct.state, acct.qpend), (1, None))
+		self.assertEqual(stash.amount, D('5.00'))
+		self.assertEqual(out.stash_io, [])
+
+	def test_credit_covers_quota(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(qpend=TS - dt.timedelta(seconds=1))
+		stash = StashState(1, '5.00', '10.00')
+		out = eng.add(acct, stash, 0, 0, TS)
+		self.assertEqual(out.result, (D('-10.00'), 0, None, None))
+		self.assertEqual(stash.amount, D('-5.00'))
+		# Running out of credit on traffic blocks without ending the period.
+		acct.ut_ingress = 1000
+		out = eng.add(acct, stash, 600, 0, TS)
+		self.assertEqual(out.result, (D('-6.00'), 1, None, None))
+		self.assertEqual(acct.qpend, TS + dt.timedelta(days=1))
+
+	def test_unblock_on_payment(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(qpend=None, state=1)
+		stash = StashState(1, '50.00')
+		out = eng.add(acct, stash, 0, 0, TS)
+		self.assertEqual(out.result, (D('-10.00'), 0, None, None))
+		self.assertEqual(acct.state, 0)
+		self.assertEqual(acct.qpend, TS + dt.timedelta(days=1))
+
+	def test_postpaid(self):
+		eng = AcctEngine({ 1 : _plan(type='postpaid') })
+		acct = self._account(ut_ingress=1500, qpend=TS - dt.timedelta(seconds=1))
+		stash = StashState(1, '10.00')
+		out = eng.add(acct, stash, 0, 0, TS)
+		# Quota sum and traffic above quota are charged at period end.
+		self.assertEqual(out.result, (D('-15.00'), 1, None, None))
+		self.assertEqual(out.stash_io, [(2, 1, 10, TS, D('-10.00'))])
+		self.assertEqual(acct.qpend, TS + dt.timedelta(days=1))
+
+	def test_access_block(self):
+		eng = AcctEngine({ 1 : _plan() })
+		acct = self._account(qpend=TS - dt.timedelta(seconds=1), bcheck=True)
+		stash = StashState(1, '100.00')
+		blocks = (
+			AccessBlockInfo(5, 'expired', TS - dt.timedelta(days=2), TS - dt.timedelta(days=1)),
+			AccessBlockInfo(6, 'planned', TS - dt.timedelta(hours=1), TS + dt.timedelta(hours=1))
+		)
+		out = eng.add(acct, stash, 0, 0, TS, blocks)
+		self.assertIsNone(out.result)
+		self.assertEqual(out.blocks, [(6, 'active', 0)])
+		self.assertEqual((acct.state, acct.bcheck), (2, False))
+		self.assertEqual(stash.amount, D('100.00'))
+		self.assertEqual(eng.add(acct, stash, 0, 0, TS).result, (None, 2, None, None))
+
+	def test_unknown(self):
+		eng = AcctEngine({ 1 : _plan() })
+		self.assertEqual(eng.add(None, None, 0, 0, TS).state, 99)
+		self.assertEqual(eng.add(self._account(rate_id=3), StashState(1, '0'), 0, 0, TS).state, 99)
+		self.assertEqual(eng.add(self._account(alias_of_id=1), StashState(1, '0'), 0, 0, TS).state, 2)
+
+class TestRateMods(unittest.TestCase):
+	def _apply(self, gmods, umods, compat):
+		return rate_mods_apply(TS, 1, gmods, umods, D('0.01'), D('0.02'), D('0'), 'in', None, compat=compat)
+
+	def test_compat_double_apply(self):
+		# Last fetched row is applied once more after each cursor runs out,
+		# even when it's the global one and per-user cursor is empty.
+		self.assertEqual(self._apply((_mod(D('2')),), (), True)[0], D('0.08'))
+		self.assertEqual(self._apply((_mod(D('2')),), (), False)[0], D('0.02'))
+		self.assertEqual(self._apply((_mod(D('2')),), (_mod(D('3')),), True)[0], D('0.36'))
+		self.assertEqual(self._apply((_mod(D('2')),), (_mod(D('3')),), False)[0], D('0.06'))
+
+	def test_filters(self):
+		# Wrong rate and out of period modifiers are skipped.
+		night = (None, None, None, 0, None, None, None, None, 6, None)
+		mods = (_mod(D('2'), rate_id=2), _mod(D('3'), period=night))
+		self.assertEqual(self._apply(mods, (), False)[0], D('0.01'))
+		self.assertEqual(self._apply((_mod(None, pol='x'),), (), False)[3], 'in x')
+
+	def test_engine_mods_compat(self):
+		rates = { 1 : _plan(abf=True, mods=(_mod(D('2')),)) }
+		res = []
+		for compat in (True, False):
+			eng = AcctEngine(rates, mods_compat=compat)
+			stash = StashState(1, '100.00')
+			eng.add(self._account(), stash, 100, 0, TS)
+			res.append(stash.amount)
+		self.assertEqual(res, [D('92.00'), D('98.00')])
+
+	def _account(self):
+		return AccountState(10, 1, 1, ut_ingress=1000, qpend=TS + dt.timedelta(hours=1))
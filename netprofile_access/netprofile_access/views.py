@@ -79,7 +79,14 @@ from netprofile_entities.models import (
 	PhysicalEntity
 )
 from netprofile_stashes.models import Stash
-from netprofile_rates.models import Rate
+from netprofile_rates.models import (
+	Rate,
+	RateType
+)
+from netprofile_rates.quota import (
+	funds_last_until,
+	percent_remaining
+)
 
 from .models import (
 	AccessEntity,
@@ -1074,6 +1081,25 @@ def _tpldef_list_accounts(tpldef, req):
 	# FIXME: add classes etc.
 	tpldef['rates'] = sess.query(Rate).filter(Rate.user_selectable == True)
 
+	now = datetime.datetime.now()
+	qp_left = {}
+	funds_until = {}
+	for stash in (tpldef.get('stashes') or ()):
+		plans = []
+		for a in stash.access_entities:
+			rate = a.rate
+			if (a.alias_of_id is not None) or (rate is None) or (a.quota_period_end is None):
+				continue
+			qp_left[a.id] = percent_remaining(rate.quota_period_amount, rate.quota_period_unit, now, a.quota_period_end)
+			if rate.type != RateType.free:
+				plans.append((rate.quota_period_amount, rate.quota_period_unit, a.quota_period_end, rate.quota_sum))
+		funds_until[stash.id] = funds_last_until(
+			stash.amount, stash.credit, plans,
+			until=now + datetime.timedelta(days=366)
+		)
+	tpldef['qp_left'] = qp_left
+	tpldef['funds_until'] = funds_until
+
 @register_hook('core.dpanetabs.access.AccessEntity')
 def _dpane_aent_mods(tabs, model, req):
 	loc = get_localizer(req)
@@ -1106,3 +1132,17 @@ def _dpane_aent_mods(tabs, model, req):
 		'createControllers' : 'NetProfile.core.controller.RelatedWizard'
 	}))
 
+@register_hook('core.metrics')
+def _metrics_acct_poll(metrics, request):
+	from netprofile_access.tasks import (
+		acct_metrics,
+		queue_stats
+	)
+
+	depth, lag = queue_stats(DBSession(), datetime.datetime.now())
+	metrics['acct_poll'] = {
+		'queue_depth' : depth,
+		'lag'         : lag,
+		'last_run'    : acct_metrics(request.registry.settings).status()
+	}
+
@@ -53,6 +53,11 @@ setup(
 	entry_points="""\
 		[netprofile.modules]
 		access = netprofile_access:Module
+		[netprofile.cli.commands]
+		acct ingest = netprofile_access.cli:IngestAccounting
+		acct replay = netprofile_access.cli:ReplayAccounting
+		[netprofile.benchmarks]
+		acct_engine = netprofile_access.bench:run
 	""",
 	message_extractors={'.' : [
 		('**.py', 'python', None),
@@ -183,6 +183,27 @@ class Module(ModuleBase):
 				generator_name='iscbind99',
 				parameter_defaults=bind_defaults,
 				description='ISC BIND DNS server versions 9.9+.'
+			),
+			ServerType(
+				id=8,
+				name='ISC Kea DHCP',
+				generator_name='kea',
+				parameter_defaults={
+					'dhcpv4'     : 'true',
+					'dhcpv6'     : 'false',
+					'interfaces' : '*'
+				},
+				description='ISC Kea DHCPv4 and DHCPv6 server.'
+			),
+			ServerType(
+				id=9,
+				name='Unbound',
+				generator_name='unbound',
+				parameter_defaults={
+					'local_zone_type' : 'transparent',
+					'gen_ptr'         : 'true'
+				},
+				description='Unbound caching DNS resolver.'
 			)
 		)
 
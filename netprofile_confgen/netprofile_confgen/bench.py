@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Config Generation module - Benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import multiprocessing
+import os
+import pkg_resources
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import transaction
+
+from sqlalchemy import (
+	create_engine,
+	event
+)
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import (
+	CreateIndex,
+	CreateTable
+)
+
+from netprofile.bench import BenchResults
+from netprofile.common import (
+	cache,
+	ipaddr
+)
+from netprofile.common.modules import ModuleError
+from netprofile.db.connection import DBSession
+
+_CHUNK = 10000
+_NET_HOSTS = 250
+
+class _Modules(object):
+	"""
+	Module manager stand-in for the generator factory.
+	"""
+	def __init__(self, loaded):
+		self.loaded = loaded
+
+	def assert_loaded(self, *mods):
+		if (len(mods) == 1) and isinstance(mods[0], (list, tuple, set)):
+			mods = mods[0]
+		not_loaded = set(mods) - set(self.loaded)
+		if len(not_loaded) > 0:
+			raise ModuleError('These modules aren\'t loaded, but are required: %s.' % (', '.join(not_loaded),))
+
+def _load_models(loaded, name):
+	# Relationships refer to models of dependent modules by name, so all
+	# of them need to be imported, in the same order module manager uses.
+	if name in loaded:
+		return
+	eps = list(pkg_resources.iter_entry_points('netprofile.modules', name))
+	if len(eps) < 1:
+		raise RuntimeError('Unable to find module \'%s\'.' % (name,))
+	modcls = loaded[name] = eps[0].load()
+	for depmod in modcls.get_deps():
+		_load_models(loaded, depmod)
+	modcls.get_models()
+
+def _create_tables(engine):
+	# Only plain tables and indexes. Comments, triggers and other DDL bound
+	# to table creation are backend-specific and not needed here.
+	from netprofile_confgen.models import (
+		Server,
+		ServerParameter,
+		ServerType
+	)
+	from netprofile_domains.models import (
+		Domain,
+		DomainAlias,
+		DomainServiceType,
+		DomainTXTRecord
+	)
+	from netprofile_hosts.models import (
+		DomainService,
+		Host,
+		HostGroup,
+		Service,
+		ServiceType
+	)
+	from netprofile_ipaddresses.models import (
+		IPv4Address,
+		IPv4ReverseZoneSerial,
+		IPv6Address,
+		IPv6ReverseZoneSerial
+	)
+	from netprofile_networks.models import (
+		Network,
+		NetworkGroup,
+		NetworkService,
+		NetworkServiceType,
+		RoutingTable,
+		RoutingTableEntry
+	)
+
+	with engine.begin() as conn:
+		for model in (
+			Domain, DomainAlias, DomainServiceType, DomainTXTRecord,
+			HostGroup, Host, ServiceType, Service, DomainService,
+			NetworkGroup, RoutingTable, RoutingTableEntry, Network,
+			NetworkServiceType, NetworkService,
+			IPv4Address, IPv6Address,
+			IPv4ReverseZoneSerial, IPv6ReverseZoneSerial,
+			ServerType, Server, ServerParameter
+		):
+			table = model.__table__
+			conn.execute(CreateTable(table))
+			for idx in table.indexes:
+				conn.execute(CreateIndex(idx))
+
+def _insert(sess, model, rows):
+	chunk = []
+	for row in rows:
+		chunk.append(row)
+		if len(chunk) >= _CHUNK:
+			sess.bulk_insert_mappings(model, chunk)
+			chunk = []
+	if len(chunk) > 0:
+		sess.bulk_insert_mappings(model, chunk)
+
+def _populate(sess, hosts, domains):
+	"""
+	Fill database with synthetic inventory. Every host gets an IPv4
+	address, every other one also gets an IPv6 address. Host 1 runs DNS
+	and is the name server of all domains, host 2 runs DHCP.
+	"""
+	from netprofile_confgen.models import (
+		Server,
+		ServerType
+	)
+	from netprofile_domains.models import (
+		Domain,
+		DomainServiceType
+	)
+	from netprofile_hosts.models import (
+		DomainService,
+		Host,
+		HostGroup
+	)
+	from netprofile_ipaddresses.models import (
+		IPv4Address,
+		IPv4ReverseZoneSerial,
+		IPv6Address,
+		IPv6ReverseZoneSerial
+	)
+	from netprofile_networks.models import (
+		Network,
+		NetworkGroup,
+		NetworkService,
+		NetworkServiceType,
+		RoutingTable,
+		RoutingTableEntry
+	)
+
+	now = datetime.datetime.now().replace(microsecond=0)
+	today = now.date()
+	nets = (hosts + _NET_HOSTS - 1) // _NET_HOSTS
+	net4 = int(ipaddr.IPv4Address('10.0.0.0'))
+	net6 = int(ipaddr.IPv6Address('2001:db8::'))
+
+	_insert(sess, DomainServiceType, (
+		{ 'id' : 1, 'name' : 'Primary Name Server' },
+		{ 'id' : 2, 'name' : 'Secondary Name Server' },
+		{ 'id' : 3, 'name' : 'Primary Mail Server' },
+		{ 'id' : 4, 'name' : 'Secondary Mail Server' },
+		{ 'id' : 5, 'name' : 'Default Host' }
+	))
+	_insert(sess, NetworkServiceType, (
+		{ 'id' : 1, 'name' : 'Name Server' },
+		{ 'id' : 4, 'name' : 'Gateway' }
+	))
+	_insert(sess, HostGroup, ({ 'id' : 1, 'name' : 'Benchmark' },))
+	_insert(sess, ServerType, (
+		{ 'id' : 1, 'name' : 'ISC DHCP 3+', 'generator_name' : 'iscdhcp' },
+		{ 'id' : 2, 'name' : 'ISC BIND 9.0-9.2', 'generator_name' : 'iscbind9' },
+		{ 'id' : 8, 'name' : 'ISC Kea DHCP', 'generator_name' : 'kea' },
+		{ 'id' : 9, 'name' : 'Unbound', 'generator_name' : 'unbound' }
+	))
+	_insert(sess, Domain, ({
+		'id'          : i + 1,
+		'name'        : 'zone%d.example' % (i + 1),
+		'serial_date' : today
+	} for i in range(domains)))
+
+	_insert(sess, RoutingTable, ({ 'id' : 1, 'name' : 'Benchmark' },))
+	_insert(sess, RoutingTableEntry, ({
+		'id'       : 1,
+		'table_id' : 1,
+		'network'  : ipaddr.IPv4Address('192.168.0.0'),
+		'cidr'     : 16
+	},))
+	groups = max(1, nets // 16)
+	_insert(sess, NetworkGroup, ({
+		'id'   : i + 1,
+		'name' : 'group%d' % (i + 1)
+	} for i in range(groups)))
+	_insert(sess, Network, ({
+		'id'               : i + 1,
+		'name'             : 'net%d' % (i + 1),
+		'domain_id'        : (i % domains) + 1,
+		'group_id'         : ((i % groups) + 1) if (i % 4 == 0) else None,
+		'routing_table_id' : 1 if (i % 8 == 0) else None,
+		'ipv4_address'     : net4 + (i << 8),
+		'ipv4_cidr'        : 24,
+		'ipv6_address'     : ipaddr.IPv6Address(net6 + (i << 64)),
+		'ipv6_cidr'        : 64
+	} for i in range(nets)))
+	_insert(sess, IPv4ReverseZoneSerial, ({
+		'id'           : i + 1,
+		'ipv4_address' : ipaddr.IPv4Address(net4 + (i << 8)),
+		'date'         : today
+	} for i in range(nets)))
+	_insert(sess, IPv6ReverseZoneSerial, ({
+		'id'           : i + 1,
+		'ipv6_address' : ipaddr.IPv6Address(net6 + (i << 64)),
+		'date'         : today
+	} for i in range(nets)))
+
+	_insert(sess, Host, ({
+		'id'                : i + 1,
+		'name'              : 'host%d' % (i + 1),
+		'group_id'          : 1,
+		'entity_id'         : 1,
+		'domain_id'         : (i % domains) + 1,
+		'modification_time' : now
+	} for i in range(hosts)))
+	_insert(sess, IPv4Address, ({
+		'id'               : i + 1,
+		'host_id'          : i + 1,
+		'network_id'       : (i // _NET_HOSTS) + 1,
+		'offset'           : (i % _NET_HOSTS) + 2,
+		'hardware_address' : '02:00:%02x:%02x:%02x:%02x' % (
+			(i >> 24) & 0xff,
+			(i >> 16) & 0xff,
+			(i >> 8) & 0xff,
+			i & 0xff
+		)
+	} for i in range(hosts)))
+	_insert(sess, IPv6Address, ({
+		'id'               : i // 2 + 1,
+		'host_id'          : i + 1,
+		'network_id'       : (i // _NET_HOSTS) + 1,
+		'offset'           : (i % _NET_HOSTS) + 2,
+		'hardware_address' : '02:00:%02x:%02x:%02x:%02x' % (
+			(i >> 24) & 0xff,
+			(i >> 16) & 0xff,
+			(i >> 8) & 0xff,
+			i & 0xff
+		)
+	} for i in range(0, hosts, 2)))
+	_insert(sess, NetworkService, ({
+		'id'         : i + 1,
+		'network_id' : (i // 2) + 1,
+		'host_id'    : 1 if (i % 2 == 0) else (i // 2) * _NET_HOSTS + 1,
+		'type_id'    : 1 if (i % 2 == 0) else 4
+	} for i in range(nets * 2)))
+	_insert(sess, DomainService, ({
+		'id'        : i + 1,
+		'domain_id' : (i // 3) + 1,
+		'host_id'   : 1 if (i % 3 == 0) else min(hosts, (i // 3) + 1),
+		'type_id'   : (1, 3, 5)[i % 3]
+	} for i in range(domains * 3)))
+
+	_insert(sess, Server, (
+		{ 'id' : 1, 'host_id' : 1, 'type_id' : 2 },
+		{ 'id' : 2, 'host_id' : min(hosts, 2), 'type_id' : 1 },
+		{ 'id' : 3, 'host_id' : min(hosts, 2), 'type_id' : 8 },
+		{ 'id' : 4, 'host_id' : 1, 'type_id' : 9 }
+	))
+
+class _QueryCounter(object):
+	def __init__(self, engine):
+		self.count = 0
+		event.listen(engine, 'before_cursor_execute', self)
+
+	def __call__(self, *args, **kwargs):
+		self.count += 1
+
+def _reset_peak_rss():
+	# Linux lets a process reset its own high water mark.
+	try:
+		with open('/proc/self/clear_refs', 'w') as fd:
+			fd.write('5')
+	except (IOError, OSError):
+		pass
+
+def _peak_rss():
+	"""
+	Peak resident set size in KiB.
+	"""
+	try:
+		with open('/proc/self/status', 'r') as fd:
+			for line in fd:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1])
+	except (IOError, OSError):
+		pass
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _generate(cfg, mm, srv_id, processes, queries):
+	from netprofile_confgen.gen import ConfigGeneratorFactory
+	from netprofile_confgen.models import Server
+
+	_reset_peak_rss()
+	queries.count = 0
+	factory = ConfigGeneratorFactory(cfg, mm)
+	try:
+		srv = DBSession().query(Server).get(srv_id)
+		ts = time.perf_counter()
+		factory.generate([srv], processes)
+		gen_time = time.perf_counter() - ts
+		ts = time.perf_counter()
+		factory.deploy()
+		dep_time = time.perf_counter() - ts
+	finally:
+		factory.restore_umask()
+		transaction.abort()
+	return (gen_time, dep_time, queries.count, _peak_rss())
+
+def _child_main(conn, func, args):
+	try:
+		conn.send((True, func(*args)))
+	except Exception:
+		conn.send((False, traceback.format_exc()))
+	conn.close()
+
+def _run_child(func, *args):
+	"""
+	Run a function in a forked process, so that peak memory use of one
+	case doesn't hide that of another. Database connections must be closed
+	beforehand.
+	"""
+	recv_conn, send_conn = multiprocessing.Pipe(False)
+	proc = multiprocessing.get_context('fork').Process(
+		target=_child_main,
+		args=(send_conn, func, args)
+	)
+	proc.start()
+	send_conn.close()
+	try:
+		ok, ret = recv_conn.recv()
+	except EOFError:
+		ok, ret = False, 'Benchmark process exited with code %s' % (proc.exitcode,)
+	proc.join()
+	if not ok:
+		raise RuntimeError(ret)
+	return ret
+
+def run(app=None, count=1000, domains=None, processes=0):
+	"""
+	Populate a database with a synthetic inventory of a number of hosts,
+	then generate and deploy BIND, ISC DHCP, Kea and Unbound configuration
+	into a temporary directory. Besides wall time, reports the number of
+	queries and peak RSS of each generator run. Every run is done in its
+	own forked process.
+
+	Database is a temporary SQLite file. Only tables used by generators
+	are created, without triggers. Queries of worker processes aren't
+	counted when running in parallel.
+	"""
+	cfg = {}
+	if app is not None:
+		cfg.update(app.app_config.registry.settings)
+	elif cache.cache is None:
+		cache.cache = cache.configure_cache({
+			'netprofile.cache.backend' : 'dogpile.cache.memory'
+		})
+	mm = _Modules({})
+	for moddef in ('core', 'confgen', 'ipaddresses'):
+		_load_models(mm.loaded, moddef)
+
+	res = BenchResults()
+	if domains is None:
+		domains = max(1, count // 500)
+
+	tmpdir = tempfile.mkdtemp(prefix='npbench-')
+	engine = create_engine('sqlite:///' + os.path.join(tmpdir, 'inventory.db'))
+	DBSession.remove()
+	DBSession.configure(bind=engine)
+
+	cfg.update({
+		'netprofile.confgen.deployment_type'     : 'puppet',
+		'netprofile.confgen.files_output_dir'     : os.path.join(tmpdir, 'files'),
+		'netprofile.confgen.templates_output_dir' : os.path.join(tmpdir, 'templates'),
+		'netprofile.confgen.puppet.files_dir'     : os.path.join(tmpdir, 'deploy', 'files'),
+		'netprofile.confgen.puppet.templates_dir' : os.path.join(tmpdir, 'deploy', 'templates')
+	})
+	os.makedirs(cfg['netprofile.confgen.puppet.files_dir'])
+	os.makedirs(cfg['netprofile.confgen.puppet.templates_dir'])
+
+	try:
+		_create_tables(engine)
+		with res.timed('populate (%d hosts, %d domains)' % (count, domains), count):
+			sess = sessionmaker(bind=engine)()
+			_populate(sess, count, domains)
+			sess.commit()
+			sess.close()
+
+		queries = _QueryCounter(engine)
+		for srv_id, label in ((1, 'BIND9'), (2, 'ISC DHCP'), (3, 'Kea'), (4, 'Unbound')):
+			DBSession.remove()
+			engine.dispose()
+			gen_time, dep_time, nqueries, rss = _run_child(
+				_generate,
+				cfg, mm, srv_id, processes, queries
+			)
+			res.add('%s generate' % label, count, gen_time)
+			res.add('%s deploy' % label, count, dep_time)
+			res.add('%s queries' % label, nqueries, 0)
+			res.add('%s peak RSS, KiB' % label, rss, 0)
+	finally:
+		transaction.abort()
+		DBSession.remove()
+		engine.dispose()
+		shutil.rmtree(tmpdir, ignore_errors=True)
+
+	return res
+
+if __name__ == '__main__':
+	count = 1000
+	if len(sys.argv) > 1:
+		count = int(sys.argv[1])
+	print(run(count=count).format())
@@ -28,37 +28,216 @@ from __future__ import (
 )
 
 import collections
+import collections.abc
 import datetime
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing
 import os
 import pkg_resources
 import pyramid_mako
 import shutil
+import time
+import transaction
+
+from concurrent.futures import ProcessPoolExecutor
 
-from itertools import groupby
 from pyramid.decorator import reify
 from pyramid.path import DottedNameResolver
+from mako.runtime import Context
 from mako.template import Template
-from sqlalchemy import (
-	and_,
-	or_
-)
-from sqlalchemy.orm import (
-	attributes,
-	contains_eager,
-	joinedload
-)
+from sqlalchemy.inspection import inspect
 
+from netprofile.common.ipaddr import IPPrefixTrie
 from netprofile.db.connection import DBSession
-from netprofile.db.clauses import Binary16ToDecimal
 from netprofile.db.util import populate_related_list
-from netprofile_confgen.models import (
-	Server,
-	ServerType
-)
+from netprofile_confgen.models import Server
+from netprofile_confgen.snapshot import ConfigSnapshot
 
 logger = logging.getLogger(__name__)
 
+_STATE_FILE = '.confgen_state.json'
+_CHANGESET_FILE = '.confgen_changeset.json'
+_NOW_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def _digest(*parts):
+	h = hashlib.sha1()
+	for part in parts:
+		if not isinstance(part, bytes):
+			part = json.dumps(part, default=str, sort_keys=True).encode('utf-8')
+		h.update(part)
+	return h.hexdigest()
+
+def _make_dir(path):
+	try:
+		os.mkdir(path, 0o750)
+	except OSError:
+		# Might have been created by another worker process.
+		if not os.path.isdir(path):
+			raise
+
+def _file_digest(path):
+	h = hashlib.sha1()
+	with open(path, 'rb') as fd:
+		for chunk in iter(lambda: fd.read(65536), b''):
+			h.update(chunk)
+	return h.digest()
+
+def _move_tree(src_path, dep_path):
+	dep_path_old = dep_path + '.confgen_old'
+	dep_path_new = dep_path + '.confgen_new'
+	if os.path.exists(dep_path_new):
+		shutil.rmtree(dep_path_new)
+	shutil.move(src_path, dep_path_new)
+	if os.path.exists(dep_path):
+		if os.path.exists(dep_path_old):
+			shutil.rmtree(dep_path_old)
+		shutil.move(dep_path, dep_path_old)
+	shutil.move(dep_path_new, dep_path)
+
+def _sync_tree(src_path, dep_path):
+	"""
+	Update deployed directory to match the generated one, leaving files
+	with unchanged contents as they are. Each file is replaced atomically.
+	Returns a dictionary of added, changed and removed relative paths, or
+	None if nothing changed.
+	"""
+	added = []
+	changed = []
+	removed = []
+	seen = set()
+
+	for dirpath, dirnames, filenames in os.walk(src_path):
+		reldir = os.path.relpath(dirpath, src_path)
+		depdir = os.path.normpath(os.path.join(dep_path, reldir))
+		if not os.path.isdir(depdir):
+			if os.path.lexists(depdir):
+				os.unlink(depdir)
+			os.makedirs(depdir, 0o750)
+		for fname in filenames:
+			relpath = os.path.normpath(os.path.join(reldir, fname))
+			src_file = os.path.join(dirpath, fname)
+			dep_file = os.path.join(depdir, fname)
+			seen.add(relpath)
+			if os.path.isfile(dep_file):
+				if (os.path.getsize(src_file) == os.path.getsize(dep_file)) and (_file_digest(src_file) == _file_digest(dep_file)):
+					continue
+				changed.append(relpath)
+			else:
+				if os.path.isdir(dep_file):
+					shutil.rmtree(dep_file)
+				added.append(relpath)
+			shutil.copy2(src_file, dep_file + '.confgen_new')
+			os.replace(dep_file + '.confgen_new', dep_file)
+
+	for dirpath, dirnames, filenames in os.walk(dep_path, topdown=False):
+		reldir = os.path.relpath(dirpath, dep_path)
+		for fname in filenames:
+			relpath = os.path.normpath(os.path.join(reldir, fname))
+			if relpath not in seen:
+				os.unlink(os.path.join(dirpath, fname))
+				removed.append(relpath)
+		if (reldir != os.curdir) and (not os.path.isdir(os.path.join(src_path, reldir))) and (len(os.listdir(dirpath)) == 0):
+			os.rmdir(dirpath)
+
+	if not (added or changed or removed):
+		return None
+	return {
+		'added'   : sorted(added),
+		'changed' : sorted(changed),
+		'removed' : sorted(removed)
+	}
+
+class _HashingWriter(object):
+	"""
+	Output buffer for Mako that encodes rendered text straight into a
+	file, updating a digest on the way.
+	"""
+	def __init__(self, fd, digest):
+		self.fd = fd
+		self.digest = digest
+
+	def write(self, text):
+		if not isinstance(text, bytes):
+			text = text.encode('utf-8')
+		self.digest.update(text)
+		self.fd.write(text)
+
+def _render_file(path, tpl, param, tpl_id):
+	# Same value as _digest(tpl_id, rendered_data), without keeping the
+	# whole file in memory.
+	h = hashlib.sha1(json.dumps(tpl_id, default=str, sort_keys=True).encode('utf-8'))
+	with open(path, 'wb') as fd:
+		tpl.render_context(Context(_HashingWriter(fd, h), **param))
+	return h.hexdigest()
+
+def _template_id(tpl):
+	mtime = None
+	if tpl.filename and os.path.isfile(tpl.filename):
+		mtime = os.path.getmtime(tpl.filename)
+	return (tpl.uri, mtime)
+
+# Template lookups outlive generator factories, so that templates are
+# compiled once per process.
+_template_lookups = {}
+
+def get_template_lookup(cfg):
+	"""
+	Get process-wide template lookup for given settings.
+
+	Compiled template modules are stored in netprofile.confgen.module_directory
+	or, if unset, in mako.module_directory. Templates are recompiled when
+	their source files change.
+	"""
+	name_resolver = DottedNameResolver()
+	lookup_opts = pyramid_mako.parse_options_from_settings(
+		cfg,
+		'mako.',
+		name_resolver.maybe_resolve
+	)
+
+	lookup_opts.update({
+		'output_encoding'   : 'utf8',
+		'default_filters'   : ['str'],
+		'filesystem_checks' : True
+	})
+	module_dir = cfg.get('netprofile.confgen.module_directory')
+	if module_dir:
+		lookup_opts['module_directory'] = os.path.abspath(module_dir)
+
+	key = repr(sorted(lookup_opts.items()))
+	lookup = _template_lookups.get(key)
+	if lookup is None:
+		lookup = _template_lookups[key] = pyramid_mako.PkgResourceTemplateLookup(**lookup_opts)
+	return lookup
+
+def warm_templates(cfg):
+	"""
+	Compile templates of all registered configuration generators.
+
+	Returns number of templates loaded.
+	"""
+	lookup = get_template_lookup(cfg)
+	uris = set()
+	for ep in pkg_resources.iter_entry_points('netprofile.confgen.generators'):
+		try:
+			gen_class = ep.load()
+		except ImportError as e:
+			logger.error('Unable to load configuration generator class "%s": %s', ep.name, str(e))
+			continue
+		uris.update(gen_class.templates)
+	count = 0
+	for uri in sorted(uris):
+		try:
+			lookup.get_template(uri)
+		except Exception as e:
+			logger.error('Unable to compile template "%s": %s', uri, str(e))
+			continue
+		count += 1
+	return count
+
 class DeploymentTemplateLanguage(object):
 	pass
 
@@ -88,12 +267,17 @@ class ERBTemplateLanguage(DeploymentTemplateLanguage):
 		return '.erb'
 
 class ConfigGeneratorFactory(object):
-	def __init__(self, cfg, mmgr):
+	def __init__(self, cfg, mmgr, incremental=False):
 		self.cfg = cfg
 		self._gen = {}
 		self.mm = mmgr
+		self.incremental = incremental
 		self.deploy_files = set()
 		self.deploy_templates = set()
+		self.unchanged = set()
+		self.changeset = {}
+		self.new_state = {}
+		self.now = datetime.datetime.now().replace(microsecond=0)
 		self.orig_umask = os.umask(0o027)
 
 	@reify
@@ -139,18 +323,98 @@ class ConfigGeneratorFactory(object):
 
 	@reify
 	def mako_lookup(self):
-		name_resolver = DottedNameResolver()
-		lookup_opts = pyramid_mako.parse_options_from_settings(
-			self.cfg,
-			'mako.',
-			name_resolver.maybe_resolve
-		)
+		return get_template_lookup(self.cfg)
+
+	@reify
+	def state_file(self):
+		return os.path.join(self.outdir_files, _STATE_FILE)
+
+	@reify
+	def state(self):
+		"""
+		Input fingerprints of deployed files, stored as a mapping of
+		{ kind : { host : { path : [fingerprint, time] } } }.
+		"""
+		try:
+			with open(self.state_file, 'r') as fd:
+				return json.load(fd)
+		except (IOError, OSError, ValueError):
+			return {}
+
+	def save_state(self):
+		tmp_path = self.state_file + '.tmp'
+		with open(tmp_path, 'w') as fd:
+			json.dump(self.state, fd, sort_keys=True)
+		os.replace(tmp_path, self.state_file)
+
+	def _artifact(self, path):
+		for kind, outdir, depdir in (
+			('files', self.outdir_files, self.depdir_files),
+			('templates', self.outdir_templates, self.depdir_templates)
+		):
+			relpath = os.path.relpath(path, outdir)
+			if relpath.startswith(os.pardir):
+				continue
+			host_name, relpath = relpath.split(os.sep, 1)
+			dep_path = None
+			if depdir is not None:
+				dep_path = os.path.join(depdir, host_name, relpath)
+			return (kind, host_name, relpath, dep_path)
+		raise RuntimeError('Path "%s" is outside of confgen output directories.' % (path,))
 
-		lookup_opts.update({
-			'output_encoding' : 'utf8',
-			'default_filters' : ['str']
-		})
-		return pyramid_mako.PkgResourceTemplateLookup(**lookup_opts)
+	def render(self, path, tpl, param, inputs=None, prepare=None):
+		"""
+		Render template into a file, recording a fingerprint of its inputs.
+
+		If inputs are given, they must change whenever the rendered file
+		would. In incremental mode the file is then copied from the last
+		deployed configuration instead of rendering it again. Otherwise the
+		fingerprint is taken from rendered contents, with generation time
+		set to the one of the deployed file.
+
+		Optional prepare callable is run before rendering. Returns True if
+		the file was changed.
+		"""
+		kind, host_name, relpath, dep_path = self._artifact(path)
+		old = self.state.get(kind, {}).get(host_name, {}).get(relpath)
+		if (dep_path is None) or not os.path.isfile(dep_path):
+			old = None
+		tpl_id = _template_id(tpl)
+		now = param.get('now')
+		record = None
+
+		if inputs is not None:
+			record = [_digest(tpl_id, inputs), None]
+			if self.incremental and (old is not None) and (old[0] == record[0]):
+				shutil.copy2(dep_path, path)
+				self.new_state.setdefault(kind, {}).setdefault(host_name, {})[relpath] = old
+				return False
+		elif self.incremental and (old is not None) and old[1] and (now is not None):
+			param['now'] = datetime.datetime.strptime(old[1], _NOW_FORMAT)
+			try:
+				if prepare:
+					prepare()
+					prepare = None
+				digest = _render_file(path, tpl, param, tpl_id)
+			finally:
+				param['now'] = now
+			if digest == old[0]:
+				self.new_state.setdefault(kind, {}).setdefault(host_name, {})[relpath] = old
+				return False
+
+		if prepare:
+			prepare()
+		digest = _render_file(path, tpl, param, tpl_id)
+		if record is None:
+			record = [digest, None]
+			if now is not None:
+				record[1] = now.strftime(_NOW_FORMAT)
+		self.new_state.setdefault(kind, {}).setdefault(host_name, {})[relpath] = record
+		return True
+
+	@reify
+	def snapshot(self):
+		return ConfigSnapshot()
 
 	def restore_umask(self):
 		os.umask(self.orig_umask)
@@ -161,18 +425,18 @@ class ConfigGeneratorFactory(object):
 		if not os.path.isdir(srvdir):
 			if os.path.exists(srvdir):
 				raise RuntimeError('File output path for host "%s" exists but is not a directory.' % (host_name,))
-			os.mkdir(srvdir, 0o750)
+			_make_dir(srvdir)
 		srvdir = os.path.join(srvdir, srv.type.generator_name)
 		if not os.path.isdir(srvdir):
 			if os.path.exists(srvdir):
 				raise RuntimeError('File output path for host "%s" module "%s" exists but is not a directory.' % (host_name, srv.type.generator_name))
-			os.mkdir(srvdir, 0o750)
+			_make_dir(srvdir)
 		if xdir is not None:
 			srvdir = os.path.join(srvdir, xdir)
 			if not os.path.isdir(srvdir):
 				if os.path.exists(srvdir):
 					raise RuntimeError('File output path for host "%s" module "%s" directory "%s" exists but is not a directory.' % (host_name, srv.type.generator_name, xdir))
-				os.mkdir(srvdir, 0o750)
+				_make_dir(srvdir)
 		self.deploy_files.add(host_name)
 		return srvdir
 
@@ -182,18 +446,18 @@ class ConfigGeneratorFactory(object):
 		if not os.path.isdir(srvdir):
 			if os.path.exists(srvdir):
 				raise RuntimeError('Template output path for host "%s" exists but is not a directory.' % (host_name,))
-			os.mkdir(srvdir, 0o750)
+			_make_dir(srvdir)
 		srvdir = os.path.join(srvdir, srv.type.generator_name)
 		if not os.path.isdir(srvdir):
 			if os.path.exists(srvdir):
 				raise RuntimeError('Template output path for host "%s" module "%s" exists but is not a directory.' % (host_name, srv.type.generator_name))
-			os.mkdir(srvdir, 0o750)
+			_make_dir(srvdir)
 		if xdir is not None:
 			srvdir = os.path.join(srvdir, xdir)
 			if not os.path.isdir(srvdir):
 				if os.path.exists(srvdir):
 					raise RuntimeError('Template output path for host "%s" module "%s" directory "%s" exists but is not a directory.' % (host_name, srv.type.generator_name, xdir))
-				os.mkdir(srvdir, 0o750)
+				_make_dir(srvdir)
 		self.deploy_templates.add(host_name)
 		return srvdir
 
@@ -210,55 +474,251 @@ class ConfigGeneratorFactory(object):
 			self._gen[gen_name] = gen
 		return self._gen[gen_name]
 
+	def _is_unchanged(self, kind, host_name):
+		if not self.incremental:
+			return False
+		new = self.new_state.get(kind, {}).get(host_name)
+		return new == self.state.get(kind, {}).get(host_name)
+
+	def generate(self, servers, processes=0, chunk_size=50, progress=None):
+		"""
+		Generate configuration for a list of servers.
+
+		If processes is not zero, work units of all servers are split into
+		chunks and generated in a pool of worker processes, each with its
+		own database connection. Current transaction is committed before
+		starting the pool.
+
+		If progress callable is given, it is called with server ID, number
+		of generated units and total number of units for that server, each
+		time some units are done.
+
+		Returns a dictionary of total generation time per generator.
+		"""
+		timings = collections.defaultdict(float)
+		if not processes:
+			for srv in servers:
+				gen = self.get(srv.type.generator_name)
+				logger.info('Generating config of type %s for host %s', srv.type.generator_name, str(srv.host))
+				ts = time.time()
+				units = gen.get_units(srv)
+				for done, unit in enumerate(units, 1):
+					gen.generate(srv, unit)
+					if progress is not None:
+						progress(srv.id, done, len(units))
+				timings[gen.name] += time.time() - ts
+			return timings
+
+		jobs = []
+		totals = {}
+		parts = set()
+		for srv in servers:
+			gen = self.get(srv.type.generator_name)
+			parts.update(gen.snapshot_parts)
+			units = gen.get_units(srv)
+			logger.info('Generating config of type %s for host %s in %d unit(s)', srv.type.generator_name, str(srv.host), len(units))
+			totals[srv.id] = len(units)
+			for i in range(0, len(units), chunk_size):
+				jobs.append((srv.id, units[i:i + chunk_size]))
+		done = dict.fromkeys(totals, 0)
+		# Load fingerprints and snapshot before forking, so that workers
+		# share them instead of querying on their own.
+		self.state
+		for part in sorted(parts):
+			getattr(self.snapshot, part)
+
+		# Workers must not inherit open database connections. Loaded objects
+		# are kept unexpired, so that workers can attach them to their own
+		# sessions.
+		sess = DBSession()
+		engine = sess.get_bind()
+		expire_on_commit = sess.expire_on_commit
+		sess.expire_on_commit = False
+		try:
+			transaction.commit()
+		finally:
+			sess.expire_on_commit = expire_on_commit
+		engine.dispose()
+
+		global _pool_factory
+		_pool_factory = self
+		try:
+			with ProcessPoolExecutor(
+				max_workers=processes,
+				mp_context=multiprocessing.get_context('fork'),
+				initializer=_init_worker
+			) as pool:
+				results = pool.map(_generate_chunk, jobs)
+				for (srv_id, units), result in zip(jobs, results):
+					gen_name, new_state, files, templates, elapsed = result
+					for kind, hosts in new_state.items():
+						for host_name, records in hosts.items():
+							self.new_state.setdefault(kind, {}).setdefault(host_name, {}).update(records)
+					self.deploy_files.update(files)
+					self.deploy_templates.update(templates)
+					timings[gen_name] += elapsed
+					done[srv_id] += len(units)
+					if progress is not None:
+						progress(srv_id, done[srv_id], totals[srv_id])
+		finally:
+			_pool_factory = None
+		return timings
+
+	@reify
+	def deploy_mode(self):
+		mode = self.cfg.get('netprofile.confgen.deploy_mode', 'move')
+		if mode not in ('move', 'sync'):
+			raise RuntimeError('Unknown confgen deployment mode: %s.' % (mode,))
+		return mode
+
+	def _deploy_dirs(self, kind):
+		if kind == 'files':
+			return (self.outdir_files, self.depdir_files)
+		return (self.outdir_templates, self.depdir_templates)
+
 	def deploy(self):
-		for host_name in self.deploy_files:
-			src_path = os.path.join(self.outdir_files, host_name)
-			dep_path = os.path.join(self.depdir_files, host_name)
-			dep_path_old = dep_path + '.confgen_old'
-			dep_path_new = dep_path + '.confgen_new'
-			if os.path.exists(dep_path_new):
-				shutil.rmtree(dep_path_new)
-			shutil.move(src_path, dep_path_new)
-			if os.path.exists(dep_path):
-				if os.path.exists(dep_path_old):
-					shutil.rmtree(dep_path_old)
-				shutil.move(dep_path, dep_path_old)
-			shutil.move(dep_path_new, dep_path)
-		for host_name in self.deploy_templates:
-			src_path = os.path.join(self.outdir_templates, host_name)
-			dep_path = os.path.join(self.depdir_templates, host_name)
-			dep_path_old = dep_path + '.confgen_old'
-			dep_path_new = dep_path + '.confgen_new'
-			if os.path.exists(dep_path_new):
-				shutil.rmtree(dep_path_new)
-			shutil.move(src_path, dep_path_new)
-			if os.path.exists(dep_path):
-				if os.path.exists(dep_path_old):
-					shutil.rmtree(dep_path_old)
-				shutil.move(dep_path, dep_path_old)
-			shutil.move(dep_path_new, dep_path)
-		ret = self.deploy_files.union(self.deploy_templates)
+		"""
+		Move generated configuration into deployment directories.
+
+		In "move" mode, output directory of each host replaces the deployed
+		one. In "sync" mode, only new and changed files are written, and
+		files that weren't generated are removed. The list of affected
+		files is then stored in the changeset attribute and in a JSON file
+		next to generated files.
+
+		Returns a set of deployed host names.
+		"""
+		ret = set()
+		self.changeset = {}
+		for kind, hosts in (
+			('files', self.deploy_files),
+			('templates', self.deploy_templates)
+		):
+			if len(hosts) == 0:
+				continue
+			outdir, depdir = self._deploy_dirs(kind)
+			for host_name in hosts:
+				src_path = os.path.join(outdir, host_name)
+				dep_path = os.path.join(depdir, host_name)
+				if self._is_unchanged(kind, host_name):
+					shutil.rmtree(src_path)
+					continue
+				if self.deploy_mode == 'sync':
+					changes = _sync_tree(src_path, dep_path)
+					shutil.rmtree(src_path)
+					if changes is None:
+						continue
+					self.changeset.setdefault(host_name, {})[kind] = changes
+				else:
+					_move_tree(src_path, dep_path)
+				ret.add(host_name)
+
+		for kind, hosts in self.new_state.items():
+			self.state.setdefault(kind, {}).update(hosts)
+		if len(self.new_state) > 0:
+			self.save_state()
+		if self.deploy_mode == 'sync':
+			self.save_changeset()
+		self.unchanged = self.deploy_files.union(self.deploy_templates).difference(ret)
 		self.deploy_files = set()
 		self.deploy_templates = set()
+		self.new_state = {}
 		return ret
 
+	def save_changeset(self):
+		path = os.path.join(self.outdir_files, _CHANGESET_FILE)
+		with open(path + '.tmp', 'w') as fd:
+			json.dump({
+				'time'  : self.now.strftime(_NOW_FORMAT),
+				'hosts' : self.changeset
+			}, fd, indent=1, sort_keys=True)
+		os.replace(path + '.tmp', path)
+
+_pool_factory = None
+
+def _init_worker():
+	DBSession.remove()
+	_pool_factory._gen = {}
+	if 'snapshot' in _pool_factory.__dict__:
+		_pool_factory.snapshot.attach(DBSession())
+
+def _generate_chunk(job):
+	srv_id, units = job
+	factory = _pool_factory
+	factory.new_state = {}
+	factory.deploy_files = set()
+	factory.deploy_templates = set()
+
+	srv = DBSession().query(Server).get(srv_id)
+	gen = factory.get(srv.type.generator_name)
+	ts = time.time()
+	for unit in units:
+		gen.generate(srv, unit)
+	return (
+		gen.name,
+		factory.new_state,
+		factory.deploy_files,
+		factory.deploy_templates,
+		time.time() - ts
+	)
+
 class ConfigGenerator(object):
+	# Templates to compile at worker startup.
+	templates = ()
+	# Snapshot parts to load before forking worker processes.
+	snapshot_parts = ()
+
 	def __init__(self, factory, name):
 		self.confgen = factory
 		self.name = name
 
-	def generate(self, srv):
+	def server_inputs(self, srv):
+		"""
+		Server settings that affect every generated file.
+		"""
+		return (
+			self.name,
+			str(srv.host),
+			srv.type.parameter_defaults,
+			sorted((name, param.value) for name, param in srv.parameters.items())
+		)
+
+	def get_units(self, srv):
+		"""
+		Split configuration of a server into parts that can be generated
+		independently, possibly in separate processes. Returns a list of
+		picklable unit descriptions to pass to generate().
+		"""
+		return [None]
+
+	def generate(self, srv, unit=None):
 		pass
 
 class BIND9Generator(ConfigGenerator):
-	@reify
+	templates = (
+		'netprofile_confgen:templates/confgen/named.conf.mak',
+		'netprofile_confgen:templates/confgen/named.zone.mak',
+		'netprofile_confgen:templates/confgen/named.revzone.mak'
+	)
+	snapshot_parts = (
+		'networks',
+		'hosts',
+		'dns_servers',
+		'dns_domain_services',
+		'srv_records'
+	)
+
+	def __init__(self, factory, name):
+		super(BIND9Generator, self).__init__(factory, name)
+		self._zone_services = {}
+
+	@property
 	def dns_srvs(self):
-		return DBSession().query(Server).join(Server.type).filter(ServerType.generator_name.startswith('iscbind')).all()
+		return self.confgen.snapshot.dns_servers
 
-	@reify
+	@property
 	def all_nets(self):
-		from netprofile_networks.models import Network
-		return DBSession().query(Network).all()
+		return self.confgen.snapshot.networks
 
 	@reify
 	def all_ipv4_revzones(self):
@@ -270,10 +730,80 @@ class BIND9Generator(ConfigGenerator):
 		from netprofile_ipaddresses.models import IPv6ReverseZoneSerial
 		return DBSession().query(IPv6ReverseZoneSerial).all()
 
-	@reify
+	@property
 	def dns_domain_services(self):
-		from netprofile_hosts.models import DomainService
-		return DBSession().query(DomainService).options(joinedload(DomainService.domain)).filter(DomainService.type_id.in_((1, 2))).all()
+		return self.confgen.snapshot.dns_domain_services
+
+	def _addr_inputs(self, addrs):
+		return [(str(ip), ip.ttl, ip.visibility) for ip in addrs]
+
+	def _ns_inputs(self, services):
+		return [(dhl.type_id, str(dhl.host)) for dhl in services]
+
+	def zone_inputs(self, srv, domain):
+		"""
+		Everything named.zone.mak reads to render zones of a domain and
+		its aliases.
+		"""
+		from netprofile_hosts.models import HostAliasType
+
+		dhl_inputs = []
+		for dhl in domain.services:
+			addrs = None
+			if dhl.type_id == 5:
+				real = dhl.host.real
+				addrs = (self._addr_inputs(real.ipv4_addresses), self._addr_inputs(real.ipv6_addresses))
+			dhl_inputs.append((dhl.type_id, str(dhl.host), addrs))
+		host_inputs = []
+		for host in self.domain_hosts(domain):
+			addrs = None
+			if (not host.original) or (host.alias_type == HostAliasType.numeric):
+				real = host.real
+				addrs = (self._addr_inputs(real.ipv4_addresses), self._addr_inputs(real.ipv6_addresses))
+			host_inputs.append((
+				host.name,
+				str(host.original) if host.original else None,
+				host.alias_type,
+				addrs
+			))
+		return (
+			self.server_inputs(srv),
+			[(attr.key, getattr(domain, attr.key)) for attr in inspect(domain).mapper.column_attrs],
+			sorted(str(alias) for alias in domain.aliases),
+			dhl_inputs,
+			[
+				(sub.name, sub.enabled, sub.public, self._ns_inputs(sub.services))
+				for sub in domain.children
+			],
+			[
+				(sa.name, sa.domain.enabled, sa.domain.public, self._ns_inputs(sa.domain.services))
+				for sa in domain.children_aliases
+			],
+			[(txt.name, txt.ttl, txt.value) for txt in domain.txt_records],
+			[
+				(rr.visibility, rr.type.record_name, rr.type.start_port, rr.type.end_port, rr.priority, rr.weight, str(rr.host))
+				for rr in self.domain_srv_rr(domain)
+			],
+			host_inputs
+		)
+
+	def revzone_inputs(self, srv, rz):
+		"""
+		Everything named.revzone.mak reads to render a reverse zone.
+		"""
+		from netprofile_ipaddresses.models import IPv4ReverseZoneSerial
+		if isinstance(rz, IPv4ReverseZoneSerial):
+			addrs = self.revzone_ipv4(rz)
+		else:
+			addrs = self.revzone_ipv6(rz)
+		return (
+			self.server_inputs(srv),
+			str(rz),
+			rz.zone_name,
+			str(srv.host.domain),
+			sorted(set(str(xsrv.host) for xsrv in self.dns_srvs)),
+			[(ip.ptr_name, ip.ttl, ip.visibility, str(ip.host)) for ip in addrs]
+		)
 
 	def check_vis(self, ztype, vis):
 		from netprofile_domains.models import ObjectVisibility
@@ -290,60 +820,49 @@ class BIND9Generator(ConfigGenerator):
 		return ''.join(str(ip) + '; ' for ip in ips)
 
 	def domain_srv_rr(self, domain):
-		from netprofile_hosts.models import (
-			Host,
-			Service
-		)
-		return DBSession().query(Service).join(Host).filter(or_(
-			Service.domain_id == domain.id,
-			and_(Service.domain_id == None, Host.domain_id == domain.id)
-		))
+		return self.confgen.snapshot.domain_srv_records(domain)
 
-	def revzone_ipv4(self, rz):
-		from netprofile_networks.models import Network
-		from netprofile_ipaddresses.models import IPv4Address
-		return DBSession().query(IPv4Address).join(IPv4Address.host).join(IPv4Address.network).options(
-			contains_eager(IPv4Address.host),
-			contains_eager(IPv4Address.network)
-		).filter(
-			(Network.ipv4_address + IPv4Address.offset) >= int(rz.ipv4_network.network),
-			(Network.ipv4_address + IPv4Address.offset) <= int(rz.ipv4_network.broadcast)
-		)
+	def _revzone_buckets(self, zones, zone_net, addrs):
+		trie = IPPrefixTrie()
+		for rz in zones:
+			trie.insert(zone_net(rz), rz.id)
+		buckets = {}
+		for ip in addrs:
+			rzid = trie.get(ip.address)
+			if rzid is not None:
+				buckets.setdefault(rzid, []).append(ip)
+		return buckets
 
-	def revzone_ipv6(self, rz):
-		from netprofile_networks.models import Network
-		from netprofile_ipaddresses.models import IPv6Address
-		return DBSession().query(IPv6Address).join(IPv6Address.host).join(IPv6Address.network).options(
-			contains_eager(IPv6Address.host),
-			contains_eager(IPv6Address.network)
-		).filter(
-			(Binary16ToDecimal(Network.ipv6_address) + IPv6Address.offset) >= int(rz.ipv6_network.network),
-			(Binary16ToDecimal(Network.ipv6_address) + IPv6Address.offset) <= int(rz.ipv6_network.broadcast)
+	@reify
+	def ipv4_revzone_addresses(self):
+		"""
+		IPv4 addresses of all hosts, grouped by reverse zone ID.
+		"""
+		return self._revzone_buckets(
+			self.all_ipv4_revzones,
+			lambda rz: rz.ipv4_network,
+			self.confgen.snapshot.ipv4_addresses
 		)
 
-	def domain_hosts(self, domain):
-		from netprofile_hosts.models import Host
-		from netprofile_ipaddresses.models import (
-			IPv4Address,
-			IPv6Address
+	@reify
+	def ipv6_revzone_addresses(self):
+		"""
+		IPv6 addresses of all hosts, grouped by reverse zone ID.
+		"""
+		return self._revzone_buckets(
+			self.all_ipv6_revzones,
+			lambda rz: rz.ipv6_network,
+			self.confgen.snapshot.ipv6_addresses
 		)
 
-		# XXX: this is a hack, but it reduces poor ol' MySQL's crunch time by a factor of 10
-		sess = DBSession()
+	def revzone_ipv4(self, rz):
+		return self.ipv4_revzone_addresses.get(rz.id, ())
 
-		hipv4 = dict((k, list(v)) for k, v in groupby(
-			sess.query(IPv4Address).join(IPv4Address.host).filter(Host.domain_id == domain.id),
-			lambda ip: ip.host_id
-		))
-		hipv6 = dict((k, list(v)) for k, v in groupby(
-			sess.query(IPv6Address).join(IPv6Address.host).filter(Host.domain_id == domain.id),
-			lambda ip: ip.host_id
-		))
+	def revzone_ipv6(self, rz):
+		return self.ipv6_revzone_addresses.get(rz.id, ())
 
-		for host in domain.hosts:
-			attributes.set_committed_value(host, 'ipv4_addresses', hipv4.get(host.id, ()))
-			attributes.set_committed_value(host, 'ipv6_addresses', hipv6.get(host.id, ()))
-		return domain.hosts
+	def domain_hosts(self, domain):
+		return self.confgen.snapshot.domain_hosts(domain)
 
 	def dkim_flags(self, domain):
 		flags = []
@@ -357,7 +876,13 @@ class BIND9Generator(ConfigGenerator):
 
 	def generate_zone(self, param, ds, dname, outdir, tpl, split_dns=False, is_root=False):
 		if is_root:
-			param['hosts'] = self.domain_hosts(ds.domain)
+			param.pop('hosts', None)
+		inputs = self.zone_inputs(param['srv'], ds.domain)
+
+		def _prepare():
+			if 'hosts' not in param:
+				param['hosts'] = self.domain_hosts(ds.domain)
+
 		if split_dns:
 			param.update({
 				'domain'   : ds.domain,
@@ -365,11 +890,9 @@ class BIND9Generator(ConfigGenerator):
 				'service'  : ds,
 				'zonetype' : 'internal'
 			})
-			with open(os.path.join(outdir, dname + '.internal.zone'), 'wb') as fd:
-				fd.write(tpl.render(**param))
+			self.confgen.render(os.path.join(outdir, dname + '.internal.zone'), tpl, param, inputs, _prepare)
 			param['zonetype'] = 'external'
-			with open(os.path.join(outdir, dname + '.external.zone'), 'wb') as fd:
-				fd.write(tpl.render(**param))
+			self.confgen.render(os.path.join(outdir, dname + '.external.zone'), tpl, param, inputs, _prepare)
 		else:
 			param.update({
 				'domain'   : ds.domain,
@@ -377,8 +900,7 @@ class BIND9Generator(ConfigGenerator):
 				'service'  : ds,
 				'zonetype' : 'generic'
 			})
-			with open(os.path.join(outdir, dname + '.generic.zone'), 'wb') as fd:
-				fd.write(tpl.render(**param))
+			self.confgen.render(os.path.join(outdir, dname + '.generic.zone'), tpl, param, inputs, _prepare)
 
 		if is_root:
 			for alias in ds.domain.aliases:
@@ -393,76 +915,101 @@ class BIND9Generator(ConfigGenerator):
 		else:
 			param['rztype'] = 6
 			net = rz.ipv6_network
+		inputs = self.revzone_inputs(param['srv'], rz)
 
 		if split_dns:
 			param['zonetype'] = 'internal'
-			with open(os.path.join(outdir, rz.zone_filename + '.internal.zone'), 'wb') as fd:
-				fd.write(tpl.render(**param))
+			self.confgen.render(os.path.join(outdir, rz.zone_filename + '.internal.zone'), tpl, param, inputs)
 			if (not net.is_private) and (not net.is_link_local) and (not net.is_loopback) and (not net.is_reserved):
 				param['zonetype'] = 'external'
-				with open(os.path.join(outdir, rz.zone_filename + '.external.zone'), 'wb') as fd:
-					fd.write(tpl.render(**param))
+				self.confgen.render(os.path.join(outdir, rz.zone_filename + '.external.zone'), tpl, param, inputs)
 		else:
 			param['zonetype'] = 'generic'
-			with open(os.path.join(outdir, rz.zone_filename + '.generic.zone'), 'wb') as fd:
-				fd.write(tpl.render(**param))
+			self.confgen.render(os.path.join(outdir, rz.zone_filename + '.generic.zone'), tpl, param, inputs)
+
+	@reify
+	def revzones(self):
+		ret = dict((('revzone4', rz.id), rz) for rz in self.all_ipv4_revzones)
+		ret.update((('revzone6', rz.id), rz) for rz in self.all_ipv6_revzones)
+		return ret
+
+	def zone_services(self, srv):
+		if srv.id not in self._zone_services:
+			self._zone_services[srv.id] = dict(
+				(ds.id, ds)
+				for ds in srv.host.domain_services
+				if ds.type_id == 1
+			)
+		return self._zone_services[srv.id]
 
-	def generate(self, srv):
+	def get_units(self, srv):
 		self.confgen.mm.assert_loaded('ipaddresses')
-		deptpl = self.confgen.deptpl()
-		files_dir = self.confgen.srvdir_files(srv)
-		tpl_dir = self.confgen.srvdir_templates(srv)
+		self.confgen.srvdir_files(srv)
+		self.confgen.srvdir_templates(srv)
+		self.confgen.srvdir_files(srv, 'pri')
+		units = [('conf', None)]
+		units.extend(('zone', ds_id) for ds_id in sorted(self.zone_services(srv)))
+		if srv.get_bool_param('gen_revzones', True):
+			self.confgen.srvdir_files(srv, 'rev')
+			units.extend(('revzone4', rz.id) for rz in self.all_ipv4_revzones)
+			units.extend(('revzone6', rz.id) for rz in self.all_ipv6_revzones)
+		return units
 
+	def generate(self, srv, unit=None):
+		if unit is None:
+			for unit in self.get_units(srv):
+				self.generate(srv, unit)
+			return
+		kind, obj_id = unit
+		splitdns = srv.get_bool_param('split_dns', False)
 		param = {
-			'now'     : datetime.datetime.now().replace(microsecond=0),
-			'gen'     : self,
-			'srv'     : srv,
-			'deptype' : self.confgen.cfg.get('netprofile.confgen.deployment_type', 'puppet'),
-			'dtpl'    : deptpl
+			'now' : self.confgen.now,
+			'gen' : self,
+			'srv' : srv
 		}
-		conf_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/named.conf.mak')
-		zone_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/named.zone.mak')
-
-		with open(os.path.join(tpl_dir, 'named.conf' + deptpl.file_suffix), 'wb') as fd:
-			fd.write(conf_tpl.render(**param))
 
-		pridir = self.confgen.srvdir_files(srv, 'pri')
-		splitdns = srv.get_bool_param('split_dns', False)
-		for ds in srv.host.domain_services:
-			if ds.type_id != 1:
-				continue
+		if kind in ('conf', 'zone'):
+			deptpl = self.confgen.deptpl()
+			param.update({
+				'deptype' : self.confgen.cfg.get('netprofile.confgen.deployment_type', 'puppet'),
+				'dtpl'    : deptpl
+			})
+		if kind == 'conf':
+			tpl_dir = self.confgen.srvdir_templates(srv)
+			conf_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/named.conf.mak')
+			self.confgen.render(os.path.join(tpl_dir, 'named.conf' + deptpl.file_suffix), conf_tpl, param)
+		elif kind == 'zone':
+			ds = self.zone_services(srv)[obj_id]
+			pridir = self.confgen.srvdir_files(srv, 'pri')
+			zone_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/named.zone.mak')
 			self.generate_zone(param, ds, str(ds.domain), pridir, zone_tpl, splitdns, True)
-
-		if srv.get_bool_param('gen_revzones', True):
-			param = {
-				'now' : datetime.datetime.now().replace(microsecond=0),
-				'gen' : self,
-				'srv' : srv
-			}
+		elif kind in ('revzone4', 'revzone6'):
 			revdir = self.confgen.srvdir_files(srv, 'rev')
 			rev_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/named.revzone.mak')
-
-			for rz in self.all_ipv4_revzones:
-				self.generate_revzone(param, rz, revdir, rev_tpl, splitdns)
-			for rz in self.all_ipv6_revzones:
-				self.generate_revzone(param, rz, revdir, rev_tpl, splitdns)
+			self.generate_revzone(param, self.revzones[unit], revdir, rev_tpl, splitdns)
 
 class ISCDHCPGenerator(ConfigGenerator):
-	@reify
+	templates = (
+		'netprofile_confgen:templates/confgen/dhcpd.ipv4.conf.mak',
+	)
+	snapshot_parts = (
+		'networks',
+		'network_groups'
+	)
+
+	@property
 	def all_nets(self):
-		from netprofile_networks.models import Network
-		return DBSession().query(Network).all()
+		return self.confgen.snapshot.networks
 
-	@reify
+	@property
 	def all_netgroups(self):
-		from netprofile_networks.models import NetworkGroup
-		return DBSession().query(NetworkGroup).all()
+		return self.confgen.snapshot.network_groups
 
 	def host_iplist(self, host, ipv=4):
-		if isinstance(host, collections.Iterable):
+		if isinstance(host, collections.abc.Iterable):
 			return ','.join(self.host_iplist(h, ipv) for h in host)
 		if host.original:
-			return self.host_iplist(host.original)
+			return self.host_iplist(host.original, ipv)
 		if ipv == 4:
 			ips = host.ipv4_addresses
 		else:
@@ -471,16 +1018,15 @@ class ISCDHCPGenerator(ConfigGenerator):
 
 	@property
 	def all_hosts_ipv4(self):
-		from netprofile_hosts.models import Host
-		return DBSession().query(Host).options(joinedload(Host.ipv4_addresses))
+		return self.confgen.snapshot.iter_hosts_ipv4()
 
-	def generate(self, srv):
+	def generate(self, srv, unit=None):
 		self.confgen.mm.assert_loaded('ipaddresses')
 		srvdir = self.confgen.srvdir_files(srv)
 
 		dhcpv6 = srv.get_bool_param('dhcpv6', False)
 		param = {
-			'now'    : datetime.datetime.now().replace(microsecond=0),
+			'now'    : self.confgen.now,
 			'gen'    : self,
 			'srv'    : srv,
 			'dhcpv6' : dhcpv6
@@ -490,6 +1036,275 @@ class ISCDHCPGenerator(ConfigGenerator):
 		else:
 			conf_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/dhcpd.ipv4.conf.mak')
 
-		with open(os.path.join(srvdir, 'dhcpd.conf'), 'wb') as fd:
-			fd.write(conf_tpl.render(**param))
+		self.confgen.render(os.path.join(srvdir, 'dhcpd.conf'), conf_tpl, param)
+
+def _json(obj):
+	return json.dumps(obj, separators=(',', ':'))
+
+class KeaGenerator(ISCDHCPGenerator):
+	templates = (
+		'netprofile_confgen:templates/confgen/kea-dhcp4.conf.mak',
+		'netprofile_confgen:templates/confgen/kea-dhcp6.conf.mak',
+		'netprofile_confgen:templates/confgen/kea.hosts.mak'
+	)
+	snapshot_parts = (
+		'networks',
+		'network_groups',
+		'hosts'
+	)
+
+	def json(self, obj):
+		return _json(obj)
+
+	def families(self, srv):
+		ret = []
+		if srv.get_bool_param('dhcpv4', True):
+			ret.append(4)
+		if srv.get_bool_param('dhcpv6', False):
+			ret.append(6)
+		return ret
+
+	def interfaces(self, srv):
+		return _json(srv.get_param('interfaces', '*').replace(',', ' ').split())
+
+	def subnets(self, ipv):
+		"""
+		Enabled networks with addresses of given family, as a list of
+		shared networks with their subnets and a list of the remaining
+		subnets. Kea rejects subnets that are declared twice.
+		"""
+		attr = 'ipv%d_address' % (ipv,)
+		shared = []
+		grouped = set()
+		for ng in self.all_netgroups:
+			nets = [net for net in ng.networks if net.enabled and getattr(net, attr)]
+			if len(nets) > 0:
+				shared.append((ng, nets))
+				grouped.update(net.id for net in nets)
+		return shared, [
+			net for net in self.all_nets
+			if net.enabled and getattr(net, attr) and (net.id not in grouped)
+		]
+
+	def pools(self, net, ipv):
+		ret = []
+		if ipv == 4:
+			start, end = net.ipv4_guest_start, net.ipv4_guest_end
+			if start and end and (start <= end) and (end <= net.ipv4_network.numhosts):
+				ret.append({ 'pool' : '%s - %s' % (net.ipv4_address + start, net.ipv4_address + end) })
+		else:
+			start, end = net.ipv6_guest_start, net.ipv6_guest_end
+			if start and end and (start <= end) and (end <= net.ipv6_network.numhosts):
+				ret.append({ 'pool' : '%s - %s' % (net.ipv6_address + start, net.ipv6_address + end) })
+		return _json(ret)
+
+	def _options(self, opts, name, hosts, ipv):
+		data = self.host_iplist(hosts, ipv)
+		if data:
+			opts.append({ 'name' : name, 'data' : data })
+
+	def global_option_data(self, srv, ipv):
+		domain = srv.get_param('domain_default', str(srv.host.domain))
+		hosts = [ds.host for ds in srv.host.domain.services if ds.type_id in (1, 2)]
+		opts = []
+		if ipv == 4:
+			opts.append({ 'name' : 'domain-name', 'data' : domain })
+			self._options(opts, 'domain-name-servers', hosts, 4)
+		else:
+			opts.append({ 'name' : 'domain-search', 'data' : domain })
+			self._options(opts, 'dns-servers', hosts, 6)
+		return _json(opts)
+
+	def option_data(self, net, ipv):
+		def svc_hosts(type_id):
+			return [ns.host for ns in net.services if ns.type_id == type_id]
 
+		opts = []
+		if ipv == 6:
+			if net.domain:
+				opts.append({ 'name' : 'domain-search', 'data' : str(net.domain) })
+			self._options(opts, 'dns-servers', svc_hosts(1), 6)
+			self._options(opts, 'sntp-servers', svc_hosts(3), 6)
+			return _json(opts)
+
+		if net.domain:
+			opts.append({ 'name' : 'domain-name', 'data' : str(net.domain) })
+		self._options(opts, 'domain-name-servers', svc_hosts(1), 4)
+		nbns = len(opts)
+		self._options(opts, 'netbios-name-servers', svc_hosts(2), 4)
+		opts.append({ 'name' : 'netbios-node-type', 'data' : '8' if len(opts) > nbns else '1' })
+		self._options(opts, 'time-servers', svc_hosts(3), 4)
+		self._options(opts, 'ntp-servers', svc_hosts(3), 4)
+		self._options(opts, 'routers', svc_hosts(4), 4)
+		if net.routing_table and len(net.routing_table.entries):
+			opts.append({
+				'code'       : 121,
+				'csv-format' : False,
+				'data'       : ':'.join(itertools.chain.from_iterable(rte.dhcp_strings(net) for rte in net.routing_table.entries))
+			})
+		return _json(opts)
+
+	@reify
+	def ipv4_reservations(self):
+		"""
+		IPv4 host reservations, grouped by network ID.
+		"""
+		ret = {}
+		seen = set()
+		for host in self.all_hosts_ipv4:
+			for ip in host.ipv4_addresses:
+				if not ip.network.ipv4_address:
+					continue
+				hwaddr = str(ip.hardware_address)
+				if (ip.network_id, hwaddr) in seen:
+					logger.warn('Skipping duplicate Kea reservation for %s in network %s', hwaddr, str(ip.network))
+					continue
+				seen.add((ip.network_id, hwaddr))
+				ret.setdefault(ip.network_id, []).append({
+					'hw-address' : hwaddr,
+					'ip-address' : str(ip),
+					'hostname'   : str(host)
+				})
+		return ret
+
+	@reify
+	def ipv6_reservations(self):
+		"""
+		IPv6 host reservations, grouped by network ID. Addresses with the
+		same hardware address share one reservation.
+		"""
+		ret = {}
+		by_hwaddr = {}
+		for host in self.confgen.snapshot.hosts:
+			for ip in host.ipv6_addresses:
+				if not ip.network.ipv6_address:
+					continue
+				hwaddr = str(ip.hardware_address)
+				res = by_hwaddr.get((ip.network_id, hwaddr))
+				if res is None:
+					res = by_hwaddr[(ip.network_id, hwaddr)] = {
+						'hw-address'   : hwaddr,
+						'ip-addresses' : [],
+						'hostname'     : str(host)
+					}
+					ret.setdefault(ip.network_id, []).append(res)
+				res['ip-addresses'].append(str(ip))
+		return ret
+
+	def get_units(self, srv):
+		self.confgen.mm.assert_loaded('ipaddresses')
+		self.confgen.srvdir_templates(srv)
+		units = []
+		for ipv in self.families(srv):
+			self.confgen.srvdir_files(srv, 'hosts%d' % (ipv,))
+			units.append(('conf', ipv))
+			units.append(('hosts', ipv))
+		return units
+
+	def generate(self, srv, unit=None):
+		if unit is None:
+			for unit in self.get_units(srv):
+				self.generate(srv, unit)
+			return
+		kind, ipv = unit
+		shared, subnets = self.subnets(ipv)
+		param = {
+			'now' : self.confgen.now,
+			'gen' : self,
+			'srv' : srv,
+			'ipv' : ipv
+		}
+
+		if kind == 'conf':
+			deptpl = self.confgen.deptpl()
+			param.update({
+				'deptype' : self.confgen.cfg.get('netprofile.confgen.deployment_type', 'puppet'),
+				'dtpl'    : deptpl,
+				'shared'  : shared,
+				'subnets' : subnets
+			})
+			tpl_dir = self.confgen.srvdir_templates(srv)
+			conf_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/kea-dhcp%d.conf.mak' % (ipv,))
+			self.confgen.render(os.path.join(tpl_dir, 'kea-dhcp%d.conf%s' % (ipv, deptpl.file_suffix)), conf_tpl, param)
+		elif kind == 'hosts':
+			# Each subnet includes its reservations from a separate file, so
+			# that the main configuration stays small.
+			hostdir = self.confgen.srvdir_files(srv, 'hosts%d' % (ipv,))
+			hosts_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/kea.hosts.mak')
+			if ipv == 4:
+				reservations = self.ipv4_reservations
+			else:
+				reservations = self.ipv6_reservations
+			for net in itertools.chain(itertools.chain.from_iterable(nets for ng, nets in shared), subnets):
+				param['reservations'] = _json(reservations.get(net.id, []))
+				self.confgen.render(os.path.join(hostdir, '%d.json' % (net.id,)), hosts_tpl, param)
+
+class UnboundGenerator(ConfigGenerator):
+	templates = (
+		'netprofile_confgen:templates/confgen/unbound.conf.mak',
+		'netprofile_confgen:templates/confgen/unbound.local.mak'
+	)
+	snapshot_parts = (
+		'networks',
+		'hosts',
+		'dns_domain_services'
+	)
+
+	@property
+	def all_nets(self):
+		return self.confgen.snapshot.networks
+
+	@reify
+	def domains(self):
+		"""
+		Enabled domains served by DNS servers, by ID.
+		"""
+		return dict(
+			(ds.domain_id, ds.domain)
+			for ds in self.confgen.snapshot.dns_domain_services
+			if ds.domain.enabled
+		)
+
+	def check_vis(self, vis):
+		from netprofile_domains.models import ObjectVisibility
+		return vis in (ObjectVisibility.both, ObjectVisibility.internal)
+
+	def get_units(self, srv):
+		self.confgen.mm.assert_loaded('ipaddresses')
+		self.confgen.srvdir_templates(srv)
+		self.confgen.srvdir_files(srv, 'local')
+		units = [('conf', None)]
+		units.extend(('local', domain_id) for domain_id in sorted(self.domains))
+		return units
+
+	def generate(self, srv, unit=None):
+		if unit is None:
+			for unit in self.get_units(srv):
+				self.generate(srv, unit)
+			return
+		kind, obj_id = unit
+		param = {
+			'now' : self.confgen.now,
+			'gen' : self,
+			'srv' : srv
+		}
+
+		if kind == 'conf':
+			deptpl = self.confgen.deptpl()
+			param.update({
+				'deptype' : self.confgen.cfg.get('netprofile.confgen.deployment_type', 'puppet'),
+				'dtpl'    : deptpl
+			})
+			tpl_dir = self.confgen.srvdir_templates(srv)
+			conf_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/unbound.conf.mak')
+			self.confgen.render(os.path.join(tpl_dir, 'unbound.conf' + deptpl.file_suffix), conf_tpl, param)
+		elif kind == 'local':
+			domain = self.domains[obj_id]
+			localdir = self.confgen.srvdir_files(srv, 'local')
+			local_tpl = self.confgen.mako_lookup.get_template('netprofile_confgen:templates/confgen/unbound.local.mak')
+			param.update({
+				'domain' : domain,
+				'dnames' : [str(domain)] + [str(alias) for alias in domain.aliases],
+				'hosts'  : self.confgen.snapshot.domain_hosts(domain)
+			})
+			self.confgen.render(os.path.join(localdir, str(domain) + '.conf'), local_tpl, param)
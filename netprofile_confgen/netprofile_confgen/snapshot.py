@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Config Generation module - Data snapshot
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'ConfigSnapshot'
+]
+
+from itertools import groupby
+from pyramid.decorator import reify
+from sqlalchemy.orm import (
+	attributes,
+	joinedload,
+	subqueryload
+)
+
+from netprofile.db.connection import DBSession
+from netprofile_confgen.models import (
+	Server,
+	ServerType
+)
+
+class ConfigSnapshot(object):
+	"""
+	Data shared by all generators in a configuration generation run.
+
+	Each part is loaded on first use in a single query, with related
+	objects loaded eagerly, so that templates don't issue queries per
+	domain or per host.
+	"""
+	def __init__(self, sess=None):
+		if sess is None:
+			sess = DBSession()
+		self.sess = sess
+
+	def attach(self, sess):
+		"""
+		Add already loaded parts to another session, e.g. in a worker
+		process after the session they were loaded in was closed. Nothing
+		is queried, loaded related objects are added along with them.
+		"""
+		self.sess = sess
+		for name in ('networks', 'network_groups', 'hosts', 'dns_servers', 'dns_domain_services'):
+			sess.add_all(self.__dict__.get(name, ()))
+		for svcs in self.__dict__.get('srv_records', {}).values():
+			sess.add_all(svcs)
+
+	@reify
+	def networks(self):
+		from netprofile_networks.models import (
+			Network,
+			NetworkService,
+			RoutingTable
+		)
+		return self.sess.query(Network).options(
+			joinedload(Network.domain),
+			joinedload(Network.routing_table).subqueryload(RoutingTable.entries),
+			subqueryload(Network.services).joinedload(NetworkService.host)
+		).order_by(Network.id).all()
+
+	@reify
+	def network_groups(self):
+		from netprofile_networks.models import NetworkGroup
+		# Networks themselves are already in the identity map.
+		self.networks
+		return self.sess.query(NetworkGroup).options(
+			subqueryload(NetworkGroup.networks)
+		).order_by(NetworkGroup.id).all()
+
+	@reify
+	def hosts(self):
+		from netprofile_hosts.models import Host
+		from netprofile_ipaddresses.models import (
+			IPv4Address,
+			IPv6Address
+		)
+		return self.sess.query(Host).options(
+			joinedload(Host.domain),
+			subqueryload(Host.ipv4_addresses).joinedload(IPv4Address.network),
+			subqueryload(Host.ipv6_addresses).joinedload(IPv6Address.network)
+		).order_by(Host.id).all()
+
+	def iter_hosts_ipv4(self, chunk_size=1000):
+		"""
+		Iterate over all hosts with their IPv4 addresses loaded. Unless
+		all hosts are already in the snapshot, rows are fetched in chunks
+		and hosts aren't kept in memory after use.
+		"""
+		if 'hosts' in self.__dict__:
+			for host in self.hosts:
+				yield host
+			return
+
+		from netprofile_hosts.models import Host
+		from netprofile_ipaddresses.models import IPv4Address
+		# Keep networks around, so that addresses don't load them one by one.
+		self.networks
+		q = self.sess.query(Host, IPv4Address).outerjoin(
+			IPv4Address,
+			IPv4Address.host_id == Host.id
+		).order_by(
+			Host.id,
+			IPv4Address.id
+		).yield_per(chunk_size)
+		for host, rows in groupby(q, lambda row: row[0]):
+			attributes.set_committed_value(host, 'ipv4_addresses', [ip for h, ip in rows if ip is not None])
+			yield host
+
+	@reify
+	def hosts_by_domain(self):
+		ret = {}
+		for host in self.hosts:
+			ret.setdefault(host.domain_id, []).append(host)
+		return ret
+
+	@reify
+	def ipv4_addresses(self):
+		"""
+		IPv4 addresses of all hosts, ordered by address.
+		"""
+		ret = [ip for host in self.hosts for ip in host.ipv4_addresses if ip.network.ipv4_address]
+		ret.sort(key=lambda ip: (int(ip.network.ipv4_address), ip.offset))
+		return ret
+
+	@reify
+	def ipv6_addresses(self):
+		"""
+		IPv6 addresses of all hosts, ordered by address.
+		"""
+		ret = [ip for host in self.hosts for ip in host.ipv6_addresses if ip.network.ipv6_address]
+		ret.sort(key=lambda ip: (int(ip.network.ipv6_address), ip.offset))
+		return ret
+
+	@reify
+	def dns_servers(self):
+		self.hosts
+		return self.sess.query(Server).join(Server.type).filter(
+			ServerType.generator_name.startswith('iscbind')
+		).order_by(Server.id).all()
+
+	@reify
+	def dns_domain_services(self):
+		from netprofile_hosts.models import DomainService
+		return self.sess.query(DomainService).options(
+			joinedload(DomainService.domain)
+		).filter(
+			DomainService.type_id.in_((1, 2))
+		).order_by(DomainService.id).all()
+
+	@reify
+	def srv_records(self):
+		"""
+		SRV records, grouped by domain ID. Services with no explicit
+		domain go into the domain of their host.
+		"""
+		from netprofile_hosts.models import Service
+		self.hosts
+		ret = {}
+		for svc in self.sess.query(Service).options(
+			joinedload(Service.type)
+		).order_by(Service.id):
+			domain_id = svc.domain_id
+			if domain_id is None:
+				domain_id = svc.host.domain_id
+			ret.setdefault(domain_id, []).append(svc)
+		return ret
+
+	def domain_hosts(self, domain):
+		return self.hosts_by_domain.get(domain.id, ())
+
+	def domain_srv_records(self, domain):
+		return self.srv_records.get(domain.id, ())
@@ -27,37 +27,112 @@ from __future__ import (
 	division
 )
 
+import datetime
+import hashlib
+import json
 import logging
+import time
+import uuid
 import redis
 import transaction
 
+from dateutil.tz import tzlocal
 from pyramid.i18n import TranslationStringFactory
+from pyramid.settings import asbool
 
 from netprofile.celery import (
 	app,
-	task_cap
+	task_cap,
+	task_uid
 )
 from netprofile.db.connection import DBSession
+from netprofile.common.hooks import register_hook
 from netprofile.common.util import make_config_dict
 from netprofile.common.locale import sys_localizer
 
 from netprofile_confgen.models import Server
-from netprofile_confgen.gen import ConfigGeneratorFactory
+from netprofile_confgen.gen import (
+	ConfigGeneratorFactory,
+	warm_templates
+)
 
 logger = logging.getLogger(__name__)
 
 _ = TranslationStringFactory('netprofile_confgen')
 
-@task_cap('SRV_CONFGEN')
-@app.task
-def task_generate(srv_ids=(), station_ids=()):
+# Queued run marker expires if its task never starts.
+_QUEUED_TTL = 3600
+
+def _now():
+	return datetime.datetime.now().replace(tzinfo=tzlocal()).isoformat()
+
+def _queue_key(srv_ids, station_ids, incremental, processes):
+	req = json.dumps((
+		sorted(set(srv_ids)),
+		sorted(set(station_ids)),
+		incremental,
+		processes
+	))
+	return 'confgen.queued.' + hashlib.sha1(req.encode()).hexdigest()
+
+def _recipients_key(run_id):
+	return 'confgen.recipients.' + run_id
+
+def _recipients(rsess, run_id):
+	try:
+		return rsess.smembers(_recipients_key(run_id))
+	except redis.RedisError as e:
+		logger.warning('Unable to get confgen event recipients: %s', str(e))
+	return ()
+
+def _publish(rsess, uids, msg):
+	"""
+	Send event to RT server clients of requesting users only, as it may
+	contain host names.
+	"""
+	data = json.dumps(msg)
+	try:
+		for uid in uids:
+			rsess.publish('direct.%d' % int(uid), data)
+	except redis.RedisError as e:
+		logger.warning('Unable to publish confgen event: %s', str(e))
+
+class _Progress(object):
+	"""
+	Publishes per-server generation progress to RT server clients.
+	"""
+	def __init__(self, rsess, uids, task_id, names, loc, interval=1.0):
+		self.rsess = rsess
+		self.uids = uids
+		self.task_id = task_id
+		self.names = names
+		self.msg = loc.translate(_('Generating %s configuration for host %s: %d of %d parts done.'))
+		self.interval = interval
+		self.last = {}
+
+	def __call__(self, srv_id, done, total):
+		now = time.time()
+		if (done < total) and ((now - self.last.get(srv_id, 0)) < self.interval):
+			return
+		self.last[srv_id] = now
+		type_name, host_name = self.names[srv_id]
+		_publish(self.rsess, self.uids, {
+			'ts'    : _now(),
+			'type'  : 'task_progress',
+			'tname' : task_generate.name,
+			'tid'   : self.task_id,
+			'srvid' : srv_id,
+			'done'  : done,
+			'total' : total,
+			'value' : self.msg % (type_name, host_name, done, total)
+		})
+
+def _generate(task_id, rsess, uids, srv_ids, station_ids, incremental, processes):
 	cfg = app.settings
-	rconf = make_config_dict(cfg, 'netprofile.rt.redis.')
-	factory = ConfigGeneratorFactory(cfg, app.mmgr)
+	factory = ConfigGeneratorFactory(cfg, app.mmgr, incremental)
 
 	ret = []
 	sess = DBSession()
-	rsess = redis.Redis(**rconf)
 	loc = sys_localizer(app.mmgr.cfg.registry)
 
 	q = sess.query(Server)
@@ -65,19 +140,120 @@ def task_generate(srv_ids=(), station_ids=()):
 		q = q.filter(Server.id.in_(srv_ids))
 	if len(station_ids) > 0:
 		q = q.filter(Server.host_id.in_(station_ids))
-	for srv in q:
-		gen = factory.get(srv.type.generator_name)
-		logger.info('Generating config of type %s for host %s', srv.type.generator_name, str(srv.host))
-		gen.generate(srv)
+	servers = q.all()
+	# Parallel generation ends current transaction, so names are needed
+	# beforehand.
+	names = [(srv.id, srv.type.name, str(srv.host)) for srv in servers]
+	progress = _Progress(rsess, uids, task_id, dict(
+		(srv_id, (type_name, host_name))
+		for srv_id, type_name, host_name in names
+	), loc)
+
+	timings = factory.generate(servers, processes, progress=progress)
+	for srv_id, type_name, host_name in names:
 		ret.append(loc.translate(_('Successfully generated %s configuration for host %s.')) % (
-			srv.type.name,
-			str(srv.host)
+			type_name,
+			host_name
 		))
+	for gen_name, elapsed in sorted(timings.items()):
+		logger.info('Generator %s took %.3f seconds', gen_name, elapsed)
+		ret.append(loc.translate(_('Generator %s took %.2f seconds.')) % (gen_name, elapsed))
 
 	hosts = factory.deploy()
 	ret.append(loc.translate(_('Successfully deployed configuration for hosts: %s.')) % (', '.join(hosts),))
+	if len(factory.unchanged) > 0:
+		ret.append(loc.translate(_('Configuration is unchanged for hosts: %s.')) % (', '.join(factory.unchanged),))
 
 	factory.restore_umask()
 	transaction.commit()
 	return ret
 
+@task_cap('SRV_CONFGEN')
+@task_uid()
+@app.task(bind=True)
+def task_generate(self, srv_ids=(), station_ids=(), incremental=None, processes=None, uid=None):
+	cfg = app.settings
+	rconf = make_config_dict(cfg, 'netprofile.rt.redis.')
+	if incremental is None:
+		incremental = asbool(cfg.get('netprofile.confgen.incremental', False))
+	if processes is None:
+		processes = int(cfg.get('netprofile.confgen.processes', 0))
+	rsess = redis.Redis(**rconf)
+
+	uids = () if uid is None else (uid,)
+
+	if not asbool(cfg.get('netprofile.confgen.coalesce', False)):
+		return _generate(self.request.id, rsess, uids, srv_ids, station_ids, incremental, processes)
+
+	# Requests for the same set of servers are merged into one run, as
+	# long as that run has not started yet. Users of all merged requests
+	# get its progress and result.
+	loc = sys_localizer(app.mmgr.cfg.registry)
+	key = _queue_key(srv_ids, station_ids, incremental, processes)
+	run_id = str(uuid.uuid4())
+	if not rsess.set(key, run_id, nx=True, ex=_QUEUED_TTL):
+		run_id = rsess.get(key)
+		if (run_id is not None) and (uid is not None):
+			rkey = _recipients_key(run_id.decode())
+			rsess.sadd(rkey, uid)
+			rsess.expire(rkey, _QUEUED_TTL)
+		return [loc.translate(_('Merged into already queued configuration generation.'))]
+	if uid is not None:
+		rkey = _recipients_key(run_id)
+		rsess.sadd(rkey, uid)
+		rsess.expire(rkey, _QUEUED_TTL)
+	try:
+		task_generate_queued.apply_async(
+			args=(key, srv_ids, station_ids, incremental, processes),
+			task_id=run_id
+		)
+	except Exception:
+		rsess.delete(key)
+		raise
+	return [loc.translate(_('Configuration generation is queued.'))]
+
+@task_cap('SRV_CONFGEN')
+@app.task(bind=True)
+def task_generate_queued(self, key, srv_ids=(), station_ids=(), incremental=False, processes=0):
+	rconf = make_config_dict(app.settings, 'netprofile.rt.redis.')
+	rsess = redis.Redis(**rconf)
+
+	# Requests arriving from now on need a new run. Some may have been
+	# merged right before that, so recipients are fetched again at the end.
+	rsess.delete(key)
+	uids = set(_recipients(rsess, self.request.id))
+	try:
+		ret = _generate(self.request.id, rsess, uids, srv_ids, station_ids, incremental, processes)
+	except Exception as e:
+		uids.update(_recipients(rsess, self.request.id))
+		_publish(rsess, uids, {
+			'ts'    : _now(),
+			'type'  : 'task_error',
+			'tname' : task_generate.name,
+			'tid'   : self.request.id,
+			'errno' : 500,
+			'value' : str(e)
+		})
+		raise
+	else:
+		uids.update(_recipients(rsess, self.request.id))
+	finally:
+		try:
+			rsess.delete(_recipients_key(self.request.id))
+		except redis.RedisError:
+			pass
+	# Nobody waits for the result of this task, so send it to RT clients.
+	_publish(rsess, uids, {
+		'ts'    : _now(),
+		'type'  : 'task_result',
+		'tname' : task_generate.name,
+		'tid'   : self.request.id,
+		'value' : ret
+	})
+	return ret
+
+@register_hook('np.celery.init')
+def _warm_templates(celery_app):
+	ts = time.time()
+	count = warm_templates(celery_app.settings)
+	logger.info('Compiled %d confgen templates in %.3f seconds', count, time.time() - ts)
@@ -0,0 +1,55 @@
+## -*- coding: utf-8 -*-
+<%def name="subnet(net)">\
+{
+			"id": ${net.id},
+			"subnet": "${net.ipv4_address}/${net.ipv4_cidr}",
+			"pools": ${gen.pools(net, 4)},
+			"option-data": ${gen.option_data(net, 4)},
+			"reservations": <?include "${dtpl.var('hosts_dir')}/hosts4/${net.id}.json"?>
+		}\
+</%def>\
+// NetProfile
+// Configuration: ${srv.type.description or srv.type.name}
+// For DHCPv4 server
+// Autogenerated on ${now.date()} at ${now.time()}
+// Do not modify - this file will be overwritten!
+
+{
+"Dhcp4": {
+	"interfaces-config": {
+		"interfaces": ${gen.interfaces(srv)}
+	},
+${dtpl.if_var('control_socket')}
+	"control-socket": {
+		"socket-type": "unix",
+		"socket-name": "${dtpl.var('control_socket')}"
+	},
+${dtpl.endif}
+	"lease-database": {
+		"type": "memfile",
+		"persist": true,
+		"name": "${dtpl.var('lease_file')}"
+	},
+	"valid-lifetime": ${srv.get_param('lease_time_default', '9600')},
+	"max-valid-lifetime": ${srv.get_param('lease_time_max', '86400')},
+	"authoritative": true,
+	"option-data": ${gen.global_option_data(srv, 4)},
+	"shared-networks": [
+% for ng, nets in shared:
+		{
+			"name": ${gen.json(ng.name)},
+			"subnet4": [
+% for net in nets:
+			${subnet(net)}${'' if loop.last else ','}
+% endfor
+			]
+		}${'' if loop.last else ','}
+% endfor
+	],
+	"subnet4": [
+% for net in subnets:
+		${subnet(net)}${'' if loop.last else ','}
+% endfor
+	]
+}
+}
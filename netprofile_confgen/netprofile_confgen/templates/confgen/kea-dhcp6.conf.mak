@@ -0,0 +1,54 @@
+## -*- coding: utf-8 -*-
+<%def name="subnet(net)">\
+{
+			"id": ${net.id},
+			"subnet": "${net.ipv6_address}/${net.ipv6_cidr}",
+			"pools": ${gen.pools(net, 6)},
+			"option-data": ${gen.option_data(net, 6)},
+			"reservations": <?include "${dtpl.var('hosts_dir')}/hosts6/${net.id}.json"?>
+		}\
+</%def>\
+// NetProfile
+// Configuration: ${srv.type.description or srv.type.name}
+// For DHCPv6 server
+// Autogenerated on ${now.date()} at ${now.time()}
+// Do not modify - this file will be overwritten!
+
+{
+"Dhcp6": {
+	"interfaces-config": {
+		"interfaces": ${gen.interfaces(srv)}
+	},
+${dtpl.if_var('control_socket')}
+	"control-socket": {
+		"socket-type": "unix",
+		"socket-name": "${dtpl.var('control_socket')}"
+	},
+${dtpl.endif}
+	"lease-database": {
+		"type": "memfile",
+		"persist": true,
+		"name": "${dtpl.var('lease_file')}"
+	},
+	"valid-lifetime": ${srv.get_param('lease_time_default', '9600')},
+	"max-valid-lifetime": ${srv.get_param('lease_time_max', '86400')},
+	"option-data": ${gen.global_option_data(srv, 6)},
+	"shared-networks": [
+% for ng, nets in shared:
+		{
+			"name": ${gen.json(ng.name)},
+			"subnet6": [
+% for net in nets:
+			${subnet(net)}${'' if loop.last else ','}
+% endfor
+			]
+		}${'' if loop.last else ','}
+% endfor
+	],
+	"subnet6": [
+% for net in subnets:
+		${subnet(net)}${'' if loop.last else ','}
+% endfor
+	]
+}
+}
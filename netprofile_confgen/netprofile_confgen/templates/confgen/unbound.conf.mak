@@ -0,0 +1,33 @@
+## -*- coding: utf-8 -*-
+# NetProfile
+# Configuration: ${srv.type.description or srv.type.name}
+# Autogenerated on ${now.date()} at ${now.time()}
+# Do not modify - this file will be overwritten!
+
+server:
+	interface: 127.0.0.1
+	interface: ::1
+% for selfv4 in srv.host.real.ipv4_addresses:
+	interface: ${selfv4}
+% endfor
+% for selfv6 in srv.host.real.ipv6_addresses:
+	interface: ${selfv6}
+% endfor
+
+	access-control: 127.0.0.0/8 allow
+	access-control: ::1/128 allow
+% for net in gen.all_nets:
+% if net.enabled:
+% if net.ipv4_address:
+	access-control: ${net.ipv4_address}/${net.ipv4_cidr} allow
+% endif
+% if net.ipv6_address:
+	access-control: ${net.ipv6_address}/${net.ipv6_cidr} allow
+% endif
+% endif
+% endfor
+
+${dtpl.if_var('work_dir')}
+	directory: "${dtpl.var('work_dir')}"
+${dtpl.endif}
+	include: "${dtpl.var('local_dir')}/*.conf"
@@ -0,0 +1,51 @@
+## -*- coding: utf-8 -*-
+<%!
+	import itertools
+	from netprofile_hosts.models import HostAliasType
+%>\
+# NetProfile
+# Configuration: ${srv.type.description or srv.type.name}
+# Local data for domain ${domain}
+# Autogenerated on ${now.date()} at ${now.time()}
+# Do not modify - this file will be overwritten!
+
+server:
+% for dname in dnames:
+	local-zone: "${dname}." ${srv.get_param('local_zone_type', 'transparent')}
+% for host in hosts:
+% if (not host.original) or (host.alias_type == HostAliasType.numeric):
+% for ipv4 in host.real.ipv4_addresses:
+% if gen.check_vis(ipv4.visibility):
+% if ipv4.ttl:
+	local-data: "${host.name}.${dname}. ${ipv4.ttl} IN A ${ipv4}"
+% else:
+	local-data: "${host.name}.${dname}. IN A ${ipv4}"
+% endif
+% endif
+% endfor
+% for ipv6 in host.real.ipv6_addresses:
+% if gen.check_vis(ipv6.visibility):
+% if ipv6.ttl:
+	local-data: "${host.name}.${dname}. ${ipv6.ttl} IN AAAA ${ipv6}"
+% else:
+	local-data: "${host.name}.${dname}. IN AAAA ${ipv6}"
+% endif
+% endif
+% endfor
+% elif host.alias_type == HostAliasType.symbolic:
+	local-data: "${host.name}.${dname}. IN CNAME ${host.original}."
+% endif
+% endfor
+% endfor
+% if srv.get_bool_param('gen_ptr', True):
+
+% for host in hosts:
+% if not host.original:
+% for ip in itertools.chain(host.ipv4_addresses, host.ipv6_addresses):
+% if ip.address and gen.check_vis(ip.visibility):
+	local-data-ptr: "${ip} ${host}."
+% endif
+% endfor
+% endif
+% endfor
+% endif
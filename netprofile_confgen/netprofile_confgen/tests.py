@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Config Generation module - Tests
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import os
+import shutil
+import tempfile
+import unittest
+import transaction
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from netprofile.common import cache
+from netprofile.db.connection import DBSession
+from netprofile_confgen import bench
+
+# Server IDs of the benchmark inventory.
+_BIND9 = 1
+_ISCDHCP = 2
+
+class TestQueryCount(unittest.TestCase):
+	"""
+	Full generator runs over the benchmark inventory must issue a fixed
+	number of queries per zone and per network, no matter how many hosts
+	there are.
+	"""
+	DOMAINS = 2
+
+	@classmethod
+	def setUpClass(cls):
+		if cache.cache is None:
+			cache.cache = cache.configure_cache({
+				'netprofile.cache.backend' : 'dogpile.cache.memory'
+			})
+		cls.mm = bench._Modules({})
+		for moddef in ('core', 'confgen', 'ipaddresses'):
+			bench._load_models(cls.mm.loaded, moddef)
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp(prefix='nptest-')
+		self.engine = None
+
+	def tearDown(self):
+		transaction.abort()
+		DBSession.remove()
+		if self.engine is not None:
+			self.engine.dispose()
+		shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+	def _inventory(self, hosts):
+		if self.engine is not None:
+			DBSession.remove()
+			self.engine.dispose()
+		path = os.path.join(self.tmpdir, str(hosts))
+		self.engine = create_engine('sqlite:///' + os.path.join(path, 'inventory.db'))
+		self.cfg = {
+			'netprofile.confgen.deployment_type'     : 'puppet',
+			'netprofile.confgen.files_output_dir'     : os.path.join(path, 'files'),
+			'netprofile.confgen.templates_output_dir' : os.path.join(path, 'templates'),
+			'netprofile.confgen.puppet.files_dir'     : os.path.join(path, 'deploy', 'files'),
+			'netprofile.confgen.puppet.templates_dir' : os.path.join(path, 'deploy', 'templates')
+		}
+		os.makedirs(self.cfg['netprofile.confgen.puppet.files_dir'])
+		os.makedirs(self.cfg['netprofile.confgen.puppet.templates_dir'])
+
+		bench._create_tables(self.engine)
+		sess = sessionmaker(bind=self.engine)()
+		bench._populate(sess, hosts, self.DOMAINS)
+		sess.commit()
+		sess.close()
+		DBSession.remove()
+		DBSession.configure(bind=self.engine)
+		self.queries = bench._QueryCounter(self.engine)
+
+	def _count(self, srv_id):
+		return bench._generate(self.cfg, self.mm, srv_id, 0, self.queries)[2]
+
+	def test_bind9(self):
+		# Both inventories fit into a single network.
+		self._inventory(20)
+		self.assertEqual(self._count(_BIND9), 30)
+		self._inventory(240)
+		self.assertEqual(self._count(_BIND9), 30)
+
+	def test_iscdhcp(self):
+		self._inventory(20)
+		self.assertEqual(self._count(_ISCDHCP), 15)
+		self._inventory(240)
+		self.assertEqual(self._count(_ISCDHCP), 15)
@@ -59,7 +59,12 @@ setup(
 			'iscbind93 = netprofile_confgen.gen:BIND9Generator',
 			'iscbind94 = netprofile_confgen.gen:BIND9Generator',
 			'iscbind99 = netprofile_confgen.gen:BIND9Generator',
-			'iscdhcp = netprofile_confgen.gen:ISCDHCPGenerator'
+			'iscdhcp = netprofile_confgen.gen:ISCDHCPGenerator',
+			'kea = netprofile_confgen.gen:KeaGenerator',
+			'unbound = netprofile_confgen.gen:UnboundGenerator'
+		],
+		'netprofile.benchmarks' : [
+			'confgen = netprofile_confgen.bench:run'
 		]
 	},
 	message_extractors={'.' : [
@@ -78,6 +78,7 @@ class Module(ModuleBase):
 		config.add_route('core.file.upload', '/file/ul', vhost='MAIN')
 		config.add_route('core.file.mount', '/file/mount/{ffid:\d+|root}*filename', vhost='MAIN')
 		config.add_route('core.export', '/file/export/{module:[\w_.-]+}/{model:[\w_.-]+}', vhost='MAIN')
+		config.add_route('core.metrics', '/metrics', vhost='MAIN')
 
 	@classmethod
 	def get_models(cls):
@@ -182,6 +182,7 @@ from netprofile.ext.filters import (
 from netprofile.db.ddl import (
 	Comment,
 	CurrentTimestampDefault,
+	Partitioned,
 	SQLFunction,
 	SQLFunctionArgument,
 	Trigger
@@ -5300,6 +5301,7 @@ class LogData(Base):
 	__tablename__ = 'logs_data'
 	__table_args__ = (
 		Comment('Actual system log'),
+		Partitioned('ts'),
 		{
 			'mysql_engine'  : 'InnoDB', # or leave MyISAM?
 			'mysql_charset' : 'utf8',
@@ -77,6 +77,13 @@ Ext.require([
 				val
 			);
 		},
+		task_progress: function(val, meta, rec)
+		{
+			return Ext.String.format('<img class="np-console-icon" src="{0}/static/core/img/info.png" /><span class="np-console-message">{1}</span>',
+				NetProfile.staticURL,
+				Ext.String.htmlEncode(val)
+			);
+		},
 		task_error: function(val, meta, rec)
 		{
 			return Ext.String.format('<img class="np-console-icon" src="{0}/static/core/img/cancel.png" /><span class="np-console-message"><strong>Error {1}</strong>: {2}</span>',
@@ -1106,6 +1113,23 @@ Ext.require([
 							}
 							NetProfile.showConsole();
 							break;
+						case 'task_progress':
+							var store = NetProfile.StoreManager.getConsoleStore('system', 'log'),
+								rec_id = 'progress-' + ev.data.tid + '-' + ev.data.srvid,
+								rec;
+							if(store)
+							{
+								rec = store.getById(rec_id);
+								if(!rec)
+								{
+									rec = Ext.create('NetProfile.model.ConsoleMessage', { id: rec_id });
+									rec.set('bodytype', 'task_progress');
+									store.add(rec);
+								}
+								rec.set('ts', new Date(ev.data.ts));
+								rec.set('data', ev.data.value);
+							}
+							break;
 						case 'task_error':
 							var store = NetProfile.StoreManager.getConsoleStore('system', 'log'),
 								rec;
@@ -190,6 +190,13 @@ def do_noop(request):
 	request.locale_name
 	return HTTPFound(location=request.route_url('core.home'))
 
+@view_config(route_name='core.metrics', renderer='json', permission='USAGE')
+def do_metrics(request):
+	# Modules add their own sections through core.metrics hook.
+	metrics = {}
+	request.run_hook('core.metrics', metrics, request)
+	return metrics
+
 @view_config(route_name='core.logout')
 def do_logout(request):
 	return auth_remove(request, 'core.login')
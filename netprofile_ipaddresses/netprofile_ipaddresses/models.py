@@ -37,7 +37,10 @@ __all__ = [
 	'IPAddrGetOffsetGenFunction',
 	'IPAddrGetOffsetHGFunction',
 	'IP6AddrGetOffsetGenFunction',
-	'IP6AddrGetOffsetHGFunction'
+	'IP6AddrGetOffsetHGFunction',
+
+	'ipv4_revzone_trie',
+	'ipv6_revzone_trie'
 ]
 
 from sqlalchemy import (
@@ -47,6 +50,7 @@ from sqlalchemy import (
 	Index,
 	Sequence,
 	Unicode,
+	event,
 	text
 )
 
@@ -58,7 +62,11 @@ from sqlalchemy.orm import (
 from sqlalchemy.ext.associationproxy import association_proxy
 
 from netprofile.common import ipaddr
-from netprofile.db.connection import Base
+from netprofile.common.cache import cache
+from netprofile.db.connection import (
+	Base,
+	DBSession
+)
 from netprofile.db import fields
 from netprofile.db.fields import (
 	DeclEnum,
@@ -671,6 +679,49 @@ class IPv6ReverseZoneSerial(Base):
 			for item in [(b >> 4) % 16, b % 16]
 		)
 
+@cache.cache_on_arguments()
+def ipv4_revzone_trie():
+	"""
+	Index of existing IPv4 reverse zones, mapped to zone networks.
+	"""
+	trie = ipaddr.IPPrefixTrie()
+	for addr, in DBSession().query(IPv4ReverseZoneSerial.ipv4_address):
+		net = ipaddr.IPv4Network(str(addr) + '/24')
+		trie.insert(net, net)
+	return trie
+
+@cache.cache_on_arguments()
+def ipv6_revzone_trie():
+	"""
+	Index of existing IPv6 reverse zones, mapped to zone networks.
+	"""
+	trie = ipaddr.IPPrefixTrie()
+	for addr, in DBSession().query(IPv6ReverseZoneSerial.ipv6_address):
+		net = ipaddr.IPv6Network(str(addr) + '/64')
+		trie.insert(net, net)
+	return trie
+
+def _mod_ipv4_revzones(mapper, conn, tgt):
+	ipv4_revzone_trie.invalidate()
+
+def _mod_ipv6_revzones(mapper, conn, tgt):
+	ipv6_revzone_trie.invalidate()
+
+event.listen(IPv4ReverseZoneSerial, 'after_delete', _mod_ipv4_revzones)
+event.listen(IPv4ReverseZoneSerial, 'after_insert', _mod_ipv4_revzones)
+event.listen(IPv4ReverseZoneSerial, 'after_update', _mod_ipv4_revzones)
+event.listen(IPv6ReverseZoneSerial, 'after_delete', _mod_ipv6_revzones)
+event.listen(IPv6ReverseZoneSerial, 'after_insert', _mod_ipv6_revzones)
+event.listen(IPv6ReverseZoneSerial, 'after_update', _mod_ipv6_revzones)
+
+# Reverse zone serials are also created by triggers on address tables.
+event.listen(IPv4Address, 'after_delete', _mod_ipv4_revzones)
+event.listen(IPv4Address, 'after_insert', _mod_ipv4_revzones)
+event.listen(IPv4Address, 'after_update', _mod_ipv4_revzones)
+event.listen(IPv6Address, 'after_delete', _mod_ipv6_revzones)
+event.listen(IPv6Address, 'after_insert', _mod_ipv6_revzones)
+event.listen(IPv6Address, 'after_update', _mod_ipv6_revzones)
+
 IPAddrGetDotStrFunction = SQLFunction(
 	'ipaddr_get_dotstr',
 	args=(
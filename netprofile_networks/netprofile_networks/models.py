@@ -33,7 +33,9 @@ __all__ = [
 	'NetworkService',
 	'NetworkServiceType',
 	'RoutingTable',
-	'RoutingTableEntry'
+	'RoutingTableEntry',
+
+	'network_trie'
 ]
 
 import itertools
@@ -46,6 +48,7 @@ from sqlalchemy import (
 	Sequence,
 	Unicode,
 	UnicodeText,
+	event,
 	text
 )
 
@@ -59,6 +62,7 @@ from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from netprofile.common import ipaddr
+from netprofile.common.cache import cache
 from netprofile.db.connection import (
 	Base,
 	DBSession
@@ -396,9 +400,46 @@ class Network(Base):
 				str(self.ipv6_cidr)
 			))
 
+	@classmethod
+	def for_address(cls, addr):
+		"""
+		Get the most specific network containing an IPv4 or IPv6 address.
+		"""
+		netid = network_trie().get(addr)
+		if netid is None:
+			return None
+		return DBSession().query(cls).get(netid)
+
 	def __str__(self):
 		return str(self.name)
 
+@cache.cache_on_arguments()
+def network_trie():
+	"""
+	Longest-prefix-match index of all networks, mapped to network IDs.
+	"""
+	trie = ipaddr.IPPrefixTrie()
+	q = DBSession().query(
+		Network.id,
+		Network.ipv4_address,
+		Network.ipv4_cidr,
+		Network.ipv6_address,
+		Network.ipv6_cidr
+	)
+	for netid, ipv4, cidr4, ipv6, cidr6 in q:
+		if ipv4 is not None:
+			trie.insert(ipaddr.IPv4Network('%s/%d' % (str(ipv4), cidr4)), netid)
+		if ipv6 is not None:
+			trie.insert(ipaddr.IPv6Network('%s/%d' % (str(ipv6), cidr6)), netid)
+	return trie
+
+def _mod_network(mapper, conn, tgt):
+	network_trie.invalidate()
+
+event.listen(Network, 'after_delete', _mod_network)
+event.listen(Network, 'after_insert', _mod_network)
+event.listen(Network, 'after_update', _mod_network)
+
 class NetworkGroup(Base):
 	"""
 	Network group object.
@@ -128,6 +128,11 @@ class Module(ModuleBase):
 		except NoResultFound:
 			pass
 
+	def get_task_imports(self):
+		return (
+			'netprofile_paidservices.tasks',
+		)
+
 	def get_css(self, request):
 		return (
 			'netprofile_paidservices:static/css/main.css',
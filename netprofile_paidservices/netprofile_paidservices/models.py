@@ -313,6 +313,7 @@ class PaidService(Base):
 		Index('paid_def_i_paidid', 'paidid'),
 		Index('paid_def_i_active', 'active'),
 		Index('paid_def_i_qpend', 'qpend'),
+		Index('paid_def_i_poll', 'active', 'qpend', 'paidid', 'stashid'),
 		Trigger('before', 'insert', 't_paid_def_bi'),
 		Trigger('before', 'update', 't_paid_def_bu'),
 		Trigger('after', 'insert', 't_paid_def_ai'),
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Paid services module - Celery tasks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import logging
+import time
+
+import redis
+import transaction
+
+from sqlalchemy import (
+	and_,
+	func,
+	or_,
+	text
+)
+from sqlalchemy.exc import OperationalError
+
+from netprofile.celery import app
+from netprofile.common.polling import (
+	PollMetrics,
+	dispatch_shards,
+	pack_shards
+)
+from netprofile.common.util import make_config_dict
+from netprofile.db.connection import DBSession
+
+from netprofile_paidservices.models import (
+	PaidService,
+	PaidServiceQPType,
+	PaidServiceType
+)
+
+logger = logging.getLogger(__name__)
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_PS_EXECUTE = text('CALL ps_execute(:epid, :ts)')
+
+def ps_metrics(settings=None):
+	rconf = make_config_dict(settings or app.settings, 'netprofile.rt.redis.')
+	return PollMetrics(redis.Redis(**rconf), 'ps')
+
+def _poll_config():
+	cfg = make_config_dict(app.settings, 'netprofile.ps.poll.')
+	return (
+		int(cfg.get('batch_size', 1000)),
+		int(cfg.get('shard_size', 200)),
+		int(cfg.get('concurrency', 4))
+	)
+
+def _due_query(sess, *cols):
+	# Only active services of independent types are polled, like ps_poll
+	# does. Columns used here are all in paid_def_i_poll.
+	return sess.query(*cols).filter(
+		PaidService.active == True,
+		PaidService.paid_id.in_(
+			sess.query(PaidServiceType.id).filter(
+				PaidServiceType.quota_period_type == PaidServiceQPType.independent
+			)
+		)
+	)
+
+def due_services(sess, ts, batch_size):
+	"""
+	Yield (service ID, stash ID, quota period end) for all paid services
+	that are due at ts. Services that were never charged come first, then
+	the rest in order of quota period end. Rows are fetched in batches of
+	batch_size with keyset pagination, so no long-running cursor is kept
+	open.
+	"""
+	cols = (PaidService.id, PaidService.stash_id, PaidService.quota_period_end)
+
+	last_id = 0
+	while True:
+		rows = _due_query(sess, *cols).filter(
+			PaidService.quota_period_end == None,
+			PaidService.id > last_id
+		).order_by(PaidService.id).limit(batch_size).all()
+		for row in rows:
+			yield row
+		if len(rows) < batch_size:
+			break
+		last_id = rows[-1][0]
+
+	last_qpend = None
+	while True:
+		q = _due_query(sess, *cols).filter(PaidService.quota_period_end < ts)
+		if last_qpend is not None:
+			q = q.filter(or_(
+				PaidService.quota_period_end > last_qpend,
+				and_(PaidService.quota_period_end == last_qpend, PaidService.id > last_id)
+			))
+		rows = q.order_by(PaidService.quota_period_end, PaidService.id).limit(batch_size).all()
+		for row in rows:
+			yield row
+		if len(rows) < batch_size:
+			break
+		last_id = rows[-1][0]
+		last_qpend = rows[-1][2]
+
+def queue_stats(sess, ts):
+	"""
+	Get number of due paid services and lag in seconds of the oldest one.
+	"""
+	count, oldest = _due_query(
+		sess,
+		func.count(PaidService.id),
+		func.min(PaidService.quota_period_end)
+	).filter(or_(
+		PaidService.quota_period_end == None,
+		PaidService.quota_period_end < ts
+	)).one()
+	lag = 0
+	if oldest is not None:
+		lag = max(0, (ts - oldest).total_seconds())
+	return (count, lag)
+
+@app.task
+def task_ps_poll(ts=None):
+	"""
+	Worker-side replacement for ps_poll procedure. Meant to be run from
+	Celery beat instead of ev_ps_poll event.
+
+	Due services are grouped by stash, so that charges to the same stash
+	are never made concurrently, and packed into shards that are executed
+	by at most netprofile.ps.poll.concurrency workers at a time.
+	"""
+	if ts is None:
+		ts = datetime.datetime.now().replace(microsecond=0)
+	elif not isinstance(ts, datetime.datetime):
+		ts = datetime.datetime.strptime(ts, TS_FORMAT)
+	batch_size, shard_size, concurrency = _poll_config()
+	started = time.time()
+
+	sess = DBSession()
+	stashes = {}
+	items = 0
+	max_lag = 0
+	for epid, stash_id, qpend in due_services(sess, ts, batch_size):
+		stashes.setdefault(stash_id, []).append(epid)
+		items += 1
+		if qpend is not None:
+			max_lag = max(max_lag, (ts - qpend).total_seconds())
+	transaction.commit()
+
+	shards = pack_shards(stashes.values(), shard_size)
+	run_id = ps_metrics().start(ts, len(shards), items, max_lag, plan_time=time.time() - started)
+	tsstr = ts.strftime(TS_FORMAT)
+	lanes = dispatch_shards([
+		task_ps_execute.si(run_id, tsstr, epids)
+		for epids in shards
+	], concurrency)
+	logger.info('Started ps_poll run %s for %d services in %d shards, %d lanes', run_id, items, len(shards), lanes)
+	return run_id
+
+@app.task(bind=True, max_retries=5, default_retry_delay=10)
+def task_ps_execute(self, run_id, ts, epids):
+	"""
+	Execute paid services in order. This is safe to retry, as ps_execute
+	skips services whose quota period has already been moved past ts.
+	"""
+	ts = datetime.datetime.strptime(ts, TS_FORMAT)
+	started = time.time()
+	sess = DBSession()
+	count = errors = 0
+	for epid in epids:
+		try:
+			sess.execute(_PS_EXECUTE, { 'epid' : epid, 'ts' : ts })
+		except OperationalError as e:
+			# Deadlocks and lock wait timeouts: try the whole shard again.
+			transaction.abort()
+			logger.warning('ps_execute for service %s failed, retrying shard: %s', epid, e)
+			raise self.retry(exc=e)
+		except Exception:
+			logger.exception('ps_execute failed for service %s', epid)
+			sess.rollback()
+			errors += 1
+			continue
+		count += 1
+	transaction.commit()
+
+	if ps_metrics().shard_done(run_id, count, errors, time.time() - started):
+		logger.info('Finished ps_poll run %s', run_id)
+	return count
+
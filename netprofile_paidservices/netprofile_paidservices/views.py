@@ -88,3 +88,17 @@ def _dpane_stash_futures(tabs, model, req):
 		'createControllers' : 'NetProfile.core.controller.RelatedWizard'
 	})
 
+@register_hook('core.metrics')
+def _metrics_ps_poll(metrics, request):
+	from netprofile_paidservices.tasks import (
+		ps_metrics,
+		queue_stats
+	)
+
+	depth, lag = queue_stats(DBSession(), dt.datetime.now())
+	metrics['ps_poll'] = {
+		'queue_depth' : depth,
+		'lag'         : lag,
+		'last_run'    : ps_metrics(request.registry.settings).status()
+	}
+
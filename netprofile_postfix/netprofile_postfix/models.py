@@ -65,7 +65,10 @@ from netprofile.db.fields import (
 	UInt32,
 	npbool
 )
-from netprofile.db.ddl import Comment
+from netprofile.db.ddl import (
+	Comment,
+	Partitioned
+)
 from netprofile.tpl import TemplateObject
 from netprofile.ext.columns import MarkupColumn
 from netprofile.ext.wizards import (
@@ -427,6 +430,7 @@ class PostfixLog(Base):
 	__tablename__ = 'postfix_log'
 	__table_args__ = (
 		Comment('Postfix Log'),
+		Partitioned('timestamp'),
 		{
 			'mysql_engine'  : 'InnoDB',
 			'mysql_charset' : 'utf8',
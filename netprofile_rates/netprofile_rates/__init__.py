@@ -38,7 +38,8 @@ class Module(ModuleBase):
 	def __init__(self, mmgr):
 		self.mmgr = mmgr
 		mmgr.cfg.add_translation_dirs('netprofile_rates:locale/')
-		mmgr.cfg.scan()
+		# NumPy is optional, so its bulk counterpart of quota is left out.
+		mmgr.cfg.scan(ignore=('.qpbulk',))
 
 	@classmethod
 	def get_deps(cls):
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Rates module - Benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import io
+import random
+
+from netprofile.bench import BenchResults
+from netprofile_rates.dest import (
+	DestinationEntry,
+	DestinationMatcher,
+	rate_cdr
+)
+from netprofile_rates import quota
+
+def _destinations(rnd, prefixes):
+	rows = []
+	for i in range(prefixes):
+		cc = rnd.choice(('1', '7', '33', '44', '49', '380', '86'))
+		rows.append((len(rows) + 1, 'normal', 'prefix', cc + str(rnd.randint(10, 99999)), None, None, None))
+	# Longer prefixes first, like real tariff tables are usually ordered.
+	rows.sort(key=lambda row: -len(row[3]))
+	for i in range(100):
+		rows.append((len(rows) + 1, 'normal', 'exact', str(rnd.randint(10 ** 9, 10 ** 10)), None, None, None))
+	for i in range(20):
+		rows.append((len(rows) + 1, 'normal', 'suffix', str(rnd.randint(100, 999)), None, None, None))
+	for i in range(20):
+		rows.append((len(rows) + 1, 'reject', 'regex', '^9[[:digit:]]{2}%d' % i, None, None, None))
+	rows.append((len(rows) + 1, 'normal', 'prefix', '', None, None, None))
+	return rows
+
+def run(app=None, count=100000, prefixes=20000):
+	"""
+	Find destinations for a number of called numbers in a synthetic
+	destination set, with a row-by-row scan like acct_rate_dest does and
+	with a compiled matcher.
+	"""
+	res = BenchResults()
+	rnd = random.Random(count)
+	rows = _destinations(rnd, prefixes)
+	calls = [
+		rnd.choice(('1', '7', '33', '44', '49', '380', '86', '9')) + str(rnd.randint(10 ** 8, 10 ** 10))
+		for i in range(count)
+	]
+
+	with res.timed('compile (%d destinations)' % len(rows), len(rows)):
+		matcher = DestinationMatcher(rows)
+	with res.timed('compiled match', count):
+		for called in calls:
+			matcher.match(called)
+
+	entries = [DestinationEntry(row, rank) for rank, row in enumerate(rows)]
+	scan = max(1, count // 1000)
+	with res.timed('row-by-row scan', scan):
+		for called in calls[:scan]:
+			for ent in entries:
+				if ent.matches(called):
+					break
+
+	infile = io.StringIO('\n'.join('%d,%s,60' % (i, called) for i, called in enumerate(calls)))
+	outfile = io.StringIO()
+	with res.timed('CDR file', count):
+		rate_cdr(matcher, infile, outfile, field=1)
+
+	return res
+
+def run_quota(app=None, count=200000):
+	"""
+	Compute quota period lengths and remaining fractions for a number of
+	synthetic accounts, one at a time and with NumPy arrays.
+	"""
+	import numpy as np
+
+	from netprofile_rates import qpbulk
+
+	res = BenchResults()
+	rnd = random.Random(count)
+	units = ('a_month', 'c_day', 'c_month', 'f_week', 'f_month')
+	base = datetime.datetime(2015, 1, 1)
+	now = base + datetime.timedelta(days=400)
+	qpa = [rnd.randint(1, 3) for i in range(count)]
+	qpu = [rnd.choice(units) for i in range(count)]
+	ends = [now + datetime.timedelta(seconds=rnd.randint(0, 86400 * 90)) for i in range(count)]
+
+	with res.timed('scalar', count):
+		for i in range(count):
+			quota.qp_length(qpa[i], qpu[i], ends[i])
+			quota.percent_remaining(qpa[i], qpu[i], now, ends[i])
+
+	with res.timed('vectorized (with conversion)', count):
+		a_qpa = np.array(qpa)
+		a_qpu = qpbulk.unit_array(qpu)
+		a_ends = qpbulk.dt_array(ends)
+		qpbulk.qp_length(a_qpa, a_qpu, a_ends)
+		qpbulk.percent_remaining(a_qpa, a_qpu, now, a_ends)
+	with res.timed('vectorized', count):
+		qpbulk.qp_length(a_qpa, a_qpu, a_ends)
+		qpbulk.percent_remaining(a_qpa, a_qpu, now, a_ends)
+
+	return res
+
+if __name__ == '__main__':
+	print(run().format())
+
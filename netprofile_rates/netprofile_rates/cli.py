@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Rates module - CLI commands
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import argparse
+import datetime
+import logging
+import random
+
+from cliff.command import Command
+
+class RateCDR(Command):
+	"""
+	Find destinations for all records of a CSV call detail record file.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(RateCDR, self).get_parser(prog_name)
+		parser.add_argument(
+			'-f', '--field',
+			type=int,
+			default=0,
+			help='Zero-based index of the column with called number.'
+		)
+		parser.add_argument(
+			'-d', '--delimiter',
+			default=',',
+			help='Field delimiter.'
+		)
+		parser.add_argument(
+			'-H', '--header',
+			action='store_true',
+			help='First line of input is a header.'
+		)
+		parser.add_argument(
+			'-o', '--output',
+			type=argparse.FileType('w'),
+			default=None,
+			help='Output file, defaults to standard output.'
+		)
+		parser.add_argument(
+			'dsid',
+			type=int,
+			help='Destination set ID.'
+		)
+		parser.add_argument(
+			'input',
+			type=argparse.FileType('r'),
+			help='Input CSV file, or - for standard input.'
+		)
+		return parser
+
+	def take_action(self, args):
+		mm = self.app.mm
+
+		if len(mm.modules) > 0:
+			mm.rescan()
+		else:
+			mm.scan()
+
+		if not mm.load('core'):
+			raise RuntimeError('Unable to proceed without core module.')
+		if not mm.load_enabled():
+			raise RuntimeError('Unable to load enabled modules.')
+
+		from netprofile_rates.dest import (
+			get_matcher,
+			rate_cdr
+		)
+
+		matcher = get_matcher(args.dsid, self.app.db_session)
+		outfile = args.output or self.app.stdout
+		rows, matched = rate_cdr(
+			matcher,
+			args.input,
+			outfile,
+			field=args.field,
+			header=args.header,
+			delimiter=args.delimiter
+		)
+		if args.output:
+			args.output.close()
+		self.log.info('Rated %d records, %d matched a destination.', rows, matched)
+
+
+class CheckQuota(Command):
+	"""
+	Compare quota period functions in netprofile_rates.quota with their
+	SQL counterparts on a number of random inputs.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(CheckQuota, self).get_parser(prog_name)
+		parser.add_argument(
+			'-n', '--count',
+			type=int,
+			default=1000,
+			help='Number of random inputs to check.'
+		)
+		parser.add_argument(
+			'-s', '--seed',
+			type=int,
+			default=None,
+			help='Random seed.'
+		)
+		return parser
+
+	def take_action(self, args):
+		mm = self.app.mm
+
+		if len(mm.modules) > 0:
+			mm.rescan()
+		else:
+			mm.scan()
+
+		if not mm.load('core'):
+			raise RuntimeError('Unable to proceed without core module.')
+		if not mm.load_enabled():
+			raise RuntimeError('Unable to load enabled modules.')
+
+		from sqlalchemy import text
+		from netprofile_rates import quota
+
+		sess = self.app.db_session
+		rnd = random.Random(args.seed)
+		units = (
+			'a_hour', 'a_day', 'a_week', 'a_month',
+			'c_hour', 'c_day', 'c_month',
+			'f_hour', 'f_day', 'f_week', 'f_month'
+		)
+		base = datetime.datetime(2015, 1, 1)
+		stmt = text(
+			'SELECT acct_rate_qpnew(:qpa, :qpu, :ts), '
+			'acct_rate_qplength(:qpa, :qpu, :end), '
+			'acct_rate_qpspent(:qpa, :qpu, :ts, :end), '
+			'acct_rate_percent_spent(:qpa, :qpu, :ts, :end), '
+			'acct_rate_percent_remaining(:qpa, :qpu, :ts, :end)'
+		)
+		stmt_count = text('SELECT acct_rate_qpcount(:qpa, :qpu, :ts, :end)')
+		errors = 0
+
+		for i in range(args.count):
+			qpa = rnd.randint(1, 13)
+			qpu = rnd.choice(units)
+			ts = base + datetime.timedelta(seconds=rnd.randint(0, 86400 * 1461))
+			end = ts + datetime.timedelta(seconds=rnd.randint(0, 86400 * 400))
+			if rnd.random() < 0.2:
+				# Stress month arithmetic on the last days of month.
+				end = end.replace(day=28) + datetime.timedelta(days=rnd.randint(0, 3))
+			params = { 'qpa' : qpa, 'qpu' : qpu, 'ts' : ts, 'end' : end }
+
+			expected = tuple(sess.execute(stmt, params).first())
+			got = (
+				quota.qp_new(qpa, qpu, ts),
+				quota.qp_length(qpa, qpu, end),
+				quota.qp_spent(qpa, qpu, ts, end),
+				quota.percent_spent(qpa, qpu, ts, end),
+				quota.percent_remaining(qpa, qpu, ts, end)
+			)
+			if not qpu.startswith('f_'):
+				expected += (sess.execute(stmt_count, params).scalar(),)
+				got += (quota.qp_count(qpa, qpu, ts, end),)
+			if expected != got:
+				errors += 1
+				self.app.stdout.write('Mismatch for %r: SQL %r, Python %r\n' % (params, expected, got))
+
+		self.log.info('Checked %d inputs, %d mismatched.', args.count, errors)
+		if errors:
+			return 1
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Rates module - Destination matching
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'DestinationEntry',
+	'DestinationMatcher',
+
+	'get_matcher',
+	'rate_destination',
+	'rate_cdr'
+]
+
+import csv
+import logging
+import re
+
+from netprofile.db.connection import DBSession
+from netprofile_rates.models import (
+	Destination,
+	destination_set_generation
+)
+
+logger = logging.getLogger(__name__)
+
+# Python's re used to allow only 100 groups per pattern.
+_REGEX_CHUNK = 90
+
+_POSIX_CLASSES = {
+	'alnum'  : 'a-zA-Z0-9',
+	'alpha'  : 'a-zA-Z',
+	'blank'  : ' \\t',
+	'cntrl'  : '\\x00-\\x1f\\x7f',
+	'digit'  : '0-9',
+	'graph'  : '\\x21-\\x7e',
+	'lower'  : 'a-z',
+	'print'  : '\\x20-\\x7e',
+	'punct'  : '!-/:-@\\[-`{-~',
+	'space'  : ' \\t\\r\\n\\v\\f',
+	'upper'  : 'A-Z',
+	'xdigit' : '0-9A-Fa-f'
+}
+
+_posix_class_rx = re.compile(r'\[:([a-z]+):\]')
+
+def _posix_regex(pattern):
+	"""
+	Convert MySQL REGEXP pattern to Python syntax.
+	"""
+	pattern = pattern.replace('[[:<:]]', r'\b').replace('[[:>:]]', r'\b')
+	return _posix_class_rx.sub(lambda m: _POSIX_CLASSES.get(m.group(1), m.group(0)), pattern)
+
+def _anchored(pattern):
+	return pattern.startswith('^') and ('|' not in pattern)
+
+class DestinationEntry(object):
+	"""
+	Single compiled destination.
+	"""
+	__slots__ = (
+		'id', 'type', 'match_type', 'match',
+		'overquota_sum_seconds', 'overquota_multiplier_seconds',
+		'cb_acct', 'rank'
+	)
+
+	def __init__(self, row, rank):
+		(
+			self.id,
+			self.type,
+			self.match_type,
+			self.match,
+			self.overquota_sum_seconds,
+			self.overquota_multiplier_seconds,
+			self.cb_acct
+		) = row
+		self.match_type = getattr(self.match_type, 'value', self.match_type)
+		self.rank = rank
+
+	def matches(self, called):
+		match = self.match
+		if match is None:
+			return False
+		mt = self.match_type
+		if mt == 'exact':
+			return called == match
+		if mt == 'prefix':
+			return called.startswith(match)
+		if mt == 'suffix':
+			return called.endswith(match)
+		if mt == 'regex':
+			try:
+				return re.search(_posix_regex(match), called, re.DOTALL) is not None
+			except re.error:
+				return False
+		return False
+
+	def overquota_sum(self, oqsum_sec):
+		"""
+		Apply over quota per second override or multiplier.
+		"""
+		if self.overquota_sum_seconds is not None:
+			return self.overquota_sum_seconds
+		if (self.overquota_multiplier_seconds is not None) and (oqsum_sec is not None):
+			return oqsum_sec * self.overquota_multiplier_seconds
+		return oqsum_sec
+
+def _trie_insert(root, key, rank):
+	node = root
+	for ch in key:
+		nxt = node[1].get(ch)
+		if nxt is None:
+			nxt = node[1][ch] = [None, {}]
+		node = nxt
+	if node[0] is None:
+		node[0] = rank
+
+def _trie_settle(node, inherited):
+	# Replace every node's rank with the best rank seen on the way down.
+	# Lookup then only needs to find the deepest node on the path.
+	stack = [(node, inherited)]
+	while stack:
+		node, inherited = stack.pop()
+		rank = node[0]
+		if (inherited is not None) and ((rank is None) or (inherited < rank)):
+			rank = node[0] = inherited
+		for child in node[1].values():
+			stack.append((child, rank))
+
+def _trie_lookup(root, key):
+	node = root
+	best = node[0]
+	for ch in key:
+		node = node[1].get(ch)
+		if node is None:
+			break
+		if node[0] is not None:
+			best = node[0]
+	return best
+
+class DestinationMatcher(object):
+	"""
+	Compiled destination set.
+
+	Returns the same destination that acct_rate_dest would find, which is
+	the first matching active destination in lookup order. Exact matches
+	are looked up in a dict, prefixes and suffixes in character tries, and
+	regular expressions are combined into a few alternations ordered by
+	lookup order.
+	"""
+	def __init__(self, rows):
+		self.entries = []
+		self.by_id = {}
+		self.exact = {}
+		self.prefixes = [None, {}]
+		self.suffixes = [None, {}]
+		self.regex = []
+
+		regex = []
+		for row in rows:
+			ent = DestinationEntry(row, len(self.entries))
+			self.entries.append(ent)
+			self.by_id[ent.id] = ent
+			if ent.match is None:
+				continue
+			mt = ent.match_type
+			if mt == 'exact':
+				self.exact.setdefault(ent.match, ent.rank)
+			elif mt == 'prefix':
+				_trie_insert(self.prefixes, ent.match, ent.rank)
+			elif mt == 'suffix':
+				_trie_insert(self.suffixes, reversed(ent.match), ent.rank)
+			elif mt == 'regex':
+				try:
+					rx = _posix_regex(ent.match)
+					re.compile(rx)
+				except re.error as e:
+					logger.warning('Skipping destination %s with invalid regex %r: %s', ent.id, ent.match, e)
+					continue
+				regex.append((ent.rank, rx))
+		_trie_settle(self.prefixes, None)
+		_trie_settle(self.suffixes, None)
+
+		# Alternatives are all tried at the start of the string, each
+		# skipping ahead on its own, so the first alternative in lookup
+		# order that matches anywhere wins. Anchored ones need no skipping.
+		for i in range(0, len(regex), _REGEX_CHUNK):
+			chunk = regex[i:i + _REGEX_CHUNK]
+			rx = re.compile('|'.join(
+				('(?P<d%d>%s)' if _anchored(rx) else '(?P<d%d>.*?(?:%s))') % (rank, rx)
+				for rank, rx in chunk
+			), re.DOTALL)
+			self.regex.append((chunk[0][0], rx))
+
+	def __len__(self):
+		return len(self.entries)
+
+	def match(self, called, destid=None):
+		"""
+		Find destination for called number or address. If destid is given,
+		only that destination is checked. Returns DestinationEntry object
+		or None.
+		"""
+		if called is None:
+			return None
+		if destid is not None:
+			ent = self.by_id.get(destid)
+			if (ent is not None) and ent.matches(called):
+				return ent
+			return None
+
+		best = self.exact.get(called)
+		rank = _trie_lookup(self.prefixes, called)
+		if (rank is not None) and ((best is None) or (rank < best)):
+			best = rank
+		rank = _trie_lookup(self.suffixes, reversed(called))
+		if (rank is not None) and ((best is None) or (rank < best)):
+			best = rank
+		for first, rx in self.regex:
+			if (best is not None) and (first >= best):
+				break
+			m = rx.match(called)
+			if m is not None:
+				rank = int(m.lastgroup[1:])
+				if (best is None) or (rank < best):
+					best = rank
+				break
+
+		if best is None:
+			return None
+		return self.entries[best]
+
+_matchers = {}
+
+def get_matcher(dsid, sess=None):
+	"""
+	Get compiled matcher for a destination set. Matchers are kept per
+	process and rebuilt after the set is modified.
+	"""
+	gen = destination_set_generation(dsid)
+	cached = _matchers.get(dsid)
+	if (cached is not None) and (cached[0] == gen):
+		return cached[1]
+	if sess is None:
+		sess = DBSession()
+	q = sess.query(
+		Destination.id,
+		Destination.type,
+		Destination.match_type,
+		Destination.match_string,
+		Destination.overquota_sum_seconds,
+		Destination.overquota_multiplier_seconds,
+		Destination.cb_acct
+	).filter(
+		Destination.set_id == dsid,
+		Destination.active == True
+	).order_by(
+		Destination.lookup_order,
+		Destination.id
+	)
+	matcher = DestinationMatcher(q)
+	_matchers[dsid] = (gen, matcher)
+	return matcher
+
+def rate_destination(dsid, called, oqsum_sec=None, destid=None, sess=None):
+	"""
+	Python counterpart of acct_rate_dest procedure. Returns a tuple of
+	(destination ID, destination type, over quota per second sum), or
+	(destid, None, oqsum_sec) if nothing matches.
+	"""
+	ent = get_matcher(dsid, sess).match(called, destid)
+	if ent is None:
+		return (destid, None, oqsum_sec)
+	return (ent.id, ent.type, ent.overquota_sum(oqsum_sec))
+
+def rate_cdr(matcher, infile, outfile, field=0, header=False, delimiter=','):
+	"""
+	Rate a CSV file of call detail records in one pass. Called number is
+	taken from the column with index field. Each row is written to outfile
+	with destination ID and type appended, or empty columns if there was
+	no match. Returns tuple of (number of rows, number of matched rows).
+	"""
+	reader = csv.reader(infile, delimiter=delimiter)
+	writer = csv.writer(outfile, delimiter=delimiter, lineterminator='\n')
+	match = matcher.match
+	rows = matched = 0
+
+	if header:
+		row = next(reader, None)
+		if row is None:
+			return (0, 0)
+		writer.writerow(row + ['destid', 'dtype'])
+	for row in reader:
+		rows += 1
+		ent = None
+		if len(row) > field:
+			ent = match(row[field])
+		if ent is None:
+			writer.writerow(row + ['', ''])
+		else:
+			matched += 1
+			writer.writerow(row + [ent.id, getattr(ent.type, 'value', ent.type)])
+	return (rows, matched)
+
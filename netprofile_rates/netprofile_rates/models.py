@@ -46,9 +46,13 @@ __all__ = [
 	'AcctRateQPCountFunction',
 	'AcctRateQPLengthFunction',
 	'AcctRateQPNewFunction',
-	'AcctRateQPSpentFunction'
+	'AcctRateQPSpentFunction',
+
+	'destination_set_generation'
 ]
 
+import uuid
+
 from sqlalchemy import (
 	Column,
 	DateTime,
@@ -59,6 +63,7 @@ from sqlalchemy import (
 	TIMESTAMP,
 	Unicode,
 	UnicodeText,
+	event,
 	text
 )
 
@@ -66,9 +71,11 @@ from sqlalchemy.orm import (
 	backref,
 	relationship
 )
+from sqlalchemy.orm.attributes import get_history
 
 from sqlalchemy.ext.associationproxy import association_proxy
 
+from netprofile.common.cache import cache
 from netprofile.db.connection import (
 	Base,
 	DBSession
@@ -536,6 +543,26 @@ class Destination(Base):
 	def __str__(self):
 		return '%s' % str(self.name)
 
+@cache.cache_on_arguments()
+def destination_set_generation(dsid):
+	"""
+	Opaque token which changes whenever destinations of a set are modified.
+	"""
+	return uuid.uuid4().hex
+
+def _mod_destination(mapper, conn, tgt):
+	for dsid in get_history(tgt, 'set_id').sum():
+		if dsid is not None:
+			destination_set_generation.invalidate(dsid)
+
+def _mod_destination_set(mapper, conn, tgt):
+	destination_set_generation.invalidate(tgt.id)
+
+event.listen(Destination, 'after_delete', _mod_destination)
+event.listen(Destination, 'after_insert', _mod_destination)
+event.listen(Destination, 'after_update', _mod_destination)
+event.listen(DestinationSet, 'after_delete', _mod_destination_set)
+
 class FilterSet(Base):
 	"""
 	Accounting filter set definition
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Rates module - Vectorized quota period arithmetic
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+NumPy-backed counterparts of the functions in netprofile_rates.quota.
+
+Timestamps are handled as datetime64[s] arrays, and lengths of time as
+int64 arrays of seconds. Quota period amount and unit can be given either
+as scalars or as arrays of the same shape as the timestamps. Fractions
+are returned as float64 arrays rounded to four decimal places, with NaN
+standing for NULL.
+
+This module requires NumPy, which is not a hard dependency of NetProfile.
+"""
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import numpy as np
+
+from netprofile_rates.quota import QP_ABSOLUTE
+
+__all__ = [
+	'dt_array',
+	'unit_array',
+
+	'qp_new',
+	'qp_end',
+	'qp_cutoff',
+	'qp_length',
+	'qp_spent',
+	'qp_count',
+	'percent_spent',
+	'percent_remaining'
+]
+
+_DT = 'datetime64[s]'
+_TD = 'timedelta64[s]'
+
+_SHIFT_SECONDS = {
+	'hour' : 3600,
+	'day'  : 86400,
+	'week' : 604800
+}
+
+def dt_array(values):
+	"""
+	Build datetime64[s] array from an iterable of datetime objects. None
+	values become NaT.
+	"""
+	if isinstance(values, np.ndarray):
+		return values.astype(_DT)
+	return np.array(list(values), dtype=_DT)
+
+def unit_array(values):
+	"""
+	Build array of quota period unit names from an iterable of strings or
+	QuotaPeriodUnit values.
+	"""
+	return np.array([getattr(u, 'value', u) for u in values], dtype=object)
+
+def _seconds(td):
+	return td.astype(_TD).astype(np.int64)
+
+def _add_months(ts, n):
+	# Same as MySQL: day of month is clamped to the length of target month.
+	months = ts.astype('datetime64[M]')
+	days = ts.astype('datetime64[D]')
+	mday = (days - months.astype('datetime64[D]')).astype(np.int64)
+	target = months + n.astype('timedelta64[M]')
+	tdays = target.astype('datetime64[D]')
+	mlen = ((target + 1).astype('datetime64[D]') - tdays).astype(np.int64)
+	return tdays + np.minimum(mday, mlen - 1).astype('timedelta64[D]') + (ts - days)
+
+def _shift(ts, unit, n):
+	if unit == 'month':
+		return _add_months(ts, n)
+	return ts + (n * _SHIFT_SECONDS[unit]).astype(_TD)
+
+def _truncate(ts, unit):
+	return ts.astype('datetime64[%s]' % unit).astype(_DT)
+
+def _by_unit(func, dtype, qpa, qpu, *times):
+	"""
+	Broadcast arguments and call func(unit, qpa, *times) for each distinct
+	quota period unit.
+	"""
+	times = [t.astype(_DT) if isinstance(t, np.ndarray) else np.asarray(t, dtype=_DT) for t in times]
+	args = np.broadcast_arrays(np.asarray(qpa, dtype=np.int64), *times)
+	if isinstance(qpu, np.ndarray) and qpu.ndim:
+		qpu = np.broadcast_to(qpu, args[0].shape)
+		out = np.zeros(args[0].shape, dtype=dtype)
+		for unit in set(qpu.ravel().tolist()):
+			mask = (qpu == unit)
+			out[mask] = func(getattr(unit, 'value', unit), *(a[mask] for a in args))
+		return out
+	return np.asarray(func(getattr(qpu, 'value', qpu), *args), dtype=dtype)
+
+def _qp_new(unit, qpa, ts):
+	if unit in QP_ABSOLUTE:
+		return QP_ABSOLUTE[unit] * qpa
+	if unit == 'c_hour':
+		end = _truncate(_shift(ts, 'hour', qpa - 1), 'h') + np.timedelta64(3599, 's')
+	elif unit == 'c_day':
+		end = _truncate(_shift(ts, 'day', qpa - 1), 'D') + np.timedelta64(86399, 's')
+	elif unit == 'c_month':
+		end = (_add_months(ts, qpa - 1).astype('datetime64[M]') + 1).astype(_DT) - np.timedelta64(1, 's')
+	elif unit in ('f_hour', 'f_day', 'f_week', 'f_month'):
+		end = _shift(ts, unit[2:], qpa)
+	else:
+		return np.zeros(ts.shape, dtype=np.int64)
+	return np.where(np.isnat(ts), 0, np.maximum(0, _seconds(end - ts)))
+
+def qp_new(qpa, qpu, ts):
+	"""
+	Vectorized acct_rate_qpnew. Returns lengths in seconds of new quota
+	periods starting at ts.
+	"""
+	return _by_unit(_qp_new, np.int64, qpa, qpu, ts)
+
+def qp_end(qpa, qpu, ts):
+	"""
+	Ends of new quota periods starting at ts.
+	"""
+	ts = np.asarray(ts, dtype=_DT)
+	return ts + qp_new(qpa, qpu, ts).astype(_TD)
+
+def _qp_cutoff(unit, qpa, endtime):
+	if unit in QP_ABSOLUTE:
+		return endtime - (QP_ABSOLUTE[unit] * qpa).astype(_TD)
+	if unit in ('f_hour', 'f_day', 'f_week', 'f_month'):
+		return _shift(endtime, unit[2:], -qpa)
+	if unit == 'c_hour':
+		return _truncate(_shift(endtime, 'hour', 1 - qpa), 'h')
+	if unit == 'c_day':
+		return _truncate(_shift(endtime, 'day', 1 - qpa), 'D')
+	if unit == 'c_month':
+		return _truncate(_shift(endtime, 'month', 1 - qpa), 'M')
+	raise ValueError('Unknown quota period unit: %r' % (unit,))
+
+def qp_cutoff(qpa, qpu, endtime):
+	"""
+	Starts of quota periods ending at endtime.
+	"""
+	return _by_unit(_qp_cutoff, _DT, qpa, qpu, endtime)
+
+def qp_length(qpa, qpu, endtime):
+	"""
+	Vectorized acct_rate_qplength.
+	"""
+	endtime = np.asarray(endtime, dtype=_DT)
+	return np.maximum(0, _seconds(endtime - qp_cutoff(qpa, qpu, endtime)))
+
+def qp_spent(qpa, qpu, ts, endtime):
+	"""
+	Vectorized acct_rate_qpspent.
+	"""
+	ts = np.asarray(ts, dtype=_DT)
+	return np.maximum(0, _seconds(ts - qp_cutoff(qpa, qpu, endtime)))
+
+def _qp_count(unit, qpa, dfrom, dto):
+	if unit in QP_ABSOLUTE:
+		return np.floor_divide(_seconds(dto - dfrom), QP_ABSOLUTE[unit] * qpa)
+	if unit == 'c_hour':
+		secs = _seconds(dto - dfrom)
+		return np.floor_divide(np.sign(secs) * (np.abs(secs) // 3600), qpa)
+	if unit == 'c_day':
+		days = (dto.astype('datetime64[D]') - dfrom.astype('datetime64[D]')).astype(np.int64)
+		return np.floor_divide(days, qpa)
+	if unit == 'c_month':
+		# Same as TIMESTAMPDIFF(MONTH, ...): only complete months are counted.
+		m_from = dfrom.astype('datetime64[M]')
+		m_to = dto.astype('datetime64[M]')
+		months = (m_to - m_from).astype(np.int64)
+		tail_from = _seconds(dfrom - m_from.astype(_DT))
+		tail_to = _seconds(dto - m_to.astype(_DT))
+		months = months - ((months > 0) & (tail_to < tail_from)) + ((months < 0) & (tail_to > tail_from))
+		return np.floor_divide(months, qpa)
+	raise ValueError('Quota period unit %r is not supported by acct_rate_qpcount' % (unit,))
+
+def qp_count(qpa, qpu, dfrom, dto):
+	"""
+	Vectorized acct_rate_qpcount.
+	"""
+	return np.maximum(0, _by_unit(_qp_count, np.int64, qpa, qpu, dfrom, dto))
+
+def _ratio(num, den):
+	# Integer division in MySQL yields four decimal places, rounded half up.
+	num, den = np.broadcast_arrays(num, den)
+	safe = np.where(den == 0, 1, den)
+	return np.where(den == 0, np.nan, ((num * 20000 + safe) // (2 * safe)) / 10000.0)
+
+def percent_spent(qpa, qpu, ts, endtime):
+	"""
+	Vectorized acct_rate_percent_spent.
+	"""
+	return _ratio(qp_spent(qpa, qpu, ts, endtime), qp_length(qpa, qpu, endtime))
+
+def percent_remaining(qpa, qpu, ts, endtime):
+	"""
+	Vectorized acct_rate_percent_remaining.
+	"""
+	ts = np.asarray(ts, dtype=_DT)
+	endtime = np.asarray(endtime, dtype=_DT)
+	return _ratio(np.maximum(0, _seconds(endtime - ts)), qp_length(qpa, qpu, endtime))
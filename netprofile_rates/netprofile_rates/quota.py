@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Rates module - Quota period arithmetic
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Python counterparts of quota period SQL functions (acct_rate_qpnew,
+acct_rate_qplength, acct_rate_qpspent, acct_rate_qpcount,
+acct_rate_percent_spent and acct_rate_percent_remaining).
+
+Timestamps are naive datetime objects, same as DATETIME values stored in
+the database. Sub-second parts are ignored, and differences are taken as
+if the database server ran in UTC.
+"""
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'QP_ABSOLUTE',
+
+	'add_months',
+	'qp_new',
+	'qp_end',
+	'qp_cutoff',
+	'qp_length',
+	'qp_spent',
+	'qp_count',
+	'percent_spent',
+	'percent_remaining',
+	'funds_last_until'
+]
+
+import calendar
+import datetime
+import decimal
+import heapq
+
+# Fixed lengths of absolute quota period units, in seconds.
+QP_ABSOLUTE = {
+	'a_hour'  : 3600,
+	'a_day'   : 86400,
+	'a_week'  : 604800,
+	'a_month' : 2592000
+}
+
+_PERCENT_QUANT = decimal.Decimal('0.0001')
+
+def _unit(qpu):
+	return getattr(qpu, 'value', qpu)
+
+def _diff(a, b):
+	return int((a.replace(microsecond=0) - b.replace(microsecond=0)).total_seconds())
+
+def add_months(ts, months):
+	"""
+	Add months to a timestamp. Same as MySQL, day of month is clamped to
+	the length of target month.
+	"""
+	month = ts.month - 1 + months
+	year = ts.year + month // 12
+	month = month % 12 + 1
+	day = min(ts.day, calendar.monthrange(year, month)[1])
+	return ts.replace(year=year, month=month, day=day)
+
+def _shift(ts, unit, n):
+	if unit == 'hour':
+		return ts + datetime.timedelta(hours=n)
+	if unit == 'day':
+		return ts + datetime.timedelta(days=n)
+	if unit == 'week':
+		return ts + datetime.timedelta(weeks=n)
+	return add_months(ts, n)
+
+def qp_new(qpa, qpu, ts):
+	"""
+	Python counterpart of acct_rate_qpnew. Returns length in seconds of a
+	new quota period starting at ts.
+	"""
+	qpu = _unit(qpu)
+	if (ts is None) or (qpu in QP_ABSOLUTE):
+		return QP_ABSOLUTE.get(qpu, 0) * qpa
+	if qpu == 'c_hour':
+		end = ts + datetime.timedelta(hours=qpa - 1)
+		end = end.replace(minute=59, second=59, microsecond=0)
+	elif qpu == 'c_day':
+		end = ts + datetime.timedelta(days=qpa - 1)
+		end = end.replace(hour=23, minute=59, second=59, microsecond=0)
+	elif qpu == 'c_month':
+		end = add_months(ts, qpa - 1)
+		end = end.replace(
+			day=calendar.monthrange(end.year, end.month)[1],
+			hour=23, minute=59, second=59, microsecond=0
+		)
+	elif qpu in ('f_hour', 'f_day', 'f_week', 'f_month'):
+		end = _shift(ts, qpu[2:], qpa)
+	else:
+		return 0
+	return max(0, _diff(end, ts))
+
+def qp_end(qpa, qpu, ts):
+	"""
+	End of a new quota period starting at ts.
+	"""
+	return ts.replace(microsecond=0) + datetime.timedelta(seconds=qp_new(qpa, qpu, ts))
+
+def qp_cutoff(qpa, qpu, endtime):
+	"""
+	Start of quota period ending at endtime, as used by acct_rate_qplength
+	and acct_rate_qpspent.
+	"""
+	qpu = _unit(qpu)
+	endtime = endtime.replace(microsecond=0)
+	if qpu in QP_ABSOLUTE:
+		return endtime - datetime.timedelta(seconds=QP_ABSOLUTE[qpu] * qpa)
+	if qpu in ('f_hour', 'f_day', 'f_week', 'f_month'):
+		return _shift(endtime, qpu[2:], -qpa)
+	if qpu == 'c_hour':
+		return _shift(endtime, 'hour', 1 - qpa).replace(minute=0, second=0)
+	if qpu == 'c_day':
+		return _shift(endtime, 'day', 1 - qpa).replace(hour=0, minute=0, second=0)
+	if qpu == 'c_month':
+		return _shift(endtime, 'month', 1 - qpa).replace(day=1, hour=0, minute=0, second=0)
+	raise ValueError('Unknown quota period unit: %r' % (qpu,))
+
+def qp_length(qpa, qpu, endtime):
+	"""
+	Python counterpart of acct_rate_qplength. Returns length in seconds of
+	quota period ending at endtime.
+	"""
+	return max(0, _diff(endtime, qp_cutoff(qpa, qpu, endtime)))
+
+def qp_spent(qpa, qpu, ts, endtime):
+	"""
+	Python counterpart of acct_rate_qpspent. Returns number of seconds
+	of quota period ending at endtime that have passed by ts.
+	"""
+	return max(0, _diff(ts, qp_cutoff(qpa, qpu, endtime)))
+
+def _month_diff(dfrom, dto):
+	# Same as TIMESTAMPDIFF(MONTH, ...): only complete months are counted.
+	months = (dto.year - dfrom.year) * 12 + dto.month - dfrom.month
+	tail_from = (dfrom.day, dfrom.time())
+	tail_to = (dto.day, dto.time())
+	if (months > 0) and (tail_to < tail_from):
+		months -= 1
+	elif (months < 0) and (tail_to > tail_from):
+		months += 1
+	return months
+
+def qp_count(qpa, qpu, dfrom, dto):
+	"""
+	Python counterpart of acct_rate_qpcount. Returns number of complete
+	quota periods between two timestamps. Floating units are not supported
+	by the SQL function, so ValueError is raised for them.
+	"""
+	qpu = _unit(qpu)
+	dfrom = dfrom.replace(microsecond=0)
+	dto = dto.replace(microsecond=0)
+	if qpu in QP_ABSOLUTE:
+		n = _diff(dto, dfrom) // (QP_ABSOLUTE[qpu] * qpa)
+	elif qpu == 'c_hour':
+		secs = _diff(dto, dfrom)
+		hours = abs(secs) // 3600
+		n = (hours if secs >= 0 else -hours) // qpa
+	elif qpu == 'c_day':
+		n = (dto.date() - dfrom.date()).days // qpa
+	elif qpu == 'c_month':
+		n = _month_diff(dfrom, dto) // qpa
+	else:
+		raise ValueError('Quota period unit %r is not supported by acct_rate_qpcount' % (qpu,))
+	return max(0, n)
+
+def _ratio(num, den):
+	if den == 0:
+		return None
+	# Integer division in MySQL yields four decimal places, rounded half up.
+	return (decimal.Decimal(num) / decimal.Decimal(den)).quantize(_PERCENT_QUANT, rounding=decimal.ROUND_HALF_UP)
+
+def percent_spent(qpa, qpu, ts, endtime):
+	"""
+	Python counterpart of acct_rate_percent_spent. Returns Decimal fraction
+	of quota period that has passed by ts, or None for empty periods.
+	"""
+	return _ratio(qp_spent(qpa, qpu, ts, endtime), qp_length(qpa, qpu, endtime))
+
+def percent_remaining(qpa, qpu, ts, endtime):
+	"""
+	Python counterpart of acct_rate_percent_remaining. Returns Decimal
+	fraction of quota period that is left after ts, or None for empty
+	periods.
+	"""
+	return _ratio(max(0, _diff(endtime, ts)), qp_length(qpa, qpu, endtime))
+
+def funds_last_until(amount, credit, plans, until=None, max_periods=1000):
+	"""
+	Forecast when stash funds run out. Plans is an iterable of tuples of
+	(quota period amount, quota period unit, current quota period end,
+	periodic sum), one for each account that draws from the stash. Every
+	account is charged its periodic sum at the end of each quota period,
+	while stash amount plus credit covers it.
+
+	Returns end of the last quota period that can be paid for, or None
+	if funds last beyond until or max_periods charges. Traffic and rate
+	modifiers are not taken into account.
+	"""
+	balance = decimal.Decimal(amount or 0) + decimal.Decimal(credit or 0)
+	heap = []
+	for idx, (qpa, qpu, qpend, qsum) in enumerate(plans):
+		if (qpend is None) or (not qsum) or (qsum <= 0):
+			continue
+		heap.append((qpend, idx, qpa, qpu, decimal.Decimal(qsum)))
+	heapq.heapify(heap)
+	for i in range(max_periods):
+		if not heap:
+			return None
+		qpend, idx, qpa, qpu, qsum = heap[0]
+		if (until is not None) and (qpend > until):
+			return None
+		if balance < qsum:
+			return qpend
+		balance -= qsum
+		# Calendar periods end a second before the next one starts.
+		start = qpend
+		if _unit(qpu) in ('c_hour', 'c_day', 'c_month'):
+			start += datetime.timedelta(seconds=1)
+		nextend = qp_end(qpa, qpu, start)
+		if nextend <= qpend:
+			heapq.heappop(heap)
+		else:
+			heapq.heapreplace(heap, (nextend, idx, qpa, qpu, qsum))
+	return None
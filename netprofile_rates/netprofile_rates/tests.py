@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Rates module - Tests
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime as dt
+import decimal
+import unittest
+
+from netprofile_rates import quota
+
+try:
+	import numpy as np
+	from netprofile_rates import qpbulk
+except ImportError:
+	np = None
+	qpbulk = None
+
+class TestQuota(unittest.TestCase):
+	def test_add_months_clamps_day(self):
+		self.assertEqual(quota.add_months(dt.datetime(2015, 1, 31, 10), 1), dt.datetime(2015, 2, 28, 10))
+		self.assertEqual(quota.add_months(dt.datetime(2016, 1, 31), 1), dt.datetime(2016, 2, 29))
+		self.assertEqual(quota.add_months(dt.datetime(2015, 3, 31), -1), dt.datetime(2015, 2, 28))
+		self.assertEqual(quota.add_months(dt.datetime(2015, 12, 15), 1), dt.datetime(2016, 1, 15))
+		self.assertEqual(quota.add_months(dt.datetime(2015, 1, 15), -13), dt.datetime(2013, 12, 15))
+
+	def test_qp_new(self):
+		ts = dt.datetime(2015, 2, 10, 12, 0, 0)
+		self.assertEqual(quota.qp_new(2, 'a_day', ts), 172800)
+		self.assertEqual(quota.qp_new(1, 'a_day', None), 86400)
+		self.assertEqual(quota.qp_new(1, 'c_day', ts), 43199)
+		self.assertEqual(quota.qp_new(1, 'c_month', ts), 18 * 86400 + 43199)
+		self.assertEqual(quota.qp_new(2, 'c_hour', dt.datetime(2015, 2, 10, 12, 30)), 5399)
+		self.assertEqual(quota.qp_new(1, 'f_month', dt.datetime(2015, 1, 31)), 28 * 86400)
+		self.assertEqual(quota.qp_new(1, 'bogus', ts), 0)
+
+	def test_calendar_boundaries(self):
+		end = dt.datetime(2015, 2, 28, 23, 59, 59)
+		self.assertEqual(quota.qp_cutoff(1, 'c_month', end), dt.datetime(2015, 2, 1))
+		self.assertEqual(quota.qp_length(1, 'c_month', end), 28 * 86400 - 1)
+		self.assertEqual(quota.qp_cutoff(3, 'c_month', end), dt.datetime(2014, 12, 1))
+		self.assertEqual(quota.qp_cutoff(1, 'c_day', end), dt.datetime(2015, 2, 28))
+		self.assertEqual(quota.qp_cutoff(2, 'c_hour', end), dt.datetime(2015, 2, 28, 22))
+		self.assertEqual(quota.qp_end(1, 'c_day', dt.datetime(2015, 2, 28, 23, 59, 59)), end)
+		with self.assertRaises(ValueError):
+			quota.qp_cutoff(1, 'bogus', end)
+
+	def test_qp_count(self):
+		self.assertEqual(quota.qp_count(1, 'c_day', dt.datetime(2015, 1, 1, 23, 59, 59), dt.datetime(2015, 1, 2)), 1)
+		self.assertEqual(quota.qp_count(1, 'c_hour', dt.datetime(2015, 1, 1, 10, 59, 59), dt.datetime(2015, 1, 1, 11)), 0)
+		self.assertEqual(quota.qp_count(1, 'c_month', dt.datetime(2015, 1, 31), dt.datetime(2015, 2, 28)), 0)
+		self.assertEqual(quota.qp_count(1, 'c_month', dt.datetime(2015, 1, 15), dt.datetime(2015, 3, 15)), 2)
+		self.assertEqual(quota.qp_count(2, 'c_month', dt.datetime(2015, 1, 15), dt.datetime(2015, 3, 15)), 1)
+		self.assertEqual(quota.qp_count(1, 'a_day', dt.datetime(2015, 1, 2), dt.datetime(2015, 1, 1)), 0)
+
+	def test_qp_count_rejects_floating_units(self):
+		for qpu in ('f_hour', 'f_day', 'f_week', 'f_month'):
+			with self.assertRaises(ValueError):
+				quota.qp_count(1, qpu, dt.datetime(2015, 1, 1), dt.datetime(2015, 2, 1))
+
+	def test_percent_rounding(self):
+		end = dt.datetime(2015, 1, 8)
+		# 18900 / 604800 is exactly 0.03125, which must round half up.
+		ts = end - dt.timedelta(seconds=604800 - 18900)
+		self.assertEqual(quota.percent_spent(1, 'a_week', ts, end), decimal.Decimal('0.0313'))
+		self.assertEqual(quota.percent_remaining(1, 'a_week', ts, end), decimal.Decimal('0.9688'))
+		ts = end - dt.timedelta(hours=16)
+		self.assertEqual(quota.percent_spent(1, 'a_day', ts, end), decimal.Decimal('0.3333'))
+		self.assertEqual(quota.percent_remaining(1, 'a_day', ts, end), decimal.Decimal('0.6667'))
+		self.assertIsNone(quota.percent_spent(0, 'a_day', ts, end))
+
+	def test_funds_last_until(self):
+		plans = ((1, 'c_month', dt.datetime(2015, 1, 31, 23, 59, 59), 10),)
+		self.assertEqual(quota.funds_last_until(25, 0, plans), dt.datetime(2015, 3, 31, 23, 59, 59))
+		self.assertEqual(quota.funds_last_until(25, 10, plans), dt.datetime(2015, 4, 30, 23, 59, 59))
+		self.assertIsNone(quota.funds_last_until(25, 0, plans, until=dt.datetime(2015, 3, 1)))
+
+def _to_float(value):
+	return None if value is None else float(value)
+
+def _nan_to_none(arr):
+	return [None if np.isnan(v) else v for v in arr.tolist()]
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class TestQuotaBulk(unittest.TestCase):
+	UNITS = ('a_hour', 'a_day', 'a_week', 'a_month', 'c_hour', 'c_day', 'c_month', 'f_hour', 'f_day', 'f_week', 'f_month')
+
+	def setUp(self):
+		base = dt.datetime(2015, 1, 31, 23, 59, 59)
+		self.times = [base + dt.timedelta(seconds=s) for s in (0, 1, 3600 * 7 + 13, 86400 * 29, 86400 * 366 + 1799)]
+
+	def test_add_months(self):
+		ts = qpbulk.dt_array([dt.datetime(2015, 1, 31, 10), dt.datetime(2016, 1, 31), dt.datetime(2015, 3, 31)])
+		res = qpbulk._add_months(ts, np.array([1, 1, -1]))
+		self.assertEqual(res.tolist(), [dt.datetime(2015, 2, 28, 10), dt.datetime(2016, 2, 29), dt.datetime(2015, 2, 28)])
+
+	def test_matches_quota(self):
+		ts = qpbulk.dt_array(self.times)
+		for qpu in self.UNITS:
+			for qpa in (1, 2, 3):
+				self.assertEqual(
+					qpbulk.qp_new(qpa, qpu, ts).tolist(),
+					[quota.qp_new(qpa, qpu, t) for t in self.times],
+					(qpa, qpu)
+				)
+				self.assertEqual(
+					qpbulk.qp_cutoff(qpa, qpu, ts).tolist(),
+					[quota.qp_cutoff(qpa, qpu, t) for t in self.times],
+					(qpa, qpu)
+				)
+				for start in self.times:
+					self.assertEqual(
+						_nan_to_none(qpbulk.percent_spent(qpa, qpu, qpbulk.dt_array([start] * len(self.times)), ts)),
+						[_to_float(quota.percent_spent(qpa, qpu, start, t)) for t in self.times],
+						(qpa, qpu, start)
+					)
+					if qpu.startswith('f_'):
+						continue
+					self.assertEqual(
+						qpbulk.qp_count(qpa, qpu, qpbulk.dt_array([start] * len(self.times)), ts).tolist(),
+						[quota.qp_count(qpa, qpu, start, t) for t in self.times],
+						(qpa, qpu, start)
+					)
+
+	def test_mixed_units(self):
+		ts = qpbulk.dt_array(self.times[:3])
+		units = qpbulk.unit_array(['c_month', 'f_day', 'a_hour'])
+		self.assertEqual(
+			qpbulk.qp_new(1, units, ts).tolist(),
+			[quota.qp_new(1, u, t) for u, t in zip(units, self.times[:3])]
+		)
+
+	def test_qp_count_rejects_floating_units(self):
+		ts = qpbulk.dt_array(self.times)
+		with self.assertRaises(ValueError):
+			qpbulk.qp_count(1, 'f_day', ts, ts)
+		with self.assertRaises(ValueError):
+			qpbulk.qp_count(1, qpbulk.unit_array(['c_day'] * 4 + ['f_month']), ts, ts)
+
+	def test_percent_rounding(self):
+		end = qpbulk.dt_array([dt.datetime(2015, 1, 8)])
+		ts = end - np.timedelta64(604800 - 18900, 's')
+		self.assertEqual(qpbulk.percent_spent(1, 'a_week', ts, end).tolist(), [0.0313])
+		self.assertTrue(np.isnan(qpbulk.percent_spent(0, 'a_day', ts, end)).all())
@@ -50,6 +50,12 @@ setup(
 	entry_points="""\
 		[netprofile.modules]
 		rates = netprofile_rates:Module
+		[netprofile.cli.commands]
+		rate cdr = netprofile_rates.cli:RateCDR
+		rate qpcheck = netprofile_rates.cli:CheckQuota
+		[netprofile.benchmarks]
+		rates_dest = netprofile_rates.bench:run
+		rates_quota = netprofile_rates.bench:run_quota
 	""",
 	message_extractors={'.' : [
 		('**.py', 'python', None),
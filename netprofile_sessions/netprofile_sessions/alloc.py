@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Sessions module - In-process IP address allocator
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'AddressPool',
+	'AddressAllocator',
+
+	'ipv4_allocator',
+	'ipv6_allocator',
+
+	'alloc_ipv4',
+	'alloc_ipv6',
+	'release_address'
+]
+
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+
+from netprofile_access.models import AccessEntity
+from netprofile_dialup.models import (
+	IPPool,
+	NAS,
+	NASPool
+)
+from netprofile_ipaddresses.models import (
+	IPv4Address,
+	IPv6Address
+)
+from netprofile_rates.models import Rate
+from netprofile_sessions.models import AccessSession
+
+logger = logging.getLogger(__name__)
+
+class AddressPool(object):
+	"""
+	Free address bitmap for a single IP address pool.
+
+	Addresses are kept in a fixed list, with a bytearray of in-use flags
+	indexed the same way and a stack of slots believed to be free. Both
+	taking and returning an address are O(1).
+	"""
+	def __init__(self, pool_id, rows):
+		self.pool_id = pool_id
+		self.ids = []
+		self.slots = {}
+		free = []
+		for addr_id, in_use in rows:
+			if not in_use:
+				free.append(len(self.ids))
+			self.slots[addr_id] = len(self.ids)
+			self.ids.append(addr_id)
+		self.used = bytearray(b'\x01') * len(self.ids)
+		for slot in free:
+			self.used[slot] = 0
+		# Separate processes walk the pool in different order, so that they
+		# rarely race for the same addresses.
+		random.shuffle(free)
+		self.free = free
+		self.loaded = time.monotonic()
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.ids)
+
+	@property
+	def free_count(self):
+		return len(self.free)
+
+	@property
+	def age(self):
+		return time.monotonic() - self.loaded
+
+	def take(self):
+		"""
+		Get an address that is believed to be free and mark it as used.
+		Returns None if there are no free addresses left.
+		"""
+		with self.lock:
+			while self.free:
+				slot = self.free.pop()
+				if not self.used[slot]:
+					self.used[slot] = 1
+					return self.ids[slot]
+
+	def put(self, addr_id):
+		"""
+		Return an address to the pool.
+		"""
+		slot = self.slots.get(addr_id)
+		if slot is None:
+			return False
+		with self.lock:
+			if not self.used[slot]:
+				return False
+			self.used[slot] = 0
+			self.free.append(slot)
+		return True
+
+class AddressAllocator(object):
+	"""
+	Hands out free addresses from IP pools without scanning the pool table.
+
+	Every process keeps its own bitmaps, so an address taken from a bitmap
+	is only a candidate. It is claimed in the database with a conditional
+	UPDATE that succeeds only if the address is still free there. A failed
+	claim means that someone else got the address first, in which case the
+	next candidate is tried.
+
+	Addresses freed elsewhere (usually by sessions_def triggers) are picked
+	up when a pool bitmap is reloaded. That happens when it gets older than
+	max_age seconds, and also when the pool runs dry, but no more often than
+	every reload_interval seconds.
+	"""
+	def __init__(self, model, max_age=300, reload_interval=5):
+		self.model = model
+		self.max_age = max_age
+		self.reload_interval = reload_interval
+		self.pools = {}
+		self.addr_pools = {}
+		self.lock = threading.Lock()
+
+	def load_rows(self, sess, pool_id):
+		model = self.model
+		return sess.query(model.id, model.in_use).filter(model.pool_id == pool_id).order_by(model.id)
+
+	def claim(self, sess, addr_id):
+		"""
+		Mark address as used in the database if it is still free there.
+		"""
+		model = self.model
+		return sess.query(model).filter(
+			model.id == addr_id,
+			model.in_use == False
+		).update({ model.in_use : True }, synchronize_session=False) == 1
+
+	def get_pool(self, sess, pool_id, reload=False):
+		pool = self.pools.get(pool_id)
+		if pool is not None:
+			age = pool.age
+			if (age < self.max_age) and not (reload and (age >= self.reload_interval)):
+				return pool
+		with self.lock:
+			# Some other thread might have reloaded it already.
+			current = self.pools.get(pool_id)
+			if (current is not None) and (current is not pool):
+				return current
+			pool = AddressPool(pool_id, self.load_rows(sess, pool_id))
+			self.pools[pool_id] = pool
+			for addr_id in pool.ids:
+				self.addr_pools[addr_id] = pool_id
+		return pool
+
+	def allocate(self, sess, pool_id):
+		"""
+		Allocate a free address from a pool. Returns address ID, or None if
+		the pool is exhausted.
+		"""
+		pool = self.get_pool(sess, pool_id)
+		while True:
+			addr_id = pool.take()
+			if addr_id is not None:
+				if self.claim(sess, addr_id):
+					return addr_id
+				continue
+			fresh = self.get_pool(sess, pool_id, reload=True)
+			if fresh is pool:
+				logger.warning('IP address pool %s is exhausted', pool_id)
+				return None
+			pool = fresh
+
+	def release(self, addr_id):
+		"""
+		Return address to its pool bitmap. This does not touch the database.
+		"""
+		pool = self.pools.get(self.addr_pools.get(addr_id))
+		if pool is not None:
+			return pool.put(addr_id)
+		return False
+
+	def invalidate(self, pool_id=None):
+		"""
+		Drop cached bitmap of a pool, or of all pools.
+		"""
+		with self.lock:
+			if pool_id is None:
+				self.pools.clear()
+				self.addr_pools.clear()
+			else:
+				self.pools.pop(pool_id, None)
+
+ipv4_allocator = AddressAllocator(IPv4Address)
+ipv6_allocator = AddressAllocator(IPv6Address)
+
+def _find_pool(sess, nas_id, rate_id):
+	pool_id = sess.query(Rate.pool_id).filter(Rate.id == rate_id).scalar()
+	q = sess.query(NASPool.pool_id).filter(NASPool.nas_id == nas_id)
+	if pool_id is not None:
+		q = q.filter(NASPool.pool_id == pool_id)
+	pools = [row[0] for row in q]
+	if pools:
+		return random.choice(pools)
+
+def _alloc(sess, alloc, model, nas_idstr, entity_name, attr):
+	nas_id = sess.query(NAS.id).filter(NAS.id_string.like(nas_idstr)).limit(1).scalar()
+	ent = sess.query(
+		getattr(AccessEntity, attr),
+		AccessEntity.rate_id
+	).filter(AccessEntity.nick == entity_name).first()
+	if (nas_id is None) or (ent is None):
+		return (None, None, None)
+	addr_id, rate_id = ent
+	if addr_id is not None:
+		# Statically assigned address: kick whoever is using it.
+		sess.query(AccessSession).filter(
+			getattr(AccessSession, attr) == addr_id
+		).delete(synchronize_session=False)
+		if sess.query(model).filter(
+			model.id == addr_id
+		).update({ model.in_use : True }, synchronize_session=False) != 1:
+			return (None, None, None)
+		return (nas_id, None, addr_id)
+	pool_id = _find_pool(sess, nas_id, rate_id)
+	if pool_id is None:
+		return (None, None, None)
+	return (nas_id, pool_id, alloc.allocate(sess, pool_id))
+
+def alloc_ipv4(sess, nas_idstr, entity_name):
+	"""
+	Python counterpart of acct_alloc_ip procedure, for use by RADIUS
+	integration code. Returns a tuple of (IPv4 address ID, NAS ID), with
+	zeroes on failure.
+	"""
+	nas_id, pool_id, addr_id = _alloc(sess, ipv4_allocator, IPv4Address, nas_idstr, entity_name, 'ipv4_address_id')
+	if addr_id is None:
+		return (0, 0)
+	return (addr_id, nas_id)
+
+def alloc_ipv6(sess, nas_idstr, entity_name):
+	"""
+	Python counterpart of acct_alloc_ipv6 procedure, for use by RADIUS
+	integration code. Returns a tuple of (IPv6 address ID, NAS ID, pool
+	IPv6 prefix, pool IPv6 prefix length). If the pool has no free
+	addresses, address ID is zero and the pool prefix is returned instead.
+	"""
+	nas_id, pool_id, addr_id = _alloc(sess, ipv6_allocator, IPv6Address, nas_idstr, entity_name, 'ipv6_address_id')
+	if nas_id is None:
+		return (0, 0, None, None)
+	if addr_id is None:
+		pfx = sess.query(IPPool.ipv6_prefix, IPPool.ipv6_prefix_length).filter(IPPool.id == pool_id).first()
+		if pfx is None:
+			return (0, nas_id, None, None)
+		return (0, nas_id, pfx[0], pfx[1])
+	return (addr_id, nas_id, None, None)
+
+def release_address(ipv4_id=None, ipv6_id=None):
+	"""
+	Tell allocators that session addresses are free again. Database flags
+	are reset by sessions_def triggers, so this only updates the bitmaps.
+	"""
+	if ipv4_id is not None:
+		ipv4_allocator.release(ipv4_id)
+	if ipv6_id is not None:
+		ipv6_allocator.release(ipv6_id)
+
+def _mod_ipv4_address(mapper, conn, tgt):
+	for pool_id in get_history(tgt, 'pool_id').sum():
+		if pool_id is not None:
+			ipv4_allocator.invalidate(pool_id)
+
+def _mod_ipv6_address(mapper, conn, tgt):
+	for pool_id in get_history(tgt, 'pool_id').sum():
+		if pool_id is not None:
+			ipv6_allocator.invalidate(pool_id)
+
+def _del_session(mapper, conn, tgt):
+	release_address(tgt.ipv4_address_id, tgt.ipv6_address_id)
+
+event.listen(IPv4Address, 'after_delete', _mod_ipv4_address)
+event.listen(IPv4Address, 'after_insert', _mod_ipv4_address)
+event.listen(IPv4Address, 'after_update', _mod_ipv4_address)
+event.listen(IPv6Address, 'after_delete', _mod_ipv6_address)
+event.listen(IPv6Address, 'after_insert', _mod_ipv6_address)
+event.listen(IPv6Address, 'after_update', _mod_ipv6_address)
+event.listen(AccessSession, 'after_delete', _del_session)
+
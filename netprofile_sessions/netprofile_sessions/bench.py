@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Sessions module - Benchmarks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import decimal
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from netprofile.bench import BenchResults
+from netprofile_access.engine import RatePlan
+from netprofile_sessions.alloc import AddressAllocator
+from netprofile_sessions.simulate import (
+	Scenario,
+	UsageColumns,
+	replay_usage
+)
+
+class _MemoryTable(object):
+	"""
+	Stand-in for ipaddr_def that charges a fixed latency per statement.
+	"""
+	def __init__(self, size, latency):
+		self.inuse = [False] * size
+		self.latency = latency
+		self.table_lock = threading.Lock()
+		self.row_locks = [threading.Lock() for i in range(64)]
+		self.conflicts = 0
+
+	def select_for_update(self):
+		# SELECT ... WHERE inuse = 'N' AND poolid = ? LIMIT 1 FOR UPDATE,
+		# followed by UPDATE. Concurrent callers queue on the same rows.
+		with self.table_lock:
+			if self.latency:
+				time.sleep(self.latency)
+			for addr_id, inuse in enumerate(self.inuse):
+				if not inuse:
+					self.inuse[addr_id] = True
+					return addr_id
+
+	def compare_and_set(self, addr_id):
+		# UPDATE ... SET inuse = 'Y' WHERE ipaddrid = ? AND inuse = 'N'
+		with self.row_locks[addr_id % 64]:
+			if self.latency:
+				time.sleep(self.latency)
+			if self.inuse[addr_id]:
+				self.conflicts += 1
+				return False
+			self.inuse[addr_id] = True
+			return True
+
+class _MemoryAllocator(AddressAllocator):
+	def __init__(self, table):
+		super(_MemoryAllocator, self).__init__(None)
+		self.table = table
+
+	def load_rows(self, sess, pool_id):
+		return list(enumerate(self.table.inuse))
+
+	def claim(self, sess, addr_id):
+		return self.table.compare_and_set(addr_id)
+
+def _run_sessions(count, workers, func):
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		got = list(pool.map(func, range(count)))
+	if None in got:
+		raise RuntimeError('Pool got exhausted during benchmark')
+	if len(set(got)) != count:
+		raise RuntimeError('Same address was handed out twice')
+
+def run(app=None, count=10000, workers=64, processes=4, latency=0.0002):
+	"""
+	Start a number of sessions at once, allocating addresses either the way
+	acct_alloc_ip does or through several independent allocators, as if
+	running in separate processes. Database statements are simulated with
+	a fixed latency.
+	"""
+	res = BenchResults()
+	size = count + count // 4
+
+	table = _MemoryTable(size, latency)
+	with res.timed('acct_alloc_ip (%d sessions)' % count, count):
+		_run_sessions(count, workers, lambda i: table.select_for_update())
+
+	table = _MemoryTable(size, latency)
+	allocs = [_MemoryAllocator(table) for i in range(processes)]
+	with res.timed('allocator x%d (%d sessions)' % (processes, count), count):
+		_run_sessions(count, workers, lambda i: allocs[i % processes].allocate(None, 1))
+	res.add('allocator x%d CAS conflicts' % processes, table.conflicts, 0)
+
+	table = _MemoryTable(size, 0)
+	alloc = _MemoryAllocator(table)
+	alloc.get_pool(None, 1)
+	with res.timed('allocator bitmap only', count):
+		for i in range(count):
+			alloc.allocate(None, 1)
+
+	return res
+
+def _sim_plans():
+	D = decimal.Decimal
+	plans = {}
+	for rid, rtype, unit, qsum in (
+		(1, 'prepaid',      'c_month', D('10')),
+		(2, 'prepaid_cont', 'f_day',   D('0.5')),
+		(3, 'postpaid',     'c_month', D('15'))
+	):
+		plans[rid] = (RatePlan(
+			rid, rtype, False, 1, unit,
+			10 ** 10, 10 ** 10,
+			qsum, D('1'), D('0.000000001'), D('0.000000002'),
+			True, True, None, None,
+			()
+		), ())
+	return plans
+
+def run_simulate(app=None, accounts=20000, sessions=400000, shards=16, processes=4):
+	"""
+	Replay a month of synthetic session history with current and candidate
+	rates, in a single process and in a process pool.
+	"""
+	res = BenchResults()
+	rnd = random.Random(sessions)
+	plans = _sim_plans()
+	start = datetime.datetime(2015, 1, 1)
+	end = datetime.datetime(2015, 2, 1)
+	span = int((end - start).total_seconds())
+
+	accts = []
+	balances = {}
+	for i in range(accounts):
+		rate_id = rnd.choice((1, 2, 3))
+		qpend = start + datetime.timedelta(seconds=rnd.randint(0, 86400))
+		accts.append((i + 1, i + 1, rate_id, qpend, 0, ()))
+		balances[i + 1] = [rnd.randint(0, 50) * 10 ** 8, 0]
+	cols = UsageColumns()
+	for i in range(sessions):
+		ts = start + datetime.timedelta(seconds=rnd.randint(0, span - 1))
+		cols.add_traffic(rnd.randint(1, accounts), ts, rnd.randint(0, 10 ** 9), rnd.randint(0, 10 ** 8))
+	for i in range(accounts // 4):
+		ts = start + datetime.timedelta(seconds=rnd.randint(0, span - 1))
+		cols.add_operation(rnd.randint(1, accounts), ts, rnd.randint(5, 50))
+	scenario = Scenario(rates={ 1 : { 'qsum' : '11' }, 2 : { 'oqsum_ingress' : '0.000000002' } })
+
+	totals = []
+	for label, procs in (('single process', 0), ('%d processes' % processes, processes)):
+		with res.timed('simulate, %s' % label, sessions):
+			out = replay_usage(plans, accts, balances, {}, cols, scenario, end, shards=shards, processes=procs)
+		totals.append(out.totals)
+	if totals[0] != totals[1]:
+		raise RuntimeError('Parallel simulation gave different results')
+
+	return res
+
+if __name__ == '__main__':
+	print(run().format())
+
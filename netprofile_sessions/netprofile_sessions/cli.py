@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Sessions module - Command-line utilities
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import argparse
+import datetime
+import json
+import logging
+
+from cliff.command import Command
+
+def _date(value):
+	return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+class SimulateRates(Command):
+	"""
+	Estimate revenue impact of rate changes by replaying session history.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(SimulateRates, self).get_parser(prog_name)
+		parser.add_argument(
+			'-s', '--start',
+			type=_date,
+			required=True,
+			help='Start of replayed time range, as YYYY-MM-DD.'
+		)
+		parser.add_argument(
+			'-e', '--end',
+			type=_date,
+			required=True,
+			help='End of replayed time range (exclusive), as YYYY-MM-DD.'
+		)
+		parser.add_argument(
+			'-p', '--processes',
+			type=int,
+			default=None,
+			help='Number of worker processes, 0 to run in this process. Defaults to number of CPUs.'
+		)
+		parser.add_argument(
+			'--shards',
+			type=int,
+			default=64,
+			help='Number of stash shards to split the work into.'
+		)
+		parser.add_argument(
+			'--by-rate',
+			action='store_true',
+			help='Output totals per rate instead of per entity.'
+		)
+		parser.add_argument(
+			'--all-traffic',
+			action='store_true',
+			help='Account all traffic, like @npa_all_traffic does.'
+		)
+		parser.add_argument(
+			'--no-compat',
+			action='store_true',
+			help='Apply each rate modifier once, instead of reproducing acct_rate_mods quirk.'
+		)
+		parser.add_argument(
+			'-o', '--output',
+			type=argparse.FileType('w'),
+			default=None,
+			help='Output CSV file, defaults to standard output.'
+		)
+		parser.add_argument(
+			'scenario',
+			type=argparse.FileType('r'),
+			help='JSON file with candidate rate and rate modifier changes.'
+		)
+		return parser
+
+	def take_action(self, args):
+		mm = self.app.mm
+
+		if len(mm.modules) > 0:
+			mm.rescan()
+		else:
+			mm.scan()
+
+		if not mm.load('core'):
+			raise RuntimeError('Unable to proceed without core module.')
+		if not mm.load_enabled():
+			raise RuntimeError('Unable to load enabled modules.')
+
+		from netprofile_sessions.simulate import (
+			Scenario,
+			simulate
+		)
+
+		scenario = Scenario.from_json(json.load(args.scenario))
+		res = simulate(
+			self.app.db_session,
+			scenario,
+			args.start,
+			args.end,
+			shards=args.shards,
+			processes=args.processes,
+			all_traffic=args.all_traffic,
+			mods_compat=not args.no_compat
+		)
+		outfile = args.output or self.app.stdout
+		res.write_csv(outfile, by_rate=args.by_rate)
+		if args.output:
+			args.output.close()
+		actual, baseline, candidate = res.totals
+		self.log.info(
+			'Simulated %d entities: actually charged %s, current rates %s, candidate rates %s, delta %s.',
+			len(res.entities), actual, baseline, candidate, candidate - baseline
+		)
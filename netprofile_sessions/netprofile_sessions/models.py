@@ -74,7 +74,9 @@ from netprofile.db.fields import (
 )
 from netprofile.db.ddl import (
 	Comment,
+	CurrentTimestampDefault,
 	InArgument,
+	Partitioned,
 	SQLEvent,
 	SQLFunction,
 	Trigger
@@ -360,6 +362,7 @@ class AccessSessionHistory(Base):
 		Index('sessions_history_i_destid', 'destid'),
 		Index('sessions_history_i_endts', 'endts'),
 		Index('sessions_history_i_nasid', 'nasid'),
+		Partitioned('endts', fill=('startts',)),
 		{
 			'mysql_engine'  : 'InnoDB',
 			'mysql_charset' : 'utf8',
@@ -390,7 +393,8 @@ class AccessSessionHistory(Base):
 					'pol_ingress', 'pol_egress'
 				),
 				'easy_search'   : ('name', 'csid'),
-				'detail_pane'   : ('netprofile_core.views', 'dpane_simple')
+				'detail_pane'   : ('netprofile_core.views', 'dpane_simple'),
+				'cold_archive'  : 'endts'
 			}
 		}
 	)
@@ -528,8 +532,8 @@ class AccessSessionHistory(Base):
 		'endts',
 		TIMESTAMP(),
 		Comment('Session end time'),
-		nullable=True,
-		default=None,
+		CurrentTimestampDefault(),
+		nullable=False,
 		info={
 			'header_string' : _('Ended')
 		}
@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Sessions module - What-if rate simulation
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'Scenario',
+	'UsageColumns',
+	'SimulationResult',
+
+	'load_plans',
+	'load_usage',
+	'replay_usage',
+	'simulate'
+]
+
+import array
+import csv
+import datetime
+import decimal
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from netprofile_access.acctdiff import (
+	rate_mod,
+	rate_plan
+)
+from netprofile_access.engine import (
+	AccountState,
+	AcctEngine,
+	StashState
+)
+from netprofile_access.models import (
+	AccessEntity,
+	PerUserRateModifier
+)
+from netprofile_rates.models import Rate
+from netprofile_rates.quota import qp_cutoff
+from netprofile_sessions.models import AccessSessionHistory
+from netprofile_stashes.models import (
+	Stash,
+	StashOperation,
+	StashOperationType
+)
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+# Money is carried in columns as integers in units of 1e-8, which is the
+# scale of all money columns in the database.
+_MONEY_SCALE = decimal.Decimal(10 ** 8)
+_ZERO = decimal.Decimal(0)
+
+_DECIMAL_FIELDS = frozenset((
+	'qsum', 'auxsum', 'oqsum_ingress', 'oqsum_egress',
+	'oqsum_ingress_mul', 'oqsum_egress_mul', 'oqsum_sec_mul'
+))
+
+_SUB_OPS = tuple(op for op in StashOperationType if op.value.startswith('sub_'))
+
+def _secs(ts):
+	return int((ts - _EPOCH).total_seconds())
+
+def _ts(secs):
+	return _EPOCH + datetime.timedelta(seconds=secs)
+
+def _money(value):
+	return int((decimal.Decimal(value) * _MONEY_SCALE).to_integral_value())
+
+def _overrides(data):
+	ret = {}
+	for fld, value in data.items():
+		if (fld in _DECIMAL_FIELDS) and (value is not None):
+			value = decimal.Decimal(str(value))
+		ret[fld] = value
+	return ret
+
+class Scenario(object):
+	"""
+	Candidate changes to rates and rate modifiers.
+
+	Argument rates maps rate IDs to dicts of RatePlan fields to replace,
+	and modifiers maps rate modifier type IDs to dicts of RateMod fields
+	to replace. Modifier changes apply both to global and to per-user
+	modifiers of that type. Setting "enabled" to false for a modifier type
+	removes its modifiers altogether.
+	"""
+	def __init__(self, rates=None, modifiers=None):
+		self.rates = dict((int(k), _overrides(v)) for k, v in (rates or {}).items())
+		self.modifiers = dict((int(k), _overrides(v)) for k, v in (modifiers or {}).items())
+
+	@classmethod
+	def from_json(cls, data):
+		return cls(data.get('rates'), data.get('modifiers'))
+
+	def mods(self, typed_mods):
+		"""
+		Apply modifier changes to a sequence of (type ID, RateMod) tuples.
+		Returns a tuple of the same form.
+		"""
+		ret = []
+		for type_id, mod in typed_mods:
+			chg = self.modifiers.get(type_id)
+			if chg is not None:
+				if not chg.get('enabled', True):
+					continue
+				mod = mod._replace(**dict((k, v) for k, v in chg.items() if k != 'enabled'))
+			ret.append((type_id, mod))
+		return tuple(ret)
+
+	def plan(self, plan, mod_types):
+		"""
+		Apply changes to a RatePlan whose global modifiers have type IDs
+		listed in mod_types.
+		"""
+		chg = self.rates.get(plan.id)
+		if chg:
+			plan = plan._replace(**chg)
+		mods = self.mods(zip(mod_types, plan.mods))
+		return plan._replace(mods=tuple(mod for type_id, mod in mods))
+
+class UsageColumns(object):
+	"""
+	Columnar store of simulation inputs.
+
+	Traffic is held as parallel arrays of entity IDs, session end times (as
+	UNIX time) and ingress and egress traffic. Stash operations that are not
+	caused by accounting, like payments, are held as parallel arrays of stash
+	IDs, UNIX times and sums in units of 1e-8.
+	"""
+	def __init__(self):
+		self.entity = array.array('q')
+		self.ts = array.array('q')
+		self.tin = array.array('q')
+		self.teg = array.array('q')
+		self.op_stash = array.array('q')
+		self.op_ts = array.array('q')
+		self.op_sum = array.array('q')
+
+	def __len__(self):
+		return len(self.entity)
+
+	def add_traffic(self, entity_id, ts, tin, teg):
+		self.entity.append(entity_id)
+		self.ts.append(_secs(ts))
+		self.tin.append(int(tin or 0))
+		self.teg.append(int(teg or 0))
+
+	def add_operation(self, stash_id, ts, diff):
+		self.op_stash.append(stash_id)
+		self.op_ts.append(_secs(ts))
+		self.op_sum.append(_money(diff))
+
+	def split(self, entity_shard, stash_shard, shards):
+		"""
+		Split into a list of UsageColumns objects, one per shard. Shard
+		numbers are looked up in entity_shard and stash_shard mappings.
+		"""
+		parts = [UsageColumns() for i in range(shards)]
+		for i, entity_id in enumerate(self.entity):
+			shard = entity_shard.get(entity_id)
+			if shard is not None:
+				part = parts[shard]
+				part.entity.append(entity_id)
+				part.ts.append(self.ts[i])
+				part.tin.append(self.tin[i])
+				part.teg.append(self.teg[i])
+		for i, stash_id in enumerate(self.op_stash):
+			shard = stash_shard.get(stash_id)
+			if shard is not None:
+				part = parts[shard]
+				part.op_stash.append(stash_id)
+				part.op_ts.append(self.op_ts[i])
+				part.op_sum.append(self.op_sum[i])
+		return parts
+
+class SimulationResult(object):
+	"""
+	Per-entity and per-rate charges under current and candidate rates.
+
+	Field entities maps entity IDs to lists of [rate ID, actually charged,
+	charged with current rates, charged with candidate rates]. Actual
+	charges come from stash operation history, the other two are simulated
+	from the same starting state, so the difference between them is the
+	effect of the scenario.
+	"""
+	def __init__(self):
+		self.entities = {}
+
+	def update(self, entities):
+		self.entities.update(entities)
+
+	@property
+	def rates(self):
+		ret = {}
+		for rate_id, actual, baseline, candidate in self.entities.values():
+			row = ret.get(rate_id)
+			if row is None:
+				row = ret[rate_id] = [0, _ZERO, _ZERO, _ZERO]
+			row[0] += 1
+			row[1] += actual
+			row[2] += baseline
+			row[3] += candidate
+		return ret
+
+	@property
+	def totals(self):
+		actual = baseline = candidate = _ZERO
+		for row in self.entities.values():
+			actual += row[1]
+			baseline += row[2]
+			candidate += row[3]
+		return (actual, baseline, candidate)
+
+	def write_csv(self, outfile, by_rate=False):
+		writer = csv.writer(outfile, lineterminator='\n')
+		if by_rate:
+			writer.writerow(('rateid', 'entities', 'actual', 'baseline', 'candidate', 'delta'))
+			for rate_id, (count, actual, baseline, candidate) in sorted(self.rates.items(), key=lambda x: (x[0] is None, x[0])):
+				writer.writerow((rate_id, count, actual, baseline, candidate, candidate - baseline))
+		else:
+			writer.writerow(('entityid', 'rateid', 'actual', 'baseline', 'candidate', 'delta'))
+			for entity_id, (rate_id, actual, baseline, candidate) in sorted(self.entities.items()):
+				writer.writerow((entity_id, rate_id, actual, baseline, candidate, candidate - baseline))
+
+def load_plans(sess):
+	"""
+	Load all rates. Returns a mapping of rate IDs to tuples of (RatePlan,
+	sequence of global modifier type IDs in lookup order).
+	"""
+	plans = {}
+	for rate in sess.query(Rate):
+		mods = sorted(
+			(gm for gm in rate.global_modmap if gm.enabled),
+			key=lambda gm: gm.lookup_order
+		)
+		plans[rate.id] = (rate_plan(rate), tuple(gm.type_id for gm in mods))
+	return plans
+
+def _start_qpend(plan, qpend, start):
+	# Walk back over whole quota periods to the one in effect at start.
+	if (qpend is None) or (plan is None):
+		return qpend
+	while qpend > start:
+		prev = qp_cutoff(plan.qp_amount, plan.qp_unit, qpend)
+		if plan.qp_unit in ('c_hour', 'c_day', 'c_month'):
+			prev -= _SECOND
+		if prev >= qpend:
+			break
+		qpend = prev
+	return qpend
+
+def load_usage(sess, start, end, plans):
+	"""
+	Load simulation inputs for a time range. Returns a tuple of (list of
+	account tuples, mapping of stash IDs to starting balances, mapping of
+	entity IDs to actually charged sums, UsageColumns object).
+
+	Account state at start is reconstructed from current state. Stash
+	balances are rolled back using stash operation history, and quota
+	periods are walked back from current ones. Used traffic starts at zero,
+	and rate changes made during the range are not known, so current rates
+	are used throughout.
+	"""
+	accounts = []
+	user_mods = {}
+	q = sess.query(PerUserRateModifier).options(
+		joinedload(PerUserRateModifier.type)
+	).filter(
+		PerUserRateModifier.enabled == True
+	).order_by(
+		PerUserRateModifier.entity_id,
+		PerUserRateModifier.lookup_order
+	)
+	for pm in q:
+		user_mods.setdefault(pm.entity_id, []).append((pm.type_id, rate_mod(pm.rate_id, pm.type)))
+
+	q = sess.query(
+		AccessEntity.id,
+		AccessEntity.stash_id,
+		AccessEntity.rate_id,
+		AccessEntity.quota_period_end,
+		AccessEntity.access_state
+	).filter(
+		AccessEntity.alias_of_id == None,
+		AccessEntity.stash_id != None
+	).order_by(AccessEntity.id)
+	for entity_id, stash_id, rate_id, qpend, state in q.yield_per(10000):
+		plan = plans.get(rate_id)
+		qpend = _start_qpend(plan[0] if plan else None, qpend, start)
+		accounts.append((
+			entity_id, stash_id, rate_id, qpend,
+			2 if (state == 2) else 0,
+			tuple(user_mods.get(entity_id, ()))
+		))
+
+	balances = {}
+	for stash_id, amount, credit in sess.query(Stash.id, Stash.amount, Stash.credit).yield_per(10000):
+		balances[stash_id] = [_money(amount), _money(credit)]
+	q = sess.query(
+		StashOperation.stash_id,
+		func.sum(StashOperation.difference)
+	).filter(
+		StashOperation.timestamp >= start
+	).group_by(StashOperation.stash_id)
+	for stash_id, diff in q:
+		if stash_id in balances:
+			balances[stash_id][0] -= _money(diff or 0)
+
+	actual = {}
+	cols = UsageColumns()
+	q = sess.query(
+		StashOperation.stash_id,
+		StashOperation.entity_id,
+		StashOperation.type,
+		StashOperation.timestamp,
+		StashOperation.difference
+	).filter(
+		StashOperation.timestamp >= start,
+		StashOperation.timestamp < end
+	).order_by(StashOperation.timestamp)
+	for stash_id, entity_id, optype, ts, diff in q.yield_per(10000):
+		if optype in _SUB_OPS:
+			if entity_id is not None:
+				actual[entity_id] = actual.get(entity_id, _ZERO) - diff
+		else:
+			cols.add_operation(stash_id, ts, diff)
+
+	q = sess.query(
+		AccessSessionHistory.entity_id,
+		AccessSessionHistory.end_timestamp,
+		AccessSessionHistory.used_ingress_traffic,
+		AccessSessionHistory.used_egress_traffic
+	).filter(
+		AccessSessionHistory.end_timestamp >= start,
+		AccessSessionHistory.end_timestamp < end
+	)
+	for entity_id, ts, tin, teg in q.yield_per(10000):
+		cols.add_traffic(entity_id, ts, tin, teg)
+
+	logger.info('Loaded %d accounts, %d sessions and %d stash operations', len(accounts), len(cols), len(cols.op_ts))
+	return (accounts, balances, actual, cols)
+
+class _Replay(object):
+	"""
+	State of one shard replayed with one set of rates.
+	"""
+	def __init__(self, plans, accounts, balances, all_traffic, mods_compat):
+		self.engine = AcctEngine(plans, all_traffic=all_traffic, mods_compat=mods_compat)
+		self.accounts = {}
+		self.by_stash = {}
+		self.stashes = {}
+		self.charged = {}
+		for entity_id, stash_id, rate_id, qpend, state, mods in accounts:
+			acct = AccountState(
+				entity_id, stash_id, rate_id,
+				qpend=qpend, state=state,
+				mods=tuple(mod for type_id, mod in mods)
+			)
+			self.accounts[entity_id] = acct
+			self.by_stash.setdefault(stash_id, []).append(acct)
+			self.charged[entity_id] = _ZERO
+			if stash_id not in self.stashes:
+				amount, credit = balances.get(stash_id, (0, 0))
+				self.stashes[stash_id] = StashState(
+					stash_id,
+					decimal.Decimal(amount) / _MONEY_SCALE,
+					decimal.Decimal(credit) / _MONEY_SCALE
+				)
+
+	def _add(self, acct, tin, teg, ts):
+		out = self.engine.add(acct, self.stashes[acct.stash_id], tin, teg, ts)
+		if out.diff:
+			self.charged[acct.entity_id] -= out.diff
+
+	def catch_up(self, acct, ts):
+		# Quota periods that ended before ts are rolled over the way
+		# acct_poll would do it.
+		while (acct.state != 2) and (acct.qpend is not None) and (acct.qpend < ts):
+			qpend = acct.qpend
+			self._add(acct, 0, 0, qpend + _SECOND)
+			if (acct.qpend is not None) and (acct.qpend <= qpend):
+				break
+
+	def traffic(self, entity_id, ts, tin, teg):
+		acct = self.accounts.get(entity_id)
+		if acct is None:
+			return
+		self.catch_up(acct, ts)
+		self._add(acct, tin, teg, ts)
+
+	def operation(self, stash_id, ts, diff):
+		stash = self.stashes.get(stash_id)
+		if stash is None:
+			return
+		accts = self.by_stash.get(stash_id, ())
+		for acct in accts:
+			self.catch_up(acct, ts)
+		stash.amount += decimal.Decimal(diff) / _MONEY_SCALE
+		# Accounts blocked for lack of funds are picked up by acct_poll.
+		for acct in accts:
+			if (acct.qpend is None) and (acct.state != 2):
+				self._add(acct, 0, 0, ts)
+
+	def finish(self, ts):
+		for acct in self.accounts.values():
+			self.catch_up(acct, ts)
+
+def _run_shard(job):
+	runs, balances, cols, end, engine_args = job
+	events = []
+	for i in range(len(cols.ts)):
+		events.append((cols.ts[i], 1, i))
+	for i in range(len(cols.op_ts)):
+		events.append((cols.op_ts[i], 0, i))
+	events.sort()
+	events = [(_ts(secs), kind, i) for secs, kind, i in events]
+	end = _ts(end)
+
+	charged = []
+	for plans, accounts in runs:
+		rep = _Replay(plans, accounts, balances, *engine_args)
+		for ts, kind, i in events:
+			if kind:
+				rep.traffic(cols.entity[i], ts, cols.tin[i], cols.teg[i])
+			else:
+				rep.operation(cols.op_stash[i], ts, cols.op_sum[i])
+		rep.finish(end)
+		charged.append(rep.charged)
+	base, cand = charged
+	return dict((entity_id, (base[entity_id], cand[entity_id])) for entity_id in base)
+
+def simulate(sess, scenario, start, end, shards=16, processes=None, all_traffic=False, mods_compat=True):
+	"""
+	Replay accounting for a time range with current rates and with rates
+	changed by scenario, using the same rules as acct_add. Each session from
+	session history is accounted as a single update at its end time.
+
+	Accounts are split into shards by stash, and shards are replayed in a
+	pool of worker processes. Set processes to 0 to replay everything in
+	the current process. Returns a SimulationResult object.
+	"""
+	plans = load_plans(sess)
+	accounts, balances, actual, cols = load_usage(sess, start, end, plans)
+	return replay_usage(
+		plans, accounts, balances, actual, cols, scenario, end,
+		shards=shards,
+		processes=processes,
+		all_traffic=all_traffic,
+		mods_compat=mods_compat
+	)
+
+def replay_usage(plans, accounts, balances, actual, cols, scenario, end, shards=16, processes=None, all_traffic=False, mods_compat=True):
+	"""
+	Run simulation over data returned by load_plans() and load_usage().
+	See simulate() for details.
+	"""
+	baseline = dict((rate_id, plan) for rate_id, (plan, mod_types) in plans.items())
+	candidate = dict((rate_id, scenario.plan(plan, mod_types)) for rate_id, (plan, mod_types) in plans.items())
+	cand_accounts = [acct[:5] + (scenario.mods(acct[5]),) for acct in accounts]
+
+	stash_shard = {}
+	entity_shard = {}
+	shard_accounts = [([], []) for i in range(shards)]
+	for base_acct, cand_acct in zip(accounts, cand_accounts):
+		entity_id, stash_id = base_acct[:2]
+		shard = stash_shard.setdefault(stash_id, stash_id % shards)
+		entity_shard[entity_id] = shard
+		shard_accounts[shard][0].append(base_acct)
+		shard_accounts[shard][1].append(cand_acct)
+	parts = cols.split(entity_shard, stash_shard, shards)
+
+	engine_args = (all_traffic, mods_compat)
+	jobs = []
+	for shard in range(shards):
+		base_accts, cand_accts = shard_accounts[shard]
+		if not base_accts:
+			continue
+		shard_balances = dict((acct[1], balances.get(acct[1], (0, 0))) for acct in base_accts)
+		jobs.append((
+			((baseline, base_accts), (candidate, cand_accts)),
+			shard_balances, parts[shard], _secs(end), engine_args
+		))
+
+	if processes == 0:
+		results = [_run_shard(job) for job in jobs]
+	else:
+		with ProcessPoolExecutor(max_workers=processes) as pool:
+			results = list(pool.map(_run_shard, jobs))
+
+	res = SimulationResult()
+	rate_ids = dict((acct[0], acct[2]) for acct in accounts)
+	for charged in results:
+		res.update(
+			(entity_id, [rate_ids[entity_id], actual.get(entity_id, _ZERO), base, cand])
+			for entity_id, (base, cand) in charged.items()
+		)
+	return res
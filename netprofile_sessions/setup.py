@@ -50,6 +50,11 @@ setup(
 	entry_points="""\
 		[netprofile.modules]
 		sessions = netprofile_sessions:Module
+		[netprofile.cli.commands]
+		acct simulate = netprofile_sessions.cli:SimulateRates
+		[netprofile.benchmarks]
+		sessions_alloc = netprofile_sessions.bench:run
+		sessions_simulate = netprofile_sessions.bench:run_simulate
 	""",
 	message_extractors={'.' : [
 		('**.py', 'python', None),
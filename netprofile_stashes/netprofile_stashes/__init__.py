@@ -60,7 +60,10 @@ class Module(ModuleBase):
 			models.Stash,
 			models.StashIO,
 			models.StashIOType,
-			models.StashOperation
+			models.StashOperation,
+			models.StashIORollup,
+			models.StashOperationRollup,
+			models.StashRollupMonth
 		)
 
 	@classmethod
@@ -249,6 +252,11 @@ class Module(ModuleBase):
 			)
 		)
 
+	def get_task_imports(self):
+		return (
+			'netprofile_stashes.tasks',
+		)
+
 	def get_css(self, request):
 		return (
 			'netprofile_stashes:static/css/main.css',
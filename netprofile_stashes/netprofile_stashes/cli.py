@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Stashes module - Command-line utilities
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import logging
+
+from cliff.command import Command
+
+from netprofile.cli import _load_modules
+
+def _month(value):
+	return datetime.datetime.strptime(value, '%Y-%m').date()
+
+class RollupStashes(Command):
+	"""
+	Compute monthly totals of stash I/O and stash operations.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(RollupStashes, self).get_parser(prog_name)
+		parser.add_argument(
+			'-m', '--month',
+			type=_month,
+			action='append',
+			help='Rebuild totals for a month, as YYYY-MM. Can be given more than once.'
+		)
+		parser.add_argument(
+			'-g', '--grace',
+			type=int,
+			default=86400,
+			help='Number of seconds after the end of a month to wait before rolling it up.'
+		)
+		return parser
+
+	def take_action(self, args):
+		_load_modules(self.app)
+
+		import transaction
+		from netprofile_stashes.ledger import (
+			compact,
+			rollup_month
+		)
+
+		sess = self.app.db_session
+		if args.month:
+			for month in args.month:
+				io_rows, op_rows = rollup_month(sess, month)
+				transaction.commit()
+				self.log.info('Rolled up %s: %d I/O operations, %d stash operations.', month, io_rows, op_rows)
+			return
+		months = compact(sess, grace=args.grace, commit=transaction.commit)
+		self.log.info('Rolled up %d months.', len(months))
+
+class CheckStashRollups(Command):
+	"""
+	Compare monthly totals of stash I/O and stash operations with raw data.
+	"""
+
+	log = logging.getLogger(__name__)
+
+	def get_parser(self, prog_name):
+		parser = super(CheckStashRollups, self).get_parser(prog_name)
+		parser.add_argument(
+			'-m', '--month',
+			type=_month,
+			action='append',
+			help='Check only this month, as YYYY-MM. Can be given more than once.'
+		)
+		return parser
+
+	def take_action(self, args):
+		_load_modules(self.app)
+
+		from netprofile_stashes.ledger import check_rollups
+
+		errors = 0
+		for month, table, stash_id, key, have, want in check_rollups(self.app.db_session, args.month):
+			errors += 1
+			self.app.stdout.write('%s\t%s\t%s\t%s\t%r\t%r\n' % (
+				month.strftime('%Y-%m'), table, stash_id, key, have, want
+			))
+		if errors:
+			raise RuntimeError('Found %d mismatched monthly totals.' % (errors,))
+		self.log.info('All monthly totals match.')
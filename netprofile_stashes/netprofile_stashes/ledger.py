@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Stashes module - Monthly ledger rollups
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+__all__ = [
+	'month_start',
+	'next_month',
+	'rollup_month',
+	'pending_months',
+	'compact',
+	'split_range',
+	'io_count',
+	'io_totals',
+	'operation_totals',
+	'check_rollups'
+]
+
+import datetime
+import logging
+
+from sqlalchemy import (
+	Date,
+	func,
+	literal
+)
+
+from netprofile_stashes.models import (
+	StashIO,
+	StashIORollup,
+	StashOperation,
+	StashOperationRollup,
+	StashRollupMonth
+)
+
+logger = logging.getLogger(__name__)
+
+def month_start(ts):
+	"""
+	First day of month of a date or timestamp, as a date.
+	"""
+	return datetime.date(ts.year, ts.month, 1)
+
+def next_month(month):
+	if month.month == 12:
+		return datetime.date(month.year + 1, 1, 1)
+	return datetime.date(month.year, month.month + 1, 1)
+
+def _bounds(month):
+	start = datetime.datetime(month.year, month.month, 1)
+	nxt = next_month(month)
+	return (start, datetime.datetime(nxt.year, nxt.month, 1))
+
+def _io_query(sess, stash_ids, ts_from, ts_to):
+	q = sess.query(
+		StashIO.type_id,
+		func.count('*'),
+		func.coalesce(func.sum(StashIO.difference), 0)
+	).filter(
+		StashIO.timestamp >= ts_from,
+		StashIO.timestamp < ts_to
+	)
+	if stash_ids is not None:
+		q = q.filter(StashIO.stash_id.in_(stash_ids))
+	return q
+
+def _op_query(sess, stash_ids, ts_from, ts_to):
+	q = sess.query(
+		StashOperation.type,
+		func.count('*'),
+		func.coalesce(func.sum(StashOperation.difference), 0),
+		func.coalesce(func.sum(StashOperation.accounted_ingress), 0),
+		func.coalesce(func.sum(StashOperation.accounted_egress), 0)
+	).filter(
+		StashOperation.timestamp >= ts_from,
+		StashOperation.timestamp < ts_to
+	)
+	if stash_ids is not None:
+		q = q.filter(StashOperation.stash_id.in_(stash_ids))
+	return q
+
+def rollup_month(sess, month):
+	"""
+	Compute per-stash totals of stash I/O and stash operations for a month
+	and mark it as closed. Existing totals for that month are replaced.
+	Only months that have already ended can be closed. Returns a tuple of
+	(number of I/O operations, number of stash operations) that were
+	rolled up.
+	"""
+	start, end = _bounds(month)
+	if end > datetime.datetime.now():
+		raise ValueError('Month %s has not ended yet.' % (month,))
+	io_tbl = StashIORollup.__table__
+	op_tbl = StashOperationRollup.__table__
+	sess.query(StashIORollup).filter(StashIORollup.month == month).delete(synchronize_session=False)
+	sess.query(StashOperationRollup).filter(StashOperationRollup.month == month).delete(synchronize_session=False)
+
+	q = sess.query(
+		StashIO.stash_id,
+		literal(month, Date()),
+		StashIO.type_id,
+		func.count('*'),
+		func.sum(StashIO.difference)
+	).filter(
+		StashIO.timestamp >= start,
+		StashIO.timestamp < end
+	).group_by(StashIO.stash_id, StashIO.type_id)
+	sess.execute(io_tbl.insert().from_select(
+		(io_tbl.c.stashid, io_tbl.c.month, io_tbl.c.siotypeid, io_tbl.c.cnt, io_tbl.c.diff),
+		q.statement
+	))
+
+	q = sess.query(
+		StashOperation.stash_id,
+		literal(month, Date()),
+		StashOperation.type,
+		func.count('*'),
+		func.sum(StashOperation.difference),
+		func.coalesce(func.sum(StashOperation.accounted_ingress), 0),
+		func.coalesce(func.sum(StashOperation.accounted_egress), 0)
+	).filter(
+		StashOperation.timestamp >= start,
+		StashOperation.timestamp < end
+	).group_by(StashOperation.stash_id, StashOperation.type)
+	sess.execute(op_tbl.insert().from_select(
+		(
+			op_tbl.c.stashid, op_tbl.c.month, op_tbl.c.type, op_tbl.c.cnt,
+			op_tbl.c.diff, op_tbl.c.acct_ingress, op_tbl.c.acct_egress
+		),
+		q.statement
+	))
+
+	io_rows = sess.query(func.coalesce(func.sum(StashIORollup.count), 0)).filter(StashIORollup.month == month).scalar()
+	op_rows = sess.query(func.coalesce(func.sum(StashOperationRollup.count), 0)).filter(StashOperationRollup.month == month).scalar()
+	mark = sess.query(StashRollupMonth).get(month)
+	if mark is None:
+		mark = StashRollupMonth(month=month)
+		sess.add(mark)
+	mark.timestamp = datetime.datetime.now().replace(microsecond=0)
+	mark.io_rows = io_rows
+	mark.op_rows = op_rows
+	sess.flush()
+	return (int(io_rows), int(op_rows))
+
+def pending_months(sess, now=None, grace=86400):
+	"""
+	List months that have ended at least grace seconds ago and were not
+	rolled up yet, starting from the month of the earliest stash I/O or
+	stash operation. Months without any rows are listed too, so that
+	they get closed with empty totals. Grace period leaves time for
+	accounting updates that carry timestamps from the previous month.
+
+	Triggers on stashes_io_def and stashes_ops drop the mark of a closed
+	month whenever a row from that month is added, changed or removed,
+	so such months are listed again.
+	"""
+	if now is None:
+		now = datetime.datetime.now()
+	firsts = [ts for ts in (
+		sess.query(func.min(StashIO.timestamp)).scalar(),
+		sess.query(func.min(StashOperation.timestamp)).scalar()
+	) if ts is not None]
+	if len(firsts) == 0:
+		return []
+	first = min(firsts)
+	limit = month_start(now - datetime.timedelta(seconds=grace))
+	done = set(row[0] for row in sess.query(StashRollupMonth.month).filter(StashRollupMonth.month < limit))
+	months = []
+	month = month_start(first)
+	while month < limit:
+		if month not in done:
+			months.append(month)
+		month = next_month(month)
+	return months
+
+def compact(sess, now=None, grace=86400, commit=None):
+	"""
+	Roll up all pending months, oldest first. If commit is given, it is
+	called after each month. Returns a list of months that were rolled up.
+	"""
+	months = pending_months(sess, now, grace)
+	for month in months:
+		io_rows, op_rows = rollup_month(sess, month)
+		logger.info('Rolled up %s: %d I/O operations, %d stash operations', month, io_rows, op_rows)
+		if commit is not None:
+			commit()
+	return months
+
+def split_range(sess, ts_from, ts_to):
+	"""
+	Split time range [ts_from, ts_to) into closed months that lie wholly
+	inside of it, and ranges of raw rows to read for the rest. Returns a
+	tuple of (list of months, list of (start, end) tuples).
+	"""
+	months = []
+	raw = []
+	first = month_start(ts_from)
+	if _bounds(first)[0] < ts_from:
+		first = next_month(first)
+	candidates = []
+	month = first
+	while _bounds(month)[1] <= ts_to:
+		candidates.append(month)
+		month = next_month(month)
+	if candidates:
+		closed = set(row[0] for row in sess.query(StashRollupMonth.month).filter(
+			StashRollupMonth.month.between(candidates[0], candidates[-1])
+		))
+		months = [m for m in candidates if m in closed]
+
+	pos = ts_from
+	for month in months:
+		start, end = _bounds(month)
+		if start > pos:
+			raw.append((pos, start))
+		pos = end
+	if pos < ts_to:
+		raw.append((pos, ts_to))
+	return (months, raw)
+
+def io_totals(sess, stash_ids, ts_from, ts_to):
+	"""
+	Number and sum of stash I/O operations in time range [ts_from, ts_to),
+	by I/O type. Closed months are read from rollups. Pass None as
+	stash_ids to get totals for all stashes. Returns a mapping of I/O type
+	IDs to lists of [count, sum].
+	"""
+	months, raw = split_range(sess, ts_from, ts_to)
+	ret = {}
+	queries = [_io_query(sess, stash_ids, start, end).group_by(StashIO.type_id) for start, end in raw]
+	if months:
+		q = sess.query(
+			StashIORollup.type_id,
+			func.sum(StashIORollup.count),
+			func.sum(StashIORollup.difference)
+		).filter(StashIORollup.month.in_(months))
+		if stash_ids is not None:
+			q = q.filter(StashIORollup.stash_id.in_(stash_ids))
+		queries.append(q.group_by(StashIORollup.type_id))
+	for q in queries:
+		for type_id, count, diff in q:
+			row = ret.setdefault(type_id, [0, 0])
+			row[0] += int(count)
+			row[1] += diff
+	return ret
+
+def io_count(sess, stash_ids, ts_from, ts_to):
+	"""
+	Number of stash I/O operations in time range [ts_from, ts_to).
+	"""
+	return sum(row[0] for row in io_totals(sess, stash_ids, ts_from, ts_to).values())
+
+def operation_totals(sess, stash_ids, ts_from, ts_to):
+	"""
+	Number and sums of stash operations in time range [ts_from, ts_to), by
+	operation type. Closed months are read from rollups. Returns a mapping
+	of StashOperationType values to lists of [count, sum, ingress traffic,
+	egress traffic].
+	"""
+	months, raw = split_range(sess, ts_from, ts_to)
+	ret = {}
+	queries = [_op_query(sess, stash_ids, start, end).group_by(StashOperation.type) for start, end in raw]
+	if months:
+		q = sess.query(
+			StashOperationRollup.type,
+			func.sum(StashOperationRollup.count),
+			func.sum(StashOperationRollup.difference),
+			func.sum(StashOperationRollup.accounted_ingress),
+			func.sum(StashOperationRollup.accounted_egress)
+		).filter(StashOperationRollup.month.in_(months))
+		if stash_ids is not None:
+			q = q.filter(StashOperationRollup.stash_id.in_(stash_ids))
+		queries.append(q.group_by(StashOperationRollup.type))
+	for q in queries:
+		for optype, count, diff, tin, teg in q:
+			row = ret.setdefault(optype, [0, 0, 0, 0])
+			row[0] += int(count)
+			row[1] += diff
+			row[2] += int(tin)
+			row[3] += int(teg)
+	return ret
+
+def check_rollups(sess, months=None):
+	"""
+	Verify rollups against raw rows. Checks all closed months, or only
+	those listed in months. Yields a tuple of (month, table name, stash ID,
+	type, totals from rollup, totals from raw rows) for every mismatch.
+	"""
+	if months is None:
+		months = [row[0] for row in sess.query(StashRollupMonth.month).order_by(StashRollupMonth.month)]
+	for month in months:
+		start, end = _bounds(month)
+
+		have = dict(
+			((stash_id, type_id), (int(count), diff))
+			for stash_id, type_id, count, diff in sess.query(
+				StashIORollup.stash_id,
+				StashIORollup.type_id,
+				StashIORollup.count,
+				StashIORollup.difference
+			).filter(StashIORollup.month == month)
+		)
+		want = dict(
+			((stash_id, type_id), (int(count), diff))
+			for stash_id, type_id, count, diff in sess.query(
+				StashIO.stash_id,
+				StashIO.type_id,
+				func.count('*'),
+				func.sum(StashIO.difference)
+			).filter(
+				StashIO.timestamp >= start,
+				StashIO.timestamp < end
+			).group_by(StashIO.stash_id, StashIO.type_id)
+		)
+		for key in sorted(set(have) | set(want)):
+			if have.get(key) != want.get(key):
+				yield (month, StashIORollup.__tablename__, key[0], key[1], have.get(key), want.get(key))
+
+		have = dict(
+			((stash_id, optype), (int(count), diff, int(tin), int(teg)))
+			for stash_id, optype, count, diff, tin, teg in sess.query(
+				StashOperationRollup.stash_id,
+				StashOperationRollup.type,
+				StashOperationRollup.count,
+				StashOperationRollup.difference,
+				StashOperationRollup.accounted_ingress,
+				StashOperationRollup.accounted_egress
+			).filter(StashOperationRollup.month == month)
+		)
+		want = dict(
+			((stash_id, optype), (int(count), diff, int(tin), int(teg)))
+			for stash_id, optype, count, diff, tin, teg in sess.query(
+				StashOperation.stash_id,
+				StashOperation.type,
+				func.count('*'),
+				func.sum(StashOperation.difference),
+				func.coalesce(func.sum(StashOperation.accounted_ingress), 0),
+				func.coalesce(func.sum(StashOperation.accounted_egress), 0)
+			).filter(
+				StashOperation.timestamp >= start,
+				StashOperation.timestamp < end
+			).group_by(StashOperation.stash_id, StashOperation.type)
+		)
+		for key in sorted(set(have) | set(want), key=lambda k: (k[0], str(k[1]))):
+			if have.get(key) != want.get(key):
+				yield (month, StashOperationRollup.__tablename__, key[0], key[1], have.get(key), want.get(key))
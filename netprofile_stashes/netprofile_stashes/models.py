@@ -34,6 +34,9 @@ __all__ = [
 	'StashIO',
 	'StashIOType',
 	'StashOperation',
+	'StashIORollup',
+	'StashOperationRollup',
+	'StashRollupMonth',
 	
 	'FuturesPollProcedure',
 
@@ -42,6 +45,7 @@ __all__ = [
 
 from sqlalchemy import (
 	Column,
+	Date,
 	FetchedValue,
 	ForeignKey,
 	Index,
@@ -77,6 +81,7 @@ from netprofile.db.fields import (
 from netprofile.db.ddl import (
 	Comment,
 	CurrentTimestampDefault,
+	Partitioned,
 	SQLEvent,
 	SQLFunction,
 	Trigger
@@ -514,6 +519,9 @@ class StashIO(Base):
 		Index('stashes_io_i_ts', 'ts'),
 		Trigger('before', 'insert', 't_stashes_io_def_bi'),
 		Trigger('after', 'insert', 't_stashes_io_def_ai'),
+		Trigger('after', 'update', 't_stashes_io_def_au'),
+		Trigger('after', 'delete', 't_stashes_io_def_ad'),
+		Partitioned('ts'),
 		{
 			'mysql_engine'  : 'InnoDB',
 			'mysql_charset' : 'utf8',
@@ -693,6 +701,10 @@ class StashOperation(Base):
 		Index('stashes_ops_i_ts', 'ts'),
 		Index('stashes_ops_i_operator', 'operator'),
 		Index('stashes_ops_i_entityid', 'entityid'),
+		Trigger('after', 'insert', 't_stashes_ops_ai'),
+		Trigger('after', 'update', 't_stashes_ops_au'),
+		Trigger('after', 'delete', 't_stashes_ops_ad'),
+		Partitioned('ts'),
 		{
 			'mysql_engine'  : 'InnoDB',
 			'mysql_charset' : 'utf8',
@@ -705,7 +717,8 @@ class StashOperation(Base):
 				'menu_name'    : _('Operations'),
 				'default_sort'  : ({ 'property': 'ts', 'direction': 'DESC' },),
 				'grid_view' : ('type', 'stash', 'entity', 'operator_user', 'ts', 'diff', 'acct_ingress', 'acct_egress'),
-				'form_view' : ('type', 'stash', 'entity', 'operator_user', 'ts', 'diff', 'acct_ingress', 'acct_egress')
+				'form_view' : ('type', 'stash', 'entity', 'operator_user', 'ts', 'diff', 'acct_ingress', 'acct_egress'),
+				'cold_archive'  : 'ts'
 			}
 		}
 	)
@@ -848,6 +861,277 @@ class StashOperation(Base):
 			str(self.timestamp)
 		)
 
+class StashIORollup(Base):
+	"""
+	Monthly totals of stash I/O operations.
+	"""
+	__tablename__ = 'stashes_io_monthly'
+	__table_args__ = (
+		Comment('Monthly totals of stashes input/output operations'),
+		Index('stashes_io_monthly_i_month', 'month'),
+		Index('stashes_io_monthly_i_siotypeid', 'siotypeid'),
+		{
+			'mysql_engine'  : 'InnoDB',
+			'mysql_charset' : 'utf8',
+			'info'          : {
+				'cap_menu'      : 'BASE_STASHES',
+				'cap_read'      : 'STASHES_IO',
+				'cap_create'    : '__NOPRIV__',
+				'cap_edit'      : '__NOPRIV__',
+				'cap_delete'    : '__NOPRIV__',
+				'menu_name'     : _('Monthly Operations'),
+				'default_sort'  : ({ 'property': 'month', 'direction': 'DESC' },),
+				'grid_view'     : ('stash', 'month', 'type', 'count', 'diff'),
+				'form_view'     : ('stash', 'month', 'type', 'count', 'diff')
+			}
+		}
+	)
+	stash_id = Column(
+		'stashid',
+		UInt32(),
+		ForeignKey('stashes_def.stashid', name='stashes_io_monthly_fk_stashid', ondelete='CASCADE', onupdate='CASCADE'),
+		Comment('Stash ID'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Stash'),
+			'filter_type'   : 'none'
+		}
+	)
+	month = Column(
+		Date(),
+		Comment('First day of month'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Month')
+		}
+	)
+	type_id = Column(
+		'siotypeid',
+		UInt32(),
+		ForeignKey('stashes_io_types.siotypeid', name='stashes_io_monthly_fk_siotypeid', ondelete='CASCADE', onupdate='CASCADE'),
+		Comment('Stash I/O type ID'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Type'),
+			'filter_type'   : 'list'
+		}
+	)
+	count = Column(
+		'cnt',
+		UInt32(),
+		Comment('Number of operations'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Count')
+		}
+	)
+	difference = Column(
+		'diff',
+		Money(),
+		Comment('Total change'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Change')
+		}
+	)
+
+	stash = relationship(
+		'Stash',
+		innerjoin=True,
+		backref=backref(
+			'io_rollups',
+			cascade='all, delete-orphan',
+			passive_deletes=True
+		)
+	)
+	type = relationship(
+		'StashIOType',
+		innerjoin=True,
+		lazy='joined'
+	)
+
+class StashOperationRollup(Base):
+	"""
+	Monthly totals of low-level stash operations.
+	"""
+	__tablename__ = 'stashes_ops_monthly'
+	__table_args__ = (
+		Comment('Monthly totals of operations on stashes'),
+		Index('stashes_ops_monthly_i_month', 'month'),
+		{
+			'mysql_engine'  : 'InnoDB',
+			'mysql_charset' : 'utf8',
+			'info'          : {
+				'cap_menu'      : 'BASE_STASHES',
+				'cap_read'      : 'STASHES_IO',
+				'cap_create'    : '__NOPRIV__',
+				'cap_edit'      : '__NOPRIV__',
+				'cap_delete'    : '__NOPRIV__',
+				'menu_name'     : _('Monthly Operations'),
+				'default_sort'  : ({ 'property': 'month', 'direction': 'DESC' },),
+				'grid_view'     : ('stash', 'month', 'type', 'count', 'diff', 'acct_ingress', 'acct_egress'),
+				'form_view'     : ('stash', 'month', 'type', 'count', 'diff', 'acct_ingress', 'acct_egress')
+			}
+		}
+	)
+	stash_id = Column(
+		'stashid',
+		UInt32(),
+		ForeignKey('stashes_def.stashid', name='stashes_ops_monthly_fk_stashid', ondelete='CASCADE', onupdate='CASCADE'),
+		Comment('Stash ID'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Stash'),
+			'filter_type'   : 'none'
+		}
+	)
+	month = Column(
+		Date(),
+		Comment('First day of month'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Month')
+		}
+	)
+	type = Column(
+		StashOperationType.db_type(),
+		Comment('Type of operation'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Type')
+		}
+	)
+	count = Column(
+		'cnt',
+		UInt32(),
+		Comment('Number of operations'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Count')
+		}
+	)
+	difference = Column(
+		'diff',
+		Money(),
+		Comment('Total changes made to stash'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Change')
+		}
+	)
+	accounted_ingress = Column(
+		'acct_ingress',
+		Traffic(),
+		Comment('Total accounted ingress traffic'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Ingress Traffic')
+		}
+	)
+	accounted_egress = Column(
+		'acct_egress',
+		Traffic(),
+		Comment('Total accounted egress traffic'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Egress Traffic')
+		}
+	)
+
+	stash = relationship(
+		'Stash',
+		innerjoin=True,
+		backref=backref(
+			'operation_rollups',
+			cascade='all, delete-orphan',
+			passive_deletes=True
+		)
+	)
+
+class StashRollupMonth(Base):
+	"""
+	Month for which stash operation totals were computed.
+	"""
+	__tablename__ = 'stashes_rollup_months'
+	__table_args__ = (
+		Comment('Months with computed stash operation totals'),
+		{
+			'mysql_engine'  : 'InnoDB',
+			'mysql_charset' : 'utf8',
+			'info'          : {
+				'cap_menu'      : 'BASE_STASHES',
+				'cap_read'      : 'STASHES_IO',
+				'cap_create'    : '__NOPRIV__',
+				'cap_edit'      : '__NOPRIV__',
+				'cap_delete'    : '__NOPRIV__',
+				'menu_name'     : _('Closed Months'),
+				'default_sort'  : ({ 'property': 'month', 'direction': 'DESC' },),
+				'grid_view'     : ('month', 'ts', 'io_rows', 'op_rows'),
+				'form_view'     : ('month', 'ts', 'io_rows', 'op_rows')
+			}
+		}
+	)
+	month = Column(
+		Date(),
+		Comment('First day of month'),
+		primary_key=True,
+		nullable=False,
+		info={
+			'header_string' : _('Month')
+		}
+	)
+	timestamp = Column(
+		'ts',
+		TIMESTAMP(),
+		Comment('Time stamp of last rollup'),
+		CurrentTimestampDefault(),
+		nullable=False,
+		info={
+			'header_string' : _('Computed')
+		}
+	)
+	io_rows = Column(
+		UInt64(),
+		Comment('Number of rolled up I/O operations'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('I/O Operations')
+		}
+	)
+	op_rows = Column(
+		UInt64(),
+		Comment('Number of rolled up stash operations'),
+		nullable=False,
+		default=0,
+		server_default=text('0'),
+		info={
+			'header_string' : _('Stash Operations')
+		}
+	)
+
+	def __str__(self):
+		return '%s' % (self.month,)
+
 class FuturePayment(Base):
 	"""
 	Future payment object.
@@ -855,7 +1139,7 @@ class FuturePayment(Base):
 	__tablename__ = 'futures_def'
 	__table_args__ = (
 		Comment('Future payments'),
-		Index('futures_def_i_futures', 'state', 'ptime'),
+		Index('futures_def_i_futures', 'state', 'ptime', 'stashid'),
 		Index('futures_def_i_entityid', 'entityid'),
 		Index('futures_def_i_stashid', 'stashid'),
 		Index('futures_def_i_cby', 'cby'),
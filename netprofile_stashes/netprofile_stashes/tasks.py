@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+#
+# NetProfile: Stashes module - Celery tasks
+# © Copyright 2015 Alex 'Unik' Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (
+	unicode_literals,
+	print_function,
+	absolute_import,
+	division
+)
+
+import datetime
+import logging
+import time
+
+import redis
+import transaction
+
+from sqlalchemy import (
+	and_,
+	func,
+	or_,
+	text
+)
+from sqlalchemy.exc import OperationalError
+
+from netprofile.celery import app
+from netprofile.common.polling import (
+	PollMetrics,
+	dispatch_shards,
+	pack_shards
+)
+from netprofile.common.util import make_config_dict
+from netprofile.db.connection import DBSession
+
+from netprofile_stashes.ledger import compact
+from netprofile_stashes.models import (
+	FuturePayment,
+	FuturePaymentState,
+	StashIO
+)
+
+logger = logging.getLogger(__name__)
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Stash I/O types that count as paying off a promised payment.
+PAYOFF_IO_TYPES = (101, 105, 106, 107, 108, 109)
+
+# entities_access belongs to access module, which depends on this one.
+_BLOCK_STASH = text('UPDATE `entities_access` SET `state` = 1 WHERE `stashid` = :stashid')
+
+def futures_metrics(settings=None):
+	rconf = make_config_dict(settings or app.settings, 'netprofile.rt.redis.')
+	return PollMetrics(redis.Redis(**rconf), 'futures')
+
+def _poll_config():
+	cfg = make_config_dict(app.settings, 'netprofile.futures.poll.')
+	return (
+		int(cfg.get('batch_size', 1000)),
+		int(cfg.get('shard_size', 200)),
+		int(cfg.get('concurrency', 4))
+	)
+
+def _due_query(sess, ts, *cols):
+	# Resolved from futures_def_i_futures alone.
+	return sess.query(*cols).filter(
+		FuturePayment.state == FuturePaymentState.active,
+		FuturePayment.payment_time < ts
+	)
+
+def due_futures(sess, ts, batch_size):
+	"""
+	Yield (future payment ID, stash ID, payment time) for all active
+	promised payments that are past due at ts, in order of payment time.
+	Rows are fetched in batches of batch_size with keyset pagination.
+	"""
+	last_ptime = None
+	last_id = 0
+	while True:
+		q = _due_query(sess, ts, FuturePayment.id, FuturePayment.stash_id, FuturePayment.payment_time)
+		if last_ptime is not None:
+			q = q.filter(or_(
+				FuturePayment.payment_time > last_ptime,
+				and_(FuturePayment.payment_time == last_ptime, FuturePayment.id > last_id)
+			))
+		rows = q.order_by(FuturePayment.payment_time, FuturePayment.id).limit(batch_size).all()
+		for row in rows:
+			yield row
+		if len(rows) < batch_size:
+			break
+		last_id = rows[-1][0]
+		last_ptime = rows[-1][2]
+
+def queue_stats(sess, ts):
+	"""
+	Get number of due promised payments and lag in seconds of the oldest
+	one.
+	"""
+	count, oldest = _due_query(
+		sess, ts,
+		func.count(FuturePayment.id),
+		func.min(FuturePayment.payment_time)
+	).one()
+	lag = 0
+	if oldest is not None:
+		lag = max(0, (ts - oldest).total_seconds())
+	return (count, lag)
+
+def settle_future(sess, fid):
+	"""
+	Python counterpart of a single futures_poll iteration. Marks promised
+	payment as paid if enough money came in since it was made, or cancels
+	it and blocks accounts of the stash otherwise. Returns False if the
+	payment is no longer active, which makes retries harmless.
+	"""
+	fut = sess.query(FuturePayment).filter(
+		FuturePayment.id == fid,
+		FuturePayment.state == FuturePaymentState.active
+	).with_for_update().first()
+	if fut is None:
+		return False
+	paid = sess.query(func.sum(StashIO.difference)).filter(
+		StashIO.stash_id == fut.stash_id,
+		StashIO.timestamp.between(fut.creation_time, fut.payment_time),
+		StashIO.type_id.in_(PAYOFF_IO_TYPES)
+	).scalar()
+	if (paid is not None) and (paid >= fut.difference):
+		fut.state = FuturePaymentState.paid
+	else:
+		fut.state = FuturePaymentState.cancelled
+		sess.execute(_BLOCK_STASH, { 'stashid' : fut.stash_id })
+	sess.flush()
+	return True
+
+@app.task
+def task_futures_poll(ts=None):
+	"""
+	Worker-side replacement for futures_poll procedure. Meant to be run from
+	Celery beat instead of ev_futures_poll event.
+
+	Due promised payments are grouped by stash and packed into shards that
+	are settled by at most netprofile.futures.poll.concurrency workers at a
+	time.
+	"""
+	if ts is None:
+		ts = datetime.datetime.now().replace(microsecond=0)
+	elif not isinstance(ts, datetime.datetime):
+		ts = datetime.datetime.strptime(ts, TS_FORMAT)
+	batch_size, shard_size, concurrency = _poll_config()
+	started = time.time()
+
+	sess = DBSession()
+	stashes = {}
+	items = 0
+	max_lag = 0
+	for fid, stash_id, ptime in due_futures(sess, ts, batch_size):
+		stashes.setdefault(stash_id, []).append(fid)
+		items += 1
+		max_lag = max(max_lag, (ts - ptime).total_seconds())
+	transaction.commit()
+
+	shards = pack_shards(stashes.values(), shard_size)
+	run_id = futures_metrics().start(ts, len(shards), items, max_lag, plan_time=time.time() - started)
+	lanes = dispatch_shards([
+		task_futures_settle.si(run_id, fids)
+		for fids in shards
+	], concurrency)
+	logger.info('Started futures_poll run %s for %d payments in %d shards, %d lanes', run_id, items, len(shards), lanes)
+	return run_id
+
+@app.task(bind=True, max_retries=5, default_retry_delay=10)
+def task_futures_settle(self, run_id, fids):
+	"""
+	Settle promised payments in order, committing after each one.
+	"""
+	started = time.time()
+	sess = DBSession()
+	count = errors = 0
+	for fid in fids:
+		try:
+			if settle_future(sess, fid):
+				count += 1
+			transaction.commit()
+		except OperationalError as e:
+			# Deadlocks and lock wait timeouts: try the whole shard again.
+			transaction.abort()
+			logger.warning('Settling promised payment %s failed, retrying shard: %s', fid, e)
+			raise self.retry(exc=e)
+		except Exception:
+			logger.exception('Unable to settle promised payment %s', fid)
+			transaction.abort()
+			errors += 1
+
+	if futures_metrics().shard_done(run_id, count, errors, time.time() - started):
+		logger.info('Finished futures_poll run %s', run_id)
+	return count
+
+@app.task
+def task_stashes_rollup(ts=None):
+	"""
+	Compute monthly totals of stash I/O and stash operations for all months
+	that have ended at least netprofile.stashes.rollup.grace seconds ago
+	and were not rolled up yet. Meant to be run daily from Celery beat.
+	"""
+	if ts is None:
+		ts = datetime.datetime.now().replace(microsecond=0)
+	elif not isinstance(ts, datetime.datetime):
+		ts = datetime.datetime.strptime(ts, TS_FORMAT)
+	cfg = make_config_dict(app.settings, 'netprofile.stashes.rollup.')
+	months = compact(DBSession(), ts, int(cfg.get('grace', 86400)), commit=transaction.commit)
+	transaction.commit()
+	return [month.isoformat() for month in months]
+
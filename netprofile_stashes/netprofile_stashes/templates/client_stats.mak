@@ -91,6 +91,28 @@ from netprofile_stashes.models import IOOperationType
 % else:
 	<div class="panel-body text-center">${_('No operations were found.')}</div>
 % endif
+% if len(totals) > 0:
+	<div class="table-responsive">
+	<table class="table table-condensed">
+	<thead>
+		<tr>
+			<th>${_('Type')}</th>
+			<th>${_('Operations')}</th>
+			<th>${_('Total')}</th>
+		</tr>
+	</thead>
+	<tbody>
+% for iotype, count, diff in totals:
+		<tr>
+			<td>${iotype}</td>
+			<td>${count}</td>
+			<td>${diff | n,curr_fmt}</td>
+		</tr>
+% endfor
+	</tbody>
+	</table>
+	</div>
+% endif
 % if maxpage > 1:
 	<div class="panel-footer">
 		<ul class="pagination pagination-sm" style="margin-top: 0.1em; margin-bottom: 0.1em;">
@@ -0,0 +1,8 @@
+## -*- coding: utf-8 -*-
+<%inherit file="netprofile:templates/ddl_trigger.mak"/>\
+<%block name="sql">\
+	IF ((@archive_purge IS NULL) OR (@archive_purge <> 1)) AND (OLD.ts < LAST_DAY(NOW() - INTERVAL 1 MONTH) + INTERVAL 1 DAY) THEN
+		DELETE FROM `stashes_rollup_months`
+		WHERE `month` = LAST_DAY(OLD.ts - INTERVAL 1 MONTH) + INTERVAL 1 DAY;
+	END IF;
+</%block>
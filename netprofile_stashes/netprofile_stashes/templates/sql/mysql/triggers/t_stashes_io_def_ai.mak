@@ -5,4 +5,8 @@
 		INSERT INTO `stashes_ops` (`stashid`, `type`, `ts`, `operator`, `diff`, `comments`)
 		VALUES (NEW.stashid, 'oper', NEW.ts, IF(@accessuid > 0, @accessuid, NULL), NEW.diff, CONCAT('sio:', NEW.sioid, '|'));
 	END IF;
+	IF NEW.ts < LAST_DAY(NOW() - INTERVAL 1 MONTH) + INTERVAL 1 DAY THEN
+		DELETE FROM `stashes_rollup_months`
+		WHERE `month` = LAST_DAY(NEW.ts - INTERVAL 1 MONTH) + INTERVAL 1 DAY;
+	END IF;
 </%block>
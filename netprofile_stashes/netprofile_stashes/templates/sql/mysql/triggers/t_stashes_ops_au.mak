@@ -0,0 +1,14 @@
+## -*- coding: utf-8 -*-
+<%inherit file="netprofile:templates/ddl_trigger.mak"/>\
+<%block name="sql">\
+	IF OLD.ts < LAST_DAY(NOW() - INTERVAL 1 MONTH) + INTERVAL 1 DAY THEN
+		DELETE FROM `stashes_rollup_months`
+		WHERE `month` = LAST_DAY(OLD.ts - INTERVAL 1 MONTH) + INTERVAL 1 DAY;
+	END IF;
+	IF (NEW.ts <> OLD.ts) THEN
+		IF NEW.ts < LAST_DAY(NOW() - INTERVAL 1 MONTH) + INTERVAL 1 DAY THEN
+			DELETE FROM `stashes_rollup_months`
+			WHERE `month` = LAST_DAY(NEW.ts - INTERVAL 1 MONTH) + INTERVAL 1 DAY;
+		END IF;
+	END IF;
+</%block>
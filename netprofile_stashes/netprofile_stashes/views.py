@@ -46,7 +46,6 @@ from pyramid.httpexceptions import (
 	HTTPSeeOther
 )
 from pyramid.response import FileResponse
-from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 
 from netprofile.common.factory import RootFactory
@@ -58,8 +57,10 @@ from .models import (
 	PassbookPass,
 	FuturePaymentOrigin,
 	Stash,
-	StashIO
+	StashIO,
+	StashIOType
 )
+from .ledger import io_totals
 
 _ = TranslationStringFactory('netprofile_stashes')
 
@@ -270,6 +271,15 @@ def client_promise(ctx, request):
 
 	return HTTPSeeOther(location=request.route_url('stashes.cl.accounts', traverse=()))
 
+def _io_totals_list(sess, totals):
+	if len(totals) == 0:
+		return []
+	types = dict((t.id, t) for t in sess.query(StashIOType).filter(StashIOType.id.in_(list(totals))))
+	return [
+		(types.get(type_id, type_id), totals[type_id][0], totals[type_id][1])
+		for type_id in sorted(totals)
+	]
+
 @view_config(
 	route_name='stashes.cl.accounts',
 	name='ops',
@@ -327,12 +337,9 @@ def client_ops(ctx, request):
 		sname = ctx.name
 	else:
 		stash_ids = [s.id for s in ent.stashes]
-	total = sess.query(func.count('*')).select_from(StashIO)\
-		.filter(
-			StashIO.stash_id.in_(stash_ids),
-			StashIO.timestamp.between(ts_from, ts_to)
-		)\
-		.scalar()
+	# Range end is inclusive, ledger helpers take an exclusive one.
+	totals = io_totals(sess, stash_ids, ts_from, ts_to + dt.timedelta(microseconds=1))
+	total = sum(row[0] for row in totals.values())
 	max_page = int(math.ceil(total / per_page))
 	if max_page <= 0:
 		max_page = 1
@@ -369,6 +376,7 @@ def client_ops(ctx, request):
 		'perpage' : per_page,
 		'maxpage' : max_page,
 		'ios'     : ios.all(),
+		'totals'  : _io_totals_list(sess, totals),
 		'crumbs'  : crumbs
 	}
 
@@ -383,3 +391,17 @@ def _gen_menu(menu, req):
 		'text'  : _('Accounts')
 	})
 
+@register_hook('core.metrics')
+def _metrics_futures_poll(metrics, request):
+	from netprofile_stashes.tasks import (
+		futures_metrics,
+		queue_stats
+	)
+
+	depth, lag = queue_stats(DBSession(), dt.datetime.now())
+	metrics['futures_poll'] = {
+		'queue_depth' : depth,
+		'lag'         : lag,
+		'last_run'    : futures_metrics(request.registry.settings).status()
+	}
+
@@ -50,6 +50,9 @@ setup(
 	entry_points="""\
 		[netprofile.modules]
 		stashes = netprofile_stashes:Module
+		[netprofile.cli.commands]
+		stash rollup = netprofile_stashes.cli:RollupStashes
+		stash verify = netprofile_stashes.cli:CheckStashRollups
 	""",
 	message_extractors={'.' : [
 		('**.py', 'python', None),
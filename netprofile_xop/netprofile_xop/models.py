@@ -59,7 +59,8 @@ from sqlalchemy.ext.associationproxy import association_proxy
 
 from netprofile.common.ipaddr import (
 	IPAddress,
-	IPNetwork
+	IPNetwork,
+	IPPrefixTrie
 )
 from netprofile.db.connection import (
 	Base,
@@ -94,6 +95,27 @@ from pyramid.i18n import (
 
 _ = TranslationStringFactory('netprofile_xop')
 
+def _parse_access_list(acl):
+	nets = []
+	for ace in acl.split(';'):
+		try:
+			nets.append(IPNetwork(ace.strip()))
+		except ValueError:
+			pass
+	return nets
+
+# Keyed on the ACL text itself, so edits never hit a stale entry.
+_acl_tries = {}
+_ACL_TRIES_MAX = 256
+
+def _access_list_trie(acl):
+	trie = _acl_tries.get(acl)
+	if trie is None:
+		if len(_acl_tries) >= _ACL_TRIES_MAX:
+			_acl_tries.clear()
+		trie = _acl_tries[acl] = IPPrefixTrie(_parse_access_list(acl))
+	return trie
+
 class ExternalOperationState(DeclEnum):
 	"""
 	Enumeration of xop state codes
@@ -518,13 +540,13 @@ class ExternalOperationProvider(Base):
 	def access_nets(self):
 		if not self.access_list:
 			return ()
-		nets = []
-		for ace in self.access_list.split(';'):
-			try:
-				nets.append(IPNetwork(ace.strip()))
-			except ValueError:
-				pass
-		return nets
+		return _parse_access_list(self.access_list)
+
+	@property
+	def access_trie(self):
+		if not self.access_list:
+			return None
+		return _access_list_trie(self.access_list)
 
 	def __str__(self):
 		return '%s' % self.name
@@ -536,13 +558,10 @@ class ExternalOperationProvider(Base):
 			addr = IPAddress(req.remote_addr)
 		except ValueError:
 			return False
-		nets = self.access_nets
-		if len(nets) == 0:
+		trie = self.access_trie
+		if not trie:
 			return True
-		for net in nets:
-			if addr in net:
-				return True
-		return False
+		return addr in trie
 
 	def get_gateway(self):
 		if not self.gateway_class: